@@ -1,10 +1,25 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-from pycaret.classification import load_model, predict_model
-import shap
-import matplotlib.pyplot as plt
+from pycaret.classification import load_model
 import os
+from collections import deque
+import utils
+import instrumentation
+import profiling
+import render_cache
+import prediction_cache
+import log_config
+from instrumentation import stage
+from explain import compute_shap, concat_results, batch_importance, load_error_report, to_explanation
+from job_queue import JobQueue, JobFailed
+from ensemble import ModelEnsemble, predict_frame
+from model_registry import ModelRegistry, ModelHandle, warm_up, model_feature_names
+from drift_monitor import SensorSketch, compute_drift, DEFAULT_REFERENCE_PATH as DRIFT_REFERENCE_PATH
+from shap_store import ShapStore, STORE_DIR as SHAP_STORE_DIR
+from wafer_index import WaferIndex, INDEX_DIR as WAFER_INDEX_DIR
+from input_validation import SensorBounds, validate_batch, DEFAULT_BOUNDS_PATH as INPUT_BOUNDS_PATH
+from what_if import default_ranges, sweep, pairwise_grid, score_overrides
+from watch_folder import WatchStore, STORE_DIR as WATCH_STORE_DIR
 
 # --- 1. 設定頁面資訊 (移除側邊欄後，Layout 更重要) ---
 st.set_page_config(
@@ -14,278 +29,713 @@ st.set_page_config(
     initial_sidebar_state="collapsed" # 預設收起側邊欄
 )
 
+# --- 1.0 非阻塞 logging (PyCaret / CatBoost 只留警告；同一行程只設定一次) ---
+log_config.configure_logging('app', profile='scoring')
+
+# --- 1.1 效能剖析 (網址加 ?profile=1 或設定 YIELD_PROFILE=1 時剖析本次 rerun) ---
+def get_query_param(name):
+    """讀取網址查詢參數 (相容新舊版 Streamlit API)"""
+    try:
+        return st.query_params.get(name)
+    except AttributeError:
+        return st.experimental_get_query_params().get(name, [None])[0]
+
+profile_query = get_query_param('profile')
+
 # --- 2. 載入模型 (邏輯移出側邊欄) ---
-# 設定模型路徑
+# 版本庫為空時使用的舊模型路徑
 model_path = 'output/final_yield_prediction_model'
+# 範例資料 (壓力測試時以 YIELD_SAMPLE_DATA 指向合成資料)
+SAMPLE_DATA_PATH = os.environ.get('YIELD_SAMPLE_DATA', 'data/secom_processed.csv')
+SAMPLE_ROWS = int(os.environ.get('YIELD_SAMPLE_ROWS', 100))
 
-@st.cache_resource
-def load_yield_model():
+def load_yield_model(path):
     """載入模型並回傳 Pipeline"""
-    if os.path.exists(model_path + '.pkl'):
-        return load_model(model_path)
+    with stage('model_load'):
+        return load_model(path)
+
+@st.cache_resource
+def get_model_handle():
+    """
+    取得模型 handle (所有 session 共用)
+    首次同步載入 ACTIVE 版本，之後由背景執行緒偵測新版本、暖機後原子替換，不需重啟 App
+    """
+    handle = ModelHandle(ModelRegistry(), loader=load_yield_model, warmup=warm_up, fallback_path=model_path)
+    handle.refresh()
+    return handle.start()
+
+@st.cache_resource
+def load_drift_reference():
+    """載入訓練時保存的感測器參考分佈 (漂移監控用)"""
+    if os.path.exists(DRIFT_REFERENCE_PATH):
+        return SensorSketch.load(DRIFT_REFERENCE_PATH)
+    return None
+
+@st.cache_resource(max_entries=2)
+def load_input_bounds(bounds_mtime):
+    """載入訓練時保存的感測器界限；沒有界限檔時只檢查 required_features.pkl 的欄位"""
+    if bounds_mtime is None:
+        return SensorBounds.schema_only(utils.load_feature_config())
+    return SensorBounds.load(INPUT_BOUNDS_PATH)
+
+@st.cache_resource(max_entries=2)
+def load_shap_store(store_mtime):
+    """載入訓練時建立的全域 SHAP store (以更新時間為 key，重新訓練後自動換新)"""
+    return ShapStore.load(SHAP_STORE_DIR)
+
+@st.cache_resource(max_entries=2)
+def load_wafer_index(index_mtime):
+    """以 memory-map 開啟相似晶圓索引 (重新訓練後依更新時間自動換新)"""
+    return WaferIndex(WAFER_INDEX_DIR)
+
+@st.cache_data(max_entries=2)
+def load_watch_summary(store_mtime):
+    """讀取監看資料夾 daemon 的結果 (結果庫更新時間改變時才重新查詢)"""
+    store = WatchStore(WATCH_STORE_DIR)
+    return {'totals': store.totals(), 'hourly': store.hourly(), 'recent': store.recent_files(),
+            'risks': store.top_risks()}
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def wafer_shap(data_version, model_version, wafer_key, _compute):
+    """
+    單片晶圓的 SHAP 結果 (key 與 waterfall 渲染快取相同：資料版本 / 模型版本 / 晶圓)
+    waterfall 與相似晶圓查詢共用，同一片晶圓 rerun 時不重算；_compute 只在快取未命中時執行
+    """
+    return _compute()
+
+@st.cache_resource
+def get_prediction_cache():
+    """逐列預測快取 (所有 session 共用；設定 YIELD_PREDICTION_CACHE_PATH 時會存到磁碟)"""
+    return prediction_cache.from_env()
+
+@st.cache_resource
+def get_job_queue():
+    """背景工作佇列 (需另外啟動 `python job_queue.py --workers N`)"""
+    return JobQueue()
+
+# 背景工作最長等待時間 (秒)
+JOB_TIMEOUT_SEC = 600
+# 漂移摘要記住最近幾批資料的 ID (避免 rerun 重複累加；批次本身已合併進 SensorSketch)
+DRIFT_RECENT_BATCHES = 32
+# 批次摘要使用 exact TreeSHAP 時最多計算的晶圓數 (approximate 不限)
+EXACT_BATCH_ROWS = 500
+# What-if 掃描預設的感測器數 (依 SHAP 重要性) 與手動調整的滑桿數
+WHAT_IF_DEFAULT_SENSORS = 5
+WHAT_IF_SLIDERS = 5
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """啟動 /metrics 端點 (需設定 YIELD_METRICS=1 與 YIELD_METRICS_PORT)"""
+    if os.environ.get('YIELD_METRICS_PORT'):
+        return instrumentation.start_metrics_server()
+    return None
+
+
+def main():
+    """一次 rerun 的畫面流程 (st.stop() / st.rerun() 會以例外跳出)"""
+    start_metrics_endpoint()
+
+    # 在主流程中載入模型
+    with st.spinner("Loading AI Model and Resources..."):
+        model_handle = get_model_handle()
+        # 每次 rerun 取得當下的版本；整個 rerun 使用同一個模型，避免中途被替換
+        model_version, pipeline = model_handle.current()
+
+    # 檢查模型是否載入成功，並設定 model 變數
+    if pipeline is None:
+        st.error(f"❌ Critical Error: No active model in the registry and no model file at '{model_path}.pkl'. Please run training scripts first.")
+        st.stop() # 停止執行後續程式碼
     else:
-        return None
-
-# 在主流程中載入模型
-with st.spinner("Loading AI Model and Resources..."):
-    pipeline = load_yield_model()
-
-# 檢查模型是否載入成功，並設定 model 變數
-if pipeline is None:
-    st.error(f"❌ Critical Error: Model file not found at '{model_path}.pkl'. Please run training scripts first.")
-    st.stop() # 停止執行後續程式碼
-else:
-    # 嘗試提取最終模型供 SHAP 使用
-    try:
-        model = pipeline._final_estimator
-    except:
-        model = pipeline
-
-# --- 3. 標題與簡介 (整合狀態顯示) ---
-st.title("🧊 AI Semiconductor Yield Prediction System")
-
-# 使用 Columns 來讓狀態顯示更緊湊
-col_desc, col_status = st.columns([3, 1])
-with col_desc:
-    st.markdown("""
-    **Overview**: This application predicts wafer yield outcomes and analyzes failure root causes using SHAP values.
-    Upload your batch data to identify high-risk wafers immediately.
-    """)
-with col_status:
-    # 用一個漂亮的綠色區塊顯示狀態，取代原本的側邊欄
-    st.success("✅ System Status: Online\n\nModel: CatBoost/XGBoost Ensemble")
-
-st.markdown("---")
-
-# --- 4. 主功能分頁 (UI 英文統一) ---
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
-    "📂 Batch Prediction", 
-    "📊 Statistics", 
-    "⚠️ Fail Ranking", 
-    "🔍 Root Cause (SHAP)",
-    "📉 Model Performance" 
-])
-
-# 初始化 session_state
-if 'predictions' not in st.session_state:
-    st.session_state['predictions'] = None
-if 'data' not in st.session_state:
-    st.session_state['data'] = None
-
-# ==========================================
-# Tab 1: Batch Prediction
-# ==========================================
-with tab1:
-    st.subheader("Data Upload & Execution")
-    
-    col_input, col_action = st.columns([2, 1])
-    
-    with col_input:
-        use_sample = st.checkbox("Use Sample Data (secom_processed.csv)")
-        uploaded_file = st.file_uploader("Or Upload CSV File", type=['csv'])
-    
-    df = None
-    if use_sample:
-        if os.path.exists('data/secom_processed.csv'):
-            df = pd.read_csv('data/secom_processed.csv').head(100)
-            st.info("ℹ️ Loaded sample data (first 100 rows).")
-    elif uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
-        st.success("✅ File uploaded successfully.")
-
-    if df is not None:
-        st.session_state['data'] = df
-        
-        # 把按鈕放在右側 Action 區塊，比較整齊
-        with col_action:
-            st.write("###") #用來對齊的空白
-            if st.button("🚀 Run Prediction", type="primary", use_container_width=True):
-                with st.spinner("Processing wafers..."):
-                    predictions = predict_model(pipeline, data=df)
-                    st.session_state['predictions'] = predictions
-                    st.success("Analysis Complete!")
-        
-        with st.expander("👁️ Preview Input Data"):
-            st.dataframe(df.head())
-
-        # 下載按鈕區域
+        # 嘗試提取最終模型供 SHAP 使用
+        try:
+            model = pipeline._final_estimator
+        except:
+            model = pipeline
+
+    # --- 3. 標題與簡介 (整合狀態顯示) ---
+    st.title("🧊 AI Semiconductor Yield Prediction System")
+
+    # 使用 Columns 來讓狀態顯示更緊湊
+    col_desc, col_status = st.columns([3, 1])
+    with col_desc:
+        st.markdown("""
+        **Overview**: This application predicts wafer yield outcomes and analyzes failure root causes using SHAP values.
+        Upload your batch data to identify high-risk wafers immediately.
+        """)
+    with col_status:
+        # 用一個漂亮的綠色區塊顯示狀態，取代原本的側邊欄
+        if isinstance(pipeline, ModelEnsemble):
+            model_label = "Ensemble (" + " / ".join(pipeline.names) + ")"
+        else:
+            model_label = type(model).__name__
+        st.success(f"✅ System Status: Online\n\nModel: {model_label}\n\nVersion: `{model_version}`")
+        if isinstance(pipeline, ModelEnsemble):
+            with st.expander("Ensemble weights"):
+                st.dataframe(pipeline.describe(), hide_index=True, use_container_width=True)
+        if model_handle.last_error:
+            st.warning(f"⚠️ New model version failed to load, still serving `{model_version}`.")
+
+    st.markdown("---")
+
+    # --- 4. 主功能分頁 (UI 英文統一) ---
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+        "📂 Batch Prediction", 
+        "📊 Statistics", 
+        "⚠️ Fail Ranking", 
+        "🔍 Root Cause (SHAP)",
+        "📉 Model Performance" 
+    ])
+
+    # 初始化 session_state
+    if 'predictions' not in st.session_state:
+        st.session_state['predictions'] = None
+    if 'data' not in st.session_state:
+        st.session_state['data'] = None
+        st.session_state['data_version'] = None
+    if 'drift_batch_count' not in st.session_state:
+        st.session_state['drift_sketch'] = None
+        st.session_state['drift_batches'] = deque(maxlen=DRIFT_RECENT_BATCHES)
+        st.session_state['drift_batch_count'] = 0
+    if 'validation' not in st.session_state:
+        st.session_state['validation'] = None
+
+    # ==========================================
+    # Tab 1: Batch Prediction
+    # ==========================================
+    with tab1:
+        st.subheader("Data Upload & Execution")
+
+        col_input, col_action = st.columns([2, 1])
+
+        with col_input:
+            use_sample = st.checkbox(f"Use Sample Data ({os.path.basename(SAMPLE_DATA_PATH)})")
+            uploaded_file = st.file_uploader("Or Upload CSV File", type=['csv'])
+
+        df = None
+        if use_sample:
+            if os.path.exists(SAMPLE_DATA_PATH):
+                with stage('csv_parse') as s:
+                    df = pd.read_csv(SAMPLE_DATA_PATH, nrows=SAMPLE_ROWS)
+                    s.add_rows(len(df))
+                st.info(f"ℹ️ Loaded sample data (first {len(df)} rows).")
+        elif uploaded_file is not None:
+            with stage('csv_parse') as s:
+                df = pd.read_csv(uploaded_file)
+                s.add_rows(len(df))
+            st.success("✅ File uploaded successfully.")
+
+        if df is not None:
+            st.session_state['data'] = df
+            st.session_state['data_version'] = utils.dataframe_fingerprint(df)
+
+            # 累積漂移摘要 (同一批資料只累加一次，避免 rerun 重複計算)
+            drift_reference = load_drift_reference()
+            if drift_reference is not None:
+                batch_id = st.session_state['data_version']
+                if batch_id not in st.session_state['drift_batches']:
+                    if st.session_state['drift_sketch'] is None:
+                        st.session_state['drift_sketch'] = drift_reference.empty_like()
+                    st.session_state['drift_sketch'].update(df)
+                    st.session_state['drift_batches'].append(batch_id)
+                    st.session_state['drift_batch_count'] += 1
+
+            # 送進模型前先驗證欄位、文字內容、數值範圍與缺值率 (同一批資料只驗證一次)
+            validation = st.session_state['validation']
+            if validation is None or validation['data_version'] != st.session_state['data_version']:
+                with stage('input_validation', rows=len(df)):
+                    validation = validate_batch(df, load_input_bounds(SensorBounds.mtime(INPUT_BOUNDS_PATH)))
+                validation['data_version'] = st.session_state['data_version']
+                st.session_state['validation'] = validation
+            accepted_df = df[~validation['reject']]
+            summary = validation['summary']
+
+            if summary['missing_columns']:
+                st.error(f"❌ Upload is missing {len(summary['missing_columns'])} required sensors "
+                         f"(e.g. {', '.join(summary['missing_columns'][:5])}). No wafers can be scored.")
+            elif summary['rejected'] > 0:
+                st.warning(f"⚠️ {summary['rejected']} of {summary['rows']} wafers failed validation and will not be scored "
+                           f"(non-numeric: {summary['rejected_by']['non_numeric']}, "
+                           f"out of range: {summary['rejected_by']['out_of_range']}, "
+                           f"too many NaNs: {summary['rejected_by']['nan_rate']}).")
+            if summary['rejected'] > 0 or not validation['report'].empty:
+                with st.expander("🧪 Validation Report"):
+                    if summary['rejected'] > 0 and not summary['missing_columns']:
+                        rejected = df[validation['reject']].copy()
+                        rejected.insert(0, 'reject_reason', validation['reasons'][validation['reject']])
+                        st.dataframe(rejected, use_container_width=True)
+                    st.dataframe(validation['report'], use_container_width=True)
+                    st.caption(f"Validated in {summary['elapsed_sec'] * 1000:.0f} ms.")
+
+            # 把按鈕放在右側 Action 區塊，比較整齊
+            with col_action:
+                st.write("###") #用來對齊的空白
+                if st.button("🚀 Run Prediction", type="primary", use_container_width=True,
+                             disabled=accepted_df.empty):
+                    job_queue = get_job_queue()
+                    cache = get_prediction_cache()
+
+                    def score_rows(rows):
+                        """只有快取未命中的晶圓才會送到這裡"""
+                        if job_queue.live_workers() > 0:
+                            # 交給背景 worker 計算，這個 session 只睡眠輪詢進度，不佔用 CPU
+                            progress_bar = st.progress(0.0, text="Queued for background workers...")
+                            group_id = job_queue.submit('predict', rows)
+                            return job_queue.wait(
+                                group_id, timeout=JOB_TIMEOUT_SEC,
+                                on_progress=lambda p: progress_bar.progress(p, text=f"Processing wafers... {p:.0%}")
+                            )
+                        with st.spinner("Processing wafers..."):
+                            with stage('predict_model', rows=len(rows)):
+                                return predict_frame(pipeline, data=rows)
+
+                    try:
+                        predictions, n_cached = cache.predict(accepted_df, model_version, model_feature_names(pipeline), score_rows)
+                        st.session_state['predictions'] = predictions
+                        st.success("Analysis Complete!")
+                        cache_stats = cache.stats()
+                        st.caption(f"⚡ {n_cached} of {len(accepted_df)} wafers served from the prediction cache "
+                                   f"(overall hit rate {cache_stats['hit_rate']:.0%}, {cache_stats['entries']:,} cached rows).")
+                    except (JobFailed, TimeoutError) as e:
+                        st.error(f"❌ Background prediction failed: {e}")
+
+            with st.expander("👁️ Preview Input Data"):
+                st.dataframe(df.head())
+
+            # 下載按鈕區域
+            if st.session_state['predictions'] is not None:
+                st.divider()
+                st.subheader("Downloads")
+                csv_all = st.session_state['predictions'].to_csv(index=False).encode('utf-8-sig')
+                st.download_button(
+                    label="📥 Download Full Results (CSV)",
+                    data=csv_all,
+                    file_name="full_predictions_result.csv",
+                    mime="text/csv"
+                )
+
+    # ==========================================
+    # Tab 2: Batch Statistics
+    # ==========================================
+    with tab2:
+        st.subheader("Yield Overview")
         if st.session_state['predictions'] is not None:
-            st.divider()
-            st.subheader("Downloads")
-            csv_all = st.session_state['predictions'].to_csv(index=False).encode('utf-8-sig')
-            st.download_button(
-                label="📥 Download Full Results (CSV)",
-                data=csv_all,
-                file_name="full_predictions_result.csv",
-                mime="text/csv"
-            )
-
-# ==========================================
-# Tab 2: Batch Statistics
-# ==========================================
-with tab2:
-    st.subheader("Yield Overview")
-    if st.session_state['predictions'] is not None:
-        preds = st.session_state['predictions']
-        total = len(preds)
-        fail_count = preds[preds['prediction_label'] == 1].shape[0]
-        pass_count = total - fail_count
-        yield_rate = (pass_count / total) * 100
-        
-        c1, c2, c3 = st.columns(3)
-        c1.metric("Total Wafers", f"{total}")
-        c2.metric("Yield Rate", f"{yield_rate:.2f}%")
-        c3.metric("Defect Count", f"{fail_count}", delta_color="inverse")
-        
-        # 讓圖表置中且不要太大
-        col_fig, _ = st.columns([1, 1])
-        with col_fig:
-            fig, ax = plt.subplots(figsize=(6, 4))
-            ax.pie([pass_count, fail_count], labels=['Pass', 'Fail'], autopct='%1.1f%%', colors=['#66b3ff','#ff9999'])
-            st.pyplot(fig)
-    else:
-        st.warning("⚠️ Please run prediction in the 'Batch Prediction' tab first.")
-
-# ==========================================
-# Tab 3: Fail Ranking
-# ==========================================
-with tab3:
-    st.subheader("High-Risk Wafer Ranking")
-    if st.session_state['predictions'] is not None:
-        preds = st.session_state['predictions']
-        fails = preds[preds['prediction_label'] == 1].copy()
-        
-        if not fails.empty:
-            st.markdown("**Top 20 Wafers with Highest Failure Probability:**")
-            top_fails = fails.sort_values(by='prediction_score', ascending=False).head(20)
-            st.dataframe(top_fails.style.background_gradient(subset=['prediction_score'], cmap='Reds'))
-            
-            csv_fails = top_fails.to_csv(index=False).encode('utf-8-sig')
-            st.download_button(
-                label="🚨 Download Top 20 High-Risk List (CSV)",
-                data=csv_fails,
-                file_name="high_risk_wafers.csv",
-                mime="text/csv",
-                type="primary"
-            )
+            preds = st.session_state['predictions']
+            total = len(preds)
+            fail_count = preds[preds['prediction_label'] == 1].shape[0]
+            pass_count = total - fail_count
+            yield_rate = (pass_count / total) * 100
+
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Total Wafers", f"{total}")
+            c2.metric("Yield Rate", f"{yield_rate:.2f}%")
+            c3.metric("Defect Count", f"{fail_count}", delta_color="inverse")
+
+            # 讓圖表置中且不要太大
+            col_fig, _ = st.columns([1, 1])
+            with col_fig:
+                st.image(render_cache.render_yield_pie(pass_count, fail_count), use_container_width=True)
+        else:
+            st.warning("⚠️ Please run prediction in the 'Batch Prediction' tab first.")
+
+        st.divider()
+        st.subheader("Sensor Drift Monitor")
+        st.caption("Compares all uploaded batches against the training distribution of every sensor (PSI / KS).")
+        drift_reference = load_drift_reference()
+        if drift_reference is None:
+            st.info(f"Drift reference not found at `{DRIFT_REFERENCE_PATH}`. Run `train_upgrade.py` to create it.")
+        elif st.session_state['drift_sketch'] is None:
+            st.warning("⚠️ Please load data in the 'Batch Prediction' tab first.")
         else:
-            st.success("🎉 No failures predicted in this batch!")
+            drift_sketch = st.session_state['drift_sketch']
+            drift = compute_drift(drift_reference, drift_sketch)
+
+            d1, d2, d3 = st.columns(3)
+            d1.metric("Batches Monitored", f"{st.session_state['drift_batch_count']}")
+            d2.metric("Wafers Monitored", f"{drift_sketch.n_rows}")
+            d3.metric("Sensors with Major Drift", f"{int((drift['level'] == 'Major').sum())}")
+
+            top_k = st.slider("Number of sensors to show", min_value=5, max_value=50, value=20)
+            worst = drift.sort_values('psi', ascending=False, na_position='last').head(top_k)
+            st.dataframe(worst.style.background_gradient(subset=['psi'], cmap='Oranges'), use_container_width=True)
+
+            if st.button("🔄 Reset Drift History"):
+                st.session_state['drift_sketch'] = None
+                st.session_state['drift_batches'].clear()
+                st.session_state['drift_batch_count'] = 0
+                st.rerun()
+
+        st.divider()
+        st.subheader("Watch Folder")
+        st.caption("Exports scored automatically by `python watch_folder.py --watch-dir <folder>` (no upload needed).")
+        watch_mtime = WatchStore.mtime(WATCH_STORE_DIR)
+        if watch_mtime is None:
+            st.info(f"No watch-folder results at `{WATCH_STORE_DIR}`. Start `python watch_folder.py` to score "
+                    "new exports as they arrive.")
+        else:
+            watch = load_watch_summary(watch_mtime)
+            totals = watch['totals']
+            w1, w2, w3, w4 = st.columns(4)
+            w1.metric("Files Scored", f"{totals['files']}")
+            w2.metric("Wafers Scored", f"{totals['scored']:,}")
+            w3.metric("Yield Rate", f"{totals['yield']:.2%}" if totals['yield'] is not None else "n/a")
+            w4.metric("Failed Files", f"{totals['failed_files']}", delta_color="inverse")
+            if totals['last_finished']:
+                st.caption(f"Last file finished at {pd.to_datetime(totals['last_finished'], unit='s'):%Y-%m-%d %H:%M:%S} UTC. "
+                           "All watch-folder times are UTC.")
+
+            if not watch['hourly'].empty:
+                st.markdown("**Hourly yield (UTC)**")
+                st.line_chart(watch['hourly'], x='hour_utc', y=['yield', 'mean_fail_probability'])
+            col_files, col_risks = st.columns(2)
+            with col_files:
+                st.markdown("**Recent files**")
+                st.dataframe(watch['recent'], hide_index=True, use_container_width=True)
+            with col_risks:
+                st.markdown("**Highest-risk wafers**")
+                st.dataframe(watch['risks'].style.background_gradient(subset=['fail_probability'], cmap='Reds'),
+                             hide_index=True, use_container_width=True)
+            if st.button("🔄 Refresh Watch Folder"):
+                st.rerun()
+
+    # ==========================================
+    # Tab 3: Fail Ranking
+    # ==========================================
+    with tab3:
+        st.subheader("High-Risk Wafer Ranking")
+        if st.session_state['predictions'] is not None:
+            preds = st.session_state['predictions']
+            fails = preds[preds['prediction_label'] == 1].copy()
+
+            if not fails.empty:
+                st.markdown("**Top 20 Wafers with Highest Failure Probability:**")
+                top_fails = fails.sort_values(by='prediction_score', ascending=False).head(20)
+                st.dataframe(top_fails.style.background_gradient(subset=['prediction_score'], cmap='Reds'))
+
+                csv_fails = top_fails.to_csv(index=False).encode('utf-8-sig')
+                st.download_button(
+                    label="🚨 Download Top 20 High-Risk List (CSV)",
+                    data=csv_fails,
+                    file_name="high_risk_wafers.csv",
+                    mime="text/csv",
+                    type="primary"
+                )
+            else:
+                st.success("🎉 No failures predicted in this batch!")
+                st.divider()
+                st.markdown("**Lowest Confidence 'Pass' Wafers (Watch List):**")
+                risky_pass = preds[preds['prediction_label'] == 0].sort_values(by='prediction_score', ascending=True).head(10)
+                st.dataframe(risky_pass)
+
+                csv_risky = risky_pass.to_csv(index=False).encode('utf-8-sig')
+                st.download_button(
+                    label="📥 Download Watch List (CSV)",
+                    data=csv_risky,
+                    file_name="risky_pass_wafers.csv",
+                    mime="text/csv"
+                )
+        else:
+            st.warning("⚠️ Please run prediction first.")
+
+    # ==========================================
+    # Tab 4: SHAP Analysis 
+    # ==========================================
+    with tab4:
+        st.subheader("Model Interpretability")
+
+        st.markdown("### 1. Global Feature Importance")
+        st.caption("Visualizes which sensor readings contribute most to yield failures across the entire dataset.")
+
+        shap_store_mtime = ShapStore.mtime(SHAP_STORE_DIR)
+        if shap_store_mtime is not None:
+            global_shap = load_shap_store(shap_store_mtime)
+            store_version = global_shap.meta.get('model_version')
+            if store_version and store_version != model_version:
+                st.caption(f"ℹ️ SHAP values were computed for model `{store_version}` (active: `{model_version}`).")
+
+            col_filter, col_rank = st.columns([1, 2])
+            with col_filter:
+                shap_group = st.radio("Wafers:", ["All", "Fail", "Pass"], horizontal=True, key='shap_group')
+                shap_filter = st.text_input("Filter sensors:", "", placeholder="e.g. feature_10", key='shap_filter')
+                shap_top_k = st.slider("Top sensors:", 5, 50, 20, key='shap_top_k')
+            importance = global_shap.importance(group=shap_group.lower(), contains=shap_filter.strip() or None,
+                                                top_k=shap_top_k)
+            with col_rank:
+                if importance.empty:
+                    st.info("No sensors match the filter.")
+                else:
+                    st.dataframe(importance.to_frame().style.background_gradient(cmap='Reds'), use_container_width=True)
+
+            if not importance.empty:
+                st.markdown("**Dependence View**")
+                dep_feature = st.selectbox("Sensor:", importance.index, key='shap_dep_feature')
+                dependence = global_shap.dependence(dep_feature, group=shap_group.lower())
+                st.scatter_chart(dependence, x='value', y='shap', color='outcome')
+                st.caption(f"{len(dependence)} sampled wafers (of {global_shap.meta['n_rows']}). "
+                           "Positive SHAP pushes the prediction toward Fail.")
+        else:
+            # 尚未建立 SHAP store 時退回舊的靜態圖
+            shap_img_path = "reports/SHAP Summary.png"
+            shap_img = render_cache.load_static_image(shap_img_path)
+            if shap_img is not None:
+                st.image(shap_img, caption="SHAP Summary Plot", use_container_width=True)
+            else:
+                st.info(f"No SHAP store at `{SHAP_STORE_DIR}`. Run `train_upgrade.py` to build it.")
+
+        st.divider()
+        st.markdown("### 2. Current Batch Drivers")
+        st.caption("Which sensors drive the predictions for the uploaded wafers. "
+                   "Approximate mode (path attribution) covers the whole batch at roughly the cost of a prediction.")
+
+        if st.session_state['data'] is not None:
+            batch_df = st.session_state['data']
+            if st.session_state['validation'] is not None:
+                batch_df = batch_df[~st.session_state['validation']['reject']]
+            explain_mode = st.radio("Explanation mode:", ["Approximate (fast)", "Exact (TreeSHAP)"],
+                                    horizontal=True, key='batch_explain_mode')
+            method = 'approximate' if explain_mode.startswith('Approximate') else 'exact'
+            if method == 'exact':
+                batch_df = batch_df.head(EXACT_BATCH_ROWS)
+            batch_key = (st.session_state['data_version'], model_version, method)
+
+            if st.button("🧠 Explain Batch", disabled=batch_df.empty):
+                try:
+                    job_queue = get_job_queue()
+                    if job_queue.live_workers() > 0:
+                        group_id = job_queue.submit('shap', batch_df, params={'method': method})
+                        result = concat_results(job_queue.wait(group_id, timeout=JOB_TIMEOUT_SEC))
+                    else:
+                        with st.spinner(f"Explaining {len(batch_df)} wafers..."):
+                            result = compute_shap(pipeline, batch_df, method=method)
+                    st.session_state['batch_shap'] = {'key': batch_key, 'importance': batch_importance(result),
+                                                      'rows': len(result['index'])}
+                except Exception as e:
+                    st.error(f"Error explaining batch: {e}")
+
+            batch_shap = st.session_state.get('batch_shap')
+            if batch_shap is not None and batch_shap['key'] == batch_key:
+                st.dataframe(batch_shap['importance'].style.background_gradient(cmap='Reds', subset=['mean |SHAP|']),
+                             use_container_width=True)
+                st.caption(f"{batch_shap['rows']} wafers, {method} attribution. "
+                           "Positive mean SHAP pushes the batch toward Fail.")
+            if method == 'approximate':
+                error_report = load_error_report()
+                if error_report is not None:
+                    st.caption(f"📏 Approximation vs exact SHAP on {error_report['rows']} validation wafers "
+                               f"({error_report['model']}): relative error {error_report['relative_error']:.1%}, "
+                               f"importance rank correlation {error_report['importance_spearman']:.2f}, "
+                               f"top-{error_report['top_k']} overlap {error_report['top_k_overlap']:.0%}, "
+                               f"{error_report['speedup']:.1f}x faster.")
+            elif len(st.session_state['data']) > EXACT_BATCH_ROWS:
+                st.caption(f"Exact mode explains the first {EXACT_BATCH_ROWS} wafers only.")
+        else:
+            st.warning("⚠️ Please load data first in the 'Batch Prediction' tab.")
+
+        st.divider()
+        st.markdown("### 3. Local Waterfall Analysis")
+        st.caption("Deep dive into a specific wafer to understand why the model predicted it as Fail/Pass.")
+
+        if st.session_state['data'] is not None:
+            shap_data = st.session_state['data'].head(500) # Limit for performance
+
+            # 選擇晶圓 ID
+            col_sel, col_viz = st.columns([1, 3])
+
+            with col_sel:
+                sample_idx = st.selectbox("Select Wafer Index:", shap_data.index)
+
+            def compute_selected_shap():
+                """計算所選晶圓的 SHAP (只在 wafer_shap 快取未命中時執行)"""
+                # TreeSHAP 每一列彼此獨立，只需計算所選的晶圓 (單片 drill-down 一律使用 exact)
+                wafer = shap_data.loc[[sample_idx]]
+                job_queue = get_job_queue()
+                if job_queue.live_workers() > 0:
+                    return job_queue.wait(job_queue.submit('shap', wafer, params={'method': 'exact'}),
+                                          timeout=JOB_TIMEOUT_SEC)
+                return compute_shap(pipeline, wafer)
+
+            def selected_wafer_shap():
+                return wafer_shap(st.session_state['data_version'], model_version, sample_idx, compute_selected_shap)
+
+            def build_explanation():
+                """所選晶圓的 SHAP 解釋 (只在渲染快取未命中時執行)"""
+                return to_explanation(selected_wafer_shap(), 0)
+
+            with col_viz:
+                try:
+                    st.markdown(f"**Impact Factors for Wafer {sample_idx}:**")
+                    waterfall_png = render_cache.render_waterfall(
+                        st.session_state['data_version'], model_version, sample_idx, build_explanation
+                    )
+                    st.image(waterfall_png)
+                except Exception as e:
+                    st.error(f"Error generating SHAP plot: {e}")
+
             st.divider()
-            st.markdown("**Lowest Confidence 'Pass' Wafers (Watch List):**")
-            risky_pass = preds[preds['prediction_label'] == 0].sort_values(by='prediction_score', ascending=True).head(10)
-            st.dataframe(risky_pass)
-            
-            csv_risky = risky_pass.to_csv(index=False).encode('utf-8-sig')
-            st.download_button(
-                label="📥 Download Watch List (CSV)",
-                data=csv_risky,
-                file_name="risky_pass_wafers.csv",
-                mime="text/csv"
-            )
-    else:
-        st.warning("⚠️ Please run prediction first.")
-
-# ==========================================
-# Tab 4: SHAP Analysis 
-# ==========================================
-with tab4:
-    st.subheader("Model Interpretability")
-    
-    st.markdown("### 1. Global Feature Importance")
-    st.caption("Visualizes which sensor readings contribute most to yield failures across the entire dataset.")
-    
-    shap_img_path = "reports/SHAP Summary.png"
-    
-    if os.path.exists(shap_img_path):
-        st.image(shap_img_path, caption="SHAP Summary Plot", use_container_width=True)
-    else:
-        st.info(f"SHAP Summary image not found at `{shap_img_path}`.")
+            st.markdown("### 4. Similar Historical Wafers")
+            st.caption("Past wafers whose sensor profile (or SHAP profile) is closest to the selected wafer, and what happened to them.")
+            wafer_index_mtime = WaferIndex.mtime(WAFER_INDEX_DIR)
+            if wafer_index_mtime is None:
+                st.info(f"No wafer index at `{WAFER_INDEX_DIR}`. Run `train_upgrade.py` or `python wafer_index.py build`.")
+            else:
+                wafer_index = load_wafer_index(wafer_index_mtime)
+                n_similar = st.slider("Number of similar wafers:", 5, 50, 10, key='similar_k')
+                try:
+                    wafer = shap_data.loc[[sample_idx]]
+                    with stage('similar_wafer_query'):
+                        if wafer_index.space == 'shap':
+                            result = selected_wafer_shap()
+                            query = pd.Series(result['values'][0], index=result['feature_names'] or wafer_index.feature_names)
+                        else:
+                            query = wafer
+                        similar = wafer_index.query(query, k=n_similar)
+                    fail_rate = (similar['label'] == 1).mean()
+                    st.metric("Fail rate among similar wafers", f"{fail_rate:.1%}",
+                              help=f"Searched {wafer_index.meta['n_rows']:,} historical wafers ({wafer_index.space} space).")
+                    st.dataframe(
+                        similar.style.apply(lambda r: ['background-color: #ffe0e0' if r['outcome'] == 'Fail' else ''] * len(r), axis=1),
+                        use_container_width=True
+                    )
+                except Exception as e:
+                    st.error(f"Error searching similar wafers: {e}")
 
-    st.divider()
-    st.markdown("### 2. Local Waterfall Analysis")
-    st.caption("Deep dive into a specific wafer to understand why the model predicted it as Fail/Pass.")
-    
-    if st.session_state['data'] is not None:
-        shap_data = st.session_state['data'].head(500) # Limit for performance
-        
-        # 選擇晶圓 ID
-        col_sel, col_viz = st.columns([1, 3])
-        
-        with col_sel:
-            sample_idx = st.selectbox("Select Wafer Index:", shap_data.index)
-            
-        with col_viz:
+            st.divider()
+            st.markdown("### 5. What-If Sensitivity")
+            st.caption("How far each sensor must move (others held fixed) to flip the selected wafer between Fail and Pass. "
+                       "The whole grid is scored in one batched call.")
+            model_sensors = model_feature_names(pipeline)
+            # 預設掃描 SHAP 最重要的感測器 (目前批次的摘要優先，其次是全域 store)
+            batch_shap = st.session_state.get('batch_shap')
+            if batch_shap is not None and batch_shap['key'][:2] == (st.session_state['data_version'], model_version):
+                ranked = list(batch_shap['importance'].index)
+            elif shap_store_mtime is not None:
+                ranked = list(global_shap.importance(group='all', top_k=WHAT_IF_DEFAULT_SENSORS).index)
+            else:
+                ranked = []
+            default_sensors = [c for c in ranked if c in model_sensors][:WHAT_IF_DEFAULT_SENSORS] \
+                or model_sensors[:WHAT_IF_DEFAULT_SENSORS]
+
+            col_cfg, col_res = st.columns([1, 2])
+            with col_cfg:
+                what_if_sensors = st.multiselect("Sensors to sweep:", model_sensors, default=default_sensors,
+                                                 key='what_if_sensors')
+                what_if_points = st.slider("Grid points per sensor:", 11, 101, 41, step=10, key='what_if_points')
             try:
-                # 準備 SHAP 資料
-                transformer = pipeline[:-1]
-                X_transformed = transformer.transform(shap_data)
-                explainer = shap.TreeExplainer(model)
-                shap_values = explainer.shap_values(X_transformed)
-                
-                # 處理 SHAP 格式 (相容 XGBoost/CatBoost)
-                if isinstance(shap_values, list):
-                    sv = shap_values[1]
-                    bv = explainer.expected_value[1] if isinstance(explainer.expected_value, (list, np.ndarray)) else explainer.expected_value
-                elif len(np.array(shap_values).shape) == 3:
-                    sv = np.array(shap_values)[:, :, 1]
-                    bv = explainer.expected_value[1] if isinstance(explainer.expected_value, (list, np.ndarray)) else explainer.expected_value
-                else:
-                    sv = shap_values
-                    bv = explainer.expected_value
-                    if isinstance(bv, (list, np.ndarray)) and len(bv) == 1:
-                        bv = bv[0]
-                
-                loc_idx = shap_data.index.get_loc(sample_idx)
-                row_data = X_transformed.iloc[loc_idx] if isinstance(X_transformed, pd.DataFrame) else X_transformed[loc_idx]
-                
-                explanation = shap.Explanation(
-                    values=sv[loc_idx], 
-                    base_values=bv, 
-                    data=row_data, 
-                    feature_names=X_transformed.columns if hasattr(X_transformed, 'columns') else None
-                )
-                
-                st.markdown(f"**Impact Factors for Wafer {sample_idx}:**")
-                fig_water, ax_water = plt.subplots()
-                shap.plots.waterfall(explanation, show=False)
-                st.pyplot(fig_water)
-                
+                wafer = shap_data.loc[[sample_idx]]
+                bounds = load_input_bounds(SensorBounds.mtime(INPUT_BOUNDS_PATH))
+                batch_ref = st.session_state['data']
+                what_if_ranges = default_ranges(wafer, what_if_sensors, reference=batch_ref, bounds=bounds)
+                # 同一片晶圓、同一組設定只掃描一次 (滑桿 rerun 時沿用)
+                what_if_key = (st.session_state['data_version'], model_version, sample_idx,
+                               tuple(what_if_sensors), what_if_points)
+                cached = st.session_state.get('what_if')
+                if what_if_sensors and (cached is None or cached['key'] != what_if_key):
+                    st.session_state['what_if'] = cached = {
+                        'key': what_if_key, 'result': sweep(pipeline, wafer, what_if_ranges, n_points=what_if_points)}
+                if what_if_sensors:
+                    result = cached['result']
+                    flips = result['flips']
+                    target = 'Pass' if result['base_label'] == 1 else 'Fail'
+                    with col_res:
+                        st.metric("Current Fail probability", f"{result['base_proba']:.1%}",
+                                  help=f"Threshold {result['threshold']:.2f}; {result['rows_scored']:,} grid rows scored.")
+                        st.markdown(f"**Smallest single-sensor change that flips the wafer to {target}:**")
+                        st.dataframe(flips.style.format({'current': '{:.4g}', 'flip_value': '{:.4g}', 'delta': '{:+.4g}',
+                                                         'delta_pct_of_range': '{:.1f}%', 'min_fail_proba': '{:.1%}',
+                                                         'max_fail_proba': '{:.1%}'}, na_rep='no flip'),
+                                     hide_index=True, use_container_width=True)
+
+                    curve_sensor = st.selectbox("Response curve:", what_if_sensors, key='what_if_curve')
+                    curve = result['curves'][result['curves']['sensor'] == curve_sensor]
+                    chart = curve[['value', 'fail_proba']].assign(threshold=result['threshold'])
+                    st.line_chart(chart, x='value', y=['fail_proba', 'threshold'])
+
+                    with st.expander("🎛️ Try sensor values"):
+                        overrides = {}
+                        for sensor in what_if_sensors[:WHAT_IF_SLIDERS]:
+                            low, high = what_if_ranges[sensor]
+                            current = wafer[sensor].iloc[0]
+                            start = float(current) if pd.notna(current) else (low + high) / 2
+                            overrides[sensor] = st.slider(sensor, low, high, start, step=(high - low) / 100,
+                                                          format='%.4g', key=f'what_if_{sample_idx}_{sensor}')
+                        proba = score_overrides(pipeline, wafer, overrides)
+                        st.metric("Fail probability with these values", f"{proba:.1%}",
+                                  delta=f"{(proba - result['base_proba']) * 100:+.1f} pts", delta_color='inverse')
+
+                    if len(what_if_sensors) >= 2:
+                        with st.expander("🗺️ Two-sensor grid"):
+                            col_x, col_y = st.columns(2)
+                            sensor_x = col_x.selectbox("X sensor:", what_if_sensors, index=0, key='what_if_x')
+                            sensor_y = col_y.selectbox("Y sensor:", what_if_sensors, index=1, key='what_if_y')
+                            if sensor_x != sensor_y:
+                                grid = pairwise_grid(pipeline, wafer, sensor_x, sensor_y, what_if_ranges, n_points=15)
+                                st.dataframe(grid.style.format('{:.0%}').background_gradient(cmap='RdYlGn_r', vmin=0, vmax=1),
+                                             use_container_width=True)
+                                st.caption("Fail probability when both sensors change together.")
             except Exception as e:
-                st.error(f"Error generating SHAP plot: {e}")
-    else:
-        st.warning("⚠️ Please load data first in the 'Batch Prediction' tab.")
-
-# ==========================================
-# Tab 5: Model Performance 
-# ==========================================
-with tab5:
-    st.subheader("Validation Metrics")
-    st.markdown("Detailed proof of model reliability.")
-    
-    report_imgs = {
-        "Confusion Matrix": "output/automl_reports/confusion_matrix.png",
-        "AUC-ROC Curve": "output/automl_reports/auc_roc_curve.png",
-        "Feature Importance": "output/automl_reports/feature_importance.png",
-        "Learning Curve": "output/automl_reports/learning_curve.png",
-        "Model Comparison": "reports/model_comparison_final.png"
-    }
-
-    col1, col2 = st.columns(2)
-    
-    for i, (title, path) in enumerate(report_imgs.items()):
-        container = col1 if i % 2 == 0 else col2
-        with container:
-            if os.path.exists(path):
-                st.image(path, caption=title, use_container_width=True)
-            else:
-                st.warning(f"⚠️ Missing: {title}")
-    
+                st.error(f"Error running what-if analysis: {e}")
+        else:
+            st.warning("⚠️ Please load data first in the 'Batch Prediction' tab.")
+
+    # ==========================================
+    # Tab 5: Model Performance 
+    # ==========================================
+    with tab5:
+        st.subheader("Validation Metrics")
+        st.markdown("Detailed proof of model reliability.")
+
+        report_imgs = {
+            "Confusion Matrix": "output/automl_reports/confusion_matrix.png",
+            "AUC-ROC Curve": "output/automl_reports/auc_roc_curve.png",
+            "Feature Importance": "output/automl_reports/feature_importance.png",
+            "Learning Curve": "output/automl_reports/learning_curve.png",
+            "Model Comparison": "reports/model_comparison_final.png"
+        }
+
+        col1, col2 = st.columns(2)
+
+        for i, (title, path) in enumerate(report_imgs.items()):
+            container = col1 if i % 2 == 0 else col2
+            with container:
+                img = render_cache.load_static_image(path)
+                if img is not None:
+                    st.image(img, caption=title, use_container_width=True)
+                else:
+                    st.warning(f"⚠️ Missing: {title}")
+
+        st.divider()
+        st.subheader("Overfitting Analysis")
+        analysis_path = "reports/overfitting_analysis.txt"
+        if os.path.exists(analysis_path):
+            with open(analysis_path, "r", encoding='utf-8') as f:
+                report_text = f.read()
+            st.text_area("Analysis Report", report_text, height=150)
+        else:
+            st.info("No analysis report found.")
+
+    # 每次 rerun 結束時輸出量測結果 (未啟用時不做任何事)
+    instrumentation.flush()
+
+
+# --- 執行本次 rerun；st.stop() / st.rerun() / 例外都會跳出 main()，剖析一律在 finally 中結束 ---
+# (避免 cProfile 與執行緒上的剖析狀態殘留在 ScriptRunner 執行緒，之後的剖析失效)
+rerun_profiler = None
+if profiling.profiling_requested(profile_query):
+    rerun_profiler = profiling.ProfileCapture('app_rerun').start()
+profile_paths = (None, None)
+try:
+    main()
+finally:
+    if rerun_profiler is not None:
+        profile_paths = rerun_profiler.stop()
+        # ?profile=1 只剖析一次 rerun，之後的互動不再重複剖析
+        if profile_query is not None and hasattr(st, 'query_params'):
+            del st.query_params['profile']
+
+# 提供本次 rerun 的剖析摘要下載 (st.stop() / st.rerun() 跳出時檔案仍已寫到 reports/profiles/)
+prof_path, summary_path = profile_paths
+if summary_path is not None:
     st.divider()
-    st.subheader("Overfitting Analysis")
-    analysis_path = "reports/overfitting_analysis.txt"
-    if os.path.exists(analysis_path):
-        with open(analysis_path, "r", encoding='utf-8') as f:
-            report_text = f.read()
-        st.text_area("Analysis Report", report_text, height=150)
-    else:
-        st.info("No analysis report found.")
+    st.caption(f"🔬 Profile captured: `{prof_path}`")
+    with open(summary_path, 'r', encoding='utf-8') as f:
+        st.download_button("📥 Download Hot-Function Summary", f.read(),
+                           file_name=os.path.basename(summary_path), mime="text/plain")
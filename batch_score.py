@@ -0,0 +1,325 @@
+"""
+批次評分 CLI (Headless Sharded Batch Scoring)
+
+夜間排程不需開 Streamlit，直接對大量 CSV / Parquet 匯出檔評分：
+- 輸入可為多個檔案、glob 或 @清單檔 (每行一個路徑)
+- 以檔案為單位分片：--shard-index / --shard-count 分給多台機器，機器內再分給 process pool
+  (主行程載入模型一次後 fork，模型記憶體以 copy-on-write 共用)
+- 每個檔案完成後寫出 _markers/<part>._SUCCESS；重跑時已完成且輸入、模型版本未變的檔案會跳過
+- 輸出分區存放 (scores/<part>.csv|parquet)，最後合併出 summary.json / file_summary.csv / top_risks.csv
+
+用法:
+    python batch_score.py "exports/*.csv" --output output/batch_scores/nightly --workers 4
+    python batch_score.py @files.txt --output /shared/scores --shard-index 1 --shard-count 3
+    python batch_score.py --merge-only --output /shared/scores
+"""
+import argparse
+import gc
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from log_config import configure_logging
+
+OUTPUT_DIR = 'output/batch_scores'
+DEFAULT_MODEL_PATH = 'output/final_yield_prediction_model'
+CHUNK_ROWS = 20000
+TOP_RISKS = 50
+SUPPORTED_SUFFIXES = ('.csv', '.parquet')
+
+# worker 行程共用的模型 (在 fork 前由主行程載入)
+_PIPELINE = None
+_MODEL_VERSION = None
+_BOUNDS = None
+
+
+def expand_inputs(patterns):
+    """展開 glob / @清單檔，回傳排序後去重的檔案清單 (各機器看到的順序一致)"""
+    paths = []
+    for pattern in patterns:
+        if pattern.startswith('@'):
+            with open(pattern[1:], 'r', encoding='utf-8') as f:
+                paths.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+        elif glob.has_magic(pattern):
+            paths.extend(glob.glob(pattern, recursive=True))
+        else:
+            paths.append(pattern)
+    paths = [os.path.normpath(p) for p in paths if p.lower().endswith(SUPPORTED_SUFFIXES)]
+    return sorted(dict.fromkeys(paths))
+
+
+def shard_files(paths, shard_index=0, shard_count=1):
+    """依排序後的位置輪流分配到各分片"""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard index {shard_index} is outside 0..{shard_count - 1}")
+    return paths[shard_index::shard_count]
+
+
+def part_name(path):
+    """輸出分區名稱：檔名 + 完整路徑雜湊 (不同資料夾的同名檔案不會互相覆蓋)"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{hashlib.md5(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]}"
+
+
+def input_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def marker_path(output_dir, path):
+    return os.path.join(output_dir, '_markers', part_name(path) + '._SUCCESS')
+
+
+def is_complete(output_dir, path, model_version):
+    """已有完成標記，且輸入檔與模型版本都沒變"""
+    try:
+        with open(marker_path(output_dir, path), 'r', encoding='utf-8') as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return marker.get('input') == input_signature(path) and marker.get('model_version') == model_version
+
+
+def iter_chunks(path, chunk_rows=CHUNK_ROWS):
+    if path.lower().endswith('.parquet'):
+        data = pd.read_parquet(path)
+        for start in range(0, len(data), chunk_rows):
+            yield data.iloc[start:start + chunk_rows]
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+def fail_probability(predictions):
+    """prediction_score 是預測類別的機率，換算成 Fail (1) 的機率"""
+    score = predictions['prediction_score'].to_numpy(dtype=np.float64)
+    return np.where(predictions['prediction_label'].to_numpy() == 1, score, 1 - score)
+
+
+def score_file(path, output_dir, pipeline, model_version, bounds=None, id_column=None,
+               output_format='csv', chunk_rows=CHUNK_ROWS, top_k=TOP_RISKS):
+    """
+    評分單一檔案：分塊驗證 + 預測，寫出分區檔與完成標記
+    Returns:
+        dict: 該檔案的摘要 (同時寫入完成標記)
+    """
+    from ensemble import predict_frame
+    from input_validation import BatchValidator
+
+    start = time.perf_counter()
+    name = part_name(path)
+    scores_dir = os.path.join(output_dir, 'scores')
+    os.makedirs(scores_dir, exist_ok=True)
+    os.makedirs(os.path.join(output_dir, '_markers'), exist_ok=True)
+    signature = input_signature(path)
+
+    validator = BatchValidator(bounds) if bounds is not None else None
+    outputs, risks = [], []
+    row_offset = 0
+    with stage('batch_score_file') as s:
+        for chunk in iter_chunks(path, chunk_rows):
+            chunk = chunk.reset_index(drop=True)
+            chunk.index += row_offset
+            row_offset += len(chunk)
+            reject = np.zeros(len(chunk), dtype=bool)
+            reasons = pd.Series('', index=chunk.index)
+            if validator is not None:
+                reject, reasons = validator.update(chunk)
+
+            result = chunk.copy()
+            result['prediction_label'] = np.nan
+            result['prediction_score'] = np.nan
+            result['fail_probability'] = np.nan
+            accepted = chunk[~reject]
+            if len(accepted):
+                predicted = predict_frame(pipeline, data=accepted)
+                result.loc[accepted.index, 'prediction_label'] = predicted['prediction_label'].to_numpy()
+                result.loc[accepted.index, 'prediction_score'] = predicted['prediction_score'].to_numpy()
+                result.loc[accepted.index, 'fail_probability'] = fail_probability(predicted)
+            result['reject_reason'] = reasons.to_numpy()
+            outputs.append(result)
+
+            scored = result[~reject]
+            top = scored.nlargest(top_k, 'fail_probability')
+            risks.append(pd.DataFrame({
+                'source_file': path,
+                'row': top.index,
+                'wafer_id': top[id_column].to_numpy() if id_column in top.columns else top.index,
+                'fail_probability': top['fail_probability'].to_numpy(),
+            }))
+            s.add_rows(len(chunk))
+
+    frame = pd.concat(outputs) if outputs else pd.DataFrame()
+    # 先寫暫存檔再替換，中斷時不會留下寫一半的分區
+    part_path = os.path.join(scores_dir, f"{name}.{output_format}")
+    tmp_path = f"{part_path}.{os.getpid()}.tmp"
+    if output_format == 'parquet':
+        frame.to_parquet(tmp_path, index=False)
+    else:
+        frame.to_csv(tmp_path, index_label='row')
+    os.replace(tmp_path, part_path)
+
+    labels = frame['prediction_label'] if len(frame) else pd.Series(dtype=float)
+    top_risks = pd.concat(risks).nlargest(top_k, 'fail_probability') if risks else pd.DataFrame()
+    marker = {
+        'source_file': path,
+        'part': part_path,
+        'input': signature,
+        'model_version': model_version,
+        'rows': int(len(frame)),
+        'rejected': int(validator.n_rejected) if validator is not None else 0,
+        'scored': int(labels.notna().sum()),
+        'fails': int((labels == 1).sum()),
+        'top_risks': json.loads(top_risks.to_json(orient='records')),
+        'elapsed_sec': round(time.perf_counter() - start, 3),
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    marker_file = marker_path(output_dir, path)
+    with open(marker_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(marker, f)
+    os.replace(marker_file + '.tmp', marker_file)
+    return marker
+
+
+def load_model_for_scoring(model_path=DEFAULT_MODEL_PATH):
+    """載入版本庫 ACTIVE 模型與輸入驗證界限 (存到模組變數，fork 後 worker 直接共用)"""
+    global _PIPELINE, _MODEL_VERSION, _BOUNDS
+    from pycaret.classification import load_model
+    from input_validation import SensorBounds, DEFAULT_BOUNDS_PATH
+    from model_registry import ModelRegistry
+
+    version, path = ModelRegistry().resolve(model_path)
+    if version is None:
+        raise FileNotFoundError(f"No active model in the registry and no model at {model_path}.pkl")
+    print(f"📦 Loading model {version} from {path}.pkl ...")
+    _PIPELINE = load_model(path)
+    _MODEL_VERSION = version
+    _BOUNDS = SensorBounds.load(DEFAULT_BOUNDS_PATH) if os.path.exists(DEFAULT_BOUNDS_PATH) else None
+    return version
+
+
+def _score_task(args):
+    path, output_dir, options = args
+    try:
+        return score_file(path, output_dir, _PIPELINE, _MODEL_VERSION, bounds=_BOUNDS, **options)
+    except Exception as e:
+        return {'source_file': path, 'error': f"{type(e).__name__}: {e}"}
+
+
+def run_shard(paths, output_dir, workers=1, **options):
+    """以 process pool 評分一個分片的所有檔案 (模型需先以 load_model_for_scoring 載入)"""
+    tasks = [(p, output_dir, options) for p in paths]
+    if workers <= 1 or len(tasks) <= 1:
+        return [_score_task(t) for t in tasks]
+
+    # 把目前所有物件移出 GC 追蹤範圍，避免 fork 後 GC 掃描觸發 copy-on-write 複製
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ctx.Pool(processes=min(workers, len(tasks))) as pool:
+        # 大檔可能很慢，一次只派一個檔案讓 worker 負載平均
+        return list(pool.imap_unordered(_score_task, tasks, chunksize=1))
+
+
+def merge_summary(output_dir, expected_files=None, top_k=TOP_RISKS):
+    """
+    讀取所有分片的完成標記，合併出整體良率與風險最高的晶圓
+    多台機器寫入同一個 output_dir 時，任何一台 (或最後一台) 都可以執行
+    """
+    markers = []
+    for marker_file in sorted(glob.glob(os.path.join(output_dir, '_markers', '*._SUCCESS'))):
+        with open(marker_file, 'r', encoding='utf-8') as f:
+            markers.append(json.load(f))
+
+    files = pd.DataFrame([{k: m[k] for k in ('source_file', 'model_version', 'rows', 'rejected', 'scored',
+                                             'fails', 'elapsed_sec')} for m in markers],
+                         columns=['source_file', 'model_version', 'rows', 'rejected', 'scored', 'fails', 'elapsed_sec'])
+    if len(files):
+        files['yield'] = np.where(files['scored'] > 0, 1 - files['fails'] / files['scored'].clip(lower=1), np.nan)
+    files.to_csv(os.path.join(output_dir, 'file_summary.csv'), index=False)
+
+    risks = pd.DataFrame([r for m in markers for r in m['top_risks']],
+                         columns=['source_file', 'row', 'wafer_id', 'fail_probability'])
+    risks.nlargest(top_k, 'fail_probability').to_csv(os.path.join(output_dir, 'top_risks.csv'), index=False)
+
+    scored = int(files['scored'].sum()) if len(files) else 0
+    fails = int(files['fails'].sum()) if len(files) else 0
+    done = set(files['source_file']) if len(files) else set()
+    summary = {
+        'files_completed': len(files),
+        'files_expected': len(expected_files) if expected_files is not None else None,
+        'files_missing': sorted(set(expected_files) - done) if expected_files is not None else None,
+        'rows': int(files['rows'].sum()) if len(files) else 0,
+        'rejected': int(files['rejected'].sum()) if len(files) else 0,
+        'scored': scored,
+        'fails': fails,
+        'yield': round(1 - fails / scored, 4) if scored else None,
+        'model_versions': sorted(files['model_version'].unique().tolist()) if len(files) else [],
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score CSV/Parquet exports without the dashboard")
+    parser.add_argument('inputs', nargs='*', help="files, globs (quote them) or @list.txt")
+    parser.add_argument('--output', default=OUTPUT_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="format of the partitioned output")
+    parser.add_argument('--id-column', default=None, help="column identifying each wafer in top_risks.csv")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH,
+                        help="fallback model path without .pkl (used only when the registry is empty)")
+    parser.add_argument('--force', action='store_true', help="rescore files that already have a _SUCCESS marker")
+    parser.add_argument('--no-merge', action='store_true', help="skip writing the merged summary")
+    parser.add_argument('--merge-only', action='store_true', help="only merge existing shard markers")
+    args = parser.parse_args()
+
+    # 評分期間 PyCaret / CatBoost 只留警告，log 由背景執行緒寫到 reports/logs/batch_score.log
+    configure_logging('batch_score', profile='scoring')
+    os.makedirs(args.output, exist_ok=True)
+    errors = []
+    all_files = expand_inputs(args.inputs) if args.inputs else None
+    if not args.merge_only:
+        if not all_files:
+            parser.error("no input files matched")
+        version = load_model_for_scoring(args.model)
+        shard = shard_files(all_files, args.shard_index, args.shard_count)
+        todo = [p for p in shard if args.force or not is_complete(args.output, p, version)]
+        print(f"🧩 Shard {args.shard_index + 1}/{args.shard_count}: {len(shard)} files, "
+              f"{len(shard) - len(todo)} already done, {len(todo)} to score with {args.workers} workers")
+        start = time.perf_counter()
+        results = run_shard(todo, args.output, workers=args.workers, id_column=args.id_column,
+                            output_format=args.format, chunk_rows=args.chunk_rows)
+        errors = [r for r in results if 'error' in r]
+        rows = sum(r.get('rows', 0) for r in results)
+        elapsed = time.perf_counter() - start
+        print(f"   -> {rows} rows in {elapsed:.1f} s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+        for r in errors:
+            print(f"   ❌ {r['source_file']}: {r['error']}")
+
+    if not args.no_merge:
+        summary = merge_summary(args.output, expected_files=all_files)
+        yield_text = f"{summary['yield']:.2%}" if summary['yield'] is not None else 'n/a'
+        print(f"📊 {summary['files_completed']} files merged: {summary['scored']} wafers scored, "
+              f"yield {yield_text} -> {os.path.join(args.output, 'summary.json')}")
+        if summary['files_missing']:
+            print(f"   ⚠️ {len(summary['files_missing'])} files have no _SUCCESS marker yet (other shards still running?)")
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+感測器漂移監控 (Drift Monitor)
+
+訓練時為每個感測器保存一組「分位數切點 + 直方圖計數」作為參考分佈，
+之後每個新批次 (或串流 chunk) 只需在相同切點下累積計數，
+就能一次向量化計算全部感測器的 PSI / KS，不需要保存任何原始歷史資料。
+"""
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_REFERENCE_PATH = 'reports/drift_reference.npz'
+DEFAULT_BINS = 10  # bin 編號以 uint8 累加，最多 255 個
+CHUNK_ROWS = 4096
+PSI_EPS = 1e-4
+
+# PSI 常用判讀門檻
+PSI_MODERATE = 0.1
+PSI_MAJOR = 0.25
+
+
+def _as_matrix(data, feature_names):
+    """依參考特徵順序取出 float64 矩陣；缺少的欄位補 NaN，文字內容轉為 NaN"""
+    if isinstance(data, pd.DataFrame):
+        frame = data.reindex(columns=feature_names)
+        non_numeric = frame.select_dtypes(exclude='number').columns
+        if len(non_numeric) > 0:
+            frame = frame.copy()
+            frame[non_numeric] = frame[non_numeric].apply(pd.to_numeric, errors='coerce')
+        return frame.to_numpy(dtype=np.float64)
+    return np.asarray(data, dtype=np.float64)
+
+
+def _bin_counts(X, cuts, chunk_rows=CHUNK_ROWS):
+    """
+    一次計算所有感測器在各自切點下的直方圖計數
+    Args:
+        X: (n_rows, n_features) 矩陣
+        cuts: (n_features, n_bins - 1) 內部切點
+    Returns:
+        counts: (n_features, n_bins), nan_counts: (n_features,)
+    """
+    n_features, n_cuts = cuts.shape
+    n_bins = n_cuts + 1
+    offsets = np.arange(n_features) * n_bins
+    counts = np.zeros(n_features * n_bins, dtype=np.int64)
+    nan_counts = np.zeros(n_features, dtype=np.int64)
+
+    # 切點轉置成 (n_cuts, n_features)，每次比較都是連續記憶體
+    cuts_by_level = np.ascontiguousarray(cuts.T)
+
+    # 以列為單位分塊；每個切點做一次整塊比較，bin 編號 = 小於該值的切點數
+    for start in range(0, X.shape[0], chunk_rows):
+        block = X[start:start + chunk_rows]
+        nan_mask = np.isnan(block)
+        nan_counts += nan_mask.sum(axis=0)
+        bin_idx = np.zeros(block.shape, dtype=np.uint8)
+        above = np.empty(block.shape, dtype=bool)
+        for level in cuts_by_level:
+            np.greater(block, level, out=above)
+            bin_idx += above.view(np.uint8)
+        flat = (bin_idx + offsets)[~nan_mask]
+        counts += np.bincount(flat, minlength=n_features * n_bins)
+
+    return counts.reshape(n_features, n_bins), nan_counts
+
+
+class SensorSketch:
+    """
+    可合併的感測器分佈摘要
+    只保存切點與計數 (約 590 x 10 個整數)，任意多個批次都可以相加合併。
+    """
+
+    def __init__(self, feature_names, cuts, counts=None, nan_counts=None, n_rows=0):
+        self.feature_names = [str(f) for f in feature_names]
+        self.cuts = np.asarray(cuts, dtype=np.float64)
+        n_features, n_cuts = self.cuts.shape
+        self.counts = np.zeros((n_features, n_cuts + 1), dtype=np.int64) if counts is None \
+            else np.asarray(counts, dtype=np.int64)
+        self.nan_counts = np.zeros(n_features, dtype=np.int64) if nan_counts is None \
+            else np.asarray(nan_counts, dtype=np.int64)
+        self.n_rows = int(n_rows)
+
+    @classmethod
+    def from_data(cls, data, feature_names=None, n_bins=DEFAULT_BINS):
+        """由訓練資料建立參考摘要 (切點取各感測器的分位數)"""
+        if feature_names is None:
+            feature_names = [c for c in data.columns if c != 'label']
+        X = _as_matrix(data, feature_names)
+        quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+        with warnings.catch_warnings():
+            # 整欄皆為 NaN 的感測器會觸發 All-NaN 警告，切點保持 NaN 即可
+            warnings.simplefilter('ignore', RuntimeWarning)
+            cuts = np.nanquantile(X, quantiles, axis=0).T
+        sketch = cls(feature_names, cuts)
+        return sketch._accumulate(X)
+
+    def empty_like(self):
+        """建立切點相同、計數為 0 的摘要 (用來累積新批次)"""
+        return SensorSketch(self.feature_names, self.cuts)
+
+    def _accumulate(self, X):
+        counts, nan_counts = _bin_counts(X, self.cuts)
+        self.counts += counts
+        self.nan_counts += nan_counts
+        self.n_rows += X.shape[0]
+        return self
+
+    def update(self, data):
+        """累積一個批次或串流 chunk 的資料 (原地更新並回傳自己)"""
+        return self._accumulate(_as_matrix(data, self.feature_names))
+
+    def merge(self, other):
+        """合併兩個摘要 (切點必須相同)，回傳新的摘要"""
+        if self.feature_names != other.feature_names or \
+                not np.array_equal(self.cuts, other.cuts, equal_nan=True):
+            raise ValueError("Cannot merge sketches built with different sensors or bin edges")
+        return SensorSketch(self.feature_names, self.cuts,
+                            self.counts + other.counts,
+                            self.nan_counts + other.nan_counts,
+                            self.n_rows + other.n_rows)
+
+    def save(self, path=DEFAULT_REFERENCE_PATH):
+        """存成壓縮 npz 檔"""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        np.savez_compressed(path,
+                            feature_names=np.array(self.feature_names),
+                            cuts=self.cuts,
+                            counts=self.counts,
+                            nan_counts=self.nan_counts,
+                            n_rows=np.array(self.n_rows))
+
+    @classmethod
+    def load(cls, path=DEFAULT_REFERENCE_PATH):
+        """讀取 npz 摘要"""
+        with np.load(path, allow_pickle=False) as f:
+            return cls(f['feature_names'].tolist(), f['cuts'], f['counts'],
+                       f['nan_counts'], int(f['n_rows']))
+
+
+def _proportions(counts):
+    """各 bin 佔比；完全沒有有效值的感測器回傳 NaN"""
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(totals > 0, counts / np.maximum(totals, 1), np.nan)
+
+
+def compute_drift(reference, current):
+    """
+    一次向量化計算所有感測器的漂移指標
+    Returns:
+        pd.DataFrame: feature, psi, ks, nan_rate_ref, nan_rate_cur, level
+    """
+    if reference.feature_names != current.feature_names:
+        raise ValueError("Reference and current sketches cover different sensors")
+
+    p = np.clip(_proportions(reference.counts), PSI_EPS, None)
+    q = np.clip(_proportions(current.counts), PSI_EPS, None)
+    psi = ((q - p) * np.log(q / p)).sum(axis=1)
+    ks = np.abs(np.cumsum(q - p, axis=1)).max(axis=1)
+
+    nan_rate_ref = reference.nan_counts / max(reference.n_rows, 1)
+    nan_rate_cur = current.nan_counts / max(current.n_rows, 1)
+
+    result = pd.DataFrame({
+        'feature': reference.feature_names,
+        'psi': psi,
+        'ks': ks,
+        'nan_rate_ref': nan_rate_ref,
+        'nan_rate_cur': nan_rate_cur,
+    })
+    result['level'] = np.select(
+        [result['psi'] >= PSI_MAJOR, result['psi'] >= PSI_MODERATE],
+        ['Major', 'Moderate'],
+        default='Stable'
+    )
+    result.loc[result['psi'].isna(), 'level'] = 'No Data'
+    return result
+
+
+def top_drifted(reference, current, k=20):
+    """回傳 PSI 最高的前 k 個感測器"""
+    drift = compute_drift(reference, current)
+    return drift.sort_values('psi', ascending=False, na_position='last').head(k).reset_index(drop=True)
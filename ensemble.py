@@ -0,0 +1,192 @@
+"""
+多模型集成預測 (Concurrent Multi-Model Ensemble)
+
+train_upgrade.py 原本只保留 compare_models 的第一名；集成模式保留前幾名 finalize 後的模型，
+以訓練時在 holdout 上擬合的權重加權平均 Fail 機率。
+
+- 同一次 PyCaret setup 產生的模型前處理完全相同，預測時只 transform 一次 (shared_preprocessing)
+- 各模型的 predict_proba 在 thread pool 上同時執行 (XGBoost / LightGBM / CatBoost 預測時會釋放 GIL)，
+  整體延遲接近最慢的單一模型，而不是全部相加
+- 整個集成以 joblib 存成單一 .pkl 登錄到 ModelRegistry，App / worker 與一般模型一樣熱替換
+
+用法:
+    from ensemble import ModelEnsemble, fit_weights, predict_frame
+    weights = fit_weights(holdout_probas, y_holdout)
+    gate_proba = cross_fitted_proba(holdout_probas, y_holdout)   # 比較集成 / 單一模型用
+    ens = ModelEnsemble(pipelines, weights, names=['CatBoost', 'XGBoost', ...])
+    predictions = predict_frame(ens, df)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+from instrumentation import stage
+
+DEFAULT_THRESHOLD = 0.5
+PROBA_EPS = 1e-6
+
+
+def fit_weights(probas, y):
+    """
+    在 holdout 上擬合非負、總和為 1 的權重 (最小化加權平均機率的 log loss)
+    Args:
+        probas: (n_rows, n_models) 各模型的 Fail 機率
+        y: 0/1 標籤
+    """
+    probas = np.clip(np.asarray(probas, dtype=np.float64), PROBA_EPS, 1 - PROBA_EPS)
+    y = np.asarray(y, dtype=np.float64)
+    n_models = probas.shape[1]
+
+    def log_loss(w):
+        p = np.clip(probas @ w, PROBA_EPS, 1 - PROBA_EPS)
+        return -np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))
+
+    result = minimize(log_loss, np.full(n_models, 1.0 / n_models), method='SLSQP',
+                      bounds=[(0.0, 1.0)] * n_models,
+                      constraints=({'type': 'eq', 'fun': lambda w: w.sum() - 1.0},))
+    weights = np.clip(result.x if result.success else np.full(n_models, 1.0 / n_models), 0.0, None)
+    return weights / weights.sum()
+
+
+def cross_fitted_proba(probas, y, n_splits=5, random_state=0):
+    """
+    交叉擬合的集成機率：每一折的權重只用其他折擬合，再套用到該折
+    用來比較集成與單一模型 (擬合權重與評估不使用同一批資料，避免高估集成)
+    Returns:
+        (n_rows,) 集成的 Fail 機率
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    probas = np.asarray(probas, dtype=np.float64)
+    y = np.asarray(y)
+    n_splits = min(n_splits, int(np.bincount(y.astype(int)).min()))
+    if n_splits < 2:
+        raise ValueError("Need at least 2 samples of each class to cross-fit ensemble weights")
+    blended = np.empty(len(y), dtype=np.float64)
+    folds = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for fit_idx, eval_idx in folds.split(probas, y):
+        blended[eval_idx] = probas[eval_idx] @ fit_weights(probas[fit_idx], y[fit_idx])
+    return blended
+
+
+def _final_estimator(pipeline):
+    try:
+        return pipeline._final_estimator
+    except AttributeError:
+        return pipeline
+
+
+class ModelEnsemble:
+    """多個 PyCaret Pipeline 的加權機率平均"""
+
+    def __init__(self, members, weights, names=None, threshold=DEFAULT_THRESHOLD,
+                 shared_preprocessing=False, max_workers=None):
+        if len(members) != len(weights):
+            raise ValueError("Each ensemble member needs exactly one weight")
+        self.members = list(members)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.names = list(names) if names else [type(_final_estimator(m)).__name__ for m in self.members]
+        self.threshold = threshold
+        self.shared_preprocessing = shared_preprocessing
+        self.max_workers = max_workers
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def __getstate__(self):
+        # thread pool 與 lock 無法 pickle，載入後再建立
+        state = self.__dict__.copy()
+        state['_pool'] = state['_pool_pid'] = None
+        del state['_pool_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        with self._pool_lock:
+            # fork 出來的 worker (job_queue / batch_score) 沒有繼承父行程的執行緒，需重建
+            if self._pool is None or self._pool_pid != os.getpid():
+                # 預設每個成員兩條執行緒，讓兩個 session 同時預測時不必互相排隊
+                workers = self.max_workers or int(os.environ.get('YIELD_ENSEMBLE_THREADS', 2 * len(self.members)))
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ensemble')
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    @property
+    def explain_pipeline(self):
+        """權重最高的成員，SHAP 解釋與相似晶圓查詢以它為準"""
+        return self.members[int(np.argmax(self.weights))]
+
+    @property
+    def feature_names_in_(self):
+        return getattr(self.members[0], 'feature_names_in_', None)
+
+    def member_probas(self, data):
+        """
+        各成員的 Fail 機率 (n_rows, n_models)，所有成員同時在 thread pool 上計算
+        shared_preprocessing 時前處理只做一次，各成員只跑最後的模型
+        """
+        # 上傳檔常帶有 wafer id 等額外欄位，只保留模型訓練時的感測器欄位
+        names = self.feature_names_in_
+        if names is not None and isinstance(data, pd.DataFrame):
+            data = data[[c for c in names if c != 'label']]
+        if self.shared_preprocessing:
+            with stage('ensemble_transform', rows=len(data)):
+                X = self.members[0][:-1].transform(data)
+            tasks = [(_final_estimator(m).predict_proba, X) for m in self.members]
+        else:
+            tasks = [(m.predict_proba, data) for m in self.members]
+
+        pool = self._executor()
+        with stage('ensemble_predict', rows=len(data)):
+            futures = [pool.submit(fn, X_in) for fn, X_in in tasks]
+            return np.column_stack([np.asarray(f.result())[:, 1] for f in futures])
+
+    def predict_proba(self, data):
+        p = self.member_probas(data) @ self.weights
+        return np.column_stack([1 - p, p])
+
+    def predict(self, data):
+        return (self.predict_proba(data)[:, 1] >= self.threshold).astype(int)
+
+    def predict_frame(self, data):
+        """與 PyCaret predict_model 相同格式：原始資料加上 prediction_label / prediction_score (預測類別的機率)"""
+        p = self.predict_proba(data)[:, 1]
+        label = (p >= self.threshold).astype(int)
+        result = data.copy()
+        result['prediction_label'] = label
+        result['prediction_score'] = np.round(np.where(label == 1, p, 1 - p), 4)
+        return result
+
+    def describe(self):
+        """成員與權重 (顯示 / 登錄 metadata 用)"""
+        return pd.DataFrame({'model': self.names, 'weight': np.round(self.weights, 4)})
+
+
+def preprocessing_matches(members, sample, atol=1e-9):
+    """確認所有成員對同一份樣本的前處理輸出相同 (相同才能共用 transform)"""
+    reference = np.asarray(members[0][:-1].transform(sample), dtype=np.float64)
+    for member in members[1:]:
+        other = np.asarray(member[:-1].transform(sample), dtype=np.float64)
+        if other.shape != reference.shape or not np.allclose(other, reference, atol=atol, equal_nan=True):
+            return False
+    return True
+
+
+def predict_frame(model, data):
+    """集成模型與一般 PyCaret Pipeline 共用的批次預測入口"""
+    if isinstance(model, ModelEnsemble):
+        return model.predict_frame(data)
+    from pycaret.classification import predict_model
+    return predict_model(model, data=data)
+
+
+def explain_pipeline(model):
+    """SHAP 使用的 Pipeline：集成時取權重最高的成員"""
+    return model.explain_pipeline if isinstance(model, ModelEnsemble) else model
@@ -0,0 +1,234 @@
+"""
+SHAP 解釋計算 (app.py 與背景 worker 共用)
+
+兩種模式：
+- exact: TreeSHAP，單一晶圓 drill-down (waterfall、相似晶圓) 使用
+- approximate: Saabas 路徑歸因 (沿決策路徑累加每個分裂造成的期望值變化)，成本與一次預測相當，
+  批次摘要預設使用；XGBoost / sklearn 森林透過 shap 的 approximate=True，CatBoost 使用內建的
+  Approximate ShapValues，LightGBM 沒有近似版本，會退回 exact
+近似誤差以 approximation_error() 在驗證樣本上與 exact 對照，存成 reports/shap_approximation.json
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from ensemble import explain_pipeline
+
+EXPLAIN_MODES = ('exact', 'approximate')
+APPROX_REPORT_PATH = 'reports/shap_approximation.json'
+ERROR_SAMPLE_ROWS = 200
+TOP_K = 20
+EXPLAINER_CACHE_SIZE = 2
+
+_explainers = OrderedDict()
+_explainer_lock = threading.Lock()
+
+
+def get_final_estimator(pipeline):
+    """取出 Pipeline 最後一步的模型 (非 Pipeline 時直接回傳；集成模型取權重最高的成員)"""
+    pipeline = explain_pipeline(pipeline)
+    try:
+        return pipeline._final_estimator
+    except AttributeError:
+        return pipeline
+
+
+def get_explainer(pipeline):
+    """
+    取得模型的 TreeExplainer (建構深的集成要數秒)
+    以模型物件為 key 快取最近 EXPLAINER_CACHE_SIZE 個，熱替換後自動改用新模型
+    """
+    import shap
+
+    estimator = get_final_estimator(pipeline)
+    key = id(estimator)
+    with _explainer_lock:
+        cached = _explainers.get(key)
+        # 同時保存模型本身，避免舊模型被回收後 id 被重複使用
+        if cached is not None and cached[0] is estimator:
+            _explainers.move_to_end(key)
+            return cached[1]
+    with stage('tree_explainer'):
+        # 串流訓練的 BoosterClassifier 以原生 LightGBM Booster 建立 explainer
+        explainer = shap.TreeExplainer(getattr(estimator, 'booster_', estimator))
+    with _explainer_lock:
+        _explainers[key] = (estimator, explainer)
+        while len(_explainers) > EXPLAINER_CACHE_SIZE:
+            _explainers.popitem(last=False)
+    return explainer
+
+
+def _positive_class(shap_values, expected_value):
+    """統一不同模型的 SHAP 輸出格式 (相容 XGBoost/CatBoost/RF)，只取 Fail (class 1)"""
+    if isinstance(shap_values, list):
+        sv = shap_values[1]
+        bv = expected_value[1] if isinstance(expected_value, (list, np.ndarray)) else expected_value
+    elif len(np.array(shap_values).shape) == 3:
+        sv = np.array(shap_values)[:, :, 1]
+        bv = expected_value[1] if isinstance(expected_value, (list, np.ndarray)) else expected_value
+    else:
+        sv = shap_values
+        bv = expected_value
+        if isinstance(bv, (list, np.ndarray)) and len(bv) == 1:
+            bv = bv[0]
+    return np.asarray(sv), float(bv)
+
+
+def _attributions(explainer, estimator, X, method):
+    """依模式計算原始 SHAP 輸出 (格式與 explainer.shap_values 相同)"""
+    if method == 'exact':
+        return explainer.shap_values(X)
+    if type(estimator).__module__.startswith('catboost'):
+        # shap 對 CatBoost 會忽略 approximate，直接呼叫 CatBoost 的近似版本 (最後一欄是 base value)
+        from catboost import Pool
+        values = estimator.get_feature_importance(Pool(X), type='ShapValues', shap_calc_type='Approximate')
+        return values[:, :-1]
+    return explainer.shap_values(X, approximate=True)
+
+
+def compute_shap(pipeline, data, explainer=None, method='exact'):
+    """
+    計算一批晶圓的 SHAP 值
+    Args:
+        pipeline: PyCaret Pipeline
+        data: 原始感測器資料 (DataFrame)
+        explainer: 已建立的 TreeExplainer (預設使用 get_explainer() 的快取)
+        method: 'exact' (TreeSHAP) 或 'approximate' (Saabas 路徑歸因)
+    Returns:
+        dict: values (n_rows x n_features), base_value, data (前處理後特徵), feature_names, index, method
+    """
+    if method not in EXPLAIN_MODES:
+        raise ValueError(f"Unknown explanation method '{method}', expected one of {EXPLAIN_MODES}")
+    pipeline = explain_pipeline(pipeline)
+    transformer = pipeline[:-1]
+    with stage('pipeline_transform', rows=len(data)):
+        X_transformed = transformer.transform(data)
+    if explainer is None:
+        explainer = get_explainer(pipeline)
+    stage_name = 'shap_values' if method == 'exact' else 'shap_values_approx'
+    with stage(stage_name, rows=len(data)):
+        shap_values = _attributions(explainer, get_final_estimator(pipeline), X_transformed, method)
+
+    sv, bv = _positive_class(shap_values, explainer.expected_value)
+    if isinstance(X_transformed, pd.DataFrame):
+        feature_names = list(X_transformed.columns)
+        X_values = X_transformed.to_numpy()
+    else:
+        feature_names = None
+        X_values = np.asarray(X_transformed)
+    return {
+        'values': sv,
+        'base_value': bv,
+        'data': X_values,
+        'feature_names': feature_names,
+        'index': list(data.index),
+        'method': method,
+    }
+
+
+def concat_results(results):
+    """合併分段計算的 compute_shap() 結果 (背景佇列把大批次切成多個 part)"""
+    if isinstance(results, dict):
+        return results
+    merged = dict(results[0])
+    merged['values'] = np.concatenate([r['values'] for r in results])
+    merged['data'] = np.concatenate([r['data'] for r in results])
+    merged['index'] = [i for r in results for i in r['index']]
+    return merged
+
+
+def batch_importance(result, top_k=TOP_K):
+    """compute_shap() 結果的批次摘要：各感測器平均 |SHAP| 與平均 SHAP (正值偏向 Fail)"""
+    values = np.asarray(result['values'])
+    names = result['feature_names'] or [f'feature_{i}' for i in range(values.shape[1])]
+    table = pd.DataFrame({
+        'mean |SHAP|': np.abs(values).mean(axis=0),
+        'mean SHAP': values.mean(axis=0),
+    }, index=pd.Index(names, name='feature'))
+    return table.sort_values('mean |SHAP|', ascending=False).head(top_k)
+
+
+def compare_attributions(exact, approx, top_k=TOP_K):
+    """
+    近似歸因對照 exact SHAP 的誤差
+    - relative_error: 平均絕對誤差 / exact 平均 |SHAP|
+    - importance_spearman: 全域重要性 (平均 |SHAP|) 排名的 Spearman 相關
+    - top_k_overlap: 前 k 名重要感測器的重疊比例
+    - row_top_driver_agreement: 每片晶圓最大影響感測器相同的比例
+    """
+    exact = np.asarray(exact, dtype=np.float64)
+    approx = np.asarray(approx, dtype=np.float64)
+    if exact.shape != approx.shape:
+        raise ValueError(f"Attribution shapes differ: {exact.shape} vs {approx.shape}")
+    abs_error = np.abs(approx - exact)
+    scale = np.abs(exact).mean()
+    importance_exact = np.abs(exact).mean(axis=0)
+    importance_approx = np.abs(approx).mean(axis=0)
+    k = min(top_k, exact.shape[1])
+    top_exact = set(np.argsort(-importance_exact)[:k])
+    top_approx = set(np.argsort(-importance_approx)[:k])
+    spearman = pd.Series(importance_exact).corr(pd.Series(importance_approx), method='spearman')
+    return {
+        'rows': int(exact.shape[0]),
+        'mean_abs_error': float(abs_error.mean()),
+        'max_abs_error': float(abs_error.max()) if abs_error.size else 0.0,
+        'relative_error': float(abs_error.mean() / scale) if scale > 0 else 0.0,
+        'importance_spearman': float(spearman) if pd.notna(spearman) else 1.0,
+        'top_k': k,
+        'top_k_overlap': len(top_exact & top_approx) / k if k else 1.0,
+        'row_top_driver_agreement': float(
+            (np.abs(exact).argmax(axis=1) == np.abs(approx).argmax(axis=1)).mean()) if exact.size else 1.0,
+    }
+
+
+def approximation_error(pipeline, data, sample_rows=ERROR_SAMPLE_ROWS, random_state=0, top_k=TOP_K):
+    """在驗證樣本上同時計算 exact 與 approximate，回傳誤差與每列耗時"""
+    sample = data.sample(n=min(sample_rows, len(data)), random_state=random_state)
+    explainer = get_explainer(pipeline)
+    results, seconds = {}, {}
+    for method in EXPLAIN_MODES:
+        start = time.perf_counter()
+        results[method] = compute_shap(pipeline, sample, explainer=explainer, method=method)
+        seconds[method] = time.perf_counter() - start
+    report = compare_attributions(results['exact']['values'], results['approximate']['values'], top_k=top_k)
+    report.update({
+        'model': type(get_final_estimator(pipeline)).__name__,
+        'exact_ms_per_row': round(seconds['exact'] / len(sample) * 1000, 3),
+        'approx_ms_per_row': round(seconds['approximate'] / len(sample) * 1000, 3),
+        'speedup': round(seconds['exact'] / max(seconds['approximate'], 1e-9), 2),
+    })
+    return report
+
+
+def save_error_report(report, path=APPROX_REPORT_PATH, model_version=None):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dict(report, model_version=model_version, created_at=time.time()), f, indent=2)
+
+
+def load_error_report(path=APPROX_REPORT_PATH):
+    """讀取近似誤差報告；不存在時回傳 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def to_explanation(result, position=0):
+    """把 compute_shap() 結果中的某一列轉成 shap.Explanation (供 waterfall 使用)"""
+    import shap
+
+    return shap.Explanation(
+        values=result['values'][position],
+        base_values=result['base_value'],
+        data=result['data'][position],
+        feature_names=result['feature_names']
+    )
@@ -0,0 +1,310 @@
+"""
+快速 SMOTE 重抽樣 (給 PyCaret setup 的 fix_imbalance_method 使用)
+
+與 imblearn SMOTE 相同的演算法 (少數類別樣本與其 k 個近鄰之間做線性插值)，差別在於：
+- exact : 分塊向量化 (矩陣乘法) 計算精確 kNN，記憶體用量固定
+- approx: 先以隨機投影降維找候選鄰居，再用原始距離重新排序 (近似 kNN)
+- auto  : 少數類別樣本數小時用 exact，大時用 approx
+- n_jobs > 1 時各區塊以執行緒平行計算 (numpy 矩陣運算會釋放 GIL)
+- 鄰居圖依資料內容快取：compare_models 中每個模型的同一個 CV fold 資料相同，只需計算一次；
+  PyCaret / joblib 以 loky 子行程平行跑 fold 時記憶體快取無法共用，因此也寫入磁碟 (依內容雜湊命名)，
+  其他 worker 行程直接讀取
+- 每次重抽樣的耗時會寫入 reports/smote_timing.csv (訓練腳本開啟資源帳本時也記入 resource_ledger)
+
+用法:
+    from fast_smote import get_resampler
+    setup(..., fix_imbalance=True, fix_imbalance_method=get_resampler())
+
+環境變數 YIELD_SMOTE_MODE = auto / exact / approx / imblearn (改回 PyCaret 預設 SMOTE)
+         YIELD_SMOTE_JOBS = 平行執行緒數
+         YIELD_SMOTE_CACHE_DIR = 跨行程的鄰居圖快取資料夾 (預設在系統暫存目錄；設為空字串停用)
+"""
+import csv
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator
+
+from instrumentation import stage, current_rss_bytes
+from resource_ledger import ResourceLedger
+
+BLOCK_ROWS = 1024
+AUTO_EXACT_MAX_ROWS = 20000
+PROJECTION_DIM = 32
+CANDIDATE_FACTOR = 4
+GRAPH_CACHE_SIZE = 16
+GRAPH_DISK_CACHE_SIZE = 64
+DEFAULT_GRAPH_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'yield_smote_graphs')
+TIMING_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'smote_timing.csv')
+TIMING_FIELDS = ['timestamp', 'mode', 'rows', 'minority_rows', 'features', 'generated',
+                 'cache_hit', 'knn_sec', 'total_sec']
+
+_GRAPH_CACHE = OrderedDict()
+
+
+def _blocks(n_rows, block_rows):
+    return [(start, min(start + block_rows, n_rows)) for start in range(0, n_rows, block_rows)]
+
+
+def _map_blocks(func, n_rows, block_rows, n_jobs):
+    """對每個區塊執行 func(start, end)，依序合併結果"""
+    spans = _blocks(n_rows, block_rows)
+    if n_jobs > 1 and len(spans) > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            parts = list(pool.map(lambda span: func(*span), spans))
+    else:
+        parts = [func(start, end) for start, end in spans]
+    return np.vstack(parts)
+
+
+def _smallest_k(dist, k):
+    """每列距離最小的 k 個欄位索引 (依距離排序)"""
+    idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(dist, idx, axis=1).argsort(axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def knn_exact(X, k, block_rows=BLOCK_ROWS, n_jobs=1):
+    """
+    精確 kNN (排除自己)，以 |a|^2 + |b|^2 - 2ab 分塊計算距離
+    Returns:
+        (n, k) 鄰居索引
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    sq_norm = np.einsum('ij,ij->i', X, X)
+
+    def search(start, end):
+        dist = sq_norm[start:end, None] + sq_norm[None, :] - 2.0 * (X[start:end] @ X.T)
+        dist[np.arange(end - start), np.arange(start, end)] = np.inf
+        return _smallest_k(dist, k)
+
+    return _map_blocks(search, X.shape[0], block_rows, n_jobs)
+
+
+def knn_approx(X, k, n_components=PROJECTION_DIM, candidate_factor=CANDIDATE_FACTOR,
+               block_rows=BLOCK_ROWS, n_jobs=1, random_state=None):
+    """
+    近似 kNN：隨機投影到低維度找 k * candidate_factor 個候選，再以原始距離挑出前 k 個
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    n_rows, n_features = X.shape
+    n_candidates = min(k * candidate_factor, n_rows - 1)
+    if n_components >= n_features or n_candidates <= k:
+        return knn_exact(X, k, block_rows, n_jobs)
+
+    rng = np.random.default_rng(random_state)
+    projection = rng.normal(size=(n_features, n_components)) / np.sqrt(n_components)
+    candidates = knn_exact(X @ projection, n_candidates, block_rows, n_jobs)
+
+    def rerank(start, end):
+        cand = candidates[start:end]
+        diff = X[cand] - X[start:end, None, :]
+        dist = np.einsum('ijk,ijk->ij', diff, diff)
+        return np.take_along_axis(cand, _smallest_k(dist, k), axis=1)
+
+    return _map_blocks(rerank, n_rows, block_rows, n_jobs)
+
+
+def _graph_key(X, k, mode):
+    digest = hashlib.blake2b(np.ascontiguousarray(X).tobytes(), digest_size=16)
+    digest.update(f"{X.shape}|{k}|{mode}".encode())
+    return digest.hexdigest()
+
+
+def graph_cache_dir():
+    """跨行程鄰居圖快取的資料夾；YIELD_SMOTE_CACHE_DIR 設為空字串時回傳 None (只用行程內快取)"""
+    path = os.environ.get('YIELD_SMOTE_CACHE_DIR', DEFAULT_GRAPH_CACHE_DIR)
+    return path or None
+
+
+def _load_graph(key):
+    cache_dir = graph_cache_dir()
+    if cache_dir is None:
+        return None
+    path = os.path.join(cache_dir, f"{key}.npy")
+    try:
+        neighbors = np.load(path)
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return neighbors
+
+
+def _save_graph(key, neighbors):
+    """先寫暫存檔再原子改名，其他 worker 不會讀到寫一半的檔案；磁碟快取只是加速，寫入失敗時忽略"""
+    cache_dir = graph_cache_dir()
+    if cache_dir is None:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = os.path.join(cache_dir, f"{key}.{os.getpid()}.tmp.npy")
+        np.save(tmp_path, neighbors)
+        os.replace(tmp_path, os.path.join(cache_dir, f"{key}.npy"))
+        # 只保留最近使用的 GRAPH_DISK_CACHE_SIZE 個
+        entries = sorted((e for e in os.scandir(cache_dir) if e.name.endswith('.npy') and '.tmp.' not in e.name),
+                         key=lambda e: e.stat().st_mtime)
+        for entry in entries[:-GRAPH_DISK_CACHE_SIZE]:
+            os.remove(entry.path)
+    except OSError:
+        pass
+
+
+def neighbor_graph(X, k, mode='exact', n_jobs=1, random_state=None):
+    """
+    取得 (可能已快取的) 鄰居圖：先查行程內快取，再查磁碟快取 (其他 CV worker 行程算好的)
+    Returns:
+        (neighbors, cache_hit)
+    """
+    key = _graph_key(X, k, mode)
+    if key in _GRAPH_CACHE:
+        _GRAPH_CACHE.move_to_end(key)
+        return _GRAPH_CACHE[key], True
+
+    neighbors = _load_graph(key)
+    cache_hit = neighbors is not None
+    if not cache_hit:
+        if mode == 'approx':
+            neighbors = knn_approx(X, k, n_jobs=n_jobs, random_state=random_state)
+        else:
+            neighbors = knn_exact(X, k, n_jobs=n_jobs)
+        _save_graph(key, neighbors)
+
+    _GRAPH_CACHE[key] = neighbors
+    while len(_GRAPH_CACHE) > GRAPH_CACHE_SIZE:
+        _GRAPH_CACHE.popitem(last=False)
+    return neighbors, cache_hit
+
+
+def clear_cache():
+    """清除行程內與磁碟上的鄰居圖快取"""
+    _GRAPH_CACHE.clear()
+    cache_dir = graph_cache_dir()
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.npy'):
+                os.remove(entry.path)
+
+
+def _append_timing(path, row):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TIMING_FIELDS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+class FastSMOTE(BaseEstimator):
+    """
+    imblearn 相容的 SMOTE 重抽樣器 (提供 fit_resample)
+    sampling_strategy='auto' 時把所有少數類別補到與多數類別相同筆數
+    """
+
+    def __init__(self, k_neighbors=5, mode='auto', n_jobs=1, random_state=None, timing_log=None):
+        self.k_neighbors = k_neighbors
+        self.mode = mode
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.timing_log = timing_log
+
+    def _resolve_mode(self, n_rows):
+        if self.mode == 'auto':
+            return 'exact' if n_rows <= AUTO_EXACT_MAX_ROWS else 'approx'
+        if self.mode not in ('exact', 'approx'):
+            raise ValueError(f"Unknown FastSMOTE mode: {self.mode}")
+        return self.mode
+
+    def fit_resample(self, X, y):
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        columns = X.columns if isinstance(X, pd.DataFrame) else None
+        y_name = y.name if isinstance(y, pd.Series) else None
+        X_values = np.asarray(X, dtype=np.float64)
+        y_values = np.asarray(y)
+        rng = np.random.default_rng(self.random_state)
+
+        classes, counts = np.unique(y_values, return_counts=True)
+        target_count = counts.max()
+        new_X, new_y = [], []
+        knn_sec, cache_hits, minority_rows, mode = 0.0, [], 0, self.mode
+
+        with stage('smote_resample', rows=len(y_values)):
+            for cls, count in zip(classes, counts):
+                n_new = target_count - count
+                if n_new == 0:
+                    continue
+                X_min = X_values[y_values == cls]
+                k = min(self.k_neighbors, count - 1)
+                if k < 1:
+                    raise ValueError(f"Class {cls} has {count} sample(s); SMOTE needs at least 2")
+                minority_rows += count
+                mode = self._resolve_mode(count)
+
+                knn_start = time.perf_counter()
+                neighbors, hit = neighbor_graph(X_min, k, mode, n_jobs=self.n_jobs,
+                                                random_state=self.random_state)
+                knn_sec += time.perf_counter() - knn_start
+                cache_hits.append(hit)
+
+                # 隨機挑選基準樣本與其中一個鄰居，在兩者連線上插值
+                base = rng.integers(0, count, size=n_new)
+                partner = neighbors[base, rng.integers(0, k, size=n_new)]
+                gap = rng.random((n_new, 1))
+                new_X.append(X_min[base] + gap * (X_min[partner] - X_min[base]))
+                new_y.append(np.full(n_new, cls, dtype=y_values.dtype))
+
+        X_out = np.vstack([X_values] + new_X)
+        y_out = np.concatenate([y_values] + new_y)
+        generated = len(y_out) - len(y_values)
+
+        _append_timing(self.timing_log or TIMING_LOG, {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'mode': mode,
+            'rows': len(y_values),
+            'minority_rows': minority_rows,
+            'features': X_values.shape[1],
+            'generated': generated,
+            'cache_hit': bool(cache_hits) and all(cache_hits),
+            'knn_sec': round(knn_sec, 6),
+            'total_sec': round(time.perf_counter() - start_time, 6),
+        })
+        ledger = ResourceLedger.active()
+        if ledger is not None:
+            ledger.record('smote', wall_sec=time.perf_counter() - start_time,
+                          cpu_sec=time.process_time() - start_cpu, rows=len(y_values),
+                          features=X_values.shape[1], peak_rss_mb=current_rss_bytes() / 1e6,
+                          generated=generated, mode=mode, status='ok')
+
+        if columns is not None:
+            X_out = pd.DataFrame(X_out, columns=columns)
+        if y_name is not None or isinstance(y, pd.Series):
+            y_out = pd.Series(y_out, name=y_name)
+        return X_out, y_out
+
+
+def get_resampler(random_state=123):
+    """
+    依環境變數建立重抽樣器，傳給 setup(fix_imbalance_method=...)
+    YIELD_SMOTE_MODE=imblearn 時回傳 'SMOTE' (PyCaret 預設實作)
+    """
+    mode = os.environ.get('YIELD_SMOTE_MODE', 'auto').lower()
+    if mode == 'imblearn':
+        return 'SMOTE'
+    n_jobs = int(os.environ.get('YIELD_SMOTE_JOBS', os.cpu_count() or 1))
+    return FastSMOTE(mode=mode, n_jobs=n_jobs, random_state=random_state)
+
+
+def timing_summary(path=None):
+    """彙總 smote_timing.csv：各模式的次數、快取命中率與平均耗時"""
+    log = pd.read_csv(path or TIMING_LOG)
+    return log.groupby('mode').agg(calls=('total_sec', 'size'),
+                                   cache_hit_rate=('cache_hit', 'mean'),
+                                   mean_knn_sec=('knn_sec', 'mean'),
+                                   mean_total_sec=('total_sec', 'mean'))
@@ -2,6 +2,9 @@ import pandas as pd
 import os
 import matplotlib.pyplot as plt
 from pycaret.classification import *
+from fast_smote import get_resampler
+from resource_ledger import ResourceLedger
+from log_config import configure_logging, pycaret_logger, disable_catboost_files
 
 # 設定繪圖後端 (避免在無視窗環境報錯)
 plt.switch_backend('Agg') 
@@ -34,7 +37,12 @@ def main():
         return
 
     print(f"✅ 找到檔案：{csv_path}")
-    dataset = pd.read_csv(csv_path)
+    configure_logging('generate_report')
+    ledger = ResourceLedger('generate_report.py')
+    with ledger.stage('load_data') as s_load:
+        dataset = pd.read_csv(csv_path)
+        s_load.set(rows=len(dataset), features=dataset.shape[1] - 1)
+    n_rows, n_features = len(dataset), dataset.shape[1] - 1
 
     # 2. 自動偵測 Target 欄位 (抓最後一欄)
     # 這裡修正了之前一直寫死 'label' 的錯誤
@@ -44,14 +52,18 @@ def main():
     # 3. 初始化 PyCaret
     print("⚙️ 正在初始化環境 (Setup)...")
     try:
-        s = setup(data=dataset, target=target_col, session_id=123, fix_imbalance=True, verbose=False)
+        with ledger.stage('setup', rows=n_rows, features=n_features):
+            s = setup(data=dataset, target=target_col, session_id=123, fix_imbalance=True,
+                      fix_imbalance_method=get_resampler(), verbose=False, system_log=pycaret_logger())
+        disable_catboost_files()
     except Exception as e:
         print(f"❌ Setup 初始化失敗: {e}")
         return
 
     # 4. 訓練模型
     print("⏳ 正在訓練 Random Forest 模型 (請稍候)...")
-    rf = create_model('rf', verbose=False)
+    with ledger.stage('create_model:rf', rows=n_rows, features=n_features):
+        rf = create_model('rf', verbose=False)
     
     # 建立 reports 資料夾
     reports_dir = os.path.join(os.getcwd(), 'reports')
@@ -63,7 +75,8 @@ def main():
         try:
             print(f"   -> 繪製 {filename}...")
             # 產生圖片 (PyCaret 會存在當前目錄)
-            plot_model(model, plot=plot_type, save=True)
+            with ledger.stage(f'plot_model:{plot_type}', rows=n_rows, features=n_features):
+                plot_model(model, plot=plot_type, save=True)
             
             # 處理檔名 (PyCaret 預設檔名 -> 我們要的檔名)
             default_map = {
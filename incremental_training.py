@@ -0,0 +1,243 @@
+"""
+增量重新訓練 (Warm-Start Incremental Retraining)
+
+載入目前使用中的模型，只用新到貨的已標記晶圓繼續訓練，不必每週從頭重跑整份資料：
+- XGBoost  : 以既有 booster 為起點再加 extra_trees 棵樹 (xgb_model)
+- LightGBM : init_model 接續既有 booster
+- CatBoost : init_model 接續既有模型
+- RandomForest / ExtraTrees : warm_start=True，保留舊樹並在新資料上增加樹
+前處理 (補值、標準化等) 直接沿用已訓練好的 pipeline 統計值，不重新 fit。
+集成模型 (ModelEnsemble) 無法直接接續訓練；ACTIVE 為集成時以 --base-version 指定其單一模型版本。
+
+新版本會在 holdout 上與舊模型比較，通過門檻才登錄並設為 ACTIVE；
+報告會列出與完整重新訓練相比節省的時間。
+
+用法:
+    python incremental_training.py --new data/new_lots.csv
+    python incremental_training.py --new data/new_lots.csv --holdout data/holdout.csv --extra-trees 50
+    python incremental_training.py --new data/new_lots.csv --base-version v0003-1a2b3c4d
+"""
+import argparse
+import copy
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from ensemble import ModelEnsemble
+from model_registry import ModelRegistry
+
+REPORT_PATH = 'reports/incremental_training_report.md'
+HISTORY_DATA = 'data/secom_processed.csv'
+EXTRA_TREES = 100
+MAX_METRIC_DROP = 0.02
+
+
+def continue_training(estimator, X, y, extra_trees=EXTRA_TREES):
+    """
+    從既有模型繼續訓練，回傳新的模型物件 (原模型不會被修改)
+    """
+    name = type(estimator).__name__
+    if name == 'XGBClassifier':
+        model = clone(estimator).set_params(n_estimators=extra_trees)
+        model.fit(X, y, xgb_model=estimator.get_booster())
+    elif name == 'LGBMClassifier':
+        model = clone(estimator).set_params(n_estimators=extra_trees)
+        model.fit(X, y, init_model=estimator.booster_)
+    elif name == 'CatBoostClassifier':
+        model = estimator.copy()
+        model.set_params(iterations=extra_trees)
+        model.fit(X, y, init_model=estimator, verbose=False)
+    elif hasattr(estimator, 'warm_start') and hasattr(estimator, 'estimators_'):
+        model = copy.deepcopy(estimator)
+        model.set_params(warm_start=True, n_estimators=len(estimator.estimators_) + extra_trees)
+        model.fit(X, y)
+    else:
+        raise ValueError(f"{name} does not support warm-start training; run a full retrain instead")
+    return model
+
+
+def holdout_metrics(pipeline, X, y):
+    """在 holdout 上計算 Recall / Precision / F1 / AUC (Fail = 1)"""
+    proba = pipeline.predict_proba(X)[:, 1]
+    pred = (proba >= 0.5).astype(int)
+    metrics = {
+        'Recall': recall_score(y, pred, zero_division=0),
+        'Prec.': precision_score(y, pred, zero_division=0),
+        'F1': f1_score(y, pred, zero_division=0),
+    }
+    metrics['AUC'] = roc_auc_score(y, proba) if len(np.unique(y)) > 1 else float('nan')
+    return {k: round(float(v), 4) for k, v in metrics.items()}
+
+
+def incremental_update(pipeline, X_new, y_new, extra_trees=EXTRA_TREES, resampler=None):
+    """
+    沿用 pipeline 前處理統計值，只用新資料接續訓練最後的模型
+    Returns:
+        (new_pipeline, fit_sec)
+    """
+    if isinstance(pipeline, ModelEnsemble):
+        raise ValueError("A ModelEnsemble cannot be trained incrementally; continue from its single-model version")
+    start = time.perf_counter()
+    X_t = pipeline[:-1].transform(X_new)
+    y_t = np.asarray(y_new)
+    if resampler is not None and np.bincount(y_t.astype(int)).min() >= 2:
+        X_t, y_t = resampler.fit_resample(X_t, y_t)
+
+    step_name, estimator = pipeline.steps[-1]
+    new_estimator = continue_training(estimator, X_t, y_t, extra_trees)
+
+    new_pipeline = copy.copy(pipeline)
+    new_pipeline.steps = list(pipeline.steps[:-1]) + [(step_name, new_estimator)]
+    return new_pipeline, time.perf_counter() - start
+
+
+def full_retrain(pipeline, X, y, extra_trees=EXTRA_TREES):
+    """
+    對照組：同樣的 pipeline 與超參數從頭訓練 (樹的總數與增量版本相同)，回傳 (pipeline, fit_sec)
+    """
+    baseline = clone(pipeline)
+    step_name, estimator = baseline.steps[-1]
+    params = estimator.get_params()
+    for key in ('n_estimators', 'iterations'):
+        if params.get(key) is not None:
+            estimator.set_params(**{key: params[key] + extra_trees})
+    start = time.perf_counter()
+    baseline.fit(X, y)
+    return baseline, time.perf_counter() - start
+
+
+def write_report(summary, path=REPORT_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = [
+        "# Incremental Retraining Report",
+        "",
+        f"- Base version: `{summary['base_version']}`",
+        f"- New version: `{summary.get('new_version') or 'not registered'}`"
+        + (" (active)" if summary.get('activated') else ""),
+        f"- Model: {summary['model']} (+{summary['extra_trees']} trees)",
+        f"- New labeled wafers: {summary['new_rows']} (holdout: {summary['holdout_rows']})",
+        f"- Incremental fit: {summary['incremental_sec']:.2f} s",
+    ]
+    if summary.get('full_retrain_sec') is not None:
+        saved = summary['full_retrain_sec'] - summary['incremental_sec']
+        lines.append(f"- Full retrain ({summary.get('full_retrain_source', 'measured')}): "
+                     f"{summary['full_retrain_sec']:.2f} s "
+                     f"(saved {saved:.2f} s, {saved / summary['full_retrain_sec']:.0%})")
+    lines += ["", "| Metric | " + " | ".join(summary['holdout']) + " |",
+              "| :--- |" + " ---: |" * len(summary['holdout'])]
+    for metric in summary['holdout'][next(iter(summary['holdout']))]:
+        lines.append(f"| {metric} | " + " | ".join(str(summary['holdout'][m][metric]) for m in summary['holdout']) + " |")
+    lines += ["", f"Validation: {'✅ passed' if summary['passed'] else '❌ failed'} "
+              f"(max allowed drop {summary['max_drop']})"]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continue training the active model on new labeled wafers")
+    parser.add_argument('--new', required=True, help="CSV of new labeled wafers (same columns as secom_processed.csv)")
+    parser.add_argument('--holdout', default=None, help="holdout CSV (default: split from --new)")
+    parser.add_argument('--holdout-frac', type=float, default=0.2)
+    parser.add_argument('--extra-trees', type=int, default=EXTRA_TREES)
+    parser.add_argument('--history', default=HISTORY_DATA, help="full history for the full-retrain timing baseline")
+    parser.add_argument('--skip-full-baseline', action='store_true')
+    parser.add_argument('--max-drop', type=float, default=MAX_METRIC_DROP,
+                        help="largest allowed drop in holdout Recall/F1 versus the current model")
+    parser.add_argument('--no-activate', action='store_true')
+    parser.add_argument('--base-version', default=None,
+                        help="registry version to continue from (default: the ACTIVE version)")
+    args = parser.parse_args()
+
+    from pycaret.classification import load_model
+    import joblib
+    from fast_smote import get_resampler
+
+    registry = ModelRegistry()
+    if args.base_version:
+        base_version, base_path = args.base_version, registry.model_path(args.base_version)
+    else:
+        base_version, base_path = registry.resolve()
+    if base_version is None:
+        raise FileNotFoundError("❌ No model available; run train_upgrade.py first")
+    print(f"📦 Loading current model {base_version}...")
+    pipeline = load_model(base_path, verbose=False)
+    if isinstance(pipeline, ModelEnsemble):
+        # train_upgrade.py 在集成的 metadata 記錄同一次訓練登錄的單一模型版本
+        single_version = registry.get(base_version).get('metadata', {}).get('single_model_version')
+        hint = f"--base-version {single_version}" if single_version else "--base-version <single-model version>"
+        raise ValueError(f"❌ {base_version} is a ModelEnsemble and cannot be trained incrementally; "
+                         f"rerun with {hint}")
+
+    new_data = pd.read_csv(args.new)
+    if args.holdout:
+        train_part, holdout = new_data, pd.read_csv(args.holdout)
+    else:
+        train_part, holdout = train_test_split(new_data, test_size=args.holdout_frac,
+                                               stratify=new_data['label'], random_state=123)
+    X_new, y_new = train_part.drop(columns='label'), train_part['label']
+    X_hold, y_hold = holdout.drop(columns='label'), holdout['label']
+
+    print(f"🌱 Continuing training on {len(X_new)} new wafers (+{args.extra_trees} trees)...")
+    resampler = get_resampler()
+    new_pipeline, incremental_sec = incremental_update(
+        pipeline, X_new, y_new, args.extra_trees,
+        resampler=None if isinstance(resampler, str) else resampler)
+
+    results = {'current': holdout_metrics(pipeline, X_hold, y_hold),
+               'incremental': holdout_metrics(new_pipeline, X_hold, y_hold)}
+
+    full_sec = None
+    if not args.skip_full_baseline and os.path.exists(args.history):
+        print("⏱️ Timing a full retrain for comparison...")
+        history = pd.concat([pd.read_csv(args.history), train_part], ignore_index=True)
+        baseline, full_sec = full_retrain(pipeline, history.drop(columns='label'), history['label'],
+                                          args.extra_trees)
+        results['full retrain'] = holdout_metrics(baseline, X_hold, y_hold)
+
+    full_sec_source = 'measured'
+    if full_sec is None and not base_version.startswith('legacy-'):
+        # 沒有跑對照組時，改用基準版本登錄時記錄的完整訓練 (finalize_model) 時間
+        full_sec = registry.get(base_version).get('metadata', {}).get('finalize_sec')
+        full_sec_source = f'recorded for {base_version}'
+
+    passed = all(results['incremental'][m] >= results['current'][m] - args.max_drop for m in ('Recall', 'F1'))
+    summary = {
+        'base_version': base_version,
+        'model': type(new_pipeline.steps[-1][1]).__name__,
+        'extra_trees': args.extra_trees,
+        'new_rows': len(X_new),
+        'holdout_rows': len(X_hold),
+        'incremental_sec': round(incremental_sec, 3),
+        'full_retrain_sec': round(full_sec, 3) if full_sec is not None else None,
+        'full_retrain_source': full_sec_source,
+        'holdout': results,
+        'max_drop': args.max_drop,
+        'passed': passed,
+    }
+
+    if passed:
+        model_file = 'incremental_yield_prediction_model.pkl'
+        joblib.dump(new_pipeline, model_file)
+        summary['new_version'] = registry.register(
+            model_file, source='incremental_training.py',
+            metadata={'mode': 'incremental', **{k: v for k, v in summary.items() if k != 'passed'}},
+            activate=not args.no_activate)
+        summary['activated'] = not args.no_activate
+        os.remove(model_file)
+        print(f"   -> ✅ Registered {summary['new_version']}" + (" (active)" if summary['activated'] else ""))
+    else:
+        print("   -> ❌ Holdout metrics dropped beyond the allowed margin; model not registered")
+
+    write_report(summary)
+    print(json.dumps(results, indent=2))
+    print(f"📄 Report saved to {REPORT_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+上傳資料驗證 (Input Validation)
+
+在送進 predict_model 之前，先以一次向量化檢查擋下格式錯誤或明顯異常的晶圓：
+- Schema  : 是否缺少 required_features.pkl 中的感測器 (缺欄位時整批拒絕)
+- 文字內容 : 數值欄位中出現無法轉換的文字
+- 範圍    : 超出訓練資料 [min, max] 加上容許範圍 (range 的 RANGE_MARGIN 倍) 或為 ±inf
+- 缺值率  : 單片晶圓的 NaN 比例超過訓練時最高值 + ROW_NAN_SLACK
+另外以整批的感測器缺值率與訓練時比較，只列為警告不拒絕。
+
+界限值在訓練時存成 JSON (reports/input_bounds.json)；
+大檔可用 BatchValidator 逐 chunk 驗證，報告會累積整份資料的統計。
+
+用法:
+    from input_validation import SensorBounds, validate_batch
+    result = validate_batch(df, SensorBounds.load())
+    accepted = df[~result['reject']]
+"""
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_BOUNDS_PATH = 'reports/input_bounds.json'
+RANGE_MARGIN = 0.5
+ROW_NAN_SLACK = 0.1
+NAN_RATE_TOLERANCE = 0.2
+REASON_COLUMNS = ['non_numeric', 'out_of_range', 'nan_rate']
+
+
+class SensorBounds:
+    """每個感測器可接受的數值範圍與訓練時的缺值率"""
+
+    def __init__(self, feature_names, low, high, nan_rate, max_row_nan_rate=1.0, n_rows=0):
+        self.feature_names = [str(f) for f in feature_names]
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.nan_rate = np.asarray(nan_rate, dtype=np.float64)
+        self.max_row_nan_rate = float(max_row_nan_rate)
+        self.n_rows = int(n_rows)
+
+    @classmethod
+    def from_data(cls, data, feature_names=None, margin=RANGE_MARGIN, row_nan_slack=ROW_NAN_SLACK):
+        """由訓練資料建立界限 (全空的感測器不設範圍)"""
+        if feature_names is None:
+            feature_names = [c for c in data.columns if c != 'label']
+        X = data[feature_names].to_numpy(dtype=np.float64)
+        present = ~np.isnan(X)
+        has_value = present.any(axis=0)
+        minimum = np.min(np.where(present, X, np.inf), axis=0)
+        maximum = np.max(np.where(present, X, -np.inf), axis=0)
+        # 零變異的感測器以數值本身的大小當作容許寬度，避免任何微小差異都被拒絕
+        span = np.where(maximum > minimum, maximum - minimum, np.maximum(np.abs(maximum), 1.0))
+        low = np.where(has_value, minimum - margin * span, -np.inf)
+        high = np.where(has_value, maximum + margin * span, np.inf)
+        nan_rate = 1.0 - present.mean(axis=0) if len(X) else np.zeros(len(feature_names))
+        row_nan = 1.0 - present.mean(axis=1).min() if len(X) else 0.0
+        return cls(feature_names, low, high, nan_rate,
+                   max_row_nan_rate=min(1.0, row_nan + row_nan_slack), n_rows=len(X))
+
+    @classmethod
+    def schema_only(cls, feature_names):
+        """沒有訓練界限時只檢查欄位與文字內容"""
+        n = len(feature_names)
+        return cls(feature_names, np.full(n, -np.inf), np.full(n, np.inf), np.zeros(n))
+
+    def save(self, path=DEFAULT_BOUNDS_PATH):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        payload = {
+            'feature_names': self.feature_names,
+            # JSON 沒有 inf，以 null 表示不設限
+            'low': [None if not np.isfinite(v) else float(v) for v in self.low],
+            'high': [None if not np.isfinite(v) else float(v) for v in self.high],
+            'nan_rate': [round(float(v), 6) for v in self.nan_rate],
+            'max_row_nan_rate': self.max_row_nan_rate,
+            'n_rows': self.n_rows,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+
+    @classmethod
+    def load(cls, path=DEFAULT_BOUNDS_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        low = [-np.inf if v is None else v for v in payload['low']]
+        high = [np.inf if v is None else v for v in payload['high']]
+        return cls(payload['feature_names'], low, high, payload['nan_rate'],
+                   payload.get('max_row_nan_rate', 1.0), payload.get('n_rows', 0))
+
+    @staticmethod
+    def mtime(path=DEFAULT_BOUNDS_PATH):
+        """界限檔的更新時間；不存在時回傳 None"""
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+
+def _numeric_matrix(data, feature_names):
+    """
+    取出 float64 矩陣，並標記「有內容但不是數字」的儲存格
+    只有 object 欄位需要逐欄轉換，全數值的批次直接 to_numpy
+    """
+    frame = data[feature_names]
+    text_cols = [i for i, dtype in enumerate(frame.dtypes) if not pd.api.types.is_numeric_dtype(dtype)]
+    if not text_cols:
+        return frame.to_numpy(dtype=np.float64), None
+    non_numeric = np.zeros(frame.shape, dtype=bool)
+    coerced_cols = {}
+    for i in text_cols:
+        raw = frame.iloc[:, i]
+        coerced = pd.to_numeric(raw, errors='coerce')
+        non_numeric[:, i] = (coerced.isna() & raw.notna()).to_numpy()
+        coerced_cols[frame.columns[i]] = coerced.astype(np.float64)
+    X = frame.assign(**coerced_cols).to_numpy(dtype=np.float64)
+    return X, non_numeric
+
+
+class BatchValidator:
+    """可逐 chunk 驗證並累積報告的驗證器"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        n = len(bounds.feature_names)
+        self.n_rows = 0
+        self.n_rejected = 0
+        self.missing_columns = []
+        self.rejected_by = dict.fromkeys(REASON_COLUMNS, 0)
+        self.non_numeric = np.zeros(n, dtype=np.int64)
+        self.below = np.zeros(n, dtype=np.int64)
+        self.above = np.zeros(n, dtype=np.int64)
+        self.nan_counts = np.zeros(n, dtype=np.int64)
+        self.elapsed_sec = 0.0
+
+    def update(self, data):
+        """
+        驗證一個批次 / chunk
+        Returns:
+            (reject: bool ndarray, reasons: 每列的拒絕原因 Series，通過的列為空字串)
+        """
+        start = time.perf_counter()
+        names = self.bounds.feature_names
+        n_rows = len(data)
+        self.n_rows += n_rows
+
+        missing = [c for c in names if c not in data.columns]
+        if missing:
+            for c in missing:
+                if c not in self.missing_columns:
+                    self.missing_columns.append(c)
+            reason = f"missing sensors: {', '.join(missing[:3])}" + (f" (+{len(missing) - 3} more)" if len(missing) > 3 else "")
+            self.n_rejected += n_rows
+            self.elapsed_sec += time.perf_counter() - start
+            return np.ones(n_rows, dtype=bool), pd.Series(reason, index=data.index)
+
+        X, non_numeric = _numeric_matrix(data, names)
+        is_nan = np.isnan(X)
+        below = X < self.bounds.low
+        above = X > self.bounds.high
+        out_of_range = below | above
+
+        self.nan_counts += is_nan.sum(axis=0)
+        self.below += below.sum(axis=0)
+        self.above += above.sum(axis=0)
+        row_nan_rate = is_nan.mean(axis=1) if names else np.zeros(n_rows)
+        bad_nan = row_nan_rate > self.bounds.max_row_nan_rate
+        bad_range = out_of_range.any(axis=1)
+        if non_numeric is not None:
+            self.non_numeric += non_numeric.sum(axis=0)
+            bad_text = non_numeric.any(axis=1)
+        else:
+            bad_text = np.zeros(n_rows, dtype=bool)
+        reject = bad_text | bad_range | bad_nan
+
+        # 原因字串只需替被拒絕的列建立 (通常很少)
+        reasons = np.full(n_rows, '', dtype=object)
+        for mask, label, flags in ((bad_text, 'non-numeric', non_numeric), (bad_range, 'out of range', out_of_range)):
+            rows = np.flatnonzero(mask & (reasons == ''))
+            if len(rows):
+                first = flags[rows].argmax(axis=1)
+                extra = flags[rows].sum(axis=1) - 1
+                reasons[rows] = [f"{label}: {names[c]}" + (f" (+{e} more)" if e else "")
+                                 for c, e in zip(first, extra)]
+        rows = np.flatnonzero(bad_nan & (reasons == ''))
+        reasons[rows] = [f"NaN rate {r:.0%}" for r in row_nan_rate[rows]]
+
+        self.rejected_by['non_numeric'] += int(bad_text.sum())
+        self.rejected_by['out_of_range'] += int((bad_range & ~bad_text).sum())
+        self.rejected_by['nan_rate'] += int((bad_nan & ~bad_text & ~bad_range).sum())
+        self.n_rejected += int(reject.sum())
+        self.elapsed_sec += time.perf_counter() - start
+        return reject, pd.Series(reasons, index=data.index)
+
+    def report(self):
+        """
+        各感測器的問題統計 (只列出有問題的感測器)
+        Returns:
+            pd.DataFrame: feature, non_numeric, below_min, above_max, nan_rate, nan_rate_ref, status
+        """
+        nan_rate = self.nan_counts / max(self.n_rows, 1)
+        report = pd.DataFrame({
+            'feature': self.bounds.feature_names,
+            'non_numeric': self.non_numeric,
+            'below_min': self.below,
+            'above_max': self.above,
+            'nan_rate': nan_rate,
+            'nan_rate_ref': self.bounds.nan_rate,
+        })
+        report['status'] = np.select(
+            [report['non_numeric'] > 0,
+             (report['below_min'] + report['above_max']) > 0,
+             report['nan_rate'] > report['nan_rate_ref'] + NAN_RATE_TOLERANCE],
+            ['Non-numeric', 'Out of range', 'High NaN rate (warning)'],
+            default='OK'
+        )
+        return report[report['status'] != 'OK'].reset_index(drop=True)
+
+    def summary(self):
+        return {
+            'rows': self.n_rows,
+            'rejected': self.n_rejected,
+            'accepted': self.n_rows - self.n_rejected,
+            'missing_columns': list(self.missing_columns),
+            'rejected_by': dict(self.rejected_by),
+            'elapsed_sec': self.elapsed_sec,
+        }
+
+
+def validate_batch(data, bounds, chunk_rows=None):
+    """
+    驗證整批資料 (chunk_rows 指定時分塊處理，減少暫存矩陣的記憶體)
+    Returns:
+        dict: reject (bool ndarray), reasons (Series), report (DataFrame), summary (dict)
+    """
+    validator = BatchValidator(bounds)
+    step = chunk_rows or max(len(data), 1)
+    masks, reasons = [], []
+    for start in range(0, max(len(data), 1), step):
+        mask, reason = validator.update(data.iloc[start:start + step])
+        masks.append(mask)
+        reasons.append(reason)
+    return {
+        'reject': np.concatenate(masks),
+        'reasons': pd.concat(reasons),
+        'report': validator.report(),
+        'summary': validator.summary(),
+    }
@@ -0,0 +1,324 @@
+"""
+階段效能量測 (Stage Instrumentation)
+
+記錄各處理階段 (CSV 解析、前處理 transform、predict_model、SHAP、繪圖...) 的
+延遲直方圖、呼叫次數、處理筆數與記憶體峰值，並輸出成 Prometheus 文字格式或 JSON。
+
+啟用方式：設定環境變數 YIELD_METRICS=1
+    - YIELD_METRICS_PORT: 啟動本機 HTTP 端點 (/metrics, /metrics.json)
+    - 未啟用且沒有 listener 時 stage() 只回傳共用的空物件，幾乎沒有額外成本
+    - add_stage_listener() 註冊的函式在每個階段結束時收到耗時 (log_config 用來把階段耗時寫進 log)
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組
+    resource = None
+
+METRICS_JSON_PATH = 'reports/metrics.json'
+METRICS_PROM_PATH = 'reports/metrics.prom'
+DEFAULT_PORT = 9108
+FLUSH_INTERVAL_SEC = 5.0
+
+# 延遲直方圖的 bucket 上界 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = os.environ.get('YIELD_METRICS', '0') == '1'
+_lock = threading.Lock()
+_stats = {}
+_server = None
+_last_flush = 0.0
+_listeners = []
+_current_stage = contextvars.ContextVar('yield_stage', default=None)
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(flag):
+    """程式內開關量測 (主要給測試與 CLI 使用)"""
+    global _enabled
+    _enabled = bool(flag)
+
+
+def add_stage_listener(listener):
+    """註冊階段結束時的回呼 listener(name, seconds, rows, failed)"""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_stage_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def current_stage():
+    """目前執行緒 / context 所在的階段名稱 (沒有時回傳 None)"""
+    return _current_stage.get()
+
+
+def reset():
+    """清空所有已記錄的統計"""
+    with _lock:
+        _stats.clear()
+
+
+def peak_rss_bytes():
+    """目前行程的記憶體峰值 (bytes)；無法取得時回傳 0"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 回傳 KB，macOS 回傳 bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss_bytes(pid=None):
+    """行程目前的常駐記憶體 (bytes)，預設為自己；非 Linux 平台只能回傳自己的峰值"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss_bytes() if pid is None else 0
+
+
+class _StageStats:
+    """單一階段的累計統計"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.peak_rss_bytes = 0
+        self.rss_growth_bytes = 0
+
+    def observe(self, seconds, rows, rss_before, rss_after, failed):
+        self.count += 1
+        self.errors += int(failed)
+        self.rows += rows
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, upper in enumerate(LATENCY_BUCKETS):
+            if seconds <= upper:
+                self.bucket_counts[i] += 1
+                break
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss_after)
+        self.rss_growth_bytes = max(self.rss_growth_bytes, rss_after - rss_before)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_seconds': round(self.total_seconds, 6),
+            'mean_seconds': round(self.total_seconds / self.count, 6) if self.count else 0.0,
+            'max_seconds': round(self.max_seconds, 6),
+            'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS], self.bucket_counts)),
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'rss_growth_bytes': self.rss_growth_bytes,
+        }
+
+
+class _NullStage:
+    """未啟用量測時使用的空 context"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add_rows(self, n):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """量測一個階段：耗時、處理筆數與記憶體峰值變化"""
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = int(rows or 0)
+
+    def add_rows(self, n):
+        self.rows += int(n)
+
+    def __enter__(self):
+        self._token = _current_stage.set(self.name)
+        self._rss_before = peak_rss_bytes()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        _current_stage.reset(self._token)
+        if _enabled:
+            rss_after = peak_rss_bytes()
+            with _lock:
+                stats = _stats.get(self.name)
+                if stats is None:
+                    stats = _stats[self.name] = _StageStats()
+                stats.observe(seconds, self.rows, self._rss_before, rss_after, exc_type is not None)
+        for listener in list(_listeners):
+            listener(self.name, seconds, self.rows, exc_type is not None)
+        return False
+
+
+def stage(name, rows=None):
+    """
+    量測一個處理階段
+    用法:
+        with stage('predict_model', rows=len(df)):
+            ...
+        with stage('csv_parse') as s:
+            df = pd.read_csv(f)
+            s.add_rows(len(df))
+    """
+    if not _enabled and not _listeners:
+        return _NULL_STAGE
+    return _Stage(name, rows)
+
+
+def instrumented(name):
+    """函式裝飾器版本的 stage()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """取得目前所有階段統計 (dict)"""
+    with _lock:
+        stages = {name: s.to_dict() for name, s in _stats.items()}
+    return {
+        'generated_at': time.time(),
+        'pid': os.getpid(),
+        'process_peak_rss_bytes': peak_rss_bytes(),
+        'stages': stages,
+    }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_prometheus():
+    """輸出 Prometheus text exposition 格式"""
+    snap = snapshot()
+    lines = [
+        '# HELP yield_stage_duration_seconds Latency of each processing stage.',
+        '# TYPE yield_stage_duration_seconds histogram',
+    ]
+    for name, s in sorted(snap['stages'].items()):
+        cumulative = 0
+        for upper, count in s['buckets'].items():
+            cumulative += count
+            lines.append(f'yield_stage_duration_seconds_bucket{{stage="{_label(name)}",le="{upper}"}} {cumulative}')
+        lines.append(f'yield_stage_duration_seconds_bucket{{stage="{_label(name)}",le="+Inf"}} {s["count"]}')
+        lines.append(f'yield_stage_duration_seconds_sum{{stage="{_label(name)}"}} {s["total_seconds"]}')
+        lines.append(f'yield_stage_duration_seconds_count{{stage="{_label(name)}"}} {s["count"]}')
+
+    counters = [
+        ('yield_stage_errors_total', 'counter', 'Calls that raised an exception.', 'errors'),
+        ('yield_stage_rows_total', 'counter', 'Rows processed by each stage.', 'rows'),
+        ('yield_stage_peak_rss_bytes', 'gauge', 'Process peak RSS observed at the end of the stage.', 'peak_rss_bytes'),
+        ('yield_stage_rss_growth_bytes', 'gauge', 'Largest peak RSS increase during a single call.', 'rss_growth_bytes'),
+    ]
+    for metric, kind, help_text, key in counters:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for name, s in sorted(snap['stages'].items()):
+            lines.append(f'{metric}{{stage="{_label(name)}"}} {s[key]}')
+
+    lines.append('# HELP yield_process_peak_rss_bytes Peak RSS of the process.')
+    lines.append('# TYPE yield_process_peak_rss_bytes gauge')
+    lines.append(f'yield_process_peak_rss_bytes {snap["process_peak_rss_bytes"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _atomic_write(path, text):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_metrics(json_path=METRICS_JSON_PATH, prom_path=METRICS_PROM_PATH):
+    """把目前統計寫成 JSON 與 Prometheus 文字檔 (供本機 scraper / node_exporter textfile 讀取)"""
+    if json_path:
+        _atomic_write(json_path, json.dumps(snapshot(), indent=2))
+    if prom_path:
+        _atomic_write(prom_path, render_prometheus())
+
+
+def flush(min_interval=FLUSH_INTERVAL_SEC):
+    """節流版 write_metrics()：未啟用時直接略過，啟用時最多每 min_interval 秒寫一次"""
+    global _last_flush
+    if not _enabled:
+        return
+    now = time.time()
+    if now - _last_flush < min_interval:
+        return
+    _last_flush = now
+    write_metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body = json.dumps(snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        elif self.path.startswith('/metrics'):
+            body = render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不要把每次 scrape 都印到 console
+        pass
+
+
+def start_metrics_server(port=None, host='127.0.0.1'):
+    """
+    在背景執行緒啟動 /metrics 端點 (同一行程只會啟動一次)
+    Returns:
+        實際使用的 port；未啟用量測時回傳 None
+    """
+    global _server
+    if not _enabled:
+        return None
+    with _lock:
+        if _server is None:
+            if port is None:
+                port = int(os.environ.get('YIELD_METRICS_PORT', DEFAULT_PORT))
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            thread = threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True)
+            thread.start()
+    return _server.server_address[1]
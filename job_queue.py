@@ -0,0 +1,427 @@
+"""
+背景預測工作佇列 (Job Queue)
+
+Streamlit 只負責送出工作與顯示進度，實際的 predict_model / SHAP 計算交給獨立的 worker 行程，
+大批上傳不會再卡住其他工程師的畫面。
+
+- 佇列：SQLite (output/jobs/queue.db)，輸入/輸出以 pickle 檔存放在同一資料夾
+- Worker：主行程先載入模型一次，再 fork 出多個 worker，模型記憶體以 copy-on-write 共用
+- 大批資料會切成多個 part，分散到所有 worker 平行計算，完成後依原順序合併
+
+啟動 worker:
+    python job_queue.py --workers 4
+"""
+import argparse
+import contextlib
+import gc
+import multiprocessing
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import traceback
+import uuid
+
+import pandas as pd
+
+from log_config import configure_logging
+
+QUEUE_DIR = 'output/jobs'
+DEFAULT_MODEL_PATH = 'output/final_yield_prediction_model'
+SPLIT_ROWS = 2000
+PROGRESS_CHUNK_ROWS = 500
+HEARTBEAT_TIMEOUT_SEC = 30
+POLL_INTERVAL_SEC = 0.5
+RESULT_TTL_SEC = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    group_id TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_group ON jobs (group_id, part);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    pid INTEGER,
+    last_seen REAL NOT NULL
+);
+"""
+
+
+class JobFailed(Exception):
+    """背景工作執行失敗"""
+
+
+class JobQueue:
+    """以 SQLite 實作的本機工作佇列 (app 與 worker 共用)"""
+
+    def __init__(self, queue_dir=QUEUE_DIR):
+        self.queue_dir = queue_dir
+        self.db_path = os.path.join(queue_dir, 'queue.db')
+        os.makedirs(os.path.join(queue_dir, 'payloads'), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """autocommit 連線，用完即關閉"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    def _payload_path(self, job_id, suffix):
+        return os.path.join(self.queue_dir, 'payloads', f"{job_id}.{suffix}.pkl")
+
+    def _write_payload(self, path, obj):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    # ---------- 送出端 (app) ----------
+
+    def submit(self, kind, data, params=None, split_rows=SPLIT_ROWS):
+        """
+        送出一個工作 (資料過大時自動切成多個 part)
+        Returns:
+            group_id: 用來查詢進度與取回結果
+        """
+        group_id = uuid.uuid4().hex
+        if split_rows and len(data) > split_rows:
+            parts = [data.iloc[i:i + split_rows] for i in range(0, len(data), split_rows)]
+        else:
+            parts = [data]
+
+        now = time.time()
+        rows = []
+        for part, chunk in enumerate(parts):
+            job_id = f"{group_id}-{part}"
+            self._write_payload(self._payload_path(job_id, 'input'), {'data': chunk, 'params': params or {}})
+            rows.append((job_id, group_id, part, kind, 'queued', now))
+
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO jobs (id, group_id, part, kind, status, created_at) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+        return group_id
+
+    def group_status(self, group_id):
+        """整組工作的狀態：queued / running / done / failed 與整體進度 (0~1)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, progress, error FROM jobs WHERE group_id = ? ORDER BY part", (group_id,)
+            ).fetchall()
+        if not rows:
+            raise KeyError(f"Unknown job: {group_id}")
+
+        statuses = [r['status'] for r in rows]
+        errors = [r['error'] for r in rows if r['error']]
+        if 'failed' in statuses:
+            status = 'failed'
+        elif all(s == 'done' for s in statuses):
+            status = 'done'
+        elif all(s == 'queued' for s in statuses):
+            status = 'queued'
+        else:
+            status = 'running'
+        progress = sum(1.0 if r['status'] == 'done' else r['progress'] for r in rows) / len(rows)
+        return {'status': status, 'progress': progress, 'parts': len(rows), 'error': errors[0] if errors else None}
+
+    def group_result(self, group_id):
+        """取回結果；DataFrame 結果會依 part 順序合併"""
+        with self._connect() as conn:
+            ids = [r['id'] for r in conn.execute(
+                "SELECT id FROM jobs WHERE group_id = ? ORDER BY part", (group_id,)
+            )]
+        results = []
+        for job_id in ids:
+            with open(self._payload_path(job_id, 'result'), 'rb') as f:
+                results.append(pickle.load(f))
+        if all(isinstance(r, pd.DataFrame) for r in results):
+            return pd.concat(results)
+        return results[0] if len(results) == 1 else results
+
+    def wait(self, group_id, timeout=None, poll_interval=POLL_INTERVAL_SEC, on_progress=None):
+        """等待工作完成並回傳結果 (睡眠輪詢，不佔用 CPU)"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            info = self.group_status(group_id)
+            if on_progress is not None:
+                on_progress(info['progress'])
+            if info['status'] == 'done':
+                return self.group_result(group_id)
+            if info['status'] == 'failed':
+                raise JobFailed(info['error'])
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError(f"Job {group_id} did not finish within {timeout} s")
+            time.sleep(poll_interval)
+
+    def live_workers(self, timeout=HEARTBEAT_TIMEOUT_SEC):
+        """最近仍有心跳的 worker 數量"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS n FROM workers WHERE last_seen >= ?", (time.time() - timeout,)
+            ).fetchone()
+        return row['n']
+
+    # ---------- 執行端 (worker) ----------
+
+    def heartbeat(self, worker_id):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, pid, last_seen) VALUES (?, ?, ?)",
+                (worker_id, os.getpid(), time.time())
+            )
+
+    def claim(self, worker_id):
+        """原子性地領取最舊的一個 queued 工作；沒有工作時回傳 None"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT id, kind FROM jobs WHERE status = 'queued' ORDER BY created_at, part LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ? WHERE id = ?",
+                        (worker_id, time.time(), row['id'])
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+
+        with open(self._payload_path(row['id'], 'input'), 'rb') as f:
+            payload = pickle.load(f)
+        return {'id': row['id'], 'kind': row['kind'], 'data': payload['data'], 'params': payload['params']}
+
+    def update_progress(self, job_id, progress):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (float(progress), job_id))
+
+    def complete(self, job_id, result):
+        self._write_payload(self._payload_path(job_id, 'result'), result)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', progress = 1, finished_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+        input_path = self._payload_path(job_id, 'input')
+        if os.path.exists(input_path):
+            os.remove(input_path)
+
+    def fail(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (str(error), time.time(), job_id)
+            )
+
+    def requeue_stale(self, timeout=HEARTBEAT_TIMEOUT_SEC):
+        """worker 中途掛掉時，把它手上的工作放回佇列"""
+        cutoff = time.time() - timeout
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, progress = 0 "
+                "WHERE status = 'running' AND worker NOT IN (SELECT worker_id FROM workers WHERE last_seen >= ?)",
+                (cutoff,)
+            )
+            return cur.rowcount
+
+    def purge_finished(self, max_age=RESULT_TTL_SEC):
+        """清除超過 max_age 秒的已完成/失敗工作與其檔案"""
+        cutoff = time.time() - max_age
+        with self._connect() as conn:
+            ids = [r['id'] for r in conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+            )]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+        for job_id in ids:
+            for suffix in ('input', 'result'):
+                path = self._payload_path(job_id, suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        return len(ids)
+
+
+# ---------- 工作內容 ----------
+
+def run_predict_job(pipeline, data, params, report_progress):
+    """分段執行 predict_model (集成模型時所有成員同時預測)，每段完成後回報進度"""
+    from ensemble import predict_frame
+
+    outputs = []
+    for start in range(0, len(data), PROGRESS_CHUNK_ROWS):
+        chunk = data.iloc[start:start + PROGRESS_CHUNK_ROWS]
+        outputs.append(predict_frame(pipeline, data=chunk))
+        report_progress(min(1.0, (start + len(chunk)) / len(data)))
+    return pd.concat(outputs) if outputs else predict_frame(pipeline, data=data)
+
+
+def run_shap_job(pipeline, data, params, report_progress):
+    """計算指定晶圓的 SHAP 值 (params['method']: exact / approximate；TreeExplainer 在同一 worker 內重複使用)"""
+    from explain import compute_shap
+
+    return compute_shap(pipeline, data, method=(params or {}).get('method', 'exact'))
+
+
+HANDLERS = {
+    'predict': run_predict_job,
+    'shap': run_shap_job,
+}
+
+# worker 行程內的共用物件 (在 fork 前由主行程載入)
+_PIPELINE = None
+_MODEL_VERSION = None
+# 載入或暖機失敗的版本，ACTIVE 沒再變動前不重試
+_FAILED_VERSION = None
+MODEL_CHECK_INTERVAL_SEC = 10
+
+
+def load_active_model(fallback_path=DEFAULT_MODEL_PATH):
+    """載入版本庫中的 ACTIVE 模型 (版本庫為空時使用 fallback_path)"""
+    global _PIPELINE, _MODEL_VERSION
+    from pycaret.classification import load_model
+    from model_registry import ModelRegistry
+
+    version, path = ModelRegistry().resolve(fallback_path)
+    if version is None:
+        raise FileNotFoundError(f"No active model in the registry and no model at {fallback_path}.pkl")
+    print(f"📦 Loading model {version} from {path}.pkl ...")
+    _PIPELINE = load_model(path)
+    _MODEL_VERSION = version
+
+
+def refresh_worker_model(registry, fallback_path=DEFAULT_MODEL_PATH, loader=None, warmup=None):
+    """
+    ACTIVE 版本改變時載入並暖機新模型，成功後才替換 worker 的模型；有替換時回傳 True
+    新版本載入失敗時保留舊模型繼續處理工作，並記住失敗版本避免每次檢查都重試
+    """
+    global _PIPELINE, _MODEL_VERSION, _FAILED_VERSION
+    from model_registry import warm_up
+
+    version, path = registry.resolve(fallback_path)
+    if version is None or version in (_MODEL_VERSION, _FAILED_VERSION):
+        return False
+    if loader is None:
+        from pycaret.classification import load_model as loader
+    warmup = warm_up if warmup is None else warmup
+    print(f"📦 Loading model {version} from {path}.pkl ...")
+    try:
+        pipeline = loader(path)
+        warmup(pipeline)
+    except Exception as e:
+        _FAILED_VERSION = version
+        traceback.print_exc()
+        print(f"❌ Model {version} failed to load ({type(e).__name__}: {e}); keeping {_MODEL_VERSION}")
+        return False
+    _PIPELINE, _MODEL_VERSION = pipeline, version
+    return True
+
+
+def process_one(queue, worker_id, pipeline, handlers=HANDLERS):
+    """領取並執行一個工作；沒有工作時回傳 False"""
+    job = queue.claim(worker_id)
+    if job is None:
+        return False
+    try:
+        handler = handlers[job['kind']]
+        result = handler(pipeline, job['data'], job['params'],
+                         lambda p: queue.update_progress(job['id'], p))
+        queue.complete(job['id'], result)
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job['id'], f"{type(e).__name__}: {e}")
+    return True
+
+
+def _worker_loop(index, queue_dir, model_path, poll_interval):
+    from model_registry import ModelRegistry
+
+    if _PIPELINE is None:
+        # 不支援 fork 的平台 (Windows) 只能在每個 worker 各自載入
+        load_active_model(model_path)
+
+    registry = ModelRegistry()
+    queue = JobQueue(queue_dir)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    last_heartbeat = 0.0
+    last_maintenance = time.time()
+    last_model_check = time.time()
+    print(f"👷 Worker {worker_id} ready")
+    while True:
+        now = time.time()
+        if now - last_model_check > MODEL_CHECK_INTERVAL_SEC:
+            # ACTIVE 版本切換後，worker 在兩個工作之間改用新模型 (失敗時沿用舊模型)
+            refresh_worker_model(registry, model_path)
+            last_model_check = now
+        if now - last_heartbeat > HEARTBEAT_TIMEOUT_SEC / 3:
+            queue.heartbeat(worker_id)
+            last_heartbeat = now
+        if index == 0 and now - last_maintenance > 60:
+            queue.requeue_stale()
+            queue.purge_finished()
+            last_maintenance = now
+        if not process_one(queue, worker_id, _PIPELINE):
+            time.sleep(poll_interval)
+        else:
+            # 長時間工作結束後立即補一次心跳
+            queue.heartbeat(worker_id)
+            last_heartbeat = time.time()
+
+
+def run_workers(n_workers, queue_dir=QUEUE_DIR, model_path=DEFAULT_MODEL_PATH, poll_interval=POLL_INTERVAL_SEC):
+    """主行程載入模型一次後 fork 出 n_workers 個 worker"""
+    load_active_model(model_path)
+
+    # 把目前所有物件移出 GC 追蹤範圍，避免 fork 後 GC 掃描觸發 copy-on-write 複製
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    processes = [ctx.Process(target=_worker_loop, args=(i, queue_dir, model_path, poll_interval), daemon=True)
+                 for i in range(n_workers)]
+    for p in processes:
+        p.start()
+    print(f"🚀 {n_workers} workers started (queue: {queue_dir})")
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        print("🛑 Stopping workers...")
+        for p in processes:
+            p.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Background prediction / SHAP workers")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument('--queue-dir', default=QUEUE_DIR)
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH,
+                        help="fallback model path without .pkl (used only when the registry is empty)")
+    args = parser.parse_args()
+    # 每個 worker 寫自己的 reports/logs/job_queue-<pid>.log，PyCaret / CatBoost 只留警告
+    configure_logging('job_queue', profile='scoring')
+    run_workers(args.workers, args.queue_dir, args.model)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+"""
+多使用者壓力測試 (Concurrent-User Load Test)
+
+在本機啟動真正的 Streamlit server (`streamlit run app.py`)，以 N 個 websocket 客戶端模擬同時在線的工程師。
+每個客戶端和瀏覽器一樣送出 rerun 請求 (含 widget 狀態)，等到 script_finished 才算完成一個動作：
+    open -> upload (範例資料) -> [Run Prediction -> 漂移檢視 -> SHAP 分組 -> 換 SHAP 晶圓] x iterations
+Streamlit 的分頁切換只在瀏覽器端發生、不會觸發 rerun，因此以「在各分頁中操作 widget」模擬。
+
+測試資料為合成資料 (依訓練界限 / 原始資料抽樣加雜訊產生)，以 YIELD_SAMPLE_DATA 指給 server。
+逐步提高同時在線人數，輸出每個動作的延遲百分位數、吞吐量與 server 行程 RSS：
+    reports/load_test.csv、reports/load_test.md
+
+用法:
+    python load_test.py --levels 1,2,4,8 --iterations 3
+    python load_test.py --levels 4 --rows 500 --think-time 0.5 --keep-prediction-cache
+    python load_test.py --url ws://127.0.0.1:8501 --server-pid 12345   # 測試已在執行中的 server
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import current_rss_bytes
+
+APP_PATH = 'app.py'
+REPORT_CSV = 'reports/load_test.csv'
+REPORT_MD = 'reports/load_test.md'
+DEFAULT_PORT = 8765
+RUN_TIMEOUT_SEC = 600
+SERVER_START_TIMEOUT_SEC = 120
+PERCENTILES = (50, 90, 95, 99)
+RSS_SAMPLE_SEC = 0.2
+
+
+class SkipAction(Exception):
+    """畫面上沒有這個動作需要的 widget (例如尚未建立 SHAP store)"""
+
+
+def make_synthetic_data(n_rows, feature_names, bounds=None, source=None, random_state=0):
+    """
+    產生合成晶圓資料
+    - source: 原始資料 DataFrame，抽樣後加上各感測器標準差 5% 的雜訊 (每列都不同，不會命中預測快取)
+    - bounds: SensorBounds，在訓練資料範圍內均勻抽樣，並依訓練時的缺值率放入 NaN
+    - 都沒有時使用標準常態分佈
+    """
+    rng = np.random.default_rng(random_state)
+    if source is not None:
+        base = source[feature_names].sample(n=n_rows, replace=True, random_state=random_state)
+        noise = rng.normal(size=base.shape) * base.std().fillna(0).to_numpy() * 0.05
+        return (base + noise).reset_index(drop=True)
+    if bounds is not None:
+        from input_validation import RANGE_MARGIN
+        finite = np.isfinite(bounds.low) & np.isfinite(bounds.high)
+        center = np.where(finite, (bounds.low + bounds.high) / 2, 0.0)
+        # 界限含 RANGE_MARGIN 容許範圍，還原成訓練資料本身的範圍
+        half = np.where(finite, (bounds.high - bounds.low) / (2 * (1 + 2 * RANGE_MARGIN)), 1.0)
+        X = center + rng.uniform(-1, 1, size=(n_rows, len(feature_names))) * half
+        X[rng.random(X.shape) < bounds.nan_rate] = np.nan
+        return pd.DataFrame(X, columns=bounds.feature_names)[feature_names]
+    return pd.DataFrame(rng.normal(size=(n_rows, len(feature_names))), columns=feature_names)
+
+
+def start_server(app_path, port=DEFAULT_PORT, env=None, timeout=SERVER_START_TIMEOUT_SEC):
+    """以子行程啟動 streamlit server，等 /_stcore/health 回應後回傳 Popen"""
+    cmd = [sys.executable, '-m', 'streamlit', 'run', app_path,
+           '--server.headless', 'true', '--server.port', str(port),
+           '--server.enableXsrfProtection', 'false', '--browser.gatherUsageStats', 'false']
+    process = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"streamlit exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as r:
+                if r.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise TimeoutError(f"streamlit did not become healthy on port {port} within {timeout} s")
+
+
+class ServerSession:
+    """
+    一個模擬使用者：透過 websocket 與 server 溝通 (與瀏覽器相同的 BackMsg / ForwardMsg 協定)
+    客戶端保存自己設定過的 widget 值，每次 rerun 都一併送出 (瀏覽器的行為也是如此)
+    """
+
+    def __init__(self, url, timeout=RUN_TIMEOUT_SEC, random_state=0):
+        self.url = url.rstrip('/') + '/_stcore/stream'
+        self.timeout = timeout
+        self.rng = np.random.default_rng(random_state)
+        self.values = {}
+        self.widgets = {}
+        self._connection = None
+        self.ws = None
+
+    def __enter__(self):
+        from websockets.sync.client import connect
+        self._connection = connect(self.url, subprotocols=['streamlit'], max_size=None,
+                                   open_timeout=self.timeout)
+        self.ws = self._connection.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._connection.__exit__(*exc)
+
+    def rerun(self, trigger=None):
+        """送出 rerun 並讀取回應直到 script_finished；記錄本次畫面上的 widget"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.page_script_hash = ''
+        for state in list(self.values.values()) + ([trigger] if trigger is not None else []):
+            msg.rerun_script.widget_states.widgets.add().CopyFrom(state)
+        self.ws.send(msg.SerializeToString())
+
+        widgets, error = {}, None
+        deadline = time.monotonic() + self.timeout
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(self.ws.recv(timeout=max(deadline - time.monotonic(), 0.001)))
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_kind = element.WhichOneof('type')
+                if element_kind == 'exception' and error is None:
+                    error = f"{element.exception.type}: {element.exception.message}"
+                proto = getattr(element, element_kind)
+                label = getattr(proto, 'label', None)
+                if getattr(proto, 'id', '') and label is not None:
+                    widgets.setdefault(label, (element_kind, proto))
+            elif kind == 'script_finished':
+                # FINISHED_EARLY_FOR_RERUN 表示被新的 rerun 取代，繼續等待
+                if forward.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                if forward.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    error = error or 'script compile error'
+                break
+        self.widgets = widgets
+        # 畫面上已不存在的 widget 不再送出
+        live_ids = {proto.id for _, proto in widgets.values()}
+        self.values = {k: v for k, v in self.values.items() if k in live_ids}
+        if error:
+            raise RuntimeError(error)
+
+    def _find(self, kind, label_prefix):
+        for label, (element_kind, proto) in self.widgets.items():
+            if element_kind == kind and label.startswith(label_prefix):
+                return proto
+        raise SkipAction(f"{kind} '{label_prefix}' not on the page")
+
+    def _set(self, proto, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        state = WidgetState(id=proto.id, **value)
+        self.values[proto.id] = state
+        self.rerun()
+
+    def open(self):
+        self.rerun()
+
+    def upload(self):
+        self._set(self._find('checkbox', 'Use Sample Data'), bool_value=True)
+
+    def run_prediction(self):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        button = self._find('button', '🚀 Run Prediction')
+        self.rerun(trigger=WidgetState(id=button.id, trigger_value=True))
+
+    def drift_view(self):
+        from streamlit.proto.Common_pb2 import DoubleArray
+        slider = self._find('slider', 'Number of sensors to show')
+        value = float(self.rng.integers(int(slider.min), int(slider.max) + 1))
+        self._set(slider, double_array_value=DoubleArray(data=[value]))
+
+    def shap_group(self):
+        radio = self._find('radio', 'Wafers:')
+        self._set(radio, string_value=str(self.rng.choice(list(radio.options))))
+
+    def select_wafer(self):
+        selectbox = self._find('selectbox', 'Select Wafer Index:')
+        self._set(selectbox, string_value=str(self.rng.choice(list(selectbox.options))))
+
+
+SETUP_FLOW = ('open', 'upload')
+LOOP_FLOW = ('run_prediction', 'drift_view', 'shap_group', 'select_wafer')
+
+
+def run_session(session, iterations, think_time, records, rng):
+    """依序執行一個使用者的流程，每個動作記錄 (action, latency, status)"""
+    flow = list(SETUP_FLOW) + list(LOOP_FLOW) * iterations
+    with session:
+        for action in flow:
+            start = time.perf_counter()
+            try:
+                getattr(session, action)()
+                status = 'ok'
+            except SkipAction:
+                status = 'skipped'
+            except Exception as e:
+                status = f"error: {type(e).__name__}: {e}"
+            records.append({'action': action, 'latency_sec': time.perf_counter() - start, 'status': status})
+            if status.startswith('error') and action in SETUP_FLOW:
+                return
+            if think_time > 0:
+                time.sleep(rng.exponential(think_time))
+
+
+def run_level(concurrency, session_factory, iterations=3, think_time=0.0, server_pid=None, random_state=0):
+    """
+    同時啟動 concurrency 個使用者，等全部完成
+    Returns:
+        (records DataFrame, elapsed_sec, 期間 server RSS 峰值 bytes)
+    """
+    records = []
+    peak = [current_rss_bytes(server_pid)]
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(RSS_SAMPLE_SEC):
+            peak[0] = max(peak[0], current_rss_bytes(server_pid))
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    threads = []
+    for i in range(concurrency):
+        rng = np.random.default_rng(random_state + i)
+        t = threading.Thread(target=run_session, args=(session_factory(i), iterations, think_time, records, rng),
+                             name=f'load-user-{i}')
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    peak[0] = max(peak[0], current_rss_bytes(server_pid))
+    return pd.DataFrame(records, columns=['action', 'latency_sec', 'status']), elapsed, peak[0]
+
+
+def summarize(records, concurrency, elapsed, rss_bytes):
+    """每個動作的延遲百分位數 (ms)；另加一列 ALL 表示整體"""
+    rows = []
+    ok = records[records['status'] == 'ok']
+    for action, group in [('ALL', records)] + list(records.groupby('action', sort=False)):
+        latencies = ok.loc[ok['action'] == action, 'latency_sec'] if action != 'ALL' else ok['latency_sec']
+        row = {
+            'concurrency': concurrency,
+            'action': action,
+            'count': int(len(latencies)),
+            'errors': int(group['status'].str.startswith('error').sum()),
+            'skipped': int((group['status'] == 'skipped').sum()),
+        }
+        for p in PERCENTILES:
+            row[f'p{p}_ms'] = round(float(np.percentile(latencies, p)) * 1000, 1) if len(latencies) else np.nan
+        row['max_ms'] = round(float(latencies.max()) * 1000, 1) if len(latencies) else np.nan
+        row['throughput_per_sec'] = round(len(latencies) / max(elapsed, 1e-9), 2)
+        row['rss_mb'] = round(rss_bytes / 1e6, 1)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_report(summary, path_csv=REPORT_CSV, path_md=REPORT_MD, settings=None):
+    os.makedirs(os.path.dirname(path_csv) or '.', exist_ok=True)
+    summary.to_csv(path_csv, index=False)
+    overall = summary[summary['action'] == 'ALL']
+    lines = ["# Load Test Report", ""]
+    if settings:
+        lines += [f"- {k}: {v}" for k, v in settings.items()] + [""]
+    lines += ["| Users | Actions/s | p50 (ms) | p95 (ms) | p99 (ms) | Errors | Peak server RSS (MB) |",
+              "| ---: | ---: | ---: | ---: | ---: | ---: | ---: |"]
+    for _, r in overall.iterrows():
+        lines.append(f"| {r['concurrency']} | {r['throughput_per_sec']} | {r['p50_ms']} | {r['p95_ms']} | "
+                     f"{r['p99_ms']} | {r['errors']} | {r['rss_mb']} |")
+    lines += ["", "## Per-action latency", "",
+              "| Users | Action | Count | p50 (ms) | p95 (ms) | Max (ms) | Skipped |",
+              "| ---: | :--- | ---: | ---: | ---: | ---: | ---: |"]
+    for _, r in summary[summary['action'] != 'ALL'].iterrows():
+        lines.append(f"| {r['concurrency']} | {r['action']} | {r['count']} | {r['p50_ms']} | {r['p95_ms']} | "
+                     f"{r['max_ms']} | {r['skipped']} |")
+    with open(path_md, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def prepare_sample_data(n_rows, path):
+    """依目前的特徵清單產生合成資料 CSV，並回傳路徑"""
+    import pickle
+    from input_validation import SensorBounds, DEFAULT_BOUNDS_PATH
+
+    with open('required_features.pkl', 'rb') as f:
+        feature_names = pickle.load(f)
+    source = pd.read_csv('data/secom_processed.csv') if os.path.exists('data/secom_processed.csv') else None
+    bounds = SensorBounds.load(DEFAULT_BOUNDS_PATH) if os.path.exists(DEFAULT_BOUNDS_PATH) else None
+    make_synthetic_data(n_rows, feature_names, bounds=bounds, source=source).to_csv(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a local app.py server with concurrent simulated sessions")
+    parser.add_argument('--levels', default='1,2,4,8', help="comma-separated numbers of concurrent users")
+    parser.add_argument('--iterations', type=int, default=3, help="prediction/interaction loops per user")
+    parser.add_argument('--rows', type=int, default=100, help="wafers per simulated upload")
+    parser.add_argument('--think-time', type=float, default=0.0, help="mean pause between actions (s)")
+    parser.add_argument('--app', default=APP_PATH)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--url', default=None, help="use an already running server instead of starting one")
+    parser.add_argument('--server-pid', type=int, default=None, help="pid of --url server for RSS sampling")
+    parser.add_argument('--keep-prediction-cache', action='store_true',
+                        help="let repeated uploads hit the prediction cache (disabled by default)")
+    args = parser.parse_args()
+    levels = [int(x) for x in args.levels.split(',') if x.strip()]
+
+    server = None
+    url, server_pid = args.url, args.server_pid
+    if url is None:
+        sample_path = os.path.join(tempfile.mkdtemp(prefix='yield-load-'), 'synthetic_wafers.csv')
+        prepare_sample_data(args.rows, sample_path)
+        print(f"🧪 Synthetic upload: {args.rows} wafers -> {sample_path}")
+        env = dict(os.environ, YIELD_SAMPLE_DATA=sample_path, YIELD_SAMPLE_ROWS=str(args.rows))
+        if not args.keep_prediction_cache:
+            env['YIELD_PREDICTION_CACHE_SIZE'] = '0'
+        print(f"🚀 Starting streamlit on port {args.port}...")
+        server = start_server(args.app, args.port, env=env)
+        url, server_pid = f"ws://127.0.0.1:{args.port}", server.pid
+
+    try:
+        # 先跑一次暖機 (載入模型、建立快取)，不列入統計
+        print("🔥 Warming up the app...")
+        warm, _, _ = run_level(1, lambda i: ServerSession(url, random_state=10_000), iterations=1)
+        errors = warm[warm['status'].str.startswith('error')]
+        if not errors.empty:
+            raise SystemExit(f"❌ Warm-up failed: {errors['status'].iloc[0]}")
+
+        summaries = []
+        for level in levels:
+            print(f"👥 {level} concurrent users x {args.iterations} iterations...")
+            records, elapsed, rss = run_level(level, lambda i: ServerSession(url, random_state=i),
+                                              iterations=args.iterations, think_time=args.think_time,
+                                              server_pid=server_pid)
+            summary = summarize(records, level, elapsed, rss)
+            overall = summary.iloc[0]
+            print(f"   -> {overall['throughput_per_sec']} actions/s, p95 {overall['p95_ms']} ms, "
+                  f"errors {overall['errors']}, server RSS {overall['rss_mb']} MB")
+            summaries.append(summary)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    settings = {'Rows per upload': args.rows, 'Iterations per user': args.iterations,
+                'Think time (s)': args.think_time, 'Prediction cache': args.keep_prediction_cache}
+    write_report(pd.concat(summaries, ignore_index=True), settings=settings)
+    print(f"📄 Report saved to {REPORT_MD} / {REPORT_CSV}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""
+非阻塞 log 設定 (Queue-Based Logging)
+
+所有 log 先經過 QueueHandler 放進有上限的佇列，由背景執行緒 (QueueListener) 寫入檔案，
+熱路徑上只剩一次 put_nowait；佇列滿時直接丟棄並計數，不會讓預測等待磁碟。
+
+- 檔案: reports/logs/<name>.log，超過大小時輪替並以 gzip 壓縮 (<name>.log.1.gz ...)
+- 各模組 verbosity: YIELD_LOG_LEVELS="pycaret=ERROR,catboost=ERROR,yield.stage=INFO"
+- 取樣: YIELD_LOG_SAMPLE="pycaret=0.01" 表示 pycaret 的 INFO 以下每 100 筆只留 1 筆 (WARNING 以上全部保留)
+- 每筆 log 帶有所在階段 (instrumentation.stage)，階段結束時另記一筆耗時 (logger: yield.stage)
+- PyCaret 原本直接寫 logs.log；pycaret_logger() 把它導進同一個佇列 (setup(system_log=pycaret_logger()))
+- fork 出來的 worker 會在子行程重新啟動自己的寫入執行緒 (<name>-<pid>.log)
+
+用法:
+    from log_config import configure_logging, pycaret_logger
+    configure_logging('train_upgrade')                     # 訓練：PyCaret INFO
+    configure_logging('app', profile='scoring')            # 評分：PyCaret / CatBoost 只留警告
+    setup(data=df, target='label', system_log=pycaret_logger())
+"""
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+
+import instrumentation
+
+LOG_DIR = 'reports/logs'
+QUEUE_SIZE = 10000
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+LOG_FORMAT = '%(asctime)s %(levelname)s %(process)d %(name)s [%(stage)s] %(message)s'
+STAGE_LOGGER = 'yield.stage'
+
+# PyCaret 的 logger 名稱是 'logs' (設定 'pycaret' 時一併套用)
+PROFILES = {
+    # 訓練 / 報告腳本：保留 PyCaret 的進度紀錄
+    'training': {'logs': 'INFO', 'pycaret': 'INFO', 'catboost': 'WARNING', 'lightgbm': 'WARNING',
+                 'xgboost': 'WARNING', STAGE_LOGGER: 'INFO'},
+    # App / 批次評分 / worker：第三方套件只留警告，PyCaret 的 INFO 取樣 1%
+    'scoring': {'logs': 'WARNING', 'pycaret': 'WARNING', 'catboost': 'ERROR', 'lightgbm': 'ERROR',
+                'xgboost': 'WARNING', 'shap': 'WARNING', 'matplotlib': 'WARNING', STAGE_LOGGER: 'INFO'},
+}
+PROFILE_SAMPLING = {
+    'training': {},
+    'scoring': {'logs': 0.01, 'pycaret': 0.01},
+}
+
+_lock = threading.Lock()
+_state = None
+
+
+def parse_levels(text):
+    """'pycaret=ERROR,catboost=WARNING' -> {'pycaret': 'ERROR', 'catboost': 'WARNING'}"""
+    levels = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def parse_sampling(text):
+    """'pycaret=0.01' -> {'pycaret': 0.01}"""
+    return {name: float(rate) for name, rate in parse_levels(text).items()}
+
+
+def _expand(mapping):
+    """'pycaret' 同時套用到 PyCaret 實際使用的 'logs' logger"""
+    expanded = dict(mapping)
+    if 'pycaret' in mapping:
+        expanded.setdefault('logs', mapping['pycaret'])
+    return expanded
+
+
+class StageContextFilter(logging.Filter):
+    """在呼叫端執行緒補上 record.stage (所在的 instrumentation 階段)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'stage'):
+            record.stage = instrumentation.current_stage() or '-'
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    依 logger 名稱 (含上層名稱) 取樣 WARNING 以下的紀錄
+    rate=0.01 時每 100 筆保留第 1 筆 (計數式，不用亂數，結果可重現)
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = {name: rate for name, rate in rates.items() if rate < 1}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return name, self.rates[name]
+            name = name.rpartition('.')[0]
+        return None, 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        key, rate = self._rate(record.name)
+        if key is None:
+            return True
+        if rate <= 0:
+            return False
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % max(int(round(1 / rate)), 1) == 0
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """佇列滿時丟棄紀錄並計數，呼叫端永遠不會被阻塞"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _gzip_rotator(source, dest):
+    """輪替時壓縮舊檔 (在背景寫入執行緒執行)"""
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(path, max_bytes, backup_count):
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                   encoding='utf-8', delay=True)
+    handler.namer = lambda name: f"{name}.gz"
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+
+def _log_stage(name, seconds, rows, failed):
+    """instrumentation 階段結束時記錄耗時 (在呼叫端執行緒，只有一次 put_nowait)"""
+    logger = logging.getLogger(STAGE_LOGGER)
+    level = logging.WARNING if failed else logging.INFO
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s %s in %.1f ms (%d rows)", name, 'failed' if failed else 'done', seconds * 1000,
+                   rows, extra={'stage': name, 'stage_ms': round(seconds * 1000, 3), 'rows': rows})
+
+
+class _LoggingState:
+    """目前行程的佇列、寫入執行緒與設定 (fork 後在子行程重建)"""
+
+    def __init__(self, name, log_dir, profile, levels, sampling, console, queue_size, max_bytes, backup_count):
+        self.name = name
+        self.log_dir = log_dir
+        self.profile = profile
+        self.levels = levels
+        self.sampling = sampling
+        self.console = console
+        self.queue_size = queue_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pid = os.getpid()
+        self.path = None
+        self.handler = None
+        self.listener = None
+
+    def start(self, file_name):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.path = os.path.join(self.log_dir, file_name)
+        targets = [_file_handler(self.path, self.max_bytes, self.backup_count)]
+        if self.console:
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            targets.append(stream)
+        self.handler = DroppingQueueHandler(queue.Queue(self.queue_size))
+        self.handler.addFilter(StageContextFilter())
+        self.handler.addFilter(SamplingFilter(self.sampling))
+        self.listener = logging.handlers.QueueListener(self.handler.queue, *targets, respect_handler_level=True)
+        self.listener.start()
+
+        root = logging.getLogger()
+        for old in [h for h in root.handlers if isinstance(h, DroppingQueueHandler)]:
+            root.removeHandler(old)
+        root.addHandler(self.handler)
+
+    def stop(self):
+        if self.listener is None:
+            return
+        listener, self.listener = self.listener, None
+        listener.stop()
+        for target in listener.handlers:
+            target.close()
+        logging.getLogger().removeHandler(self.handler)
+
+
+def _after_fork_in_child():
+    """fork 後父行程的寫入執行緒不存在，子行程改寫自己的檔案"""
+    global _lock
+    # fork 當下其他執行緒可能正持有鎖，子行程只有一條執行緒，直接換一把新的
+    _lock = threading.Lock()
+    state = _state
+    if state is None or state.listener is None or state.pid == os.getpid():
+        return
+    # 父行程的 listener 物件在子行程沒有執行緒，不需要 stop
+    state.listener = None
+    state.pid = os.getpid()
+    base, ext = os.path.splitext(os.path.basename(state.path))
+    state.start(f"{base}-{os.getpid()}{ext}")
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def configure_logging(name='yield', profile='training', log_dir=None, levels=None, sampling=None, console=False,
+                      queue_size=QUEUE_SIZE, max_bytes=None, backup_count=None):
+    """
+    設定目前行程的非阻塞 logging (同一行程重複呼叫只會生效一次；App 每次 rerun 都可以呼叫)
+    Args:
+        name: log 檔名 (reports/logs/<name>.log)
+        profile: 'training' 或 'scoring' (預設的各模組 level 與取樣)
+        levels / sampling: 額外覆寫，環境變數 YIELD_LOG_LEVELS / YIELD_LOG_SAMPLE 優先
+        console: 同時輸出到 stderr (也由背景執行緒寫出)
+    Returns:
+        log 檔路徑
+    """
+    global _state
+    with _lock:
+        if _state is not None and _state.listener is not None:
+            return _state.path
+        merged_levels = _expand({**PROFILES[profile], **(levels or {}),
+                                 **parse_levels(os.environ.get('YIELD_LOG_LEVELS'))})
+        merged_sampling = _expand({**PROFILE_SAMPLING[profile], **(sampling or {}),
+                                   **parse_sampling(os.environ.get('YIELD_LOG_SAMPLE'))})
+        state = _LoggingState(
+            name,
+            log_dir or os.environ.get('YIELD_LOG_DIR', LOG_DIR),
+            profile, merged_levels, merged_sampling, console, queue_size,
+            max_bytes or int(float(os.environ.get('YIELD_LOG_MAX_MB', MAX_BYTES / 1024 / 1024)) * 1024 * 1024),
+            backup_count if backup_count is not None else int(os.environ.get('YIELD_LOG_BACKUPS', BACKUP_COUNT)),
+        )
+        root = logging.getLogger()
+        if root.level == logging.WARNING:  # 未設定過時預設為 WARNING，放寬給我們自己的 INFO 紀錄
+            root.setLevel(logging.INFO)
+        for logger_name, level in merged_levels.items():
+            logging.getLogger(logger_name).setLevel(level)
+        state.start(f"{name}.log")
+        _state = state
+        instrumentation.add_stage_listener(_log_stage)
+    pycaret_logger()
+    return state.path
+
+
+def shutdown():
+    """把佇列中剩下的紀錄寫完並關閉檔案 (行程結束時自動呼叫)"""
+    global _state
+    with _lock:
+        state, _state = _state, None
+    instrumentation.remove_stage_listener(_log_stage)
+    if state is not None:
+        if state.handler is not None and state.handler.dropped:
+            sys.stderr.write(f"⚠️ {state.handler.dropped} log records were dropped (queue full)\n")
+        state.stop()
+
+
+atexit.register(shutdown)
+
+
+def dropped_records():
+    """因佇列滿而丟棄的紀錄數"""
+    state = _state
+    return state.handler.dropped if state is not None and state.handler is not None else 0
+
+
+def pycaret_logger():
+    """
+    PyCaret 使用的 logger ('logs')：移除它自己加的 logs.log FileHandler，改由 root 的佇列寫出
+    傳給 setup(system_log=...) 時 PyCaret 不會再建立新的檔案
+    """
+    logger = logging.getLogger('logs')
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.FileHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    logger.propagate = True
+    return logger
+
+
+def disable_catboost_files():
+    """
+    讓 compare_models / create_model 建立的 CatBoost 不再每次訓練重寫 catboost_info/
+    PyCaret 沒有公開 CatBoost 的預設參數，只能修改 setup() 之後的模型容器；版本不符時回傳 False
+    """
+    try:
+        from pycaret.classification import functional
+        experiment = functional._CURRENT_EXPERIMENT
+        changed = False
+        for models in (experiment._all_models, experiment._all_models_internal):
+            container = models.get('catboost')
+            if container is not None:
+                container.args['allow_writing_files'] = False
+                changed = True
+        return changed
+    except Exception:
+        return False
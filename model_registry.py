@@ -0,0 +1,259 @@
+"""
+本機模型版本庫 (Model Registry)
+
+output/model_registry/
+    ACTIVE                      <- 目前使用中的版本 (以 os.replace 原子更新)
+    v0001-3fa2c81b/
+        model.pkl               <- PyCaret Pipeline
+        manifest.json           <- sha256、建立時間、來源、訓練資訊
+
+- 以內容 sha256 去重：同一份模型重複登錄只會得到同一個版本
+- App 端的 ModelHandle 會在背景偵測 ACTIVE 變更，載入新版本並暖機後再原子替換，不需重啟
+
+用法:
+    python model_registry.py register output/final_yield_prediction_model.pkl --activate
+    python model_registry.py list
+    python model_registry.py activate v0002-1b9e0c77
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+
+REGISTRY_DIR = 'output/model_registry'
+LEGACY_MODEL_PATH = 'output/final_yield_prediction_model'
+POLL_INTERVAL_SEC = 10
+WARMUP_ROWS = 32
+
+
+def file_sha256(path, block_size=1 << 20):
+    """計算檔案 sha256 (分段讀取，不會一次載入整個檔案)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_text_atomic(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """版本化、內容雜湊的模型庫"""
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+        self.active_file = os.path.join(root, 'ACTIVE')
+
+    def list_versions(self):
+        """所有版本的 manifest (依版本號排序)"""
+        if not os.path.isdir(self.root):
+            return []
+        manifests = []
+        for name in sorted(os.listdir(self.root)):
+            manifest_path = os.path.join(self.root, name, 'manifest.json')
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+        return manifests
+
+    def get(self, version):
+        with open(os.path.join(self.root, version, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def model_path(self, version):
+        """給 PyCaret load_model 用的路徑 (不含 .pkl)"""
+        return os.path.join(self.root, version, 'model')
+
+    def register(self, pkl_path, source=None, metadata=None, activate=False):
+        """
+        登錄模型檔；相同內容已存在時直接回傳既有版本
+        Returns:
+            version (str)
+        """
+        sha = file_sha256(pkl_path)
+        for manifest in self.list_versions():
+            if manifest['sha256'] == sha:
+                if activate:
+                    self.activate(manifest['version'])
+                return manifest['version']
+
+        os.makedirs(self.root, exist_ok=True)
+        version = f"v{len(self.list_versions()) + 1:04d}-{sha[:8]}"
+        manifest = {
+            'version': version,
+            'sha256': sha,
+            'size_bytes': os.path.getsize(pkl_path),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'source': source or os.path.abspath(pkl_path),
+            'metadata': metadata or {},
+        }
+
+        # 先寫到暫存資料夾，完成後再整個改名，避免讀到寫一半的版本
+        staging = os.path.join(self.root, f".staging-{version}-{os.getpid()}")
+        os.makedirs(staging)
+        shutil.copyfile(pkl_path, os.path.join(staging, 'model.pkl'))
+        with open(os.path.join(staging, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(staging, os.path.join(self.root, version))
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def active_version(self):
+        """目前使用中的版本；尚未設定時回傳 None"""
+        try:
+            with open(self.active_file, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def activate(self, version):
+        """切換使用中的版本 (原子寫入 ACTIVE 指標)"""
+        if not os.path.exists(os.path.join(self.root, version, 'model.pkl')):
+            raise ValueError(f"Unknown model version: {version}")
+        _write_text_atomic(self.active_file, version)
+
+    def verify(self, version):
+        """確認模型檔內容與 manifest 的 sha256 一致"""
+        return file_sha256(self.model_path(version) + '.pkl') == self.get(version)['sha256']
+
+    def resolve(self, fallback_path=LEGACY_MODEL_PATH):
+        """
+        取得要載入的 (版本, 路徑)
+        版本庫為空時退回舊的固定路徑，版本名稱標示為 legacy-<修改時間>
+        """
+        version = self.active_version()
+        if version is not None:
+            return version, self.model_path(version)
+        if fallback_path and os.path.exists(fallback_path + '.pkl'):
+            return f"legacy-{os.path.getmtime(fallback_path + '.pkl'):.0f}", fallback_path
+        return None, None
+
+
+def model_feature_names(pipeline):
+    """取得模型輸入的感測器欄位名稱"""
+    names = getattr(pipeline, 'feature_names_in_', None)
+    if names is None:
+        from utils import load_feature_config
+        names = load_feature_config()
+    return [c for c in names if c != 'label']
+
+
+def warm_up(pipeline, n_rows=WARMUP_ROWS):
+    """用一批合成資料 (全 0) 跑一次預測，讓新模型在切換前完成延遲初始化"""
+    import numpy as np
+    import pandas as pd
+    from ensemble import predict_frame
+
+    columns = model_feature_names(pipeline)
+    synthetic = pd.DataFrame(np.zeros((n_rows, len(columns))), columns=columns)
+    predict_frame(pipeline, data=synthetic)
+
+
+class ModelHandle:
+    """
+    持有目前使用中的模型
+    背景執行緒定期檢查 ACTIVE 指標，發現新版本時先載入並暖機，成功後才原子替換；
+    過程中 current() 一直回傳舊模型，使用者不會遇到空窗或冷啟動。
+    """
+
+    def __init__(self, registry, loader, warmup=None, fallback_path=LEGACY_MODEL_PATH,
+                 poll_interval=POLL_INTERVAL_SEC):
+        self.registry = registry
+        self.loader = loader
+        self.warmup = warmup
+        self.fallback_path = fallback_path
+        self.poll_interval = poll_interval
+        self._current = (None, None)
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._failed_version = None
+        self.last_error = None
+
+    def current(self):
+        """回傳 (version, pipeline)；tuple 一次替換，讀取端不需加鎖"""
+        return self._current
+
+    def refresh(self):
+        """若 ACTIVE 版本有變，載入、暖機並替換；有替換時回傳 True"""
+        with self._refresh_lock:
+            version, path = self.registry.resolve(self.fallback_path)
+            if version is None or version in (self._current[0], self._failed_version):
+                return False
+            try:
+                pipeline = self.loader(path)
+                if self.warmup is not None:
+                    self.warmup(pipeline)
+            except Exception as e:
+                # 新版本有問題時保留舊模型繼續服務
+                self._failed_version = version
+                self.last_error = f"{version}: {type(e).__name__}: {e}"
+                traceback.print_exc()
+                return False
+            self._current = (version, pipeline)
+            self.last_error = None
+            return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.refresh()
+
+    def start(self):
+        """啟動背景監看執行緒 (只會啟動一次)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='model-hot-swap', daemon=True)
+            self._thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local model registry")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_reg = sub.add_parser('register', help="register a model .pkl")
+    p_reg.add_argument('path')
+    p_reg.add_argument('--activate', action='store_true')
+    p_reg.add_argument('--note', default=None)
+
+    sub.add_parser('list', help="list registered versions")
+
+    p_act = sub.add_parser('activate', help="switch the active version")
+    p_act.add_argument('version')
+
+    p_ver = sub.add_parser('verify', help="check model file hashes")
+    p_ver.add_argument('version', nargs='?')
+
+    args = parser.parse_args()
+    registry = ModelRegistry()
+
+    if args.command == 'register':
+        metadata = {'note': args.note} if args.note else None
+        version = registry.register(args.path, metadata=metadata, activate=args.activate)
+        print(f"✅ Registered {args.path} as {version}" + (" (active)" if args.activate else ""))
+    elif args.command == 'list':
+        active = registry.active_version()
+        for m in registry.list_versions():
+            marker = '*' if m['version'] == active else ' '
+            print(f"{marker} {m['version']}  {m['created_at']}  {m['size_bytes'] / 1e6:.1f} MB  {m['source']}")
+    elif args.command == 'activate':
+        registry.activate(args.version)
+        print(f"✅ Active model is now {args.version}")
+    elif args.command == 'verify':
+        versions = [args.version] if args.version else [m['version'] for m in registry.list_versions()]
+        for v in versions:
+            print(f"{'✅' if registry.verify(v) else '❌'} {v}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+預算制的 Successive Halving 模型搜尋 (取代完整的 compare_models)
+
+compare_models 會對每個模型都跑完整的 10-fold CV，大部分時間花在明顯不好的模型上。
+這裡改成分輪淘汰：
+    1. 候選 = PyCaret 模型庫中的每個模型 × 預設參數與從 Tune Grid 抽樣的幾組參數
+    2. 第一輪用少量資料、少量 fold 評估全部候選，只保留前 1/eta 名晉級
+    3. 每一輪資料量乘上 eta、fold 數增加，直到剩下 n_finalists 個
+    4. 決賽者才用 create_model 跑完整 CV，輸出與 compare_models 相同格式的比較表
+每輪的候選以 joblib 平行評估；超過 budget_sec 時停止晉級，直接以目前的領先者進入決賽。
+
+每個候選都在 PyCaret 的前處理 pipeline (含 fix_imbalance) 後面接上模型，
+因此 SMOTE 等步驟只會在每個 fold 的訓練資料上執行，與 compare_models 的評估方式一致。
+"""
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import ParameterSampler, StratifiedKFold, cross_val_score, train_test_split
+
+ETA = 3
+MIN_ROWS = 300
+MIN_FOLDS = 2
+MAX_FOLDS = 5
+N_CONFIGS = 3
+N_FINALISTS = 3
+LOG_COLUMNS = ['rung', 'id', 'config', 'rows', 'folds', 'score', 'fit_sec', 'error', 'params']
+
+
+def _with_estimator(pipeline, estimator):
+    """把模型接在 (未 fit 的) 前處理 pipeline 後面"""
+    if pipeline is None:
+        return clone(estimator)
+    model = clone(pipeline)
+    model.steps.append(('actual_estimator', clone(estimator)))
+    return model
+
+
+def evaluate_candidate(candidate, X, y, pipeline, scoring, folds, random_state):
+    """以 StratifiedKFold 評估單一候選；失敗時回傳 NaN 與錯誤訊息"""
+    start = time.perf_counter()
+    try:
+        cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=random_state)
+        scores = cross_val_score(_with_estimator(pipeline, candidate['estimator']), X, y,
+                                 cv=cv, scoring=scoring, error_score='raise')
+        score, error = float(np.nanmean(scores)), None
+    except Exception as e:
+        score, error = float('nan'), f"{type(e).__name__}: {e}"
+    return score, time.perf_counter() - start, error
+
+
+def rung_schedule(n_candidates, n_rows, eta=ETA, min_rows=MIN_ROWS, min_folds=MIN_FOLDS,
+                  max_folds=MAX_FOLDS, n_finalists=N_FINALISTS):
+    """
+    每一輪的 (資料筆數, fold 數)
+    輪數 = 把候選數以 eta 倍率淘汰到 n_finalists 所需的次數
+    """
+    n_rungs = max(1, math.ceil(math.log(max(n_candidates / n_finalists, 1), eta)))
+    schedule = []
+    for rung in range(n_rungs):
+        rows = int(n_rows * eta ** -(n_rungs - rung))
+        rows = min(n_rows, max(rows, min_rows))
+        folds = min_folds + round((max_folds - min_folds) * rung / max(n_rungs - 1, 1))
+        schedule.append((rows, folds))
+    return schedule
+
+
+def halving_search(candidates, X, y, scoring, pipeline=None, eta=ETA, min_rows=MIN_ROWS,
+                   min_folds=MIN_FOLDS, max_folds=MAX_FOLDS, n_finalists=N_FINALISTS,
+                   budget_sec=None, n_jobs=-1, random_state=123):
+    """
+    Successive halving
+    Args:
+        candidates: [{'id', 'config', 'estimator', 'params'}, ...]
+        scoring: sklearn scorer (名稱或 callable)，分數越高越好
+    Returns:
+        (finalists, log DataFrame)
+    """
+    start = time.perf_counter()
+    y = pd.Series(np.asarray(y), index=X.index)
+    schedule = rung_schedule(len(candidates), len(X), eta, min_rows, min_folds, max_folds, n_finalists)
+    batch_size = max(1, (n_jobs if n_jobs > 0 else (os.cpu_count() or 1)) * 2)
+
+    survivors = list(candidates)
+    log_rows = []
+    for rung, (rows, folds) in enumerate(schedule):
+        if len(survivors) <= n_finalists:
+            break
+        if rows < len(X):
+            X_rung, _, y_rung, _ = train_test_split(X, y, train_size=rows, stratify=y,
+                                                    random_state=random_state + rung)
+        else:
+            X_rung, y_rung = X, y
+
+        scored = []
+        for offset in range(0, len(survivors), batch_size):
+            if budget_sec is not None and time.perf_counter() - start > budget_sec:
+                break
+            batch = survivors[offset:offset + batch_size]
+            results = Parallel(n_jobs=n_jobs)(
+                delayed(evaluate_candidate)(c, X_rung, y_rung, pipeline, scoring, folds, random_state)
+                for c in batch)
+            for candidate, (score, fit_sec, error) in zip(batch, results):
+                scored.append((candidate, score))
+                log_rows.append({'rung': rung, 'id': candidate['id'], 'config': candidate['config'],
+                                 'rows': len(X_rung), 'folds': folds, 'score': score,
+                                 'fit_sec': round(fit_sec, 3), 'error': error,
+                                 'params': repr(candidate['params'])})
+
+        # 依分數排序 (NaN 最後)；超過預算時尚未評估的候選保留前一輪的順序排在後面
+        scored.sort(key=lambda item: -np.inf if np.isnan(item[1]) else item[1], reverse=True)
+        evaluated = [c for c, _ in scored]
+        pending = survivors[len(scored):]
+        keep = max(n_finalists, math.ceil(len(survivors) / eta))
+        survivors = (evaluated + pending)[:keep]
+        if pending:
+            print(f"   ⏱️ Search budget of {budget_sec}s reached during rung {rung}; promoting current leaders")
+            break
+
+    # 每個模型只保留最好的一組參數進入決賽 (比較表每個模型一列，與 compare_models 相同)
+    finalists, seen = [], set()
+    for candidate in survivors:
+        if candidate['id'] not in seen:
+            finalists.append(candidate)
+            seen.add(candidate['id'])
+    return finalists[:n_finalists], pd.DataFrame(log_rows, columns=LOG_COLUMNS)
+
+
+def pycaret_candidates(include=None, n_configs=N_CONFIGS, random_state=123):
+    """
+    由 PyCaret 模型庫建立候選：預設參數 + 從 Tune Grid 抽樣的 (n_configs - 1) 組參數
+    需先執行 setup()
+    """
+    from pycaret.classification import models
+
+    library = models(internal=True)
+    if include is None:
+        library = library[library['Turbo']]
+    else:
+        library = library.loc[include]
+
+    candidates = []
+    for model_id, row in library.iterrows():
+        base_args = dict(row['Args'])
+        candidates.append({'id': model_id, 'name': row['Name'], 'config': 0,
+                           'estimator': row['Class'](**base_args), 'params': {}})
+        grid = row['Tune Grid'] or {}
+        if n_configs <= 1 or not grid:
+            continue
+        sampler = ParameterSampler(grid, n_iter=n_configs - 1, random_state=random_state)
+        for config, params in enumerate(sampler, start=1):
+            try:
+                estimator = row['Class'](**{**base_args, **params})
+            except Exception:
+                continue
+            candidates.append({'id': model_id, 'name': row['Name'], 'config': config,
+                               'estimator': estimator, 'params': params})
+    return candidates
+
+
+def search_models(include=None, sort='F1', n_configs=N_CONFIGS, n_finalists=N_FINALISTS,
+                  budget_sec=None, n_jobs=-1, log_path=None, **halving_kwargs):
+    """
+    在目前的 PyCaret setup 上執行 successive halving
+    Returns:
+        (best_model, comparison DataFrame)
+        comparison 的格式與 compare_models 後 pull() 相同 (index 為模型代號)，只包含決賽者
+    """
+    from pycaret.classification import create_model, get_config, get_metrics, pull
+
+    metrics = get_metrics()
+    scorer = metrics.set_index('Display Name').loc[sort, 'Scorer']
+    session_seed = get_config('seed')
+
+    candidates = pycaret_candidates(include, n_configs, random_state=session_seed)
+    print(f"   -> Successive halving over {len(candidates)} candidates "
+          f"({len(set(c['id'] for c in candidates))} models)")
+    finalists, log = halving_search(
+        candidates, get_config('X_train'), get_config('y_train'), scorer,
+        pipeline=get_config('pipeline'), n_finalists=n_finalists, budget_sec=budget_sec,
+        n_jobs=n_jobs, random_state=session_seed, **halving_kwargs)
+    if log_path:
+        log.to_csv(log_path, index=False)
+
+    # 決賽者以 create_model 跑完整 CV，分數與 compare_models 完全可比
+    rows, trained = [], []
+    for candidate in finalists:
+        start = time.perf_counter()
+        model = create_model(clone(candidate['estimator']), verbose=False)
+        scores = pull().loc['Mean']
+        row = {'Model': candidate['name'], **scores.to_dict(), 'TT (Sec)': round(time.perf_counter() - start, 2)}
+        rows.append(pd.Series(row, name=candidate['id']))
+        trained.append(model)
+
+    comparison = pd.DataFrame(rows)
+    order = np.argsort(-comparison[sort].to_numpy(), kind='stable')
+    comparison = comparison.iloc[order]
+    return trained[order[0]], comparison
@@ -0,0 +1,177 @@
+"""
+逐列預測快取 (Row-Level Prediction Cache)
+
+工程師一天內會重複上傳內容重疊的 CSV，同一片晶圓一再送進 predict_model。
+這裡以「感測器向量的 128-bit 雜湊 + 模型版本」為 key 快取每一列的預測結果：
+- 只有沒看過的列才送進模型，快取結果依原始輸入順序合併回去
+- 有上限的 LRU，超過 max_entries 淘汰最久沒用到的列
+- 可選擇存到磁碟 (npz)，App 重啟後仍可命中
+- 記錄命中率 (hits / lookups)
+
+雜湊只看模型實際使用的感測器欄位 (依固定順序)，多餘的欄位 (例如 wafer id、label) 不影響命中。
+"""
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+MAX_ENTRIES = 200_000
+SAVE_INTERVAL_SEC = 30.0
+PREDICTION_COLUMNS = ['prediction_label', 'prediction_score']
+# hash_pandas_object 的第二把 key，與預設 key 組合成 128-bit 雜湊
+_SECOND_HASH_KEY = 'yield-row-cache2'
+
+
+def row_hashes(data, feature_names):
+    """
+    每一列感測器向量的 128-bit 雜湊 (兩個 uint64)
+    欄位依 feature_names 對齊，缺少的欄位視為 NaN
+    """
+    frame = data.reindex(columns=feature_names).astype(np.float64)
+    low = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    high = pd.util.hash_pandas_object(frame, index=False, hash_key=_SECOND_HASH_KEY).to_numpy()
+    return low, high
+
+
+class PredictionCache:
+    """執行緒安全的 LRU 預測快取 (App 內所有 session 共用)"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, path=None, save_interval=SAVE_INTERVAL_SEC):
+        self.max_entries = max_entries
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path and os.path.exists(path):
+            self.load(path)
+        if path:
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def lookup(self, keys):
+        """回傳 (命中的位置, 命中的值, 未命中的位置)"""
+        hit_pos, hit_values, miss_pos = [], [], []
+        with self._lock:
+            for pos, key in enumerate(keys):
+                value = self._entries.get(key)
+                if value is None:
+                    miss_pos.append(pos)
+                else:
+                    self._entries.move_to_end(key)
+                    hit_pos.append(pos)
+                    hit_values.append(value)
+            self.hits += len(hit_pos)
+            self.misses += len(miss_pos)
+        return hit_pos, hit_values, miss_pos
+
+    def store(self, keys, values):
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+
+    def predict(self, data, model_version, feature_names, predict_fn):
+        """
+        只對快取未命中的列呼叫 predict_fn，結果依輸入順序合併
+        Args:
+            predict_fn: 接收未命中列的 DataFrame，回傳含 prediction_label / prediction_score 的 DataFrame
+        Returns:
+            (predictions DataFrame, 本次命中筆數)
+        """
+        with stage('prediction_cache_lookup', rows=len(data)):
+            low, high = row_hashes(data, feature_names)
+            keys = [(model_version, int(a), int(b)) for a, b in zip(low, high)]
+            hit_pos, hit_values, miss_pos = self.lookup(keys)
+
+        labels = np.empty(len(data), dtype=object)
+        scores = np.empty(len(data), dtype=np.float64)
+        if hit_pos:
+            labels[hit_pos] = [v[0] for v in hit_values]
+            scores[hit_pos] = [v[1] for v in hit_values]
+
+        if miss_pos:
+            # 同一批內重複的列只需預測一次
+            unique_keys = list(dict.fromkeys(keys[p] for p in miss_pos))
+            first_pos = {}
+            for p in miss_pos:
+                first_pos.setdefault(keys[p], p)
+            to_score = data.iloc[[first_pos[k] for k in unique_keys]]
+            scored = predict_fn(to_score)
+            new_values = list(zip(scored['prediction_label'].tolist(), scored['prediction_score'].tolist()))
+            self.store(unique_keys, new_values)
+            value_of = dict(zip(unique_keys, new_values))
+            labels[miss_pos] = [value_of[keys[p]][0] for p in miss_pos]
+            scores[miss_pos] = [value_of[keys[p]][1] for p in miss_pos]
+            self.maybe_save()
+
+        result = data.copy()
+        result['prediction_label'] = pd.Series(labels, index=data.index).infer_objects()
+        result['prediction_score'] = scores
+        return result, len(hit_pos)
+
+    def save(self, path=None):
+        """寫入磁碟 (先寫暫存檔再替換)"""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            items = list(self._entries.items())
+            self._dirty = False
+            self._last_save = time.monotonic()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path,
+                 versions=np.array([k[0] for k, _ in items], dtype=object),
+                 low=np.array([k[1] for k, _ in items], dtype=np.uint64),
+                 high=np.array([k[2] for k, _ in items], dtype=np.uint64),
+                 labels=np.array([v[0] for _, v in items], dtype=object),
+                 scores=np.array([v[1] for _, v in items], dtype=np.float64))
+        os.replace(tmp_path, path)
+
+    def maybe_save(self):
+        """距離上次寫入超過 save_interval 才寫入，避免每批都寫磁碟"""
+        if self.path and self._dirty and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def load(self, path):
+        with np.load(path, allow_pickle=True) as saved:
+            keys = zip(saved['versions'].tolist(), saved['low'].tolist(), saved['high'].tolist())
+            values = zip(saved['labels'].tolist(), saved['scores'].tolist())
+            entries = list(zip(keys, values))
+        with self._lock:
+            for key, value in entries[-self.max_entries:]:
+                self._entries[key] = value
+        self._last_save = time.monotonic()
+
+
+def from_env():
+    """依環境變數建立快取：YIELD_PREDICTION_CACHE_SIZE、YIELD_PREDICTION_CACHE_PATH (設定後才會存到磁碟)"""
+    return PredictionCache(max_entries=int(os.environ.get('YIELD_PREDICTION_CACHE_SIZE', MAX_ENTRIES)),
+                           path=os.environ.get('YIELD_PREDICTION_CACHE_PATH') or None)
@@ -0,0 +1,120 @@
+"""
+隨選效能剖析 (On-demand Profiling)
+
+用 cProfile 完整記錄一次 app.py rerun 或一次 make_batch_prediction 呼叫，
+輸出到 reports/profiles/：
+    - <時間>_<標籤>.prof      : 原始剖析資料 (可用 snakeviz / pstats 開啟)
+    - <時間>_<標籤>_top.txt   : 前 N 個熱點函式摘要 (可直接貼到 issue)
+
+觸發方式：
+    - 網址加上 ?profile=1 (只剖析該次 rerun)
+    - 或設定環境變數 YIELD_PROFILE=1 (每次 rerun / 批量預測都剖析)
+"""
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+PROFILE_DIR = 'reports/profiles'
+TOP_N = 30
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+_active = threading.local()
+
+
+def env_profiling_enabled():
+    return os.environ.get('YIELD_PROFILE', '0').lower() in _TRUE_VALUES
+
+
+def profiling_requested(query_value=None):
+    """查詢參數或環境變數任一開啟即回傳 True"""
+    if query_value is not None and str(query_value).lower() in _TRUE_VALUES:
+        return True
+    return env_profiling_enabled()
+
+
+class ProfileCapture:
+    """
+    包住一段程式的 cProfile 剖析
+    用法:
+        capture = ProfileCapture('app_rerun').start()
+        ...
+        prof_path, summary_path = capture.stop()
+    同一執行緒已在剖析時 (例如 rerun 內呼叫 make_batch_prediction)，內層不會重複啟動。
+    """
+
+    def __init__(self, label, output_dir=None, top_n=TOP_N):
+        self.label = label
+        self.output_dir = output_dir or PROFILE_DIR
+        self.top_n = top_n
+        self._profiler = None
+        self._started_at = None
+
+    @property
+    def active(self):
+        return self._profiler is not None
+
+    def start(self):
+        if getattr(_active, 'capture', None) is not None:
+            return self
+        self._profiler = cProfile.Profile()
+        self._started_at = time.perf_counter()
+        _active.capture = self
+        self._profiler.enable()
+        return self
+
+    def stop(self):
+        """停止剖析並寫出檔案；若本物件未實際啟動則回傳 (None, None)"""
+        if self._profiler is None:
+            return None, None
+        self._profiler.disable()
+        elapsed = time.perf_counter() - self._started_at
+        # 先釋放執行緒上的剖析狀態，寫檔失敗也不會讓之後的剖析失效
+        if getattr(_active, 'capture', None) is self:
+            _active.capture = None
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')[:-3]
+            base = os.path.join(self.output_dir, f"{stamp}_{self.label}")
+            prof_path = base + '.prof'
+            summary_path = base + '_top.txt'
+
+            self._profiler.dump_stats(prof_path)
+            with open(summary_path, 'w', encoding='utf-8') as f:
+                f.write(self._summary(elapsed))
+        finally:
+            self._profiler = None
+        return prof_path, summary_path
+
+    def _summary(self, elapsed):
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.strip_dirs()
+        stream.write(f"=== Profile: {self.label} ===\n")
+        stream.write(f"Captured at: {datetime.now().isoformat(timespec='seconds')}\n")
+        stream.write(f"Wall time: {elapsed:.3f} s\n\n")
+        stream.write(f"--- Top {self.top_n} by cumulative time ---\n")
+        stats.sort_stats('cumulative').print_stats(self.top_n)
+        stream.write(f"--- Top {self.top_n} by internal time ---\n")
+        stats.sort_stats('tottime').print_stats(self.top_n)
+        return stream.getvalue()
+
+
+def profiled(label):
+    """函式裝飾器：YIELD_PROFILE=1 時剖析每次呼叫，否則直接執行"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not env_profiling_enabled():
+                return func(*args, **kwargs)
+            capture = ProfileCapture(label).start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                capture.stop()
+        return wrapper
+    return decorator
@@ -0,0 +1,80 @@
+"""
+儀表板圖片渲染快取 (Render Cache)
+
+- 所有 matplotlib 圖在轉成 PNG bytes 後立即 plt.close()，不會隨 rerun 累積 figure
+- 渲染結果以「資料版本 / 模型版本」為 key 快取，同一份資料 rerun 不會重畫
+- 靜態報告圖片 (reports/*.png) 以 (路徑, 修改時間) 快取在記憶體，不再每次讀檔
+
+PNG bytes 為不可變物件，因此使用 st.cache_resource 直接共用，命中時不需複製；
+max_entries 限制快取大小，長時間執行的 session 記憶體維持在固定水位。
+"""
+import io
+import os
+import threading
+
+import matplotlib.pyplot as plt
+import streamlit as st
+
+from instrumentation import stage
+
+MAX_RENDER_ENTRIES = 64
+MAX_STATIC_ENTRIES = 32
+
+# pyplot 的全域狀態不是 thread-safe，多個 session 同時繪圖時需要互斥
+_PLOT_LOCK = threading.RLock()
+
+plt.switch_backend('Agg')
+
+
+def figure_to_png(fig, dpi=100):
+    """把 figure 轉成 PNG bytes，並立即釋放 figure"""
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
+
+
+@st.cache_resource(max_entries=MAX_RENDER_ENTRIES, show_spinner=False)
+def render_yield_pie(pass_count, fail_count):
+    """良率圓餅圖 (以 Pass/Fail 數量為 key)"""
+    with _PLOT_LOCK, stage('render_pie'):
+        fig, ax = plt.subplots(figsize=(6, 4))
+        ax.pie([pass_count, fail_count], labels=['Pass', 'Fail'], autopct='%1.1f%%', colors=['#66b3ff', '#ff9999'])
+        return figure_to_png(fig)
+
+
+@st.cache_resource(max_entries=MAX_RENDER_ENTRIES, show_spinner=False)
+def render_waterfall(data_version, model_version, wafer_key, _build_explanation):
+    """
+    單一晶圓的 SHAP waterfall 圖
+    Args:
+        data_version / model_version / wafer_key: 快取 key
+        _build_explanation: 回傳 shap.Explanation 的函式 (底線開頭不參與 hash，只在快取未命中時才執行)
+    """
+    import shap
+
+    explanation = _build_explanation()
+    with _PLOT_LOCK, stage('render_waterfall'):
+        fig = plt.figure()
+        shap.plots.waterfall(explanation, show=False)
+        drawn = plt.gcf()
+        if drawn is not fig:
+            plt.close(fig)
+        return figure_to_png(drawn)
+
+
+@st.cache_resource(max_entries=MAX_STATIC_ENTRIES, show_spinner=False)
+def _read_image_bytes(path, mtime):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def load_static_image(path):
+    """讀取靜態圖片 bytes；檔案更新 (mtime 改變) 時自動重新讀取，不存在時回傳 None"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    return _read_image_bytes(path, mtime)
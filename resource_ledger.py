@@ -0,0 +1,337 @@
+"""
+訓練資源帳本 (Training Resource Ledger)
+
+訓練與報告腳本的每個階段 (setup、compare_models、SMOTE、plot_model、interpret_model...) 結束時
+在 reports/resource_ledger.jsonl 追加一行 JSON：牆鐘時間、CPU 時間 (含已結束的子行程)、
+期間 RSS 峰值、處理的列數與特徵數。同一次執行共用一個 run_id，可跨次比較哪個階段變慢或變胖。
+
+- 階段期間以背景執行緒取樣目前 RSS，並與 ru_maxrss 的增加量合併，得到該階段的峰值
+- run_id 透過環境變數傳給子行程 (例如 CV worker 中的 FastSMOTE)，寫入同一個 run
+- 巢狀階段 (compare_models 內的 smote) 記錄 parent，比較時依階段名稱加總，但不重複計入整次執行的總時間
+
+用法:
+    ledger = ResourceLedger('train_upgrade.py')
+    with ledger.stage('setup', rows=len(df), features=df.shape[1]):
+        setup(...)
+    with ledger.stage('load_data') as s:
+        df = pd.read_csv(path)
+        s.set(rows=len(df), features=df.shape[1])
+
+    python resource_ledger.py runs
+    python resource_ledger.py compare --script train_upgrade.py [--baseline RUN_ID] [--current RUN_ID]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from instrumentation import current_rss_bytes, peak_rss_bytes
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組
+    resource = None
+
+LEDGER_PATH = 'reports/resource_ledger.jsonl'
+COMPARE_REPORT_PATH = 'reports/resource_ledger_compare.md'
+RUN_ENV = 'YIELD_LEDGER_RUN'
+PATH_ENV = 'YIELD_LEDGER_PATH'
+SCRIPT_ENV = 'YIELD_LEDGER_SCRIPT'
+PARENT_ENV = 'YIELD_LEDGER_PARENT'
+OWNER_ENV = 'YIELD_LEDGER_PID'
+RSS_SAMPLE_SEC = 0.1
+# 比較時變化超過 20%，且絕對差距超過下列門檻才標示 (避免幾毫秒的小階段誤報)
+REGRESSION_THRESHOLD = 0.2
+MIN_REGRESSION_SEC = 1.0
+MIN_REGRESSION_MB = 50.0
+
+_write_lock = threading.Lock()
+# 本行程目前開啟中的階段 (巢狀階段以最內層為 parent)
+_open_stages = []
+
+
+def _children_cpu_sec():
+    """已結束 (且被 wait) 的子行程累計 CPU 時間"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _LedgerStage:
+    """量測一個階段並在結束時寫入帳本"""
+
+    def __init__(self, ledger, name, rows, features):
+        self.ledger = ledger
+        self.name = name
+        self.rows = rows
+        self.features = features
+
+    def set(self, rows=None, features=None):
+        """階段進行中才知道資料大小時補上"""
+        if rows is not None:
+            self.rows = int(rows)
+        if features is not None:
+            self.features = int(features)
+
+    def _sample_rss(self):
+        while not self._done.wait(RSS_SAMPLE_SEC):
+            self._peak_rss = max(self._peak_rss, current_rss_bytes())
+
+    def __enter__(self):
+        self._started_at = time.time()
+        self._rss_start = current_rss_bytes()
+        self._peak_rss = self._rss_start
+        self._maxrss_before = peak_rss_bytes()
+        self._children_cpu = _children_cpu_sec()
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_rss, name=f'ledger-{self.name}', daemon=True)
+        self._sampler.start()
+        self._parent = _open_stages[-1] if _open_stages else os.environ.get(PARENT_ENV)
+        _open_stages.append(self.name)
+        if self._parent is None:
+            # 之後才建立的子行程 (CV worker) 以目前的最上層階段為 parent
+            os.environ[PARENT_ENV] = self.name
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        self._done.set()
+        self._sampler.join()
+        _open_stages.remove(self.name)
+        if self._parent is None:
+            os.environ.pop(PARENT_ENV, None)
+        peak = max(self._peak_rss, current_rss_bytes())
+        maxrss_after = peak_rss_bytes()
+        # 取樣之間的短暫尖峰只有 ru_maxrss 看得到
+        if maxrss_after > self._maxrss_before:
+            peak = max(peak, maxrss_after)
+        self.ledger.record(
+            self.name,
+            started_at=self._started_at,
+            wall_sec=wall,
+            cpu_sec=cpu,
+            children_cpu_sec=_children_cpu_sec() - self._children_cpu,
+            rss_start_mb=self._rss_start / 1e6,
+            peak_rss_mb=peak / 1e6,
+            rows=self.rows,
+            features=self.features,
+            status='ok' if exc_type is None else 'error',
+            error=None if exc_type is None else f"{exc_type.__name__}: {exc}",
+            parent=self._parent,
+        )
+        return False
+
+
+class ResourceLedger:
+    """一次腳本執行的資源帳本 (同一 run_id 的所有階段)"""
+
+    def __init__(self, script, path=None, run_id=None):
+        self.script = script
+        self.path = os.path.abspath(path or os.environ.get(PATH_ENV) or LEDGER_PATH)
+        if run_id is None:
+            run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+            # 子行程 (CV worker) 繼承環境變數後可寫入同一個 run
+            os.environ.update({RUN_ENV: run_id, PATH_ENV: self.path, SCRIPT_ENV: script,
+                               OWNER_ENV: str(os.getpid())})
+        self.run_id = run_id
+
+    @classmethod
+    def active(cls):
+        """目前行程 (或父行程) 已開啟的帳本；沒有時回傳 None"""
+        run_id = os.environ.get(RUN_ENV)
+        if not run_id:
+            return None
+        return cls(os.environ.get(SCRIPT_ENV, 'unknown'), path=os.environ.get(PATH_ENV), run_id=run_id)
+
+    def stage(self, name, rows=None, features=None):
+        return _LedgerStage(self, name, rows, features)
+
+    def record(self, stage, **fields):
+        """直接寫入一筆 (已在別處量測好的階段，例如 FastSMOTE 的每個 fold)"""
+        if 'parent' not in fields:
+            fields['parent'] = _open_stages[-1] if _open_stages else os.environ.get(PARENT_ENV)
+            # 階段開始前就已存在的 worker 不知道 parent，仍不可計入整次執行的總時間
+            if fields['parent'] is None and os.environ.get(OWNER_ENV, str(os.getpid())) != str(os.getpid()):
+                fields['parent'] = 'worker'
+        entry = {
+            'run_id': self.run_id,
+            'script': self.script,
+            'stage': stage,
+            'started_at': fields.pop('started_at', time.time()),
+            'host': platform.node(),
+            'pid': os.getpid(),
+        }
+        for key, value in fields.items():
+            entry[key] = round(value, 4) if isinstance(value, float) else value
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with _write_lock:
+            # 單行 append 寫入，多個行程同時寫也不會交錯
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        return entry
+
+
+def load_ledger(path=LEDGER_PATH):
+    """讀取帳本成 DataFrame (略過寫到一半的行)"""
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['run_id', 'script', 'stage', 'started_at'])
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return pd.DataFrame(entries)
+
+
+def list_runs(ledger):
+    """每次執行一列：腳本、開始時間、階段數、最上層階段的牆鐘時間總和與 RSS 峰值"""
+    if ledger.empty:
+        return pd.DataFrame(columns=['run_id', 'script', 'started', 'stages', 'wall_sec', 'peak_rss_mb'])
+    runs = ledger.groupby('run_id', sort=False).agg(
+        script=('script', 'first'),
+        started_at=('started_at', 'min'),
+        stages=('stage', 'nunique'),
+        peak_rss_mb=('peak_rss_mb', 'max'),
+    )
+    # 巢狀階段 (compare_models 內的 smote) 不重複計入總時間
+    top = ledger[ledger['parent'].isna()] if 'parent' in ledger else ledger
+    runs['wall_sec'] = top.groupby('run_id')['wall_sec'].sum().round(2)
+    runs['started'] = pd.to_datetime(runs['started_at'], unit='s').dt.strftime('%Y-%m-%d %H:%M:%S')
+    runs = runs.sort_values('started_at').reset_index()
+    return runs[['run_id', 'script', 'started', 'stages', 'wall_sec', 'peak_rss_mb']]
+
+
+def _stage_totals(entries):
+    return entries.groupby('stage', sort=False).agg(
+        calls=('stage', 'size'),
+        wall_sec=('wall_sec', 'sum'),
+        cpu_sec=('cpu_sec', 'sum'),
+        peak_rss_mb=('peak_rss_mb', 'max'),
+        rows=('rows', 'max'),
+        features=('features', 'max'),
+    )
+
+
+def compare_runs(ledger, current=None, baseline=None, script=None, threshold=REGRESSION_THRESHOLD,
+                 min_sec=MIN_REGRESSION_SEC, min_mb=MIN_REGRESSION_MB):
+    """
+    比較兩次執行的各階段 (預設為同一腳本最近兩次)
+    Returns:
+        (DataFrame, baseline_run_id, current_run_id)；flag 欄位為 REGRESSED / IMPROVED / NEW / REMOVED
+    """
+    runs = list_runs(ledger if script is None else ledger[ledger['script'] == script])
+    if current is None:
+        if runs.empty:
+            raise ValueError("Ledger has no runs to compare")
+        current = runs['run_id'].iloc[-1]
+    elif current not in set(ledger['run_id']):
+        raise ValueError(f"Unknown run {current}")
+    if baseline is None:
+        # 同一腳本在 current 之前的最近一次
+        runs = list_runs(ledger)
+        position = runs.index[runs['run_id'] == current][0]
+        current_script = runs.loc[position, 'script']
+        earlier = runs.loc[:position - 1]
+        earlier = earlier[earlier['script'] == current_script]
+        if earlier.empty:
+            raise ValueError(f"No earlier run of {current_script} to compare with {current}")
+        baseline = earlier['run_id'].iloc[-1]
+    elif baseline not in set(ledger['run_id']):
+        raise ValueError(f"Unknown run {baseline}")
+
+    cur = _stage_totals(ledger[ledger['run_id'] == current])
+    base = _stage_totals(ledger[ledger['run_id'] == baseline])
+    table = cur.join(base, how='outer', lsuffix='', rsuffix='_base')
+    # 依目前這次的階段順序排列，已移除的階段放最後
+    order = list(cur.index) + [s for s in base.index if s not in cur.index]
+    table = table.loc[order]
+
+    table['wall_change'] = (table['wall_sec'] / table['wall_sec_base'] - 1).round(3)
+    table['rss_change'] = (table['peak_rss_mb'] / table['peak_rss_mb_base'] - 1).round(3)
+    wall_diff = table['wall_sec'] - table['wall_sec_base']
+    rss_diff = table['peak_rss_mb'] - table['peak_rss_mb_base']
+    regressed = ((table['wall_change'] > threshold) & (wall_diff > min_sec)) | \
+                ((table['rss_change'] > threshold) & (rss_diff > min_mb))
+    improved = ((table['wall_change'] < -threshold) & (wall_diff < -min_sec)) | \
+               ((table['rss_change'] < -threshold) & (rss_diff < -min_mb))
+    table['flag'] = ''
+    table.loc[improved, 'flag'] = 'IMPROVED'
+    table.loc[regressed, 'flag'] = 'REGRESSED'
+    table.loc[table['wall_sec_base'].isna(), 'flag'] = 'NEW'
+    table.loc[table['wall_sec'].isna(), 'flag'] = 'REMOVED'
+    columns = ['calls', 'wall_sec_base', 'wall_sec', 'wall_change', 'cpu_sec_base', 'cpu_sec',
+               'peak_rss_mb_base', 'peak_rss_mb', 'rss_change', 'rows', 'features', 'flag']
+    return table[columns].round(2), baseline, current
+
+
+def render_comparison(table, baseline, current):
+    """Markdown 版本的比較表 (退步的階段以粗體標示)"""
+    lines = [f"# Resource Ledger: {current} vs {baseline}", "",
+             "| Stage | Wall base (s) | Wall (s) | Δ wall | CPU (s) | Peak RSS base (MB) | Peak RSS (MB) | Δ RSS | Rows | Features | Flag |",
+             "| :--- | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | :--- |"]
+
+    def fmt(value, pct=False):
+        if pd.isna(value):
+            return '-'
+        return f"{value:+.0%}" if pct else f"{value:g}"
+
+    for stage, r in table.iterrows():
+        name = f"**{stage}**" if r['flag'] == 'REGRESSED' else stage
+        lines.append(f"| {name} | {fmt(r['wall_sec_base'])} | {fmt(r['wall_sec'])} | {fmt(r['wall_change'], True)} | "
+                     f"{fmt(r['cpu_sec'])} | {fmt(r['peak_rss_mb_base'])} | {fmt(r['peak_rss_mb'])} | "
+                     f"{fmt(r['rss_change'], True)} | {fmt(r['rows'])} | {fmt(r['features'])} | {r['flag']} |")
+    regressed = table.index[table['flag'] == 'REGRESSED'].tolist()
+    lines += ["", f"Regressed stages: {', '.join(regressed)}" if regressed else "No stage regressed."]
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compare training resource ledgers")
+    parser.add_argument('--ledger', default=LEDGER_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('runs', help="list recorded runs")
+    compare = sub.add_parser('compare', help="compare two runs stage by stage")
+    compare.add_argument('--script', default=None, help="only consider runs of this script")
+    compare.add_argument('--baseline', default=None, help="baseline run id (default: previous run)")
+    compare.add_argument('--current', default=None, help="current run id (default: latest run)")
+    compare.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    compare.add_argument('--output', default=COMPARE_REPORT_PATH)
+    args = parser.parse_args()
+
+    ledger = load_ledger(args.ledger)
+    if args.command == 'runs':
+        print(list_runs(ledger).to_string(index=False))
+        return
+
+    try:
+        table, baseline, current = compare_runs(ledger, current=args.current, baseline=args.baseline,
+                                                script=args.script, threshold=args.threshold)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"📊 {current} vs {baseline}")
+    print(table.to_string())
+    report = render_comparison(table, baseline, current)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(report)
+    regressed = table.index[table['flag'] == 'REGRESSED'].tolist()
+    print(f"⚠️ Regressed: {', '.join(regressed)}" if regressed else "✅ No stage regressed.")
+    print(f"📄 Report saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
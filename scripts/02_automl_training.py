@@ -1,11 +1,25 @@
 import pandas as pd
 from pycaret.classification import *
 import os
+import sys
+
+# 專案根目錄的共用模組 (FastSMOTE、模型搜尋)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fast_smote import get_resampler
+from model_search import search_models
+from resource_ledger import ResourceLedger
+from log_config import configure_logging, pycaret_logger, disable_catboost_files
+
+configure_logging('02_automl_training', log_dir='../reports/logs')
+ledger = ResourceLedger('02_automl_training.py', path='../reports/resource_ledger.jsonl')
 
 print("--- Step 1: Loading Processed Data ---")
 # 載入剛剛處理好的資料
 data_path = '../data/secom_processed.csv'
-dataset = pd.read_csv(data_path)
+with ledger.stage('load_data') as s_load:
+    dataset = pd.read_csv(data_path)
+    s_load.set(rows=len(dataset), features=dataset.shape[1] - 1)
+n_rows, n_features = len(dataset), dataset.shape[1] - 1
 print(f"Data loaded successfully. Shape: {dataset.shape}")
 print("-" * 30)
 
@@ -16,37 +30,60 @@ if not os.path.exists('../output/automl_reports'):
 
 # 初始化 PyCaret 設定
 # 這邊會自動做特徵標準化(normalize)和處理類別不平衡(fix_imbalance)
-clf_session = setup(
-    data=dataset,
-    target='label',
-    session_id=123,
-    normalize=True,
-    fix_imbalance=True,
-    html=False,  # 關閉瀏覽器跳出
-    verbose=False # 減少雜訊輸出
-)
+with ledger.stage('setup', rows=n_rows, features=n_features):
+    clf_session = setup(
+        data=dataset,
+        target='label',
+        session_id=123,
+        normalize=True,
+        fix_imbalance=True,
+        fix_imbalance_method=get_resampler(),
+        html=False,  # 關閉瀏覽器跳出
+        verbose=False, # 減少雜訊輸出
+        system_log=pycaret_logger()  # 不再寫 scripts/logs.log，改由背景執行緒寫入 reports/logs/
+    )
+disable_catboost_files()  # compare_models 中的 CatBoost 不再重寫 scripts/catboost_info/
 print("PyCaret setup complete.")
 print("-" * 30)
 
 print("\n--- Step 3: Comparing Machine Learning Models ---")
-# 這是最神奇的一行：自動比較多種模型
-print("Training and comparing models... (This may take a few minutes)")
+# YIELD_SEARCH_MODE=halving (預設)：successive halving，先用小資料淘汰明顯不好的模型
+# YIELD_SEARCH_MODE=exhaustive：原本的 compare_models，每個模型都跑完整 CV
+search_mode = os.environ.get('YIELD_SEARCH_MODE', 'halving').lower()
+budget = os.environ.get('YIELD_SEARCH_BUDGET_SEC')
+if not os.path.exists('../reports'):
+    os.makedirs('../reports')
+
 # 我們依據 'F1' 分數來排名，因為良率預測通常更在乎抓出壞品
-best_model = compare_models(sort='F1')
+if search_mode == 'exhaustive':
+    with ledger.stage('compare_models', rows=n_rows, features=n_features):
+        print("Training and comparing models... (This may take a few minutes)")
+        best_model = compare_models(sort='F1')
+        results = pull()
+else:
+    with ledger.stage('model_search', rows=n_rows, features=n_features):
+        print("Running successive-halving model search...")
+        best_model, results = search_models(
+            sort='F1',
+            budget_sec=float(budget) if budget else None,
+            log_path='../reports/model_search_log.csv'
+        )
 print("Model comparison complete.")
+results.to_csv('../reports/model_comparison.csv')
 
 # 顯示前幾名的結果
-results = pull()
 print("Top models performance:")
 print(results.head())
 print("-" * 30)
 
 print("\n--- Step 4: Finalizing and Saving the Model ---")
 # 使用全部資料重新訓練最佳模型
-final_model = finalize_model(best_model)
+with ledger.stage('finalize_model', rows=n_rows, features=n_features):
+    final_model = finalize_model(best_model)
 
 # 儲存模型
 model_path = '../output/final_yield_prediction_model'
-save_model(final_model, model_path)
+with ledger.stage('save_model'):
+    save_model(final_model, model_path)
 print(f"Model saved successfully to {model_path}.pkl")
 print("-" * 30)
\ No newline at end of file
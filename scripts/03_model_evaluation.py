@@ -7,8 +7,12 @@ from pycaret.classification import *
 from sklearn.model_selection import learning_curve
 import logging
 
-# 設定 logging 以便追蹤
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# 專案根目錄的共用模組 (資源帳本、logging)
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from resource_ledger import ResourceLedger
+from log_config import configure_logging, pycaret_logger, disable_catboost_files
+from streaming_eval import evaluate_files, eval_inputs_from_env, write_reports
 
 # 路徑設定
 DATA_PATH = '../data/secom_processed.csv'
@@ -107,16 +111,25 @@ def generate_model_comparison_plot(results_df):
     logging.info(f"Comparison plot saved to {save_path}")
 
 def main():
+    # 設定 logging 以便追蹤 (背景執行緒寫入 reports/logs/，同時輸出到終端機)
+    configure_logging('03_model_evaluation', log_dir=os.path.join(REPORT_DIR, 'logs'), console=True)
     print("--- Step 1: Loading Data ---")
     if not os.path.exists(DATA_PATH):
         raise FileNotFoundError(f"Data not found at {DATA_PATH}")
     
-    dataset = pd.read_csv(DATA_PATH)
+    ledger = ResourceLedger('03_model_evaluation.py', path=os.path.join(REPORT_DIR, 'resource_ledger.jsonl'))
+    with ledger.stage('load_data') as s_load:
+        dataset = pd.read_csv(DATA_PATH)
+        s_load.set(rows=len(dataset), features=dataset.shape[1] - 1)
+    n_rows, n_features = len(dataset), dataset.shape[1] - 1
     print(f"Data shape: {dataset.shape}")
 
     print("\n--- Step 2: Initialize PyCaret ---")
     # 保持與訓練時一致的設定
-    s = setup(data=dataset, target='label', session_id=123, verbose=False, html=False)
+    with ledger.stage('setup', rows=n_rows, features=n_features):
+        s = setup(data=dataset, target='label', session_id=123, verbose=False, html=False,
+                  system_log=pycaret_logger())
+    disable_catboost_files()
     
     print("\n--- Step 3: Targeted Model Comparison (XGBoost vs CatBoost) ---")
     # 這裡我們重新比較這兩個強效模型，以獲取最新的比較數據
@@ -124,7 +137,8 @@ def main():
     print("Training XGBoost and CatBoost for comparison report...")
     try:
         # include 參數確保只比較這兩個
-        best_models = compare_models(include=['xgboost', 'catboost'], sort='F1')
+        with ledger.stage('compare_models', rows=n_rows, features=n_features):
+            best_models = compare_models(include=['xgboost', 'catboost'], sort='F1')
         results = pull()
         
         # 儲存 CSV
@@ -139,7 +153,8 @@ def main():
     print("\n--- Step 4: Load Final Model & Deep Analysis ---")
     model_path = os.path.join(MODEL_DIR, 'final_yield_prediction_model')
     try:
-        final_model = load_model(model_path)
+        with ledger.stage('load_model'):
+            final_model = load_model(model_path)
         logging.info("Final model loaded successfully.")
         
         # 取得 PyCaret 處理過的 X_train, y_train 用於手動計算 Learning Curve
@@ -147,21 +162,42 @@ def main():
         y_train = get_config('y_train')
         
         # 執行過擬合文字分析
-        check_overfitting(final_model, X_train, y_train)
+        with ledger.stage('learning_curve_analysis', rows=len(X_train), features=X_train.shape[1]):
+            check_overfitting(final_model, X_train, y_train)
         
         # 產生標準圖片報告
-        logging.info("Generating standard PyCaret plots...")
-        plot_model(final_model, plot='confusion_matrix', save=True)
-        shutil.move('Confusion Matrix.png', os.path.join(IMG_OUTPUT_DIR, 'confusion_matrix.png'))
-        
-        plot_model(final_model, plot='auc', save=True)
-        shutil.move('AUC.png', os.path.join(IMG_OUTPUT_DIR, 'auc_roc_curve.png'))
+        eval_files = eval_inputs_from_env()
+        if eval_files:
+            # YIELD_EVAL_DATA 指定的大型已標記資料放不進記憶體，改為逐塊評分並合併直方圖 (圖檔名稱不變)
+            logging.info(f"Streaming evaluation over {len(eval_files)} labeled files...")
+            with ledger.stage('streaming_eval') as s_eval:
+                eval_hist, eval_errors = evaluate_files(
+                    eval_files, final_model, workers=int(os.environ.get('YIELD_EVAL_WORKERS', os.cpu_count() or 1)))
+                s_eval.set(rows=eval_hist.n_rows)
+                eval_metrics = write_reports(
+                    eval_hist, IMG_OUTPUT_DIR, csv_dir=REPORT_DIR,
+                    image_names={'confusion_matrix': 'confusion_matrix.png', 'auc': 'auc_roc_curve.png',
+                                 'pr': 'precision_recall.png'})
+            for path, error in eval_errors.items():
+                logging.warning(f"Could not evaluate {path}: {error}")
+            logging.info(f"Streaming evaluation on {eval_metrics['Rows']} wafers: AUC {eval_metrics['AUC']:.4f}")
+        else:
+            logging.info("Generating standard PyCaret plots...")
+            with ledger.stage('plot_model:confusion_matrix', rows=n_rows, features=n_features):
+                plot_model(final_model, plot='confusion_matrix', save=True)
+            shutil.move('Confusion Matrix.png', os.path.join(IMG_OUTPUT_DIR, 'confusion_matrix.png'))
+
+            with ledger.stage('plot_model:auc', rows=n_rows, features=n_features):
+                plot_model(final_model, plot='auc', save=True)
+            shutil.move('AUC.png', os.path.join(IMG_OUTPUT_DIR, 'auc_roc_curve.png'))
         
-        plot_model(final_model, plot='feature', save=True)
+        with ledger.stage('plot_model:feature', rows=n_rows, features=n_features):
+            plot_model(final_model, plot='feature', save=True)
         shutil.move('Feature Importance.png', os.path.join(IMG_OUTPUT_DIR, 'feature_importance.png'))
         
         # 產生 Learning Curve 圖片
-        plot_model(final_model, plot='learning', save=True)
+        with ledger.stage('plot_model:learning', rows=n_rows, features=n_features):
+            plot_model(final_model, plot='learning', save=True)
         shutil.move('Learning Curve.png', os.path.join(IMG_OUTPUT_DIR, 'learning_curve.png'))
         
     except Exception as e:
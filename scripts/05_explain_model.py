@@ -1,6 +1,20 @@
 from pycaret.classification import *
 import pandas as pd
 import os
+import sys
+
+# 專案根目錄的共用模組 (FastSMOTE、SHAP 解釋)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fast_smote import get_resampler
+from explain import compute_shap, approximation_error, save_error_report
+from resource_ledger import ResourceLedger
+from log_config import configure_logging, pycaret_logger
+
+configure_logging('05_explain_model', log_dir='../reports/logs')
+ledger = ResourceLedger('05_explain_model.py', path='../reports/resource_ledger.jsonl')
+
+# 解釋模式：exact (TreeSHAP) 或 approximate (Saabas 路徑歸因，大批次快很多)
+EXPLAIN_MODE = os.environ.get('YIELD_EXPLAIN_MODE', 'exact')
 
 # 設定 matplotlib 字型 (避免中文亂碼，選用)
 import matplotlib.pyplot as plt
@@ -8,32 +22,40 @@ plt.rcParams['axes.unicode_minus'] = False
 
 print("--- Step 1: Loading Data & Setting up Environment ---")
 # 讀取資料
-data = pd.read_csv('../data/secom_processed.csv')
+with ledger.stage('load_data') as s_load:
+    data = pd.read_csv('../data/secom_processed.csv')
+    s_load.set(rows=len(data), features=data.shape[1] - 1)
+n_rows, n_features = len(data), data.shape[1] - 1
 
 # 初始化環境 (跟之前一樣)
 # session_id=123 確保結果可重現
-s = setup(
-    data=data, 
-    target='label', 
-    session_id=123, 
-    normalize=True, 
-    fix_imbalance=True, 
-    verbose=False, 
-    html=False
-)
+with ledger.stage('setup', rows=n_rows, features=n_features):
+    s = setup(
+        data=data, 
+        target='label', 
+        session_id=123, 
+        normalize=True, 
+        fix_imbalance=True, 
+        fix_imbalance_method=get_resampler(),
+        verbose=False, 
+        html=False,
+        system_log=pycaret_logger()
+    )
 print("PyCaret environment initialized.")
 
 print("\n--- Step 2: Training a Tree-Based Model (Random Forest) ---")
 # 【關鍵改變】我們不讓 AutoML 自己選，我們直接指定要訓練 'rf' (Random Forest)
 # 因為 Random Forest 是樹狀模型，完美支援 SHAP 和我們後面的 App
 print("Training Random Forest model... (This is better for SHAP)")
-rf_model = create_model('rf', verbose=False)
+with ledger.stage('create_model:rf', rows=n_rows, features=n_features):
+    rf_model = create_model('rf', verbose=False)
 print("Random Forest model trained.")
 
 print("\n--- Step 3: Saving the New Model ---")
 # 我們把這個新模型存檔，覆蓋掉原本那個 Ridge 模型
 # 這樣之後您的 App 就會用到這個更強的模型了
-save_model(rf_model, '../output/final_yield_prediction_model')
+with ledger.stage('save_model'):
+    save_model(rf_model, '../output/final_yield_prediction_model')
 print("Model overwritten with Random Forest.")
 
 print("\n--- Step 4: Generating SHAP Plots ---")
@@ -41,18 +63,43 @@ plot_output_dir = '../output/shap_plots'
 if not os.path.exists(plot_output_dir):
     os.makedirs(plot_output_dir)
 
-print("Generating SHAP Summary Plot...")
+print(f"Generating SHAP Summary Plot ({EXPLAIN_MODE})...")
 try:
-    # 這次一定會成功，因為 rf_model 是樹狀模型
-    interpret_model(rf_model, plot='summary', save=True)
-    
-    # 搬移圖片
-    if os.path.exists('Summary Plot.png'):
-        target_file = os.path.join(plot_output_dir, 'shap_summary_plot.png')
-        if os.path.exists(target_file):
-            os.remove(target_file)
-        os.rename('Summary Plot.png', target_file)
+    target_file = os.path.join(plot_output_dir, 'shap_summary_plot.png')
+    if EXPLAIN_MODE == 'approximate':
+        # 近似模式：對整份資料計算路徑歸因，不受 interpret_model 的取樣限制
+        import shap
+        pipeline = load_model('../output/final_yield_prediction_model', verbose=False)
+        with ledger.stage('approximate_shap', rows=n_rows, features=n_features):
+            result = compute_shap(pipeline, data.drop('label', axis=1), method='approximate')
+        plt.figure()
+        shap.summary_plot(result['values'], result['data'], feature_names=result['feature_names'], show=False)
+        plt.savefig(target_file, bbox_inches='tight')
+        plt.close()
         print(f" -> Success! Plot saved to {target_file}")
+    else:
+        # 這次一定會成功，因為 rf_model 是樹狀模型
+        with ledger.stage('interpret_model:summary', rows=n_rows, features=n_features):
+            interpret_model(rf_model, plot='summary', save=True)
+
+        # 搬移圖片
+        if os.path.exists('Summary Plot.png'):
+            if os.path.exists(target_file):
+                os.remove(target_file)
+            os.rename('Summary Plot.png', target_file)
+            print(f" -> Success! Plot saved to {target_file}")
+except Exception as e:
+    print(f"Error: {e}")
+
+print("\n--- Step 5: Checking Approximate vs Exact Attributions ---")
+try:
+    pipeline = load_model('../output/final_yield_prediction_model', verbose=False)
+    with ledger.stage('shap_approximation'):
+        report = approximation_error(pipeline, get_config('X_test'))
+    save_error_report(report, path='../reports/shap_approximation.json')
+    print(f" -> Relative error {report['relative_error']:.1%}, importance rank correlation "
+          f"{report['importance_spearman']:.3f}, top-{report['top_k']} overlap {report['top_k_overlap']:.0%}, "
+          f"{report['speedup']:.1f}x faster")
 except Exception as e:
     print(f"Error: {e}")
 
@@ -0,0 +1,267 @@
+"""
+SECOM 原始資料二進位儲存 (Chunked Binary Store)
+
+把空白分隔的 secom_features.txt / secom_labels.txt 轉成分塊的 .npy 檔：
+    data/secom_store/
+        meta.json                     <- 欄位名稱、每個 chunk 的筆數、來源檔已讀取到的位置
+        chunk_00000.features.npy      <- (rows, 590) 浮點數
+        chunk_00000.labels.npy        <- (rows,) int8，原始 -1 / 1
+        chunk_00000.timestamps.npy    <- (rows,) datetime64[s]
+
+- 解析：以 numpy 原生 tokenizer 解析數值，大檔案切成多個區塊平行解析
+- 增量：meta.json 記錄兩個來源檔已處理的 byte 位置，再次執行只會解析新增的行
+- 對齊：每次只寫入「特徵與標籤都已完整出現」的行數，確保 label / timestamp 與特徵逐列對齊
+
+用法:
+    python secom_store.py ingest --features data/secom_features.txt --labels data/secom_labels.txt
+    python secom_store.py info
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = 'data/secom_store'
+N_FEATURES = 590
+BLOCK_BYTES = 64 * 1024 * 1024
+HEAD_BYTES = 64 * 1024
+# 掃描換行位置時每次讀取的大小
+SCAN_BYTES = 8 * 1024 * 1024
+TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+
+def feature_names(n_features=N_FEATURES):
+    """與 01_data_preprocessing.py 相同的欄位命名 feature_1 ~ feature_590"""
+    return [f'feature_{i + 1}' for i in range(n_features)]
+
+
+def _head_fingerprint(path, length):
+    """來源檔開頭 (已處理過的部分) 的雜湊，用來偵測檔案被整個替換 (而不是單純附加)"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(min(length, HEAD_BYTES))).hexdigest()
+
+
+def _line_ends(path, start, scan_bytes=SCAN_BYTES):
+    """
+    回傳 start 之後每個完整行的結尾位置 (換行字元之後的 byte offset)
+    以固定大小的區塊掃描，記憶體只跟 scan_bytes 有關，不會一次讀入剩下的整個檔案
+    """
+    ends = []
+    offset = start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while True:
+            buf = f.read(scan_bytes)
+            if not buf:
+                break
+            ends.append(offset + np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == ord('\n')) + 1)
+            offset += len(buf)
+    return np.concatenate(ends) if ends else np.empty(0, dtype=np.int64)
+
+
+def parse_feature_block(path, start, end, n_features=N_FEATURES, dtype=np.float64):
+    """解析 [start, end) 範圍內的特徵行 (可在子行程中執行)"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('ascii')
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    if values.size % n_features != 0:
+        raise ValueError(f"{path}: bytes {start}-{end} do not contain a whole number of {n_features}-value rows")
+    return values.reshape(-1, n_features).astype(dtype, copy=False)
+
+
+def parse_label_block(path, start, end):
+    """解析標籤行：-1 "19/07/2008 11:55:00" """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    frame = pd.read_csv(io.BytesIO(raw), sep=' ', header=None, names=['label', 'timestamp'], quotechar='"')
+    labels = frame['label'].to_numpy(dtype=np.int8)
+    timestamps = pd.to_datetime(frame['timestamp'], format=TIMESTAMP_FORMAT).to_numpy().astype('datetime64[s]')
+    return labels, timestamps
+
+
+def _split_blocks(line_ends, start, block_bytes):
+    """依 byte 大小把連續的完整行切成多個區塊，切點一定落在行尾"""
+    blocks = []
+    block_start = start
+    while len(line_ends) > 0:
+        cut = int(np.searchsorted(line_ends, block_start + block_bytes, side='right'))
+        cut = max(cut, 1)
+        block_end = int(line_ends[cut - 1])
+        blocks.append((block_start, block_end, cut))
+        block_start = block_end
+        line_ends = line_ends[cut:]
+    return blocks
+
+
+class SecomStore:
+    """讀取已轉換的二進位資料"""
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.meta_path = os.path.join(store_dir, 'meta.json')
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = None
+
+    @property
+    def exists(self):
+        return self.meta is not None
+
+    @property
+    def n_rows(self):
+        return sum(c['rows'] for c in self.meta['chunks']) if self.meta else 0
+
+    @property
+    def feature_names(self):
+        return self.meta['feature_names']
+
+    def _chunk_path(self, name, kind):
+        return os.path.join(self.store_dir, f"{name}.{kind}.npy")
+
+    def iter_chunks(self, mmap=True):
+        """逐塊讀取 (features, labels, timestamps)；預設以 memory-map 開啟，不會一次載入全部資料"""
+        mode = 'r' if mmap else None
+        for chunk in self.meta['chunks']:
+            yield (np.load(self._chunk_path(chunk['name'], 'features'), mmap_mode=mode),
+                   np.load(self._chunk_path(chunk['name'], 'labels')),
+                   np.load(self._chunk_path(chunk['name'], 'timestamps')))
+
+    def iter_frames(self):
+        """逐塊回傳 DataFrame (特徵欄位 + label + timestamp)"""
+        for features, labels, timestamps in self.iter_chunks():
+            frame = pd.DataFrame(np.asarray(features), columns=self.feature_names)
+            frame['label'] = labels.astype(np.int64)
+            frame['timestamp'] = timestamps
+            yield frame
+
+    def to_frame(self):
+        """整份資料轉成 DataFrame (欄位順序與原本 concat 結果相同)"""
+        frames = list(self.iter_frames())
+        if not frames:
+            return pd.DataFrame(columns=self.feature_names + ['label', 'timestamp'])
+        return pd.concat(frames, ignore_index=True)
+
+
+def ingest(features_path, labels_path, store_dir=STORE_DIR, workers=None,
+           block_bytes=BLOCK_BYTES, dtype=np.float64, rebuild=False):
+    """
+    把來源文字檔中尚未處理的新行轉入二進位 store
+    Returns:
+        本次新增的筆數
+    """
+    store = SecomStore(store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+
+    if rebuild or not store.exists:
+        meta = {
+            'feature_names': feature_names(),
+            'dtype': np.dtype(dtype).name,
+            'chunks': [],
+            'source': {
+                'features_path': os.path.abspath(features_path),
+                'labels_path': os.path.abspath(labels_path),
+                'features_head': None,
+                'labels_head': None,
+                'features_offset': 0,
+                'labels_offset': 0,
+            },
+        }
+    else:
+        meta = store.meta
+        source = meta['source']
+        if os.path.getsize(features_path) < source['features_offset'] or \
+                os.path.getsize(labels_path) < source['labels_offset'] or \
+                _head_fingerprint(features_path, source['features_offset']) != source['features_head'] or \
+                _head_fingerprint(labels_path, source['labels_offset']) != source['labels_head']:
+            raise ValueError("Source files were replaced or truncated since the last ingest; rerun with --rebuild")
+        dtype = np.dtype(meta['dtype'])
+
+    source = meta['source']
+    feature_ends = _line_ends(features_path, source['features_offset'])
+    label_ends = _line_ends(labels_path, source['labels_offset'])
+
+    # 只處理特徵與標籤都已經完整寫入的行，確保逐列對齊
+    n_new = min(len(feature_ends), len(label_ends))
+    if n_new == 0:
+        return 0
+    feature_ends = feature_ends[:n_new]
+    label_end = int(label_ends[n_new - 1])
+
+    blocks = _split_blocks(feature_ends, source['features_offset'], block_bytes)
+    n_features = len(meta['feature_names'])
+    workers = workers or os.cpu_count() or 1
+    if len(blocks) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(parse_feature_block, features_path, start, end, n_features, dtype)
+                       for start, end, _ in blocks]
+            feature_blocks = [f.result() for f in futures]
+    else:
+        feature_blocks = [parse_feature_block(features_path, start, end, n_features, dtype)
+                          for start, end, _ in blocks]
+
+    labels, timestamps = parse_label_block(labels_path, source['labels_offset'], label_end)
+
+    row = 0
+    for block in feature_blocks:
+        name = f"chunk_{len(meta['chunks']):05d}"
+        rows = block.shape[0]
+        np.save(os.path.join(store_dir, f"{name}.features.npy"), block)
+        np.save(os.path.join(store_dir, f"{name}.labels.npy"), labels[row:row + rows])
+        np.save(os.path.join(store_dir, f"{name}.timestamps.npy"), timestamps[row:row + rows])
+        meta['chunks'].append({'name': name, 'rows': rows})
+        row += rows
+
+    source['features_offset'] = int(feature_ends[-1])
+    source['labels_offset'] = label_end
+    source['features_head'] = _head_fingerprint(features_path, source['features_offset'])
+    source['labels_head'] = _head_fingerprint(labels_path, label_end)
+
+    # chunk 檔都寫完後才更新 meta.json，中途失敗不會留下不一致的狀態
+    tmp_path = store.meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, store.meta_path)
+    return n_new
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw SECOM text files into a chunked binary store")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_ing = sub.add_parser('ingest', help="append new lines from the raw text files")
+    p_ing.add_argument('--features', default='data/secom_features.txt')
+    p_ing.add_argument('--labels', default='data/secom_labels.txt')
+    p_ing.add_argument('--store', default=STORE_DIR)
+    p_ing.add_argument('--workers', type=int, default=None, help="parallel parser processes (default: all cores)")
+    p_ing.add_argument('--float32', action='store_true', help="store features as float32 (half the size)")
+    p_ing.add_argument('--rebuild', action='store_true', help="discard the store and re-ingest from scratch")
+
+    p_info = sub.add_parser('info', help="show store summary")
+    p_info.add_argument('--store', default=STORE_DIR)
+
+    args = parser.parse_args()
+    if args.command == 'ingest':
+        dtype = np.float32 if args.float32 else np.float64
+        added = ingest(args.features, args.labels, args.store, workers=args.workers,
+                       dtype=dtype, rebuild=args.rebuild)
+        print(f"✅ Appended {added} rows. Store now holds {SecomStore(args.store).n_rows} rows.")
+    elif args.command == 'info':
+        store = SecomStore(args.store)
+        if not store.exists:
+            print(f"❌ No store found at {args.store}")
+            return
+        print(f"Rows: {store.n_rows}, Features: {len(store.feature_names)}, Chunks: {len(store.meta['chunks'])}")
+        print(f"Source: {store.meta['source']['features_path']}")
+
+
+if __name__ == '__main__':
+    main()
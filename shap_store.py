@@ -0,0 +1,221 @@
+"""
+全域 SHAP 資料庫 (SHAP Store)
+
+訓練時計算一次整份資料的 SHAP 值並存成精簡格式，儀表板直接讀取，不必重算或顯示過期的 PNG：
+    reports/shap_store/
+        meta.json        <- 特徵名稱、筆數、base value、模型版本
+        values.npy       <- (rows, features) float32 SHAP 值 (memory-map 讀取)
+        labels.npy       <- 每一列的 0/1 標籤
+        importance.csv   <- 每個特徵的平均 |SHAP| (全部 / Fail / Pass) 與平均 SHAP
+        cloud.npz        <- 降採樣的點雲 (特徵值、SHAP 值、標籤)，畫 dependence 圖用
+
+用法:
+    from shap_store import build_shap_store, ShapStore
+    build_shap_store(pipeline, X, labels=y, model_version='v0003-...')
+    store = ShapStore.load()
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+
+STORE_DIR = 'reports/shap_store'
+CHUNK_ROWS = 1024
+CLOUD_ROWS = 2000
+
+
+def _mean_abs(values, mask=None):
+    rows = values if mask is None else values[mask]
+    if len(rows) == 0:
+        return np.full(values.shape[1], np.nan, dtype=np.float32)
+    return np.abs(rows).mean(axis=0)
+
+
+def build_shap_store(pipeline, data, labels=None, out_dir=STORE_DIR, model_version=None,
+                     chunk_rows=CHUNK_ROWS, cloud_rows=CLOUD_ROWS, random_state=123):
+    """
+    分塊計算整份資料的 SHAP 並寫入 store
+    Args:
+        pipeline: PyCaret Pipeline
+        data: 感測器資料 (不含 label)
+        labels: 0/1 標籤，用於 Fail / Pass 分組
+    """
+    from explain import compute_shap, get_explainer
+
+    explainer = get_explainer(pipeline)
+    header = {}
+
+    def chunks():
+        for start in range(0, len(data), chunk_rows):
+            result = compute_shap(pipeline, data.iloc[start:start + chunk_rows], explainer=explainer)
+            header.setdefault('feature_names', result['feature_names'])
+            header.setdefault('base_value', result['base_value'])
+            yield result['values'], result['data']
+
+    with stage('shap_store_build', rows=len(data)):
+        return write_shap_store(chunks(), len(data), header, labels=labels, out_dir=out_dir,
+                                model_version=model_version, cloud_rows=cloud_rows,
+                                random_state=random_state)
+
+
+def write_shap_store(chunks, n_rows, header, labels=None, out_dir=STORE_DIR, model_version=None,
+                     cloud_rows=CLOUD_ROWS, random_state=123):
+    """
+    把逐塊產生的 (SHAP 值, 前處理後特徵值) 寫入 store (先寫暫存資料夾，完成後才替換舊的 store)
+    header: dict，feature_names / base_value (可在第一個 chunk 產生時才填入)
+    """
+    staging = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    labels = np.zeros(n_rows, dtype=np.int8) if labels is None else np.asarray(labels, dtype=np.int8)
+    fail = labels == 1
+
+    # 點雲：保留所有 Fail 樣本 (通常很少)，其餘隨機抽樣補滿 cloud_rows
+    # 抽樣只依標籤決定，串流寫入時只保留被抽到的特徵值列，記憶體與總筆數無關
+    rng = np.random.default_rng(random_state)
+    fail_rows = np.flatnonzero(fail)[:cloud_rows]
+    pass_rows = np.flatnonzero(~fail)
+    n_pass = min(len(pass_rows), cloud_rows - len(fail_rows))
+    sampled = rng.choice(pass_rows, size=n_pass, replace=False)
+    cloud_idx = np.sort(np.concatenate([fail_rows, sampled])).astype(np.int64)
+
+    values = cloud_data = None
+    start = 0
+    for chunk_values, chunk_data in chunks:
+        if values is None:
+            n_features = chunk_values.shape[1]
+            values = np.lib.format.open_memmap(os.path.join(staging, 'values.npy'), mode='w+',
+                                               dtype=np.float32, shape=(n_rows, n_features))
+            cloud_data = np.empty((len(cloud_idx), n_features), dtype=np.float32)
+        end = start + len(chunk_values)
+        values[start:end] = chunk_values
+        lo, hi = np.searchsorted(cloud_idx, [start, end])
+        cloud_data[lo:hi] = np.asarray(chunk_data)[cloud_idx[lo:hi] - start]
+        start = end
+    values.flush()
+    feature_names = header.get('feature_names') or [f'feature_{i}' for i in range(values.shape[1])]
+
+    importance = pd.DataFrame({
+        'feature': feature_names,
+        'mean_abs_shap': _mean_abs(values),
+        'mean_abs_shap_fail': _mean_abs(values, fail),
+        'mean_abs_shap_pass': _mean_abs(values, ~fail),
+        'mean_shap': np.asarray(values).mean(axis=0),
+    }).sort_values('mean_abs_shap', ascending=False)
+    importance.to_csv(os.path.join(staging, 'importance.csv'), index=False)
+
+    np.savez_compressed(os.path.join(staging, 'cloud.npz'), index=cloud_idx,
+                        values=np.asarray(values[cloud_idx]), data=cloud_data,
+                        labels=labels[cloud_idx])
+    np.save(os.path.join(staging, 'labels.npy'), labels)
+    del values
+
+    meta = {
+        'feature_names': feature_names,
+        'n_rows': n_rows,
+        'base_value': header.get('base_value'),
+        'model_version': model_version,
+        'cloud_rows': int(len(cloud_idx)),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    # 替換舊 store：舊資料夾先改名再刪除，App 不會讀到寫一半的檔案
+    if os.path.exists(out_dir):
+        retired = f"{out_dir}.old-{os.getpid()}"
+        os.replace(out_dir, retired)
+        os.replace(staging, out_dir)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        os.replace(staging, out_dir)
+    return out_dir
+
+
+class ShapStore:
+    """唯讀存取 SHAP store；SHAP 矩陣以 memory-map 開啟，只有用到的部分才會讀入"""
+
+    def __init__(self, store_dir, meta, importance, cloud, labels, values):
+        self.store_dir = store_dir
+        self.meta = meta
+        self.importance_table = importance
+        self.cloud = cloud
+        self.labels = labels
+        self.values = values
+
+    @classmethod
+    def load(cls, store_dir=STORE_DIR):
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        importance = pd.read_csv(os.path.join(store_dir, 'importance.csv'))
+        with np.load(os.path.join(store_dir, 'cloud.npz')) as npz:
+            cloud = {key: npz[key] for key in npz.files}
+        labels = np.load(os.path.join(store_dir, 'labels.npy'))
+        values = np.load(os.path.join(store_dir, 'values.npy'), mmap_mode='r')
+        return cls(store_dir, meta, importance, cloud, labels, values)
+
+    @staticmethod
+    def mtime(store_dir=STORE_DIR):
+        """store 的更新時間 (meta.json 修改時間)；不存在時回傳 None"""
+        try:
+            return os.path.getmtime(os.path.join(store_dir, 'meta.json'))
+        except OSError:
+            return None
+
+    @property
+    def feature_names(self):
+        return self.meta['feature_names']
+
+    def importance(self, group='all', contains=None, top_k=20):
+        """
+        全域特徵重要度 (預先計算好的平均 |SHAP|)
+        Args:
+            group: 'all' / 'fail' / 'pass'
+            contains: 特徵名稱篩選 (子字串，不分大小寫)
+        """
+        column = {'all': 'mean_abs_shap', 'fail': 'mean_abs_shap_fail', 'pass': 'mean_abs_shap_pass'}[group]
+        table = self.importance_table
+        if contains:
+            table = table[table['feature'].str.contains(contains, case=False, regex=False)]
+        table = table.sort_values(column, ascending=False).head(top_k)
+        return table.set_index('feature')[column].rename('mean |SHAP|')
+
+    def importance_for_rows(self, mask, chunk_rows=CHUNK_ROWS * 16):
+        """任意列篩選的平均 |SHAP| (分塊讀取 memory-map，不會一次載入整個矩陣)"""
+        mask = np.asarray(mask, dtype=bool)
+        total = np.zeros(self.values.shape[1], dtype=np.float64)
+        for start in range(0, len(mask), chunk_rows):
+            block_mask = mask[start:start + chunk_rows]
+            if block_mask.any():
+                total += np.abs(self.values[start:start + chunk_rows][block_mask]).sum(axis=0)
+        return pd.Series(total / max(mask.sum(), 1), index=self.feature_names).sort_values(ascending=False)
+
+    def dependence(self, feature, group='all'):
+        """某個特徵的 dependence 點雲：特徵值 vs SHAP 值"""
+        col = self.feature_names.index(feature)
+        frame = pd.DataFrame({
+            'value': self.cloud['data'][:, col],
+            'shap': self.cloud['values'][:, col],
+            'outcome': np.where(self.cloud['labels'] == 1, 'Fail', 'Pass'),
+        })
+        if group != 'all':
+            frame = frame[frame['outcome'] == group.capitalize()]
+        return frame
+
+    def save_summary_png(self, path, max_display=20):
+        """由點雲畫出 SHAP summary (beeswarm) 圖，供書面報告使用，不需重新計算 SHAP"""
+        import matplotlib.pyplot as plt
+        import shap
+
+        plt.close('all')
+        shap.summary_plot(self.cloud['values'], self.cloud['data'], feature_names=self.feature_names,
+                          max_display=max_display, show=False)
+        plt.savefig(path, dpi=150, bbox_inches='tight')
+        plt.close('all')
+        return path
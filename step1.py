@@ -4,21 +4,25 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pycaret.classification import load_model, plot_model
+from resource_ledger import ResourceLedger
 
 def run_step_1():
     print("開始執行步驟 1：模型深度優化...")
     
     # 確保 reports 資料夾存在，用來放生成的圖表
     os.makedirs('reports', exist_ok=True)
+    ledger = ResourceLedger('step1.py')
     
     # === 任務 A: 生成 Learning Curve 與過擬合報告 ===
     try:
         print("正在讀取模型 (這可能需要幾秒鐘)...")
         # 讀取你的最終模型 (PyCaret 會自動去抓 .pkl，所以不用打副檔名)
-        model = load_model('output/final_yield_prediction_model')
+        with ledger.stage('load_model'):
+            model = load_model('output/final_yield_prediction_model')
         
         print("正在繪製 Learning Curve...")
-        plot_model(model, plot='learning', save=True)
+        with ledger.stage('plot_model:learning'):
+            plot_model(model, plot='learning', save=True)
         
         # PyCaret 預設會把圖片存在目前資料夾，把它移動到 reports/ 裡面
         if os.path.exists('Learning Curve.png'):
@@ -58,26 +62,27 @@ def run_step_1():
         }
         df_comp = pd.DataFrame(data)
 
-        # 設定畫布與風格
-        plt.figure(figsize=(10, 6))
-        sns.set_theme(style="whitegrid")
-        ax = sns.barplot(x='Metric', y='Score', hue='Model', data=df_comp, palette='Set2')
+        with ledger.stage('comparison_chart'):
+            # 設定畫布與風格
+            plt.figure(figsize=(10, 6))
+            sns.set_theme(style="whitegrid")
+            ax = sns.barplot(x='Metric', y='Score', hue='Model', data=df_comp, palette='Set2')
 
-        # 在圖表上方標示數值
-        for container in ax.containers:
-            ax.bar_label(container, fmt='%.3f', padding=3, fontsize=11)
+            # 在圖表上方標示數值
+            for container in ax.containers:
+                ax.bar_label(container, fmt='%.3f', padding=3, fontsize=11)
 
-        # 圖表標題與排版
-        plt.title('Final Model Comparison: XGBoost vs CatBoost', fontsize=16, pad=20, fontweight='bold')
-        plt.ylim(0, 1.1)
-        plt.ylabel('Score', fontsize=12, fontweight='bold')
-        plt.xlabel('Evaluation Metric', fontsize=12, fontweight='bold')
-        plt.legend(title='Model', bbox_to_anchor=(1.05, 1), loc='upper left')
-        plt.tight_layout()
+            # 圖表標題與排版
+            plt.title('Final Model Comparison: XGBoost vs CatBoost', fontsize=16, pad=20, fontweight='bold')
+            plt.ylim(0, 1.1)
+            plt.ylabel('Score', fontsize=12, fontweight='bold')
+            plt.xlabel('Evaluation Metric', fontsize=12, fontweight='bold')
+            plt.legend(title='Model', bbox_to_anchor=(1.05, 1), loc='upper left')
+            plt.tight_layout()
 
-        # 儲存圖片
-        plt.savefig('reports/model_comparison_final.png', dpi=300, bbox_inches='tight')
-        plt.close()
+            # 儲存圖片
+            plt.savefig('reports/model_comparison_final.png', dpi=300, bbox_inches='tight')
+            plt.close()
         print("✅ 成功生成並儲存：reports/model_comparison_final.png")
 
     except Exception as e:
@@ -0,0 +1,472 @@
+"""
+串流評估 (Streaming Evaluation)
+
+plot_model 的混淆矩陣 / AUC / PR 曲線需要整份 holdout 放在記憶體；一整年的已標記生產晶圓放不下。
+這裡逐塊評分已標記資料，只累積可合併的統計量：
+- 幾個固定閾值下的混淆矩陣 (精確計數)
+- Fail / Pass 晶圓各自的分數直方圖 (預設 10,000 個等寬 bin)，由此得到 ROC / PR 曲線與 AUC
+  (同一 bin 內的分數視為同分，AUC 誤差最多為 bin 內同分造成的梯形差)
+- log loss / Brier 的總和
+
+ScoreHistogram 與 drift_monitor.SensorSketch 一樣可以相加合併：
+檔案分給 process pool (fork 後共用模型)，多台機器以 --shard-index 各自存一份 partial-*.npz，
+最後 --merge-only 合併後輸出與 plot_model 相同名稱的圖 (Confusion Matrix.png、AUC.png、Precision Recall.png)
+與 CSV (evaluation_metrics.csv、threshold_metrics.csv、roc_curve.csv、pr_curve.csv)。
+學習曲線需要重新訓練，仍由 plot_model 在記憶體內的訓練資料上計算。
+
+用法:
+    python streaming_eval.py "labeled/2025-*.parquet" --workers 8 --output reports/streaming_eval
+    python streaming_eval.py @files.txt --shard-index 0 --shard-count 4 --output /shared/eval --no-merge
+    python streaming_eval.py --merge-only --output /shared/eval
+"""
+import argparse
+import gc
+import glob
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from log_config import configure_logging
+
+OUTPUT_DIR = 'reports/streaming_eval'
+DEFAULT_MODEL_PATH = 'output/final_yield_prediction_model'
+N_BINS = 10000
+THRESHOLDS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+PROBA_EPS = 1e-15
+CURVE_POINTS = 1000
+
+# 與 plot_model(save=True) 相同的檔名
+REPORT_IMAGES = {
+    'confusion_matrix': 'Confusion Matrix.png',
+    'auc': 'AUC.png',
+    'pr': 'Precision Recall.png',
+}
+
+# worker 行程共用的模型 (在 fork 前由主行程設定)
+_MODEL = None
+
+
+class ScoreHistogram:
+    """
+    可合併的評估摘要
+    Fail / Pass 分數直方圖 + 固定閾值的混淆矩陣 + log loss / Brier 總和，任意多個 chunk 都可以相加
+    """
+
+    def __init__(self, n_bins=N_BINS, thresholds=THRESHOLDS, pos_counts=None, neg_counts=None,
+                 confusion=None, log_loss_sum=0.0, brier_sum=0.0):
+        self.n_bins = int(n_bins)
+        self.thresholds = np.asarray(sorted(set(float(t) for t in thresholds)), dtype=np.float64)
+        self.pos_counts = np.zeros(self.n_bins, dtype=np.int64) if pos_counts is None \
+            else np.asarray(pos_counts, dtype=np.int64)
+        self.neg_counts = np.zeros(self.n_bins, dtype=np.int64) if neg_counts is None \
+            else np.asarray(neg_counts, dtype=np.int64)
+        # 每個閾值一列：tn, fp, fn, tp
+        self.confusion = np.zeros((len(self.thresholds), 4), dtype=np.int64) if confusion is None \
+            else np.asarray(confusion, dtype=np.int64)
+        self.log_loss_sum = float(log_loss_sum)
+        self.brier_sum = float(brier_sum)
+
+    @property
+    def n_rows(self):
+        return int(self.pos_counts.sum() + self.neg_counts.sum())
+
+    @property
+    def positives(self):
+        return int(self.pos_counts.sum())
+
+    @property
+    def negatives(self):
+        return int(self.neg_counts.sum())
+
+    def empty_like(self):
+        return ScoreHistogram(self.n_bins, self.thresholds)
+
+    def update(self, y_true, proba):
+        """累積一個 chunk 的標籤 (0/1，SECOM 原始的 -1 視為 Pass) 與 Fail 機率 (原地更新並回傳自己)"""
+        y = np.asarray(y_true)
+        p = np.asarray(proba, dtype=np.float64)
+        keep = ~(pd.isna(y) | np.isnan(p))
+        y = y[keep].astype(np.int64) == 1
+        p = np.clip(p[keep], 0.0, 1.0)
+
+        bins = np.minimum((p * self.n_bins).astype(np.int64), self.n_bins - 1)
+        self.pos_counts += np.bincount(bins[y], minlength=self.n_bins)
+        self.neg_counts += np.bincount(bins[~y], minlength=self.n_bins)
+
+        predicted = p[:, None] >= self.thresholds[None, :]
+        actual = y[:, None]
+        self.confusion += np.column_stack([
+            (~predicted & ~actual).sum(axis=0),
+            (predicted & ~actual).sum(axis=0),
+            (~predicted & actual).sum(axis=0),
+            (predicted & actual).sum(axis=0),
+        ])
+        clipped = np.clip(p, PROBA_EPS, 1 - PROBA_EPS)
+        self.log_loss_sum += float(-np.where(y, np.log(clipped), np.log(1 - clipped)).sum())
+        self.brier_sum += float(((p - y) ** 2).sum())
+        return self
+
+    def merge(self, other):
+        """合併兩個摘要 (bin 數與閾值必須相同)，回傳新的摘要"""
+        if self.n_bins != other.n_bins or not np.array_equal(self.thresholds, other.thresholds):
+            raise ValueError("Cannot merge score histograms with different bins or thresholds")
+        return ScoreHistogram(self.n_bins, self.thresholds,
+                              self.pos_counts + other.pos_counts,
+                              self.neg_counts + other.neg_counts,
+                              self.confusion + other.confusion,
+                              self.log_loss_sum + other.log_loss_sum,
+                              self.brier_sum + other.brier_sum)
+
+    def _cumulative(self):
+        """由高分到低分累加：每個 bin 下界當閾值時的 (tp, fp, bin 下界)"""
+        tp = np.cumsum(self.pos_counts[::-1])
+        fp = np.cumsum(self.neg_counts[::-1])
+        edges = np.arange(self.n_bins - 1, -1, -1) / self.n_bins
+        return tp, fp, edges
+
+    def roc_curve(self):
+        """(fpr, tpr, thresholds)，從 (0, 0) 開始"""
+        tp, fp, edges = self._cumulative()
+        tpr = np.concatenate([[0.0], tp / max(self.positives, 1)])
+        fpr = np.concatenate([[0.0], fp / max(self.negatives, 1)])
+        return fpr, tpr, np.concatenate([[1.0], edges])
+
+    def auc(self):
+        if self.positives == 0 or self.negatives == 0:
+            return float('nan')
+        fpr, tpr, _ = self.roc_curve()
+        # 梯形法 (np.trapz / np.trapezoid 在 requirements 與新版 numpy 間改名，直接展開)
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    def pr_curve(self):
+        """(precision, recall, thresholds)，只保留有預測為 Fail 的閾值"""
+        tp, fp, edges = self._cumulative()
+        has_pred = (tp + fp) > 0
+        precision = tp[has_pred] / (tp + fp)[has_pred]
+        recall = tp[has_pred] / max(self.positives, 1)
+        return precision, recall, edges[has_pred]
+
+    def average_precision(self):
+        """與 sklearn average_precision_score 相同的階梯加總 (sum (R_k - R_k-1) * P_k)"""
+        if self.positives == 0:
+            return float('nan')
+        precision, recall, _ = self.pr_curve()
+        return float(np.sum(np.diff(np.concatenate([[0.0], recall])) * precision))
+
+    def confusion_at(self, threshold=0.5):
+        """指定閾值的 2x2 混淆矩陣 [[tn, fp], [fn, tp]] (閾值需在 thresholds 中)"""
+        matches = np.flatnonzero(np.isclose(self.thresholds, threshold))
+        if not len(matches):
+            raise ValueError(f"Threshold {threshold} was not tracked; tracked: {self.thresholds.tolist()}")
+        return self.confusion[matches[0]].reshape(2, 2)
+
+    def threshold_table(self):
+        """每個閾值的混淆矩陣與 Accuracy / Precision / Recall / F1 / Kappa / MCC"""
+        rows = [dict(threshold=t, **_confusion_metrics(c.reshape(2, 2)))
+                for t, c in zip(self.thresholds, self.confusion)]
+        return pd.DataFrame(rows)
+
+    def metrics(self, threshold=0.5):
+        """與 PyCaret pull() 相同欄位名稱的整體指標，另加 log loss / Brier"""
+        scores = _confusion_metrics(self.confusion_at(threshold))
+        n = max(self.n_rows, 1)
+        return {
+            'Accuracy': scores['accuracy'],
+            'AUC': self.auc(),
+            'Recall': scores['recall'],
+            'Prec.': scores['precision'],
+            'F1': scores['f1'],
+            'Kappa': scores['kappa'],
+            'MCC': scores['mcc'],
+            'AP': self.average_precision(),
+            'Log Loss': self.log_loss_sum / n,
+            'Brier': self.brier_sum / n,
+            'Threshold': threshold,
+            'Rows': self.n_rows,
+            'Fails': self.positives,
+        }
+
+    def save(self, path):
+        """存成壓縮 npz 檔 (分片結果與最後合併都用這個格式)"""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        np.savez_compressed(path, n_bins=np.array(self.n_bins), thresholds=self.thresholds,
+                            pos_counts=self.pos_counts, neg_counts=self.neg_counts, confusion=self.confusion,
+                            log_loss_sum=np.array(self.log_loss_sum), brier_sum=np.array(self.brier_sum))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            return cls(int(f['n_bins']), f['thresholds'], f['pos_counts'], f['neg_counts'], f['confusion'],
+                       float(f['log_loss_sum']), float(f['brier_sum']))
+
+
+def _confusion_metrics(matrix):
+    (tn, fp), (fn, tp) = np.asarray(matrix, dtype=np.float64)
+    n = tn + fp + fn + tp
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    accuracy = (tp + tn) / n if n else 0.0
+    expected = ((tp + fp) * (tp + fn) + (fn + tn) * (fp + tn)) / (n * n) if n else 0.0
+    kappa = (accuracy - expected) / (1 - expected) if expected < 1 else 0.0
+    denom = np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn))
+    mcc = (tp * tn - fp * fn) / denom if denom else 0.0
+    return {'tn': int(tn), 'fp': int(fp), 'fn': int(fn), 'tp': int(tp), 'accuracy': float(accuracy),
+            'precision': float(precision), 'recall': float(recall), 'f1': float(f1), 'kappa': float(kappa),
+            'mcc': float(mcc)}
+
+
+def iter_labeled_frames(path, chunk_rows=None):
+    """逐塊讀取已標記資料：CSV / Parquet 檔或 secom_store 目錄"""
+    from batch_score import iter_chunks, CHUNK_ROWS
+
+    if os.path.isdir(path):
+        from secom_store import SecomStore
+        yield from SecomStore(path).iter_frames()
+    else:
+        yield from iter_chunks(path, chunk_rows or CHUNK_ROWS)
+
+
+def evaluate_frames(model, frames, label='label', hist=None):
+    """逐塊評分並累積到 ScoreHistogram (每次只有一個 chunk 在記憶體中)"""
+    from model_registry import model_feature_names
+
+    hist = ScoreHistogram() if hist is None else hist
+    columns = None
+    for frame in frames:
+        if label not in frame.columns:
+            raise ValueError(f"Labeled data needs a '{label}' column")
+        if columns is None:
+            columns = model_feature_names(model)
+        with stage('streaming_eval', rows=len(frame)):
+            proba = np.asarray(model.predict_proba(frame[columns]))[:, 1]
+            hist.update(frame[label].to_numpy(), proba)
+    return hist
+
+
+def _evaluate_task(args):
+    path, chunk_rows, label, n_bins, thresholds = args
+    try:
+        hist = ScoreHistogram(n_bins, thresholds)
+        evaluate_frames(_MODEL, iter_labeled_frames(path, chunk_rows), label=label, hist=hist)
+        return path, hist, None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def evaluate_files(paths, model, workers=1, chunk_rows=None, label='label', n_bins=N_BINS, thresholds=THRESHOLDS):
+    """
+    以 process pool 評估多個檔案並合併結果 (fork 後 worker 共用主行程的模型)
+    Returns:
+        (ScoreHistogram, errors): errors 為 {path: 錯誤訊息}
+    """
+    global _MODEL
+    _MODEL = model
+    tasks = [(p, chunk_rows, label, n_bins, thresholds) for p in paths]
+    if workers <= 1 or len(tasks) <= 1:
+        results = [_evaluate_task(t) for t in tasks]
+    else:
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ctx.Pool(processes=min(workers, len(tasks))) as pool:
+            results = list(pool.imap_unordered(_evaluate_task, tasks, chunksize=1))
+
+    merged = ScoreHistogram(n_bins, thresholds)
+    errors = {}
+    for path, hist, error in results:
+        if error is not None:
+            errors[path] = error
+        else:
+            merged = merged.merge(hist)
+    return merged, errors
+
+
+def _downsample(*curves, points=CURVE_POINTS):
+    """曲線最多保留 points 個點 (CSV 與圖不需要 10,000 個 bin)"""
+    n = len(curves[0])
+    if n <= points:
+        return curves
+    idx = np.unique(np.linspace(0, n - 1, points).astype(np.int64))
+    return tuple(c[idx] for c in curves)
+
+
+def plot_confusion_matrix(hist, path, threshold=0.5):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    matrix = hist.confusion_at(threshold)
+    fig, ax = plt.subplots(figsize=(6, 5))
+    try:
+        ax.imshow(matrix, cmap='Greens')
+        for (i, j), count in np.ndenumerate(matrix):
+            ax.text(j, i, f"{count:,}", ha='center', va='center',
+                    color='white' if count > matrix.max() / 2 else 'black', fontsize=14)
+        ax.set_xticks([0, 1], labels=['Pass (0)', 'Fail (1)'])
+        ax.set_yticks([0, 1], labels=['Pass (0)', 'Fail (1)'])
+        ax.set_xlabel('Predicted Class')
+        ax.set_ylabel('True Class')
+        ax.set_title(f'Confusion Matrix (threshold {threshold:.2f}, {hist.n_rows:,} wafers)')
+        fig.tight_layout()
+        fig.savefig(path, dpi=100)
+    finally:
+        plt.close(fig)
+
+
+def plot_roc(hist, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fpr, tpr, _ = _downsample(*hist.roc_curve())
+    fig, ax = plt.subplots(figsize=(6, 5))
+    try:
+        ax.plot(fpr, tpr, label=f'ROC (AUC = {hist.auc():.3f})')
+        ax.plot([0, 1], [0, 1], linestyle='--', color='grey', label='Random')
+        ax.set_xlabel('False Positive Rate')
+        ax.set_ylabel('True Positive Rate')
+        ax.set_title(f'ROC Curve ({hist.n_rows:,} wafers)')
+        ax.legend(loc='lower right')
+        fig.tight_layout()
+        fig.savefig(path, dpi=100)
+    finally:
+        plt.close(fig)
+
+
+def plot_pr(hist, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    precision, recall, _ = _downsample(*hist.pr_curve())
+    fig, ax = plt.subplots(figsize=(6, 5))
+    try:
+        ax.step(recall, precision, where='post', label=f'AP = {hist.average_precision():.3f}')
+        ax.axhline(hist.positives / max(hist.n_rows, 1), linestyle='--', color='grey', label='Fail rate')
+        ax.set_xlabel('Recall')
+        ax.set_ylabel('Precision')
+        ax.set_ylim(0, 1.05)
+        ax.set_title(f'Precision-Recall Curve ({hist.n_rows:,} wafers)')
+        ax.legend(loc='upper right')
+        fig.tight_layout()
+        fig.savefig(path, dpi=100)
+    finally:
+        plt.close(fig)
+
+
+def write_reports(hist, output_dir, threshold=0.5, image_names=REPORT_IMAGES, csv_dir=None):
+    """
+    輸出評估圖與 CSV (圖檔名預設與 plot_model 相同，可用 image_names 改成各腳本原本的檔名)
+    Returns:
+        dict: 整體指標
+    """
+    csv_dir = csv_dir or output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(csv_dir, exist_ok=True)
+    plotters = {'confusion_matrix': lambda p: plot_confusion_matrix(hist, p, threshold),
+                'auc': lambda p: plot_roc(hist, p), 'pr': lambda p: plot_pr(hist, p)}
+    for kind, file_name in image_names.items():
+        with stage(f'streaming_eval_plot:{kind}'):
+            plotters[kind](os.path.join(output_dir, file_name))
+
+    metrics = hist.metrics(threshold)
+    pd.DataFrame([metrics]).to_csv(os.path.join(csv_dir, 'evaluation_metrics.csv'), index=False)
+    hist.threshold_table().to_csv(os.path.join(csv_dir, 'threshold_metrics.csv'), index=False)
+    fpr, tpr, roc_thresholds = _downsample(*hist.roc_curve())
+    pd.DataFrame({'threshold': roc_thresholds, 'fpr': fpr, 'tpr': tpr}).to_csv(
+        os.path.join(csv_dir, 'roc_curve.csv'), index=False)
+    precision, recall, pr_thresholds = _downsample(*hist.pr_curve())
+    pd.DataFrame({'threshold': pr_thresholds, 'precision': precision, 'recall': recall}).to_csv(
+        os.path.join(csv_dir, 'pr_curve.csv'), index=False)
+    return metrics
+
+
+def eval_inputs_from_env(name='YIELD_EVAL_DATA'):
+    """訓練 / 評估腳本使用的大型 holdout：逗號分隔的檔案、glob、@清單檔或 secom_store 目錄"""
+    from batch_score import expand_inputs
+
+    text = os.environ.get(name, '').strip()
+    if not text:
+        return []
+    patterns = [p.strip() for p in text.split(',') if p.strip()]
+    stores = [p for p in patterns if os.path.isdir(p)]
+    return stores + expand_inputs([p for p in patterns if p not in stores])
+
+
+def partial_path(output_dir, shard_index):
+    return os.path.join(output_dir, 'partials', f'partial-{shard_index:04d}.npz')
+
+
+def merge_partials(output_dir):
+    """合併所有分片的 partial-*.npz"""
+    paths = sorted(glob.glob(os.path.join(output_dir, 'partials', 'partial-*.npz')))
+    if not paths:
+        raise FileNotFoundError(f"No partial results under {os.path.join(output_dir, 'partials')}")
+    merged = ScoreHistogram.load(paths[0])
+    for path in paths[1:]:
+        merged = merged.merge(ScoreHistogram.load(path))
+    return merged, len(paths)
+
+
+def main():
+    from batch_score import expand_inputs, shard_files, load_model_for_scoring
+    import batch_score
+
+    parser = argparse.ArgumentParser(description="Evaluate a model on labeled data too large for memory")
+    parser.add_argument('inputs', nargs='*', help="labeled CSV/Parquet files, globs (quote them), @list.txt "
+                                                  "or a secom_store directory")
+    parser.add_argument('--output', default=OUTPUT_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shard-index', type=int, default=0)
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--chunk-rows', type=int, default=None)
+    parser.add_argument('--label', default='label')
+    parser.add_argument('--threshold', type=float, default=0.5, help="threshold for the confusion matrix image")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH,
+                        help="fallback model path without .pkl (used only when the registry is empty)")
+    parser.add_argument('--no-merge', action='store_true', help="only write this shard's partial result")
+    parser.add_argument('--merge-only', action='store_true', help="only merge existing partial results")
+    args = parser.parse_args()
+
+    configure_logging('streaming_eval', profile='scoring')
+    os.makedirs(args.output, exist_ok=True)
+    errors = {}
+    thresholds = sorted(set(THRESHOLDS) | {args.threshold})
+    if not args.merge_only:
+        stores = [p for p in args.inputs if os.path.isdir(p)]
+        all_files = stores + expand_inputs([p for p in args.inputs if p not in stores])
+        if not all_files:
+            parser.error("no input files matched")
+        version = load_model_for_scoring(args.model)
+        shard = shard_files(all_files, args.shard_index, args.shard_count)
+        print(f"🧩 Shard {args.shard_index + 1}/{args.shard_count}: evaluating {len(shard)} files "
+              f"with {args.workers} workers (model {version})")
+        start = time.perf_counter()
+        hist, errors = evaluate_files(shard, batch_score._PIPELINE, workers=args.workers,
+                                      chunk_rows=args.chunk_rows, label=args.label, thresholds=thresholds)
+        elapsed = time.perf_counter() - start
+        hist.save(partial_path(args.output, args.shard_index))
+        print(f"   -> {hist.n_rows} wafers in {elapsed:.1f} s ({hist.n_rows / max(elapsed, 1e-9):.0f} rows/s)")
+        for path, error in errors.items():
+            print(f"   ❌ {path}: {error}")
+
+    if not args.no_merge:
+        hist, n_parts = merge_partials(args.output)
+        metrics = write_reports(hist, args.output, threshold=args.threshold)
+        print(f"📊 Merged {n_parts} partial results: {metrics['Rows']:,} wafers, AUC {metrics['AUC']:.4f}, "
+              f"F1 {metrics['F1']:.4f} -> {args.output}")
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+
+# 將上一層目錄加入路徑，這樣才能 import batch_score
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+
+import batch_score
+from ensemble import ModelEnsemble
+from input_validation import SensorBounds
+
+FEATURES = [f'feature_{i}' for i in range(5)]
+
+@pytest.fixture
+def model():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(300, 5)), columns=FEATURES)
+    y = (X['feature_0'] > 0.7).astype(int)
+    pipeline = Pipeline([('impute', SimpleImputer()), ('model', LogisticRegression())]).fit(X, y)
+    # 單一成員的集成走 predict_frame，不需要 PyCaret
+    return ModelEnsemble([pipeline], [1.0]), SensorBounds.from_data(X)
+
+@pytest.fixture
+def exports(tmp_path):
+    rng = np.random.default_rng(1)
+    folder = tmp_path / 'exports'
+    folder.mkdir()
+    for i in range(5):
+        data = pd.DataFrame(rng.normal(size=(40, 5)), columns=FEATURES)
+        data.insert(0, 'wafer_id', [f'L{i}-W{j:02d}' for j in range(40)])
+        data.to_csv(folder / f'lot_{i}.csv', index=False)
+    return folder
+
+def test_expand_inputs_and_sharding(exports, tmp_path):
+    """測試：glob 與清單檔展開後去重排序；各分片互不重疊且涵蓋全部檔案"""
+    listing = tmp_path / 'files.txt'
+    listing.write_text(f"{exports / 'lot_0.csv'}\n# comment\n{exports / 'notes.txt'}\n")
+    paths = batch_score.expand_inputs([str(exports / '*.csv'), f'@{listing}'])
+    assert len(paths) == 5 and paths == sorted(paths)
+
+    shards = [batch_score.shard_files(paths, i, 3) for i in range(3)]
+    assert sorted(p for shard in shards for p in shard) == paths
+    assert [len(s) for s in shards] == [2, 2, 1]
+    with pytest.raises(ValueError):
+        batch_score.shard_files(paths, 3, 3)
+
+def test_score_file_writes_part_and_marker(model, exports, tmp_path):
+    """測試：單檔評分寫出分區與完成標記；驗證失敗的列不評分；輸入變更後標記失效"""
+    pipeline, bounds = model
+    path = str(exports / 'lot_0.csv')
+    data = pd.read_csv(path)
+    data.loc[3, 'feature_2'] = 1e6
+    data.to_csv(path, index=False)
+
+    out = str(tmp_path / 'scores')
+    marker = batch_score.score_file(path, out, pipeline, 'v0001', bounds=bounds, id_column='wafer_id', chunk_rows=16)
+    part = pd.read_csv(marker['part'])
+    assert len(part) == 40 and marker['rows'] == 40
+    assert marker['rejected'] == 1 and marker['scored'] == 39
+    assert part.loc[3, 'reject_reason'].startswith('out of range')
+    assert np.isnan(part.loc[3, 'prediction_score'])
+    assert marker['top_risks'][0]['wafer_id'].startswith('L0-')
+
+    assert batch_score.is_complete(out, path, 'v0001')
+    assert not batch_score.is_complete(out, path, 'v0002')
+    data.to_csv(path, index=False, float_format='%.3f')
+    assert not batch_score.is_complete(out, path, 'v0001')
+
+def test_parallel_shard_and_merged_summary(model, exports, tmp_path, monkeypatch):
+    """測試：process pool 評分一個分片，合併摘要只含已完成的檔案並列出缺少的檔案"""
+    pipeline, bounds = model
+    monkeypatch.setattr(batch_score, '_PIPELINE', pipeline)
+    monkeypatch.setattr(batch_score, '_MODEL_VERSION', 'v0001')
+    monkeypatch.setattr(batch_score, '_BOUNDS', bounds)
+    out = str(tmp_path / 'scores')
+    paths = batch_score.expand_inputs([str(exports / '*.csv')])
+
+    results = batch_score.run_shard(batch_score.shard_files(paths, 0, 2), out, workers=2, id_column='wafer_id')
+    assert all('error' not in r for r in results)
+    summary = batch_score.merge_summary(out, expected_files=paths, top_k=10)
+    assert summary['files_completed'] == 3
+    assert summary['files_missing'] == batch_score.shard_files(paths, 1, 2)
+    assert summary['scored'] == 120
+    assert summary['yield'] == pytest.approx(1 - summary['fails'] / 120, abs=1e-4)
+
+    top = pd.read_csv(os.path.join(out, 'top_risks.csv'))
+    assert len(top) == 10 and top['fail_probability'].is_monotonic_decreasing
+    with open(os.path.join(out, 'summary.json')) as f:
+        assert json.load(f)['model_versions'] == ['v0001']
@@ -0,0 +1,78 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import drift_monitor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drift_monitor import SensorSketch, compute_drift, top_drifted
+
+@pytest.fixture
+def training_data():
+    """產生模擬的訓練資料 (3 個感測器 + label)"""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'feature_1': rng.normal(0, 1, 2000),
+        'feature_2': rng.normal(10, 2, 2000),
+        'feature_3': rng.uniform(0, 1, 2000),
+        'label': rng.integers(0, 2, 2000)
+    })
+
+def test_reference_excludes_label(training_data):
+    """測試：參考分佈不應包含 label 欄位"""
+    ref = SensorSketch.from_data(training_data, n_bins=10)
+    assert ref.feature_names == ['feature_1', 'feature_2', 'feature_3']
+    assert ref.counts.shape == (3, 10)
+    assert ref.counts.sum(axis=1).tolist() == [2000, 2000, 2000]
+
+def test_same_distribution_has_low_psi(training_data):
+    """測試：同分佈的新批次 PSI 應接近 0"""
+    ref = SensorSketch.from_data(training_data)
+    rng = np.random.default_rng(1)
+    batch = pd.DataFrame({
+        'feature_1': rng.normal(0, 1, 1000),
+        'feature_2': rng.normal(10, 2, 1000),
+        'feature_3': rng.uniform(0, 1, 1000),
+    })
+    drift = compute_drift(ref, ref.empty_like().update(batch))
+    assert (drift['psi'] < 0.1).all()
+    assert (drift['level'] == 'Stable').all()
+
+def test_shifted_sensor_ranks_first(training_data):
+    """測試：偏移的感測器應排在最前面"""
+    ref = SensorSketch.from_data(training_data)
+    batch = training_data.drop(columns='label').copy()
+    batch['feature_2'] = batch['feature_2'] + 5
+    worst = top_drifted(ref, ref.empty_like().update(batch), k=1)
+    assert worst.loc[0, 'feature'] == 'feature_2'
+    assert worst.loc[0, 'level'] == 'Major'
+
+def test_merge_equals_single_pass(training_data):
+    """測試：分批累積後合併，應與一次累積結果完全相同"""
+    ref = SensorSketch.from_data(training_data)
+    first, second = training_data.iloc[:700], training_data.iloc[700:]
+    merged = ref.empty_like().update(first).merge(ref.empty_like().update(second))
+    single = ref.empty_like().update(training_data)
+    assert np.array_equal(merged.counts, single.counts)
+    assert merged.n_rows == single.n_rows == 2000
+
+def test_missing_and_text_values_counted_as_nan(training_data):
+    """測試：缺少的欄位與文字內容應計入 NaN，而不是報錯"""
+    ref = SensorSketch.from_data(training_data)
+    batch = pd.DataFrame({'feature_1': ['abc', '0.5'], 'feature_2': [1.0, 2.0]})
+    sketch = ref.empty_like().update(batch)
+    assert sketch.nan_counts.tolist() == [1, 0, 2]
+    drift = compute_drift(ref, sketch)
+    assert drift.loc[2, 'level'] == 'No Data'
+
+def test_save_and_load_roundtrip(training_data, tmp_path):
+    """測試：存檔後讀回的摘要內容一致"""
+    ref = SensorSketch.from_data(training_data)
+    path = str(tmp_path / 'drift_reference.npz')
+    ref.save(path)
+    loaded = SensorSketch.load(path)
+    assert loaded.feature_names == ref.feature_names
+    assert np.array_equal(loaded.counts, ref.counts)
+    assert loaded.n_rows == ref.n_rows
@@ -0,0 +1,103 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import pickle
+import time
+
+# 將上一層目錄加入路徑，這樣才能 import ensemble
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.pipeline import Pipeline
+from sklearn.tree import DecisionTreeClassifier
+
+from ensemble import ModelEnsemble, cross_fitted_proba, explain_pipeline, fit_weights, predict_frame, preprocessing_matches
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(400, 6)), columns=[f'feature_{i}' for i in range(6)])
+    X.iloc[::11, 1] = np.nan
+    y = (X['feature_0'] + 0.5 * X['feature_2'] > 0.8).astype(int)
+    return X, y
+
+def make_pipeline(estimator, X, y):
+    return Pipeline([('impute', SimpleImputer()), ('model', estimator)]).fit(X, y)
+
+class SlowModel:
+    """假模型：預測時睡眠 (與原生 predictor 一樣會釋放 GIL)"""
+    def __init__(self, delay, p):
+        self.delay, self.p = delay, p
+
+    def predict_proba(self, X):
+        time.sleep(self.delay)
+        return np.column_stack([np.full(len(X), 1 - self.p), np.full(len(X), self.p)])
+
+def test_fit_weights_prefers_informative_model(dataset):
+    """測試：權重非負、總和為 1，且偏向有資訊的模型"""
+    X, y = dataset
+    rng = np.random.default_rng(1)
+    good = np.clip(y * 0.8 + 0.1 + rng.normal(scale=0.05, size=len(y)), 0, 1)
+    noise = rng.random(len(y))
+    weights = fit_weights(np.column_stack([noise, good]), y)
+    assert weights.sum() == pytest.approx(1.0)
+    assert (weights >= 0).all()
+    assert weights[1] > 0.8
+
+def test_cross_fitted_gate_does_not_reward_noise():
+    """測試：純雜訊模型在擬合權重的同一批資料上看似有效，交叉擬合的 AUC 則接近隨機"""
+    rng = np.random.default_rng(0)
+    y = (rng.random(120) < 0.3).astype(int)
+    noise = rng.random((120, 20))
+    in_sample = roc_auc_score(y, noise @ fit_weights(noise, y))
+    cross_fitted = roc_auc_score(y, cross_fitted_proba(noise, y))
+    assert in_sample > 0.65
+    assert cross_fitted < 0.6
+
+def test_blended_prediction_matches_weighted_average(dataset):
+    """測試：集成機率等於加權平均；共用前處理與各自前處理結果相同；輸出格式與 predict_model 一致"""
+    X, y = dataset
+    members = [make_pipeline(LogisticRegression(), X, y),
+               make_pipeline(DecisionTreeClassifier(max_depth=3, random_state=0), X, y)]
+    weights = [0.7, 0.3]
+    expected = sum(w * m.predict_proba(X)[:, 1] for w, m in zip(weights, members))
+
+    assert preprocessing_matches(members, X.head(50))
+    separate = ModelEnsemble(members, weights)
+    shared = ModelEnsemble(members, weights, shared_preprocessing=True)
+    np.testing.assert_allclose(separate.predict_proba(X)[:, 1], expected)
+    np.testing.assert_allclose(shared.predict_proba(X)[:, 1], expected)
+
+    result = predict_frame(shared, X)
+    assert list(result.columns) == list(X.columns) + ['prediction_label', 'prediction_score']
+    assert (result['prediction_label'] == (expected >= 0.5)).all()
+    np.testing.assert_allclose(result['prediction_score'], np.round(np.maximum(expected, 1 - expected), 4))
+    assert separate.names == ['LogisticRegression', 'DecisionTreeClassifier']
+
+def test_members_are_scored_concurrently(dataset):
+    """測試：三個各需 0.3 秒的模型同時預測，總時間接近單一模型而不是相加"""
+    X, _ = dataset
+    ens = ModelEnsemble([SlowModel(0.3, p) for p in (0.2, 0.4, 0.9)], [0.2, 0.3, 0.5])
+    ens.predict_proba(X.head(5))  # 先建立 thread pool
+    start = time.perf_counter()
+    proba = ens.predict_proba(X.head(5))[:, 1]
+    assert time.perf_counter() - start < 0.6
+    np.testing.assert_allclose(proba, 0.2 * 0.2 + 0.3 * 0.4 + 0.5 * 0.9)
+
+def test_pickle_round_trip_and_explain_member(dataset):
+    """測試：集成可 pickle (thread pool 不會被存下)，SHAP 使用權重最高的成員"""
+    X, y = dataset
+    members = [make_pipeline(LogisticRegression(), X, y),
+               make_pipeline(DecisionTreeClassifier(max_depth=3, random_state=0), X, y)]
+    ens = ModelEnsemble(members, [0.25, 0.75])
+    before = ens.predict_proba(X)
+    restored = pickle.loads(pickle.dumps(ens))
+    np.testing.assert_allclose(restored.predict_proba(X), before)
+    assert explain_pipeline(restored) is restored.members[1]
+    assert list(restored.feature_names_in_) == list(X.columns)
+    with pytest.raises(ValueError):
+        ModelEnsemble(members, [1.0])
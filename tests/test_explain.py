@@ -0,0 +1,66 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import explain
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from explain import compare_attributions, batch_importance, concat_results, compute_shap, approximation_error
+
+def test_compare_attributions():
+    """測試：完全相同時誤差為零；加入雜訊後相對誤差與排名指標合理"""
+    rng = np.random.default_rng(0)
+    exact = rng.normal(size=(100, 30)) * np.linspace(3, 0.1, 30)
+    same = compare_attributions(exact, exact.copy(), top_k=10)
+    assert same['mean_abs_error'] == 0 and same['relative_error'] == 0
+    assert same['importance_spearman'] == pytest.approx(1.0) and same['top_k_overlap'] == 1.0
+    assert same['row_top_driver_agreement'] == 1.0
+
+    noisy = compare_attributions(exact, exact + rng.normal(scale=0.05, size=exact.shape), top_k=10)
+    assert 0 < noisy['relative_error'] < 0.1
+    assert noisy['importance_spearman'] > 0.9 and noisy['top_k_overlap'] >= 0.9
+
+    with pytest.raises(ValueError):
+        compare_attributions(exact, exact[:, :5])
+
+def test_batch_importance_and_concat():
+    """測試：分段結果合併後的批次摘要依平均 |SHAP| 排序"""
+    parts = [{'values': np.array([[1.0, -3.0, 0.0]]), 'data': np.zeros((1, 3)), 'index': [10],
+              'feature_names': ['a', 'b', 'c'], 'base_value': 0.1, 'method': 'approximate'},
+             {'values': np.array([[1.0, 1.0, 0.5]]), 'data': np.ones((1, 3)), 'index': [11],
+              'feature_names': ['a', 'b', 'c'], 'base_value': 0.1, 'method': 'approximate'}]
+    merged = concat_results(parts)
+    assert merged['values'].shape == (2, 3) and merged['index'] == [10, 11]
+    assert concat_results(merged) is merged
+
+    table = batch_importance(merged, top_k=2)
+    assert list(table.index) == ['b', 'a']
+    assert table.loc['b', 'mean |SHAP|'] == 2.0 and table.loc['b', 'mean SHAP'] == -1.0
+
+def test_unknown_method_rejected():
+    """測試：不支援的解釋模式直接報錯"""
+    with pytest.raises(ValueError):
+        compute_shap(None, pd.DataFrame(), method='kernel')
+
+def test_approximate_matches_exact_on_forest():
+    """測試：隨機森林的近似歸因同樣滿足加總等於預測機率，且與 exact 排名一致"""
+    pytest.importorskip('shap')
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+
+    rng = np.random.default_rng(1)
+    X = pd.DataFrame(rng.normal(size=(300, 8)), columns=[f'feature_{i}' for i in range(8)])
+    y = (X['feature_0'] + 0.5 * X['feature_1'] > 0).astype(int)
+    pipeline = Pipeline([('impute', SimpleImputer()),
+                         ('model', RandomForestClassifier(n_estimators=20, max_depth=4, random_state=0))])
+    pipeline.fit(X, y)
+
+    result = compute_shap(pipeline, X.head(50), method='approximate')
+    np.testing.assert_allclose(result['values'].sum(axis=1) + result['base_value'],
+                               pipeline.predict_proba(X.head(50))[:, 1], atol=1e-6)
+    report = approximation_error(pipeline, X, sample_rows=100, top_k=2)
+    assert report['rows'] == 100 and report['top_k_overlap'] == 1.0
+    assert report['importance_spearman'] > 0.8
@@ -0,0 +1,98 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import fast_smote
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_smote
+from fast_smote import FastSMOTE, knn_exact, knn_approx
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv('YIELD_SMOTE_CACHE_DIR', str(tmp_path / 'graphs'))
+    fast_smote.clear_cache()
+
+@pytest.fixture
+def imbalanced():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(300, 40)), columns=[f'feature_{i}' for i in range(40)])
+    y = pd.Series(np.r_[np.zeros(270, dtype=int), np.ones(30, dtype=int)], name='label')
+    X.iloc[270:] += 3.0
+    return X, y
+
+def test_exact_knn_matches_sklearn():
+    """測試：分塊 kNN 與 sklearn NearestNeighbors 結果一致"""
+    from sklearn.neighbors import NearestNeighbors
+    X = np.random.default_rng(1).normal(size=(200, 30))
+    expected = NearestNeighbors(n_neighbors=6).fit(X).kneighbors(X, return_distance=False)[:, 1:]
+    assert (knn_exact(X, 5, block_rows=37) == expected).all()
+    assert (knn_exact(X, 5, block_rows=37, n_jobs=4) == expected).all()
+
+def test_approx_knn_recall():
+    """測試：近似 kNN 找到的鄰居大部分與精確結果相同"""
+    rng = np.random.default_rng(2)
+    centers = rng.normal(scale=10, size=(20, 400))
+    X = centers[rng.integers(0, 20, size=600)] + rng.normal(size=(600, 400))
+    exact = knn_exact(X, 5)
+    approx = knn_approx(X, 5, random_state=0)
+    recall = np.mean([len(set(a) & set(e)) / 5 for a, e in zip(approx, exact)])
+    assert recall > 0.8
+
+def test_resample_balances_classes(imbalanced, tmp_path):
+    """測試：少數類別補到與多數類別相同，新樣本落在少數類別樣本之間"""
+    X, y = imbalanced
+    X_res, y_res = FastSMOTE(random_state=0, timing_log=str(tmp_path / 't.csv')).fit_resample(X, y)
+    assert list(X_res.columns) == list(X.columns)
+    assert y_res.name == 'label'
+    assert y_res.value_counts().tolist() == [270, 270]
+    synthetic = X_res.iloc[300:].to_numpy()
+    minority = X.iloc[270:].to_numpy()
+    assert (synthetic >= minority.min(axis=0) - 1e-9).all()
+    assert (synthetic <= minority.max(axis=0) + 1e-9).all()
+
+def test_neighbor_graph_cached_and_timed(imbalanced, tmp_path):
+    """測試：同一份 fold 資料第二次重抽樣時命中鄰居圖快取，並記錄耗時"""
+    X, y = imbalanced
+    log_path = str(tmp_path / 'smote_timing.csv')
+    smote = FastSMOTE(mode='exact', random_state=0, timing_log=log_path)
+    smote.fit_resample(X, y)
+    smote.fit_resample(X, y)
+    log = pd.read_csv(log_path)
+    assert log['cache_hit'].tolist() == [False, True]
+    assert (log['generated'] == 240).all()
+    assert fast_smote.timing_summary(log_path).loc['exact', 'calls'] == 2
+
+def test_neighbor_graph_shared_across_processes(imbalanced):
+    """測試：另一個 CV worker 行程 (行程內快取是空的) 可從磁碟快取讀到同一份鄰居圖"""
+    X, _ = imbalanced
+    minority = X.iloc[270:].to_numpy()
+    first, hit = fast_smote.neighbor_graph(minority, 5)
+    assert not hit
+    fast_smote._GRAPH_CACHE.clear()     # 模擬另一個 loky worker
+    second, hit = fast_smote.neighbor_graph(minority, 5)
+    assert hit
+    assert (first == second).all()
+
+def test_recall_matches_imblearn_smote(tmp_path):
+    """測試：下游模型的 recall 與 imblearn SMOTE 相差在容許範圍內"""
+    imblearn_over = pytest.importorskip('imblearn.over_sampling')
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import recall_score
+    rng = np.random.default_rng(3)
+    X = rng.normal(size=(2000, 60))
+    y = (rng.random(2000) < 0.07).astype(int)
+    X[y == 1, :10] += 0.8
+    X_train, y_train, X_test, y_test = X[:1400], y[:1400], X[1400:], y[1400:]
+
+    def recall_with(sampler):
+        X_res, y_res = sampler.fit_resample(X_train, y_train)
+        model = LogisticRegression(max_iter=1000).fit(X_res, y_res)
+        return recall_score(y_test, model.predict(X_test))
+
+    baseline = recall_with(imblearn_over.SMOTE(random_state=0))
+    for mode in ('exact', 'approx'):
+        fast = recall_with(FastSMOTE(mode=mode, random_state=0, timing_log=str(tmp_path / 't.csv')))
+        assert abs(fast - baseline) <= 0.1
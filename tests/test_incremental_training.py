@@ -0,0 +1,75 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import incremental_training
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from ensemble import ModelEnsemble
+from incremental_training import continue_training, incremental_update, full_retrain, holdout_metrics, write_report
+
+def _lots(seed, n=400):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, 6)), columns=[f'feature_{i}' for i in range(6)])
+    y = pd.Series((X['feature_0'] - X['feature_1'] > 1).astype(int), name='label')
+    return X, y
+
+@pytest.fixture
+def trained_pipeline():
+    X, y = _lots(0)
+    return Pipeline([('scale', StandardScaler()),
+                     ('actual_estimator', RandomForestClassifier(n_estimators=20, random_state=0))]).fit(X, y)
+
+def test_random_forest_adds_trees_without_touching_original(trained_pipeline):
+    """測試：RF 以 warm_start 增加樹，舊模型保持不變"""
+    X, y = _lots(1)
+    original = trained_pipeline.steps[-1][1]
+    model = continue_training(original, trained_pipeline[:-1].transform(X), y, extra_trees=10)
+    assert len(model.estimators_) == 30
+    assert len(original.estimators_) == 20
+
+def test_update_reuses_preprocessing_statistics(trained_pipeline):
+    """測試：增量訓練沿用原本的前處理統計值，不會重新 fit"""
+    X, y = _lots(2)
+    scaler_mean = trained_pipeline.steps[0][1].mean_.copy()
+    new_pipeline, fit_sec = incremental_update(trained_pipeline, X + 5.0, y, extra_trees=5)
+    assert np.allclose(new_pipeline.steps[0][1].mean_, scaler_mean)
+    assert len(new_pipeline.steps[-1][1].estimators_) == 25
+    assert len(trained_pipeline.steps[-1][1].estimators_) == 20
+    assert fit_sec >= 0
+
+def test_unsupported_model_requires_full_retrain():
+    """測試：不支援接續訓練的模型應提示改用完整重訓"""
+    X, y = _lots(3)
+    with pytest.raises(ValueError):
+        continue_training(LogisticRegression().fit(X, y), X, y)
+
+def test_ensemble_base_is_refused(trained_pipeline):
+    """測試：ACTIVE 為集成模型時應明確拒絕，而不是在 transform 時失敗"""
+    X, y = _lots(5)
+    ensemble = ModelEnsemble([trained_pipeline, trained_pipeline], [0.5, 0.5])
+    with pytest.raises(ValueError, match='single-model version'):
+        incremental_update(ensemble, X, y, extra_trees=5)
+
+def test_full_retrain_baseline_and_report(trained_pipeline, tmp_path):
+    """測試：完整重訓對照組的樹數量相同，報告列出節省時間與各模型指標"""
+    X, y = _lots(4)
+    baseline, full_sec = full_retrain(trained_pipeline, X, y, extra_trees=5)
+    assert baseline.steps[-1][1].n_estimators == 25
+
+    metrics = holdout_metrics(trained_pipeline, X, y)
+    assert set(metrics) == {'Recall', 'Prec.', 'F1', 'AUC'}
+    report_path = tmp_path / 'report.md'
+    write_report({'base_version': 'v0001-aaaa', 'new_version': 'v0002-bbbb', 'activated': True,
+                  'model': 'RandomForestClassifier', 'extra_trees': 5, 'new_rows': 400, 'holdout_rows': 100,
+                  'incremental_sec': 0.5, 'full_retrain_sec': 2.0, 'max_drop': 0.02, 'passed': True,
+                  'holdout': {'current': metrics, 'incremental': metrics}}, path=str(report_path))
+    text = report_path.read_text(encoding='utf-8')
+    assert 'saved 1.50 s, 75%' in text
+    assert '| Recall |' in text
@@ -0,0 +1,77 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import input_validation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from input_validation import BatchValidator, SensorBounds, validate_batch
+
+FEATURES = [f'feature_{i}' for i in range(20)]
+
+@pytest.fixture
+def training():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(500, 20)), columns=FEATURES)
+    data.iloc[::10, 4] = np.nan
+    return data.assign(label=rng.integers(0, 2, size=500))
+
+def test_clean_batch_passes(training):
+    """測試：與訓練資料同分佈的批次全部通過，多餘欄位不影響"""
+    bounds = SensorBounds.from_data(training)
+    assert bounds.feature_names == FEATURES
+    result = validate_batch(training, bounds)
+    assert not result['reject'].any()
+    assert result['summary']['accepted'] == 500
+    assert result['report'].empty
+
+def test_rejects_bad_rows_with_reasons(training):
+    """測試：文字內容、超出範圍、缺值過多的列被拒絕並標示原因"""
+    bounds = SensorBounds.from_data(training)
+    batch = training.drop(columns='label').head(10).copy()
+    batch['feature_3'] = batch['feature_3'].astype(object)
+    batch.iloc[1, 3] = 'ERR'
+    batch.iloc[2, 7] = 1e6
+    batch.iloc[3, 8] = -np.inf
+    batch.iloc[4, :15] = np.nan
+
+    result = validate_batch(batch, bounds)
+    assert result['reject'].tolist() == [False, True, True, True, True] + [False] * 5
+    reasons = result['reasons']
+    assert reasons.iloc[1] == 'non-numeric: feature_3'
+    assert reasons.iloc[2] == 'out of range: feature_7'
+    assert reasons.iloc[3] == 'out of range: feature_8'
+    assert reasons.iloc[4].startswith('NaN rate')
+    assert reasons.iloc[0] == ''
+    assert result['summary']['rejected_by'] == {'non_numeric': 1, 'out_of_range': 2, 'nan_rate': 1}
+    assert set(result['report']['feature']) >= {'feature_3', 'feature_7', 'feature_8'}
+
+def test_missing_sensor_rejects_whole_batch(training):
+    """測試：缺少必要感測器時整批拒絕"""
+    bounds = SensorBounds.schema_only(FEATURES)
+    batch = training.drop(columns=['label', 'feature_5'])
+    result = validate_batch(batch, bounds)
+    assert result['reject'].all()
+    assert result['summary']['missing_columns'] == ['feature_5']
+    assert 'missing sensors: feature_5' in result['reasons'].iloc[0]
+
+def test_chunked_matches_single_pass_and_round_trip(tmp_path, training):
+    """測試：存成 JSON 後載入結果相同，逐 chunk 驗證與整批一次驗證一致"""
+    path = str(tmp_path / 'input_bounds.json')
+    SensorBounds.from_data(training).save(path)
+    bounds = SensorBounds.load(path)
+
+    batch = training.drop(columns='label').copy()
+    batch.iloc[::37, 2] = 50.0
+    whole = validate_batch(batch, bounds)
+    chunked = validate_batch(batch, bounds, chunk_rows=64)
+    np.testing.assert_array_equal(whole['reject'], chunked['reject'])
+    pd.testing.assert_series_equal(whole['reasons'], chunked['reasons'])
+    pd.testing.assert_frame_equal(whole['report'], chunked['report'])
+
+    validator = BatchValidator(bounds)
+    for start in range(0, len(batch), 100):
+        validator.update(batch.iloc[start:start + 100])
+    assert validator.summary()['rejected'] == whole['reject'].sum() == len(batch.iloc[::37])
@@ -0,0 +1,65 @@
+import pytest
+import json
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import instrumentation
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrumentation
+from instrumentation import stage
+
+@pytest.fixture
+def metrics_enabled():
+    """測試期間開啟量測，結束後恢復原狀"""
+    previous = instrumentation.is_enabled()
+    instrumentation.set_enabled(True)
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+    instrumentation.set_enabled(previous)
+
+def test_disabled_stage_records_nothing():
+    """測試：未啟用時 stage() 不應記錄任何資料"""
+    instrumentation.set_enabled(False)
+    instrumentation.reset()
+    with stage('csv_parse') as s:
+        s.add_rows(10)
+    assert instrumentation.snapshot()['stages'] == {}
+
+def test_stage_counts_calls_and_rows(metrics_enabled):
+    """測試：啟用時應累計呼叫次數與處理筆數"""
+    for _ in range(3):
+        with stage('predict_model', rows=5):
+            pass
+    stats = instrumentation.snapshot()['stages']['predict_model']
+    assert stats['count'] == 3
+    assert stats['rows'] == 15
+    assert sum(stats['buckets'].values()) == 3
+
+def test_stage_records_errors(metrics_enabled):
+    """測試：階段內發生例外時應計入 errors，且例外照常拋出"""
+    with pytest.raises(ValueError):
+        with stage('shap_values'):
+            raise ValueError("boom")
+    assert instrumentation.snapshot()['stages']['shap_values']['errors'] == 1
+
+def test_prometheus_format(metrics_enabled):
+    """測試：Prometheus 輸出應包含 histogram 與 +Inf bucket"""
+    with stage('render_pie'):
+        pass
+    text = instrumentation.render_prometheus()
+    assert '# TYPE yield_stage_duration_seconds histogram' in text
+    assert 'yield_stage_duration_seconds_bucket{stage="render_pie",le="+Inf"} 1' in text
+    assert 'yield_stage_duration_seconds_count{stage="render_pie"} 1' in text
+
+def test_write_metrics_files(metrics_enabled, tmp_path):
+    """測試：JSON 與 .prom 檔案應正確寫出"""
+    with stage('csv_parse', rows=2):
+        pass
+    json_path = tmp_path / 'metrics.json'
+    prom_path = tmp_path / 'metrics.prom'
+    instrumentation.write_metrics(str(json_path), str(prom_path))
+    data = json.loads(json_path.read_text(encoding='utf-8'))
+    assert data['stages']['csv_parse']['rows'] == 2
+    assert 'yield_stage_rows_total{stage="csv_parse"} 2' in prom_path.read_text(encoding='utf-8')
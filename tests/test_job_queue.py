@@ -0,0 +1,103 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import job_queue
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import JobQueue, JobFailed, process_one
+
+def _double_handler(pipeline, data, params, report_progress):
+    """假的預測工作：把數值乘以 2"""
+    report_progress(0.5)
+    return data * params.get('factor', 2)
+
+def _broken_handler(pipeline, data, params, report_progress):
+    raise RuntimeError("model exploded")
+
+HANDLERS = {'predict': _double_handler, 'broken': _broken_handler}
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs'))
+
+@pytest.fixture
+def batch():
+    return pd.DataFrame({'feature_1': np.arange(10, dtype=float)}, index=np.arange(100, 110))
+
+def test_large_batch_is_split_and_merged_in_order(queue, batch):
+    """測試：大批資料切成多個 part，合併後順序與原始輸入一致"""
+    group_id = queue.submit('predict', batch, split_rows=3)
+    assert queue.group_status(group_id) == {'status': 'queued', 'progress': 0.0, 'parts': 4, 'error': None}
+
+    while process_one(queue, 'w1', pipeline=None, handlers=HANDLERS):
+        pass
+
+    assert queue.group_status(group_id)['status'] == 'done'
+    result = queue.wait(group_id, timeout=1)
+    assert result.index.tolist() == batch.index.tolist()
+    assert result['feature_1'].tolist() == (batch['feature_1'] * 2).tolist()
+
+def test_claim_is_exclusive(queue, batch):
+    """測試：同一個工作只會被一個 worker 領取"""
+    queue.submit('predict', batch)
+    assert queue.claim('w1') is not None
+    assert queue.claim('w2') is None
+
+def test_failed_job_raises(queue, batch):
+    """測試：工作失敗時 wait() 應拋出 JobFailed 並附上錯誤訊息"""
+    group_id = queue.submit('broken', batch)
+    process_one(queue, 'w1', pipeline=None, handlers=HANDLERS)
+    with pytest.raises(JobFailed) as excinfo:
+        queue.wait(group_id, timeout=1)
+    assert 'model exploded' in str(excinfo.value)
+
+def test_stale_worker_jobs_are_requeued(queue, batch):
+    """測試：worker 心跳逾時後，它手上的工作應放回佇列"""
+    group_id = queue.submit('predict', batch)
+    queue.heartbeat('dead-worker')
+    queue.claim('dead-worker')
+    assert queue.group_status(group_id)['status'] == 'running'
+    assert queue.requeue_stale(timeout=-1) == 1
+    assert queue.group_status(group_id)['status'] == 'queued'
+
+def test_live_workers_by_heartbeat(queue):
+    """測試：只計算最近有心跳的 worker"""
+    assert queue.live_workers() == 0
+    queue.heartbeat('w1')
+    assert queue.live_workers() == 1
+    assert queue.live_workers(timeout=-1) == 0
+
+def test_worker_keeps_old_model_on_broken_active_pointer(tmp_path, monkeypatch):
+    """測試：ACTIVE 指向壞掉的版本時，worker 應保留舊模型且不重複重試"""
+    import job_queue
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    model_file = tmp_path / 'a.pkl'
+    model_file.write_bytes(b'model-a')
+    v1 = registry.register(str(model_file), activate=True)
+
+    calls = []
+    def loader(path):
+        calls.append(path)
+        return open(path + '.pkl', 'rb').read()
+
+    monkeypatch.setattr(job_queue, '_PIPELINE', None)
+    monkeypatch.setattr(job_queue, '_MODEL_VERSION', None)
+    monkeypatch.setattr(job_queue, '_FAILED_VERSION', None)
+    assert job_queue.refresh_worker_model(registry, None, loader=loader, warmup=lambda p: None)
+    assert (job_queue._MODEL_VERSION, job_queue._PIPELINE) == (v1, b'model-a')
+
+    # ACTIVE 指向不存在的版本 (例如手動改壞或模型檔被刪除)
+    with open(registry.active_file, 'w', encoding='utf-8') as f:
+        f.write('v0099-deadbeef')
+    assert not job_queue.refresh_worker_model(registry, None, loader=loader, warmup=lambda p: None)
+    assert (job_queue._MODEL_VERSION, job_queue._PIPELINE) == (v1, b'model-a')
+    assert job_queue._FAILED_VERSION == 'v0099-deadbeef'
+
+    # 下一次檢查不應再嘗試載入同一個壞版本
+    assert not job_queue.refresh_worker_model(registry, None, loader=loader, warmup=lambda p: None)
+    assert len(calls) == 2
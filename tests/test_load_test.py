@@ -0,0 +1,95 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import time
+
+# 將上一層目錄加入路徑，這樣才能 import load_test
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from input_validation import SensorBounds, validate_batch
+from load_test import ServerSession, SkipAction, start_server, make_synthetic_data, run_level, summarize, write_report
+
+# 與 app.py 相同 widget 標籤的迷你 App，用來驗證壓力測試流程 (不需要載入模型)
+MINI_APP = '''
+import time
+import streamlit as st
+
+st.checkbox("Use Sample Data (synthetic_wafers.csv)", key='sample')
+if st.button("🚀 Run Prediction"):
+    time.sleep(0.05)
+    st.session_state['predicted'] = True
+st.slider("Number of sensors to show", min_value=5, max_value=50, value=20)
+if st.session_state.get('predicted'):
+    st.radio("Wafers:", ["All", "Fail", "Pass"])
+    st.selectbox("Select Wafer Index:", list(range(10)))
+'''
+
+class FakeSession:
+    """假使用者：每個動作固定耗時"""
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, action):
+        def act():
+            time.sleep(self.delay)
+            if action == 'select_wafer':
+                raise SkipAction(action)
+        return act
+
+def test_synthetic_data_passes_validation():
+    """測試：依訓練界限產生的合成資料落在可接受範圍內"""
+    rng = np.random.default_rng(0)
+    names = [f'feature_{i}' for i in range(30)]
+    training = pd.DataFrame(rng.normal(loc=50, scale=5, size=(400, 30)), columns=names)
+    bounds = SensorBounds.from_data(training)
+
+    synthetic = make_synthetic_data(200, names, bounds=bounds)
+    assert list(synthetic.columns) == names and len(synthetic) == 200
+    assert not validate_batch(synthetic, bounds)['reject'].any()
+
+    resampled = make_synthetic_data(50, names, source=training, random_state=1)
+    assert not resampled.duplicated().any()
+
+def test_run_level_and_percentiles():
+    """測試：多個使用者同時執行，延遲百分位數與吞吐量計算正確，略過的動作不列入延遲"""
+    records, elapsed, rss = run_level(4, lambda i: FakeSession(0.02), iterations=2)
+    assert len(records) == 4 * (2 + 4 * 2)
+    assert elapsed < 4 * 10 * 0.02  # 四個使用者同時進行，不是依序
+    summary = summarize(records, 4, elapsed, rss)
+    overall = summary.set_index('action').loc['ALL']
+    assert overall['count'] == 4 * (2 + 3 * 2)
+    assert overall['skipped'] == 4 * 2
+    assert 15 <= overall['p50_ms'] <= overall['p95_ms'] <= overall['max_ms']
+    assert overall['rss_mb'] > 0
+
+def test_server_session_drives_real_server(tmp_path):
+    """測試：ServerSession 透過 websocket 操作真正的 streamlit server，並寫出報告"""
+    app_file = tmp_path / 'mini_app.py'
+    app_file.write_text(MINI_APP, encoding='utf-8')
+    port = 18000 + os.getpid() % 1000
+    try:
+        server = start_server(str(app_file), port, timeout=60)
+    except (RuntimeError, TimeoutError) as e:
+        pytest.skip(f"streamlit server unavailable: {e}")
+    try:
+        records, elapsed, rss = run_level(2, lambda i: ServerSession(f'ws://127.0.0.1:{port}', timeout=30,
+                                                                      random_state=i),
+                                          iterations=2, server_pid=server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    assert (records['status'] == 'ok').all(), records['status'].tolist()
+    assert set(records['action']) == {'open', 'upload', 'run_prediction', 'drift_view', 'shap_group', 'select_wafer'}
+
+    summary = summarize(records, 2, elapsed, rss)
+    write_report(summary, str(tmp_path / 'load.csv'), str(tmp_path / 'load.md'))
+    report = (tmp_path / 'load.md').read_text(encoding='utf-8')
+    assert '| 2 | run_prediction | 4 |' in report
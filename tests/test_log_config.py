@@ -0,0 +1,78 @@
+import pytest
+import logging
+import gzip
+import queue
+import time
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import log_config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_config import (configure_logging, shutdown, parse_levels, parse_sampling, SamplingFilter,
+                        DroppingQueueHandler)
+from instrumentation import stage
+
+@pytest.fixture(autouse=True)
+def clean_logging(monkeypatch):
+    """每個測試都從未設定的狀態開始，結束時關閉背景寫入執行緒"""
+    for name in ('YIELD_LOG_LEVELS', 'YIELD_LOG_SAMPLE', 'YIELD_LOG_DIR', 'YIELD_LOG_MAX_MB', 'YIELD_LOG_BACKUPS'):
+        monkeypatch.delenv(name, raising=False)
+    shutdown()
+    yield
+    shutdown()
+
+def test_stage_context_and_timing(tmp_path):
+    """測試：階段內的 log 帶有階段名稱，階段結束時另記一筆耗時；重複設定只生效一次"""
+    path = configure_logging('unit', log_dir=str(tmp_path))
+    assert configure_logging('other', log_dir=str(tmp_path)) == path
+    with stage('predict_model', rows=42):
+        logging.getLogger('yield.test').info("scoring batch")
+    shutdown()
+
+    text = open(path, encoding='utf-8').read()
+    assert '[predict_model] scoring batch' in text
+    assert 'yield.stage [predict_model] predict_model done in' in text and '(42 rows)' in text
+
+def test_rotation_compresses_backups(tmp_path):
+    """測試：超過大小時輪替，舊檔以 gzip 壓縮並保留指定份數"""
+    path = configure_logging('rotate', log_dir=str(tmp_path), max_bytes=2000, backup_count=2)
+    logger = logging.getLogger('yield.test')
+    for i in range(200):
+        logger.info("line %d %s", i, 'x' * 50)
+    shutdown()
+
+    backups = sorted(p.name for p in tmp_path.iterdir() if p.name.endswith('.gz'))
+    assert backups == ['rotate.log.1.gz', 'rotate.log.2.gz']
+    with gzip.open(tmp_path / 'rotate.log.1.gz', 'rt', encoding='utf-8') as f:
+        assert 'line' in f.read()
+    assert 'line 199' in open(path, encoding='utf-8').read()
+
+def test_levels_and_sampling():
+    """測試：環境變數格式解析；取樣只作用於 WARNING 以下，子 logger 套用上層比例"""
+    assert parse_levels('pycaret=error, catboost=WARNING') == {'pycaret': 'ERROR', 'catboost': 'WARNING'}
+    assert parse_sampling('pycaret=0.1') == {'pycaret': 0.1}
+
+    sampler = SamplingFilter({'logs': 0.1, 'catboost': 0})
+    def make(name, level):
+        return logging.LogRecord(name, level, __file__, 0, "msg", None, None)
+    kept = sum(sampler.filter(make('logs', logging.INFO)) for _ in range(100))
+    assert kept == 10
+    assert sampler.filter(make('logs', logging.WARNING))
+    assert not sampler.filter(make('catboost.train', logging.INFO))
+    assert sampler.filter(make('yield.stage', logging.DEBUG))
+
+def test_full_queue_drops_without_blocking():
+    """測試：寫入端跟不上時直接丟棄並計數，呼叫端不會等待"""
+    handler = DroppingQueueHandler(queue.Queue(5))
+    logger = logging.getLogger('yield.test.drop')
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        start = time.perf_counter()
+        for i in range(1000):
+            logger.warning("record %d", i)
+        assert time.perf_counter() - start < 1.0
+    finally:
+        logger.removeHandler(handler)
+    assert handler.queue.qsize() == 5 and handler.dropped == 995
@@ -0,0 +1,83 @@
+import pytest
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import model_registry
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_registry import ModelRegistry, ModelHandle
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path / 'registry'))
+
+def _make_model_file(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+def test_register_and_activate(registry, tmp_path):
+    """測試：登錄後可切換 ACTIVE 版本，且模型檔內容可驗證"""
+    assert registry.active_version() is None
+    v1 = registry.register(_make_model_file(tmp_path, 'a.pkl', b'model-a'), activate=True)
+    v2 = registry.register(_make_model_file(tmp_path, 'b.pkl', b'model-b'))
+    assert v1.startswith('v0001-') and v2.startswith('v0002-')
+    assert registry.active_version() == v1
+
+    registry.activate(v2)
+    assert registry.active_version() == v2
+    assert registry.verify(v2)
+    assert [m['version'] for m in registry.list_versions()] == [v1, v2]
+
+def test_same_content_is_deduplicated(registry, tmp_path):
+    """測試：內容相同的模型檔 (例如 repo 內的多份副本) 只會登錄一次"""
+    v1 = registry.register(_make_model_file(tmp_path, 'copy1.pkl', b'same'))
+    v2 = registry.register(_make_model_file(tmp_path, 'copy2.pkl', b'same'))
+    assert v1 == v2
+    assert len(registry.list_versions()) == 1
+
+def test_activate_unknown_version_fails(registry):
+    """測試：切換到不存在的版本應報錯"""
+    with pytest.raises(ValueError):
+        registry.activate('v9999-deadbeef')
+
+def test_resolve_falls_back_to_legacy_path(registry, tmp_path):
+    """測試：版本庫為空時退回舊的固定模型路徑"""
+    legacy = tmp_path / 'final_yield_prediction_model'
+    assert registry.resolve(str(legacy)) == (None, None)
+    (tmp_path / 'final_yield_prediction_model.pkl').write_bytes(b'legacy')
+    version, path = registry.resolve(str(legacy))
+    assert version.startswith('legacy-')
+    assert path == str(legacy)
+
+def test_handle_hot_swaps_after_warmup(registry, tmp_path):
+    """測試：ACTIVE 變更後，handle 應先暖機再替換成新模型"""
+    warmed = []
+    loader = lambda path: open(path + '.pkl', 'rb').read()
+    handle = ModelHandle(registry, loader=loader, warmup=warmed.append, fallback_path=None)
+
+    v1 = registry.register(_make_model_file(tmp_path, 'a.pkl', b'model-a'), activate=True)
+    assert handle.refresh()
+    assert handle.current() == (v1, b'model-a')
+    assert not handle.refresh()
+
+    v2 = registry.register(_make_model_file(tmp_path, 'b.pkl', b'model-b'), activate=True)
+    assert handle.refresh()
+    assert handle.current() == (v2, b'model-b')
+    assert warmed == [b'model-a', b'model-b']
+
+def test_handle_keeps_old_model_when_warmup_fails(registry, tmp_path):
+    """測試：新版本暖機失敗時應繼續使用舊模型"""
+    def warmup(model):
+        if model == b'broken':
+            raise RuntimeError("bad model")
+
+    loader = lambda path: open(path + '.pkl', 'rb').read()
+    handle = ModelHandle(registry, loader=loader, warmup=warmup, fallback_path=None)
+    v1 = registry.register(_make_model_file(tmp_path, 'a.pkl', b'model-a'), activate=True)
+    handle.refresh()
+
+    registry.register(_make_model_file(tmp_path, 'b.pkl', b'broken'), activate=True)
+    assert not handle.refresh()
+    assert handle.current() == (v1, b'model-a')
+    assert 'bad model' in handle.last_error
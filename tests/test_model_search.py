@@ -0,0 +1,67 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import model_search
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.dummy import DummyClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier
+from model_search import halving_search, rung_schedule
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(900, 8)), columns=[f'feature_{i}' for i in range(8)])
+    y = pd.Series((X['feature_0'] + 0.3 * rng.normal(size=900) > 0.8).astype(int))
+    return X, y
+
+def _candidates():
+    candidates = [{'id': 'lr', 'config': 0, 'estimator': LogisticRegression(), 'params': {}}]
+    for depth in (1, 2, 4):
+        candidates.append({'id': 'dt', 'config': depth, 'estimator': DecisionTreeClassifier(max_depth=depth, random_state=0),
+                           'params': {'max_depth': depth}})
+    for i, strategy in enumerate(['most_frequent', 'prior', 'stratified', 'uniform', 'constant']):
+        kwargs = {'constant': 0} if strategy == 'constant' else {}
+        candidates.append({'id': f'dummy_{strategy}', 'config': i,
+                           'estimator': DummyClassifier(strategy=strategy, random_state=0, **kwargs), 'params': {}})
+    return candidates
+
+def test_schedule_grows_rows_and_folds():
+    """測試：每一輪的資料量與 fold 數遞增，且不低於下限"""
+    schedule = rung_schedule(n_candidates=45, n_rows=2000, eta=3, min_rows=100, n_finalists=3)
+    assert len(schedule) == 3
+    rows = [r for r, _ in schedule]
+    folds = [f for _, f in schedule]
+    assert rows == sorted(rows) and rows[0] >= 100 and rows[-1] < 2000
+    assert folds[0] == 2 and folds[-1] == 5
+
+def test_halving_promotes_good_models(dataset):
+    """測試：淘汰後留下的是真正有預測力的模型，每個模型只保留一組參數"""
+    X, y = dataset
+    finalists, log = halving_search(_candidates(), X, y, scoring='f1', min_rows=150, n_finalists=2, n_jobs=1)
+    assert {c['id'] for c in finalists} == {'lr', 'dt'}
+    assert log['rung'].max() >= 1
+    # 第一輪全部候選都被評估，之後只評估晉級者
+    assert (log['rung'] == 0).sum() == 9
+    assert (log['rung'] == 1).sum() == 3
+
+def test_failed_candidate_is_ranked_last(dataset):
+    """測試：訓練失敗的模型分數為 NaN、記錄錯誤且不會晉級"""
+    X, y = dataset
+    candidates = _candidates()[:2] + [{'id': 'broken', 'config': 0,
+                                       'estimator': LogisticRegression(C=-1), 'params': {}}]
+    finalists, log = halving_search(candidates, X, y, scoring='f1', min_rows=150, n_finalists=1, n_jobs=1)
+    assert finalists[0]['id'] != 'broken'
+    assert log.loc[log['id'] == 'broken', 'error'].notna().all()
+
+def test_budget_stops_promotion(dataset):
+    """測試：超過時間預算時停止評估，仍回傳領先者"""
+    X, y = dataset
+    finalists, log = halving_search(_candidates(), X, y, scoring='f1', min_rows=150,
+                                    n_finalists=2, budget_sec=0, n_jobs=1)
+    assert len(finalists) == 2
+    assert log.empty
@@ -0,0 +1,82 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import prediction_cache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prediction_cache import PredictionCache, row_hashes
+
+FEATURES = [f'feature_{i}' for i in range(8)]
+
+@pytest.fixture
+def wafers():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(50, 8)), columns=FEATURES)
+    data.iloc[::7, 2] = np.nan
+    return data
+
+class CountingModel:
+    """假模型：記錄實際被預測的列數，分數為第一個感測器的 sigmoid"""
+    def __init__(self):
+        self.scored_rows = 0
+
+    def __call__(self, rows):
+        self.scored_rows += len(rows)
+        score = 1 / (1 + np.exp(-rows['feature_0'].to_numpy()))
+        return rows.assign(prediction_label=(score >= 0.5).astype(int), prediction_score=score)
+
+def test_only_unseen_rows_are_scored_and_order_is_kept(wafers):
+    """測試：重複上傳時只預測新的列，結果依輸入順序合併且與直接預測相同"""
+    cache, model = PredictionCache(), CountingModel()
+    cache.predict(wafers.iloc[:30], 'v1', FEATURES, model)
+    assert model.scored_rows == 30
+
+    shuffled = wafers.sample(frac=1, random_state=1)
+    result, n_hits = cache.predict(shuffled, 'v1', FEATURES, model)
+    assert n_hits == 30
+    assert model.scored_rows == 50
+    expected = CountingModel()(shuffled)
+    assert list(result.index) == list(shuffled.index)
+    np.testing.assert_allclose(result['prediction_score'], expected['prediction_score'])
+    assert result['prediction_label'].tolist() == expected['prediction_label'].tolist()
+    assert cache.stats()['hit_rate'] == pytest.approx(30 / 80)
+
+def test_duplicates_and_extra_columns(wafers):
+    """測試：同一批的重複列只預測一次；非感測器欄位不影響雜湊"""
+    cache, model = PredictionCache(), CountingModel()
+    doubled = pd.concat([wafers, wafers], ignore_index=True)
+    result, _ = cache.predict(doubled, 'v1', FEATURES, model)
+    assert model.scored_rows == 50
+    assert len(result) == 100
+
+    low, high = row_hashes(wafers.assign(wafer_id=range(50)), FEATURES)
+    low2, high2 = row_hashes(wafers, FEATURES)
+    assert (low == low2).all() and (high == high2).all()
+
+def test_model_version_and_lru_eviction(wafers):
+    """測試：不同模型版本不共用結果；超過上限時淘汰最久沒用到的列"""
+    cache, model = PredictionCache(max_entries=40), CountingModel()
+    cache.predict(wafers.iloc[:20], 'v1', FEATURES, model)
+    cache.predict(wafers.iloc[:20], 'v2', FEATURES, model)
+    assert model.scored_rows == 40
+
+    cache.predict(wafers.iloc[:10], 'v1', FEATURES, model)      # 讓 v1 前 10 列變成最近使用
+    cache.predict(wafers.iloc[20:30], 'v1', FEATURES, model)    # 新增 10 列 -> 淘汰 10 列
+    assert len(cache) == 40 and cache.stats()['evictions'] == 10
+    _, n_hits = cache.predict(wafers.iloc[:10], 'v1', FEATURES, model)
+    assert n_hits == 10
+
+def test_persist_to_disk(tmp_path, wafers):
+    """測試：存到磁碟後重新載入仍可命中"""
+    path = str(tmp_path / 'cache' / 'predictions.npz')
+    cache, model = PredictionCache(path=path), CountingModel()
+    first, _ = cache.predict(wafers, 'v1', FEATURES, model)
+    cache.save()
+
+    reloaded = PredictionCache(path=path)
+    result, n_hits = reloaded.predict(wafers, 'v1', FEATURES, model)
+    assert n_hits == 50 and model.scored_rows == 50
+    pd.testing.assert_frame_equal(result, first)
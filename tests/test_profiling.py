@@ -0,0 +1,67 @@
+import pytest
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import profiling
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profiling
+
+def _busy_work():
+    return sum(i * i for i in range(20000))
+
+def test_capture_writes_profile_and_summary(tmp_path):
+    """測試：剖析結束後應產生 .prof 與熱點摘要"""
+    capture = profiling.ProfileCapture('unit_test', output_dir=str(tmp_path), top_n=5).start()
+    _busy_work()
+    prof_path, summary_path = capture.stop()
+    assert os.path.exists(prof_path)
+    summary = open(summary_path, encoding='utf-8').read()
+    assert 'Profile: unit_test' in summary
+    assert '_busy_work' in summary
+
+def test_nested_capture_is_ignored(tmp_path):
+    """測試：同一執行緒已在剖析時，內層剖析不應重複啟動"""
+    outer = profiling.ProfileCapture('outer', output_dir=str(tmp_path)).start()
+    inner = profiling.ProfileCapture('inner', output_dir=str(tmp_path)).start()
+    assert not inner.active
+    assert inner.stop() == (None, None)
+    outer.stop()
+    assert len(os.listdir(tmp_path)) == 2
+
+def test_query_param_and_env_flag(monkeypatch):
+    """測試：查詢參數或環境變數任一開啟即觸發剖析"""
+    monkeypatch.delenv('YIELD_PROFILE', raising=False)
+    assert not profiling.profiling_requested(None)
+    assert profiling.profiling_requested('1')
+    monkeypatch.setenv('YIELD_PROFILE', 'true')
+    assert profiling.profiling_requested(None)
+
+def test_profiled_decorator_only_when_enabled(monkeypatch, tmp_path):
+    """測試：裝飾器只在 YIELD_PROFILE=1 時輸出檔案"""
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    wrapped = profiling.profiled('batch')(_busy_work)
+
+    monkeypatch.delenv('YIELD_PROFILE', raising=False)
+    assert wrapped() == _busy_work()
+    assert os.listdir(tmp_path) == []
+
+    monkeypatch.setenv('YIELD_PROFILE', '1')
+    wrapped()
+    assert len(os.listdir(tmp_path)) == 2
+
+def test_capture_released_after_exception(tmp_path):
+    """測試：被剖析的程式拋出例外 (如 st.stop / st.rerun) 後，同一執行緒的下一次剖析仍應記錄"""
+    first = profiling.ProfileCapture('raising', output_dir=str(tmp_path)).start()
+    with pytest.raises(RuntimeError):
+        try:
+            raise RuntimeError('rerun')
+        finally:
+            first.stop()
+
+    second = profiling.ProfileCapture('next_rerun', output_dir=str(tmp_path), top_n=5).start()
+    assert second.active
+    _busy_work()
+    prof_path, summary_path = second.stop()
+    assert '_busy_work' in open(summary_path, encoding='utf-8').read()
+    assert len(os.listdir(tmp_path)) == 4
@@ -0,0 +1,41 @@
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import render_cache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib.pyplot as plt
+import render_cache
+
+PNG_SIGNATURE = b'\x89PNG'
+
+def test_figure_to_png_releases_figure():
+    """測試：轉成 PNG 後 figure 應被關閉，不會累積"""
+    plt.close('all')
+    fig, ax = plt.subplots()
+    ax.plot([0, 1], [0, 1])
+    png = render_cache.figure_to_png(fig)
+    assert png.startswith(PNG_SIGNATURE)
+    assert plt.get_fignums() == []
+
+def test_pie_is_cached_and_leak_free():
+    """測試：相同數據重複渲染應回傳同一份 bytes，且不留下 figure"""
+    plt.close('all')
+    first = render_cache.render_yield_pie(90, 10)
+    second = render_cache.render_yield_pie(90, 10)
+    assert first is second
+    assert plt.get_fignums() == []
+
+def test_static_image_reloads_after_change(tmp_path):
+    """測試：靜態圖片以修改時間快取，檔案更新後應重新讀取"""
+    path = tmp_path / 'report.png'
+    path.write_bytes(PNG_SIGNATURE + b'v1')
+    assert render_cache.load_static_image(str(path)) == PNG_SIGNATURE + b'v1'
+
+    path.write_bytes(PNG_SIGNATURE + b'v2')
+    os.utime(path, (1, 1))
+    assert render_cache.load_static_image(str(path)) == PNG_SIGNATURE + b'v2'
+
+def test_missing_static_image_returns_none():
+    """測試：圖片不存在時回傳 None"""
+    assert render_cache.load_static_image('reports/does_not_exist.png') is None
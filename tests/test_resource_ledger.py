@@ -0,0 +1,96 @@
+import pytest
+import pandas as pd
+import numpy as np
+import multiprocessing
+import sys
+import os
+import time
+
+# 將上一層目錄加入路徑，這樣才能 import resource_ledger
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resource_ledger
+from resource_ledger import ResourceLedger, load_ledger, list_runs, compare_runs, render_comparison
+
+LEDGER_ENV = (resource_ledger.RUN_ENV, resource_ledger.PATH_ENV, resource_ledger.SCRIPT_ENV,
+              resource_ledger.PARENT_ENV, resource_ledger.OWNER_ENV)
+
+@pytest.fixture(autouse=True)
+def clean_env():
+    """每個測試前後都清掉帳本的環境變數，避免其他測試 (FastSMOTE) 寫入暫存帳本"""
+    for name in LEDGER_ENV:
+        os.environ.pop(name, None)
+    yield
+    for name in LEDGER_ENV:
+        os.environ.pop(name, None)
+
+def _child_record():
+    ResourceLedger.active().record('smote', wall_sec=0.5, cpu_sec=0.5, rows=10)
+
+def test_stage_records_cost_and_nesting(tmp_path):
+    """測試：階段記錄牆鐘、CPU、RSS 峰值與資料大小；巢狀階段記錄 parent，例外標示為 error"""
+    path = str(tmp_path / 'ledger.jsonl')
+    ledger = ResourceLedger('train.py', path=path)
+    with ledger.stage('setup', rows=100) as s:
+        s.set(features=20)
+        with ledger.stage('smote'):
+            np.ones((2000, 2000)).sum()
+        time.sleep(0.05)
+    with pytest.raises(RuntimeError):
+        with ledger.stage('plot_model:auc'):
+            raise RuntimeError("boom")
+
+    entries = load_ledger(path).set_index('stage')
+    assert list(entries.index) == ['smote', 'setup', 'plot_model:auc']
+    setup = entries.loc['setup']
+    assert setup['wall_sec'] >= 0.05 and setup['cpu_sec'] > 0
+    assert setup['rows'] == 100 and setup['features'] == 20
+    assert setup['peak_rss_mb'] >= setup['rss_start_mb'] > 0
+    assert pd.isna(setup['parent']) and entries.loc['smote', 'parent'] == 'setup'
+    assert entries.loc['plot_model:auc', 'status'] == 'error'
+    assert 'boom' in entries.loc['plot_model:auc', 'error']
+
+def test_child_process_joins_run(tmp_path):
+    """測試：子行程 (CV worker) 透過環境變數寫入同一個 run，且不計入整次執行的總時間"""
+    path = str(tmp_path / 'ledger.jsonl')
+    ledger = ResourceLedger('train.py', path=path)
+    with ledger.stage('compare_models'):
+        worker = multiprocessing.get_context('fork').Process(target=_child_record)
+        worker.start()
+        worker.join()
+    assert ResourceLedger.active().run_id == ledger.run_id
+
+    entries = load_ledger(path)
+    child = entries[entries['stage'] == 'smote'].iloc[0]
+    assert child['run_id'] == ledger.run_id and child['pid'] != os.getpid()
+    assert child['parent'] == 'compare_models'
+    runs = list_runs(entries)
+    assert len(runs) == 1 and runs.loc[0, 'wall_sec'] < 0.5
+
+def test_compare_flags_regressed_stage(tmp_path):
+    """測試：比較最近兩次執行，變慢或記憶體變大的階段標示為 REGRESSED"""
+    path = str(tmp_path / 'ledger.jsonl')
+    costs = [
+        {'setup': (10.0, 500.0), 'compare_models': (100.0, 1500.0), 'plot_model:auc': (5.0, 800.0)},
+        {'setup': (10.5, 510.0), 'compare_models': (160.0, 1500.0), 'plot_model:auc': (5.0, 1200.0),
+         'shap_store': (30.0, 900.0)},
+    ]
+    for i, stages in enumerate(costs):
+        ledger = ResourceLedger('train_upgrade.py', path=path, run_id=f'run-{i}')
+        for name, (wall, rss) in stages.items():
+            ledger.record(name, started_at=1000.0 * (i + 1), wall_sec=wall, cpu_sec=wall, peak_rss_mb=rss,
+                          rows=1567, features=590)
+    other = ResourceLedger('step1.py', path=path, run_id='run-other')
+    other.record('load_model', started_at=5000.0, wall_sec=1.0, cpu_sec=1.0, peak_rss_mb=100.0)
+
+    ledger = load_ledger(path)
+    table, baseline, current = compare_runs(ledger, script='train_upgrade.py')
+    assert (baseline, current) == ('run-0', 'run-1')
+    assert table.loc['compare_models', 'flag'] == 'REGRESSED'
+    assert table.loc['plot_model:auc', 'flag'] == 'REGRESSED'  # 記憶體 +50%
+    assert table.loc['setup', 'flag'] == ''
+    assert table.loc['shap_store', 'flag'] == 'NEW'
+    assert '**compare_models**' in render_comparison(table, baseline, current)
+
+    with pytest.raises(ValueError):
+        compare_runs(ledger, current='run-other')
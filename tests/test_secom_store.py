@@ -0,0 +1,88 @@
+import pytest
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import secom_store
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from secom_store import SecomStore, ingest, N_FEATURES, _line_ends
+
+def _feature_line(rng):
+    values = rng.normal(size=N_FEATURES).round(4).astype(str)
+    values[rng.random(N_FEATURES) < 0.05] = 'NaN'
+    return ' '.join(values) + '\n'
+
+def _label_line(i):
+    return f'{-1 if i % 3 else 1} "19/07/2008 {i // 60:02d}:{i % 60:02d}:00"\n'
+
+def _write(tmp_path, start, stop, rng):
+    with open(tmp_path / 'features.txt', 'a') as f:
+        f.writelines(_feature_line(rng) for _ in range(start, stop))
+    with open(tmp_path / 'labels.txt', 'a') as f:
+        f.writelines(_label_line(i) for i in range(start, stop))
+
+def _ingest(tmp_path, **kwargs):
+    return ingest(str(tmp_path / 'features.txt'), str(tmp_path / 'labels.txt'),
+                  str(tmp_path / 'store'), **kwargs)
+
+def test_ingest_matches_pandas_parse(tmp_path):
+    """測試：轉換後的資料與 pandas 逐行解析結果一致 (含 NaN)"""
+    import pandas as pd
+    _write(tmp_path, 0, 50, np.random.default_rng(0))
+    assert _ingest(tmp_path, block_bytes=20_000, workers=1) == 50
+
+    frame = SecomStore(str(tmp_path / 'store')).to_frame()
+    expected = pd.read_csv(tmp_path / 'features.txt', sep=r'\s+', header=None)
+    assert frame.shape == (50, N_FEATURES + 2)
+    np.testing.assert_allclose(frame.iloc[:, :N_FEATURES].to_numpy(), expected.to_numpy(), equal_nan=True)
+    assert frame['label'].tolist() == [-1 if i % 3 else 1 for i in range(50)]
+    assert str(frame['timestamp'].iloc[1]) == '2008-07-19 00:01:00'
+
+def test_append_only_parses_new_lines(tmp_path):
+    """測試：再次 ingest 只會加入新增的行，已處理的資料不重複"""
+    rng = np.random.default_rng(1)
+    _write(tmp_path, 0, 10, rng)
+    assert _ingest(tmp_path) == 10
+    assert _ingest(tmp_path) == 0
+
+    _write(tmp_path, 10, 25, rng)
+    assert _ingest(tmp_path) == 15
+    store = SecomStore(str(tmp_path / 'store'))
+    assert store.n_rows == 25
+    assert store.to_frame()['label'].tolist() == [-1 if i % 3 else 1 for i in range(25)]
+
+def test_partial_lines_wait_for_labels(tmp_path):
+    """測試：特徵已寫入但標籤尚未到的行，要等標籤出現才會加入 (保持對齊)"""
+    rng = np.random.default_rng(2)
+    _write(tmp_path, 0, 5, rng)
+    with open(tmp_path / 'features.txt', 'a') as f:
+        f.write(_feature_line(rng))
+    assert _ingest(tmp_path) == 5
+
+    with open(tmp_path / 'labels.txt', 'a') as f:
+        f.write(_label_line(5))
+    assert _ingest(tmp_path) == 1
+    assert SecomStore(str(tmp_path / 'store')).n_rows == 6
+
+def test_replaced_source_requires_rebuild(tmp_path):
+    """測試：來源檔被整個替換時應報錯，加上 rebuild 才重新轉換"""
+    _write(tmp_path, 0, 5, np.random.default_rng(3))
+    _ingest(tmp_path)
+    (tmp_path / 'features.txt').unlink()
+    (tmp_path / 'labels.txt').unlink()
+    _write(tmp_path, 0, 3, np.random.default_rng(4))
+    with pytest.raises(ValueError):
+        _ingest(tmp_path)
+    assert _ingest(tmp_path, rebuild=True) == 3
+    assert SecomStore(str(tmp_path / 'store')).n_rows == 3
+
+def test_line_ends_scanned_in_blocks(tmp_path):
+    """測試：以小區塊掃描換行位置的結果與一次讀入相同 (含區塊邊界上的換行與未完成的最後一行)"""
+    path = tmp_path / 'lines.txt'
+    path.write_bytes(b'1 2 3\n45 6\n\n789 0 1 2\npartial')
+    expected = [6, 11, 12, 22]
+    for scan_bytes in (1, 3, 5, 6, 1024):
+        assert _line_ends(str(path), 0, scan_bytes=scan_bytes).tolist() == expected
+    assert _line_ends(str(path), 11, scan_bytes=4).tolist() == [12, 22]
+    assert _line_ends(str(path), 22, scan_bytes=4).tolist() == []
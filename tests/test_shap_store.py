@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import shap_store
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shap_store import ShapStore, write_shap_store
+
+N_ROWS, N_FEATURES = 500, 6
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(N_ROWS, N_FEATURES)) * np.array([5, 1, 0.1, 0.1, 0.1, 3])
+    data = rng.normal(size=(N_ROWS, N_FEATURES))
+    labels = (np.arange(N_ROWS) % 10 == 0).astype(int)
+    values[labels == 1, 2] += 10   # feature_2 只對 Fail 晶圓重要
+    chunks = ((values[i:i + 128], data[i:i + 128]) for i in range(0, N_ROWS, 128))
+    header = {'feature_names': [f'feature_{i}' for i in range(N_FEATURES)], 'base_value': -1.5}
+    out_dir = str(tmp_path / 'shap_store')
+    write_shap_store(chunks, N_ROWS, header, labels=labels, out_dir=out_dir, model_version='v0001-test', cloud_rows=100)
+    return ShapStore.load(out_dir), values, data, labels
+
+def test_store_round_trip(store):
+    """測試：SHAP 矩陣以 float32 memory-map 保存，內容與輸入一致"""
+    loaded, values, _, _ = store
+    assert isinstance(loaded.values, np.memmap)
+    assert loaded.values.dtype == np.float32
+    np.testing.assert_allclose(loaded.values, values, rtol=1e-6)
+    assert loaded.meta['model_version'] == 'v0001-test'
+    assert loaded.meta['base_value'] == -1.5
+
+def test_importance_filters(store):
+    """測試：全域重要度依平均 |SHAP| 排序，可依 Fail/Pass 分組與名稱篩選"""
+    loaded, values, _, labels = store
+    overall = loaded.importance(top_k=3)
+    assert overall.index[0] == 'feature_0'
+    assert np.isclose(overall.iloc[0], np.abs(values[:, 0]).mean(), rtol=1e-5)
+    assert loaded.importance(group='fail', top_k=1).index[0] == 'feature_2'
+    assert list(loaded.importance(contains='FEATURE_5').index) == ['feature_5']
+
+def test_importance_for_arbitrary_rows(store):
+    """測試：任意列篩選的重要度由 memory-map 分塊計算"""
+    loaded, values, _, _ = store
+    mask = np.arange(N_ROWS) < 37
+    result = loaded.importance_for_rows(mask, chunk_rows=16)
+    np.testing.assert_allclose(result[loaded.feature_names], np.abs(values[mask]).mean(axis=0), rtol=1e-5)
+
+def test_point_cloud_keeps_all_fail_wafers(store):
+    """測試：降採樣點雲保留所有 Fail 晶圓，dependence 資料與原始值對應"""
+    loaded, values, data, labels = store
+    cloud_idx = loaded.cloud['index']
+    assert len(cloud_idx) == 100
+    assert set(np.flatnonzero(labels)) <= set(cloud_idx)
+    dep = loaded.dependence('feature_1')
+    np.testing.assert_allclose(dep['value'], data[cloud_idx, 1], rtol=1e-6)
+    np.testing.assert_allclose(dep['shap'], values[cloud_idx, 1], rtol=1e-6)
+    assert (loaded.dependence('feature_1', group='fail')['outcome'] == 'Fail').all()
+
+def test_rebuild_replaces_existing_store(store, tmp_path):
+    """測試：重新建立 store 時整個替換，不留下暫存資料夾"""
+    loaded, values, data, labels = store
+    header = {'feature_names': loaded.feature_names, 'base_value': 0.0}
+    write_shap_store(iter([(values[:50], data[:50])]), 50, header, labels=labels[:50],
+                     out_dir=loaded.store_dir, model_version='v0002-test')
+    assert ShapStore.load(loaded.store_dir).meta['n_rows'] == 50
+    assert sorted(os.listdir(tmp_path)) == ['shap_store']
@@ -0,0 +1,94 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import streaming_eval
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score, average_precision_score, confusion_matrix, f1_score, matthews_corrcoef
+from sklearn.pipeline import Pipeline
+
+from streaming_eval import ScoreHistogram, evaluate_files, write_reports, REPORT_IMAGES
+
+@pytest.fixture
+def scores():
+    rng = np.random.default_rng(0)
+    y = (rng.random(50000) < 0.07).astype(int)
+    p = np.clip(rng.beta(2, 5, len(y)) + 0.3 * y, 0, 1)
+    return y, p
+
+def test_chunked_metrics_match_sklearn(scores):
+    """測試：逐塊累積的混淆矩陣為精確值，AUC / AP 與整批計算的 sklearn 結果幾乎相同"""
+    y, p = scores
+    hist = ScoreHistogram()
+    for start in range(0, len(y), 7000):
+        hist.update(y[start:start + 7000], p[start:start + 7000])
+
+    assert hist.n_rows == len(y) and hist.positives == y.sum()
+    np.testing.assert_array_equal(hist.confusion_at(0.5), confusion_matrix(y, p >= 0.5))
+    metrics = hist.metrics(0.5)
+    assert metrics['AUC'] == pytest.approx(roc_auc_score(y, p), abs=1e-4)
+    assert metrics['AP'] == pytest.approx(average_precision_score(y, p), abs=1e-3)
+    assert metrics['F1'] == pytest.approx(f1_score(y, p >= 0.5))
+    assert metrics['MCC'] == pytest.approx(matthews_corrcoef(y, p >= 0.5))
+    with pytest.raises(ValueError):
+        hist.confusion_at(0.55)
+
+def test_merge_and_roundtrip(scores, tmp_path):
+    """測試：分片結果相加等於一次累積；存檔讀回不變；設定不同時拒絕合併"""
+    y, p = scores
+    whole = ScoreHistogram().update(y, p)
+    left = ScoreHistogram().update(y[:20000], p[:20000])
+    right = ScoreHistogram().update(y[20000:], p[20000:])
+    merged = left.merge(right)
+    np.testing.assert_array_equal(merged.pos_counts, whole.pos_counts)
+    np.testing.assert_array_equal(merged.confusion, whole.confusion)
+    assert merged.log_loss_sum == pytest.approx(whole.log_loss_sum)
+
+    path = str(tmp_path / 'partial.npz')
+    merged.save(path)
+    loaded = ScoreHistogram.load(path)
+    assert loaded.auc() == merged.auc() and loaded.metrics() == merged.metrics()
+    with pytest.raises(ValueError):
+        merged.merge(ScoreHistogram(n_bins=100))
+
+def test_secom_labels_and_missing_scores():
+    """測試：SECOM 原始標籤 -1 視為 Pass，缺值的標籤或分數不計入"""
+    hist = ScoreHistogram().update(np.array([-1, 1, -1, 1, np.nan]), np.array([0.2, 0.9, 0.7, np.nan, 0.5]))
+    assert hist.n_rows == 3 and hist.positives == 1
+    np.testing.assert_array_equal(hist.confusion_at(0.5), [[1, 1], [0, 1]])
+
+def test_parallel_files_write_reports(tmp_path):
+    """測試：多個已標記檔案以 process pool 評估後合併，結果與單行程相同並輸出圖檔與 CSV"""
+    rng = np.random.default_rng(1)
+    X = pd.DataFrame(rng.normal(size=(4000, 5)), columns=[f'feature_{i}' for i in range(5)])
+    y = (X['feature_0'] + rng.normal(size=len(X)) > 1.5).astype(int)
+    pipeline = Pipeline([('impute', SimpleImputer()), ('model', LogisticRegression())]).fit(X, y)
+    paths = []
+    for k in range(4):
+        part = X.iloc[k * 1000:(k + 1) * 1000].assign(label=y[k * 1000:(k + 1) * 1000], wafer_id='W')
+        path = str(tmp_path / f'part{k}.csv')
+        part.to_csv(path, index=False)
+        paths.append(path)
+
+    parallel, errors = evaluate_files(paths, pipeline, workers=2, chunk_rows=300)
+    serial, _ = evaluate_files(paths, pipeline, workers=1)
+    assert errors == {} and parallel.n_rows == 4000
+    np.testing.assert_array_equal(parallel.confusion, serial.confusion)
+    assert parallel.auc() == pytest.approx(roc_auc_score(y, pipeline.predict_proba(X)[:, 1]), abs=1e-4)
+
+    _, errors = evaluate_files([str(tmp_path / 'missing.csv')], pipeline)
+    assert list(errors) == [str(tmp_path / 'missing.csv')]
+
+    out = tmp_path / 'reports'
+    metrics = write_reports(parallel, str(out))
+    for file_name in list(REPORT_IMAGES.values()) + ['evaluation_metrics.csv', 'threshold_metrics.csv',
+                                                     'roc_curve.csv', 'pr_curve.csv']:
+        assert (out / file_name).exists()
+    table = pd.read_csv(out / 'evaluation_metrics.csv')
+    assert table.loc[0, 'AUC'] == pytest.approx(metrics['AUC'])
+    assert len(pd.read_csv(out / 'roc_curve.csv')) <= 1001
@@ -0,0 +1,110 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import train_out_of_core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from train_out_of_core import StreamingStats, iter_batches, imputed_batches, train_lightgbm, train_xgboost
+
+@pytest.fixture
+def processed_csv(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(1000, 5)), columns=[f'feature_{i}' for i in range(5)])
+    df.loc[rng.random(1000) < 0.1, 'feature_1'] = np.nan
+    df['feature_3'] = 7.0                      # 零變異
+    df['feature_4'] = np.nan                   # 全空
+    df['label'] = (df['feature_0'] > 1.2).astype(int)
+    path = tmp_path / 'processed.csv'
+    df.to_csv(path, index=False)
+    return str(path), df
+
+def test_streaming_stats_match_full_frame(processed_csv):
+    """測試：分批累計的平均值與一次讀入的結果相同，且正確剔除全空與零變異欄位"""
+    path, df = processed_csv
+    stats = StreamingStats(sample_rows=100)
+    for X, y in iter_batches(path, batch_rows=128):
+        stats.update(X, y)
+    assert stats.n_rows == 1000
+    assert stats.n_positive == int(df['label'].sum())
+    np.testing.assert_allclose(stats.means[['feature_0', 'feature_1']],
+                               df[['feature_0', 'feature_1']].mean())
+    assert stats.selected_columns() == ['feature_0', 'feature_1', 'feature_2']
+
+def test_reservoir_sample_is_bounded(processed_csv):
+    """測試：保留的樣本筆數固定，不會隨資料量增加"""
+    path, df = processed_csv
+    stats = StreamingStats(sample_rows=50)
+    for X, y in iter_batches(path, batch_rows=64):
+        stats.update(X, y)
+    sample = stats.sample()
+    assert len(sample) == 50
+    assert 'label' in sample.columns
+    # 樣本應來自整份資料，而不是只有最後幾批
+    assert sample['feature_0'].isin(df['feature_0'].iloc[:500]).any()
+
+def test_imputed_batches_fill_with_global_means(processed_csv):
+    """測試：第二輪的批次以整體平均補值，只保留選定欄位"""
+    path, df = processed_csv
+    stats = StreamingStats()
+    for X, y in iter_batches(path, batch_rows=256):
+        stats.update(X, y)
+    columns = stats.selected_columns()
+    batches = list(imputed_batches(path, columns, stats.means, batch_rows=256))
+    X_all = pd.concat([X for X, _ in batches])
+    assert list(X_all.columns) == columns
+    assert not X_all.isna().any().any()
+    assert np.isclose(X_all.loc[df['feature_1'].isna().to_numpy(), 'feature_1'], df['feature_1'].mean()).all()
+
+def test_xgboost_external_memory_training(processed_csv, tmp_path):
+    """測試：XGBoost 以 DataIter 串流訓練，得到可 predict_proba 的 sklearn 模型"""
+    pytest.importorskip('xgboost')
+    path, df = processed_csv
+    stats = StreamingStats()
+    for X, y in iter_batches(path, batch_rows=200):
+        stats.update(X, y)
+    columns = stats.selected_columns()
+    model = train_xgboost(path, columns, stats.means, {'max_depth': 3}, 20, 200, str(tmp_path))
+    proba = model.predict_proba(df[columns].fillna(stats.means[columns]))[:, 1]
+    assert proba.shape == (1000,)
+    assert proba[df['label'] == 1].mean() > proba[df['label'] == 0].mean()
+
+def test_lightgbm_booster_classifier_round_trip(processed_csv, tmp_path):
+    """測試：LightGBM 串流訓練的模型可 predict_proba，且 pickle 後預測不變"""
+    pytest.importorskip('lightgbm')
+    import pickle
+    path, df = processed_csv
+    stats = StreamingStats()
+    for X, y in iter_batches(path, batch_rows=200):
+        stats.update(X, y)
+    columns = stats.selected_columns()
+    model = train_lightgbm(path, columns, stats.means, {'max_depth': 3, 'min_data_in_leaf': 5}, 20, 200, str(tmp_path))
+    X_all = df[columns].fillna(stats.means[columns])
+    proba = model.predict_proba(X_all)
+    assert proba.shape == (1000, 2)
+    assert list(model.classes_) == [0, 1]
+    assert model.feature_name_ == columns
+    assert proba[df['label'] == 1, 1].mean() > proba[df['label'] == 0, 1].mean()
+
+    restored = pickle.loads(pickle.dumps(model))
+    np.testing.assert_allclose(restored.predict_proba(X_all), proba)
+    assert (restored.predict(X_all) == model.predict(X_all)).all()
+
+def test_batches_from_secom_store(tmp_path):
+    """測試：可直接從 secom_store 分批讀取，原始 -1/1 標籤轉為 0/1"""
+    from secom_store import ingest, N_FEATURES
+    rng = np.random.default_rng(1)
+    with open(tmp_path / 'features.txt', 'w') as f:
+        for _ in range(30):
+            f.write(' '.join(rng.normal(size=N_FEATURES).round(3).astype(str)) + '\n')
+    with open(tmp_path / 'labels.txt', 'w') as f:
+        for i in range(30):
+            f.write(f'{1 if i % 5 == 0 else -1} "19/07/2008 11:55:00"\n')
+    ingest(str(tmp_path / 'features.txt'), str(tmp_path / 'labels.txt'), str(tmp_path / 'store'))
+
+    batches = list(iter_batches(str(tmp_path / 'store'), batch_rows=8))
+    assert [len(y) for _, y in batches] == [8, 8, 8, 6]
+    assert batches[0][0].shape[1] == N_FEATURES
+    assert np.concatenate([y for _, y in batches]).sum() == 6
@@ -0,0 +1,69 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import wafer_index
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wafer_index import WaferIndex, build_wafer_index, load_history_metadata
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=4, size=(15, 60))
+    cluster = rng.integers(0, 15, size=3000)
+    X = pd.DataFrame(centers[cluster] + rng.normal(size=(3000, 60)),
+                     columns=[f'feature_{i}' for i in range(60)])
+    X.iloc[::17, 3] = np.nan
+    labels = (cluster == 0).astype(int)
+    timestamps = np.datetime64('2008-07-19T00:00:00') + np.arange(3000).astype('timedelta64[m]')
+    return X, labels, timestamps
+
+@pytest.fixture
+def index(history, tmp_path):
+    X, labels, timestamps = history
+    build_wafer_index(X, labels, timestamps, out_dir=str(tmp_path / 'wafer_index'), n_components=16)
+    return WaferIndex(str(tmp_path / 'wafer_index'))
+
+def _brute_force(X, query_row, k):
+    mean, std = X.mean(), X.std(ddof=0).replace(0, 1)
+    Z = ((X - mean) / std).fillna(0).to_numpy()
+    dist = np.linalg.norm(Z - Z[query_row], axis=1)
+    dist[query_row] = np.inf
+    return set(np.argsort(dist)[:k])
+
+def test_query_matches_brute_force(history, index):
+    """測試：粗搜尋 + 重排序的結果與暴力搜尋的最近鄰大致相同"""
+    X, _, _ = history
+    recalls = []
+    for row in (0, 100, 2000):
+        result = index.query(X.iloc[[row]], k=10, exclude=row)
+        assert row not in set(result['row'])
+        recalls.append(len(set(result['row']) & _brute_force(X, row, 10)) / 10)
+    assert np.mean(recalls) >= 0.9
+
+def test_result_has_labels_and_timestamps(history, index):
+    """測試：結果附上歷史晶圓的標籤與時間戳記，且依距離排序"""
+    X, labels, timestamps = history
+    result = index.query(X.iloc[5], k=5)
+    assert result['row'].iloc[0] == 5
+    assert result['distance'].is_monotonic_increasing
+    assert (result['label'].to_numpy() == labels[result['row']]).all()
+    assert (result['timestamp'].to_numpy() == timestamps[result['row']].astype('datetime64[ns]')).all()
+    assert set(result['outcome']) <= {'Pass', 'Fail'}
+
+def test_query_aligns_columns_by_name(history, index):
+    """測試：輸入欄位順序不同時依名稱對齊"""
+    X, _, _ = history
+    shuffled = X.iloc[[42]][list(reversed(X.columns))]
+    assert index.query(shuffled, k=1)['row'].iloc[0] == 42
+
+def test_history_metadata_from_labels_file(tmp_path):
+    """測試：時間戳記由 secom_labels.txt 取得，筆數不符時為 NaT"""
+    labels_path = tmp_path / 'labels.txt'
+    labels_path.write_text('-1 "19/07/2008 11:55:00"\n1 "19/07/2008 12:32:00"\n')
+    timestamps = load_history_metadata(2, labels_path=str(labels_path), store_dir=str(tmp_path / 'none'))
+    assert str(timestamps[1]) == '2008-07-19T12:32:00'
+    assert np.isnat(load_history_metadata(3, labels_path=str(labels_path), store_dir=str(tmp_path / 'none'))).all()
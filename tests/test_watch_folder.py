@@ -0,0 +1,119 @@
+import pytest
+import pandas as pd
+import numpy as np
+import shutil
+import sys
+import os
+import time
+
+# 將上一層目錄加入路徑，這樣才能 import watch_folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+
+from ensemble import ModelEnsemble
+from input_validation import SensorBounds
+from watch_folder import WatchStore, FolderWatcher, is_candidate
+
+class FixedHandle:
+    """假的 ModelHandle：固定回傳同一個模型，記錄被取用的次數"""
+    def __init__(self, model, version='v1'):
+        self.model, self.version, self.calls = model, version, 0
+
+    def current(self):
+        self.calls += 1
+        return self.version, self.model
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(3000, 5)), columns=[f'feature_{i}' for i in range(5)])
+    y = (X['feature_0'] > 1).astype(int)
+    return X, y
+
+@pytest.fixture
+def watcher(dataset, tmp_path):
+    X, y = dataset
+    pipeline = Pipeline([('impute', SimpleImputer()), ('model', LogisticRegression())]).fit(X, y)
+    handle = FixedHandle(ModelEnsemble([pipeline], [1.0]))
+    (tmp_path / 'incoming').mkdir()
+    store = WatchStore(str(tmp_path / 'store'))
+    return FolderWatcher(str(tmp_path / 'incoming'), store, handle, bounds=SensorBounds.from_data(X),
+                         settle_sec=0, chunk_rows=300, id_column='wafer_id')
+
+def test_new_files_scored_in_chunks(watcher, dataset):
+    """測試：新檔案逐塊評分，分區檔與原始列對齊，超出範圍的晶圓被拒絕且不計入彙總"""
+    X, _ = dataset
+    batch = X.iloc[:1000].assign(wafer_id=[f'W{i}' for i in range(1000)])
+    batch.iloc[5, 0] = 1e9
+    batch.to_csv(os.path.join(watcher.watch_dir, 'lot_001.csv'), index=False)
+
+    results = watcher.run_once()
+    assert [r['status'] for r in results] == ['done']
+    result = results[0]
+    assert result['rows'] == 1000 and result['rejected'] == 1 and result['scored'] == 999
+
+    scores = pd.read_csv(result['part'])
+    assert len(scores) == 1000 and scores['row'].tolist() == list(range(1000))
+    assert pd.isna(scores.loc[5, 'fail_probability']) and scores.loc[5, 'reject_reason'] != ''
+    expected = watcher.model_handle.model.predict_proba(X.iloc[:1000].drop(index=5))[:, 1]
+    np.testing.assert_allclose(scores['fail_probability'].drop(index=5), expected, atol=1e-4)  # prediction_score 四捨五入到小數 4 位
+
+    totals = watcher.store.totals()
+    assert totals['files'] == 1 and totals['scored'] == 999 and totals['fails'] == result['fails']
+    risks = watcher.store.top_risks(limit=5)
+    assert risks['fail_probability'].is_monotonic_decreasing and risks['wafer_id'].str.startswith('W').all()
+
+    # 分區日期、每小時彙總與顯示的完成時間都使用 UTC
+    finished = watcher.store.recent_files()['finished_at_utc'].iloc[0]
+    assert os.path.basename(os.path.dirname(result['part'])) == time.strftime('%Y-%m-%d', time.gmtime(result['started_at']))
+    assert watcher.store.hourly()['hour_utc'].tolist() == [finished.strftime('%Y-%m-%d %H:00')]
+
+def test_content_hash_skips_duplicates_and_rescans_changes(watcher, dataset):
+    """測試：相同內容 (複製 / 改名) 不重算，同名檔案內容改變時重新評分"""
+    X, _ = dataset
+    path = os.path.join(watcher.watch_dir, 'lot_001.csv')
+    X.iloc[:200].to_csv(path, index=False)
+    assert len(watcher.run_once()) == 1
+    shutil.copy(path, os.path.join(watcher.watch_dir, 'lot_001_copy.csv'))
+    assert watcher.run_once() == []
+
+    X.iloc[200:500].to_csv(path, index=False)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns - 10 ** 9))
+    results = watcher.run_once()
+    assert [r['rows'] for r in results] == [300]
+    assert watcher.store.totals()['rows'] == 500
+    assert watcher.store.hourly()['files'].sum() == 2
+
+def test_unsettled_temp_and_broken_files(watcher, dataset):
+    """測試：寫入中 / 暫存檔不處理；壞檔記錄失敗且不重試，--retry-failed 後再試"""
+    X, _ = dataset
+    assert not is_candidate('lot.csv.part') and not is_candidate('.hidden.csv') and is_candidate('lot.PARQUET')
+    open(os.path.join(watcher.watch_dir, 'lot_002.csv.tmp'), 'w').write('x')
+    X.iloc[:10].to_csv(os.path.join(watcher.watch_dir, 'fresh.csv'), index=False)
+    watcher.settle_sec = 60
+    assert watcher.scan() == []
+
+    watcher.settle_sec = 0
+    open(os.path.join(watcher.watch_dir, 'empty.csv'), 'w').write('feature_0\n')
+    results = {os.path.basename(r['path']): r for r in watcher.run_once()}
+    assert results['empty.csv']['status'] == 'failed' and 'no rows' in results['empty.csv']['error']
+    assert results['fresh.csv']['status'] == 'done'
+    assert not any(name.endswith('.tmp') for _, _, names in os.walk(watcher.store.store_dir) for name in names)
+    assert watcher.run_once() == []
+    assert watcher.store.totals()['failed_files'] == 1
+
+    assert watcher.store.forget_failed() == 1
+    assert [r['status'] for r in watcher.run_once()] == ['failed']
+
+def test_one_warm_model_across_files(watcher, dataset):
+    """測試：多個檔案共用同一個已載入的模型 (每個檔案只向 handle 取一次)，不會重新載入"""
+    X, _ = dataset
+    for k in range(4):
+        X.iloc[k * 100:(k + 1) * 100].to_csv(os.path.join(watcher.watch_dir, f'lot_{k}.csv'), index=False)
+    results = watcher.run_once()
+    assert len(results) == 4 and watcher.model_handle.calls == 4
+    assert {r['model_version'] for r in results} == {'v1'}
+    assert WatchStore.mtime(watcher.store.store_dir) is not None
@@ -0,0 +1,101 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# 將上一層目錄加入路徑，這樣才能 import what_if
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+
+from ensemble import ModelEnsemble
+from input_validation import SensorBounds
+from what_if import build_grid, default_ranges, sweep, pairwise_grid, score_overrides
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(400, 8)), columns=[f'feature_{i}' for i in range(8)])
+    y = (X['feature_0'] + 0.5 * X['feature_1'] > 0).astype(int)
+    return X, y
+
+class CountingModel:
+    """包一層模型，記錄 predict_proba 的呼叫次數與列數"""
+    def __init__(self, model):
+        self.model, self.calls = model, []
+        self.feature_names_in_ = model.feature_names_in_
+
+    def predict_proba(self, X):
+        self.calls.append(len(X))
+        return self.model.predict_proba(X)
+
+def test_grid_changes_one_sensor_per_block(dataset):
+    """測試：網格第 0 列為原始晶圓，每個區塊只改變一個感測器"""
+    X, _ = dataset
+    base = X.iloc[0]
+    grid, values = build_grid(base, {'feature_2': (-1.0, 1.0), 'feature_5': (0.0, 4.0)}, n_points=5)
+    assert grid.shape == (11, 8) and values.shape == (2, 5)
+    np.testing.assert_array_equal(grid[0], base.to_numpy())
+    np.testing.assert_allclose(grid[1:6, 2], [-1.0, -0.5, 0.0, 0.5, 1.0])
+    np.testing.assert_allclose(grid[6:, 5], [0.0, 1.0, 2.0, 3.0, 4.0])
+    changed = grid[1:] != base.to_numpy()
+    assert changed[:5, [c for c in range(8) if c != 2]].sum() == 0
+
+def test_sweep_scores_grid_in_one_call_and_finds_flip(dataset):
+    """測試：整個網格一次評分 (加上一次細分)，只有相關感測器能翻轉，且回報的數值確實翻轉"""
+    X, y = dataset
+    pipeline = Pipeline([('impute', SimpleImputer()), ('model', LogisticRegression())]).fit(X, y)
+    model = CountingModel(pipeline)
+    wafer = X.assign(wafer_id='W').iloc[[int(np.argmax(pipeline.predict_proba(X)[:, 1] < 0.2))]]
+    ranges = default_ranges(wafer, list(X.columns), reference=X)
+    result = sweep(model, wafer, ranges, n_points=21)
+
+    assert model.calls[0] == 1 + 8 * 21 and len(model.calls) == 2
+    assert result['rows_scored'] == sum(model.calls)
+    assert result['base_label'] == 0 and result['base_proba'] < 0.2
+    flips = result['flips'].set_index('sensor')
+    assert flips.index[0] == 'feature_0' and flips.loc['feature_0', 'delta'] > 0
+    assert flips.loc[['feature_3', 'feature_4'], 'flip_value'].isna().all()
+    proba = score_overrides(pipeline, wafer, {'feature_0': flips.loc['feature_0', 'flip_value']})
+    assert proba >= 0.5
+    assert len(result['curves']) == 8 * 21
+
+def test_step_function_model_and_ensemble(dataset):
+    """測試：樹模型 (階梯狀機率) 的翻轉值同樣確實翻轉；集成模型使用自己的閾值"""
+    X, y = dataset
+    forest = Pipeline([('impute', SimpleImputer()),
+                       ('model', RandomForestClassifier(n_estimators=50, random_state=0))]).fit(X, y)
+    logistic = Pipeline([('impute', SimpleImputer()), ('model', LogisticRegression())]).fit(X, y)
+    ensemble = ModelEnsemble([forest, logistic], [0.5, 0.5], threshold=0.4)
+    wafer = X.iloc[[0]]
+    ranges = default_ranges(wafer, ['feature_0', 'feature_1'], reference=X)
+    for model in (forest, ensemble):
+        result = sweep(model, wafer, ranges)
+        row = result['flips'].iloc[0]
+        flipped = score_overrides(model, wafer, {row['sensor']: row['flip_value']}) >= result['threshold']
+        assert flipped != bool(result['base_label'])
+    assert result['threshold'] == 0.4
+
+    grid = pairwise_grid(forest, wafer, 'feature_0', 'feature_1', ranges, n_points=6)
+    assert grid.shape == (6, 6) and grid.index.name == 'feature_1'
+    assert grid.iloc[-1, -1] > grid.iloc[0, 0]
+
+def test_default_ranges_fallbacks(dataset):
+    """測試：範圍依序取自批次分位數、訓練界限、目前數值，且一定包含目前數值"""
+    X, _ = dataset
+    wafer = X.iloc[0].copy()
+    wafer['feature_1'] = 50.0
+    wafer['feature_2'] = np.nan
+    bounds = SensorBounds(['feature_3'], [-7.0], [7.0], [0.0])
+    ranges = default_ranges(wafer, ['feature_0', 'feature_1', 'feature_3', 'feature_2'],
+                            reference=X[['feature_0', 'feature_1']], bounds=bounds)
+    assert ranges['feature_0'][0] == pytest.approx(X['feature_0'].quantile(0.01))
+    assert ranges['feature_1'][1] == 50.0
+    assert ranges['feature_3'] == (-7.0, 7.0)
+    assert ranges['feature_2'] == (-1.0, 1.0)
+    with pytest.raises(ValueError):
+        sweep(LogisticRegression().fit(X, X['feature_0'] > 0), X.iloc[:2], ranges)
@@ -0,0 +1,317 @@
+"""
+Out-of-Core 訓練 (資料量大於記憶體時使用)
+
+不再 pd.read_csv 整份資料 + PyCaret setup，而是分批串流：
+    Pass 1: 逐批讀取，累計每個感測器的 count / sum / min / max (補值用平均、剔除全空與零變異欄位)，
+            同時以 reservoir sampling 保留固定筆數的樣本 (建立 PyCaret pipeline 用)
+    Pass 2: 逐批補值後交給 boosted tree 的串流訓練 API
+            - XGBoost : DataIter + external memory (快取在磁碟上的分頁)
+            - LightGBM: lgb.Sequence，Dataset 建構時逐批讀取並直接分箱
+記憶體上限約為 batch_rows × 特徵數 + 分箱後資料，與總筆數無關。
+
+產出的模型與 train_upgrade.py 相同格式 (PyCaret Pipeline .pkl)，App 可直接載入：
+前處理 pipeline 由樣本 setup 建立，補值統計值再以整份資料的串流平均覆蓋。
+
+用法:
+    python train_out_of_core.py --source data/secom_store
+    python train_out_of_core.py --source data/secom_processed.csv --learner lightgbm --activate
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+from instrumentation import peak_rss_bytes, stage
+from log_config import configure_logging, pycaret_logger
+
+BATCH_ROWS = 8192
+SAMPLE_ROWS = 5000
+NUM_ROUNDS = 300
+OUTPUT_MODEL = 'output/out_of_core_yield_model'
+REPORT_PATH = 'reports/out_of_core_training.json'
+
+
+def iter_batches(source, batch_rows=BATCH_ROWS):
+    """
+    逐批讀取 (X DataFrame, y 0/1 ndarray)
+    source 可以是 secom_store 資料夾 (原始 -1/1 標籤) 或含 label 欄位的 CSV
+    """
+    if os.path.isdir(source):
+        from secom_store import SecomStore
+        store = SecomStore(source)
+        for features, labels, _ in store.iter_chunks():
+            for start in range(0, len(labels), batch_rows):
+                X = pd.DataFrame(np.asarray(features[start:start + batch_rows]), columns=store.feature_names)
+                yield X, (labels[start:start + batch_rows] == 1).astype(np.int8)
+    else:
+        for chunk in pd.read_csv(source, chunksize=batch_rows):
+            y = chunk.pop('label').to_numpy()
+            yield chunk.astype(np.float64), (y == 1).astype(np.int8)
+
+
+class StreamingStats:
+    """逐批累計欄位統計值與固定大小的隨機樣本"""
+
+    def __init__(self, sample_rows=SAMPLE_ROWS, random_state=123):
+        self.sample_rows = sample_rows
+        self.rng = np.random.default_rng(random_state)
+        self.columns = None
+        self.count = self.total = self.minimum = self.maximum = None
+        self.n_rows = 0
+        self.n_positive = 0
+        self._sample = None
+        self._sample_keys = np.empty(0)
+
+    def update(self, X, y):
+        values = X.to_numpy(dtype=np.float64)
+        if self.columns is None:
+            self.columns = list(X.columns)
+            n = len(self.columns)
+            self.count = np.zeros(n, dtype=np.int64)
+            self.total = np.zeros(n)
+            self.minimum = np.full(n, np.inf)
+            self.maximum = np.full(n, -np.inf)
+        present = ~np.isnan(values)
+        self.count += present.sum(axis=0)
+        self.total += np.where(present, values, 0.0).sum(axis=0)
+        self.minimum = np.fmin(self.minimum, np.nanmin(np.where(present, values, np.inf), axis=0))
+        self.maximum = np.fmax(self.maximum, np.nanmax(np.where(present, values, -np.inf), axis=0))
+        self.n_rows += len(y)
+        self.n_positive += int(np.sum(y))
+
+        # Reservoir sampling：每列給一個隨機 key，只保留 key 最小的 sample_rows 列
+        batch = X.assign(label=np.asarray(y, dtype=np.int64))
+        keys = self.rng.random(len(batch))
+        merged = batch if self._sample is None else pd.concat([self._sample, batch], ignore_index=True)
+        merged_keys = np.concatenate([self._sample_keys, keys])
+        keep = np.sort(np.argsort(merged_keys, kind='stable')[:self.sample_rows])
+        self._sample = merged.iloc[keep].reset_index(drop=True)
+        self._sample_keys = merged_keys[keep]
+
+    @property
+    def means(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.Series(self.total / self.count, index=self.columns)
+
+    def selected_columns(self):
+        """與 01_data_preprocessing 相同：移除全空與零變異的欄位"""
+        keep = (self.count > 0) & (self.maximum > self.minimum)
+        return [c for c, k in zip(self.columns, keep) if k]
+
+    def sample(self):
+        return self._sample
+
+
+def imputed_batches(source, columns, means, batch_rows=BATCH_ROWS):
+    """Pass 2：只取選定欄位並以整體平均補值"""
+    fill = means[columns]
+    for X, y in iter_batches(source, batch_rows):
+        yield X[columns].fillna(fill), y
+
+
+def train_xgboost(source, columns, means, params, num_rounds, batch_rows, cache_dir):
+    import xgboost as xgb
+
+    class _BatchIter(xgb.DataIter):
+        def __init__(self):
+            self._batches = None
+            super().__init__(cache_prefix=os.path.join(cache_dir, 'xgb-cache'))
+
+        def next(self, input_data):
+            if self._batches is None:
+                self._batches = imputed_batches(source, columns, means, batch_rows)
+            batch = next(self._batches, None)
+            if batch is None:
+                return 0
+            X, y = batch
+            input_data(data=X.to_numpy(dtype=np.float32), label=y, feature_names=columns)
+            return 1
+
+        def reset(self):
+            self._batches = None
+
+    dtrain = xgb.DMatrix(_BatchIter(), missing=np.nan)
+    booster = xgb.train({'tree_method': 'hist', 'objective': 'binary:logistic', **params},
+                        dtrain, num_boost_round=num_rounds)
+
+    # 以 sklearn 介面載回，predict_model / SHAP TreeExplainer 都能直接使用
+    model_file = os.path.join(cache_dir, 'booster.json')
+    booster.save_model(model_file)
+    model = xgb.XGBClassifier()
+    model.load_model(model_file)
+    return model
+
+
+class BoosterClassifier(ClassifierMixin, BaseEstimator):
+    """
+    串流訓練得到的 LightGBM Booster 的 sklearn 分類器介面 (二元分類，只供預測)
+    只透過 Booster 的公開 API 預測，不依賴 LGBMClassifier 的私有屬性；
+    predict_model 使用 predict / predict_proba，SHAP 透過 booster_ 取得原生模型。
+    沒有 fit：重新訓練請再跑 train_out_of_core.py
+    """
+
+    def __init__(self, booster=None, threshold=0.5):
+        self.booster = booster
+        self.threshold = threshold
+
+    def __sklearn_is_fitted__(self):
+        return self.booster is not None
+
+    @property
+    def booster_(self):
+        return self.booster
+
+    @property
+    def classes_(self):
+        return np.array([0, 1])
+
+    @property
+    def n_features_in_(self):
+        return self.booster.num_feature()
+
+    @property
+    def feature_name_(self):
+        return self.booster.feature_name()
+
+    @property
+    def feature_names_in_(self):
+        return np.array(self.feature_name_, dtype=object)
+
+    def predict_proba(self, X):
+        p = self.booster.predict(np.asarray(X, dtype=np.float64))
+        return np.column_stack([1 - p, p])
+
+    def predict(self, X):
+        return self.classes_[(self.predict_proba(X)[:, 1] >= self.threshold).astype(int)]
+
+
+def train_lightgbm(source, columns, means, params, num_rounds, batch_rows, cache_dir):
+    import lightgbm as lgb
+
+    # Sequence 需要隨機存取，因此先把補值後的批次寫成 memmap (磁碟上的 float32)
+    path = os.path.join(cache_dir, 'lgb-features.f32')
+    labels, n_rows = [], 0
+    with open(path, 'wb') as f:
+        for X, y in imputed_batches(source, columns, means, batch_rows):
+            f.write(X.to_numpy(dtype=np.float32).tobytes())
+            labels.append(y)
+            n_rows += len(y)
+    matrix = np.memmap(path, dtype=np.float32, mode='r', shape=(n_rows, len(columns)))
+
+    class _MemmapSequence(lgb.Sequence):
+        def __init__(self, data):
+            self.data = data
+            self.batch_size = batch_rows
+
+        def __getitem__(self, idx):
+            return self.data[idx]
+
+        def __len__(self):
+            return len(self.data)
+
+    dtrain = lgb.Dataset(_MemmapSequence(matrix), label=np.concatenate(labels), feature_name=columns,
+                         free_raw_data=True)
+    booster = lgb.train({'objective': 'binary', 'verbose': -1, **params}, dtrain, num_boost_round=num_rounds)
+
+    # 包成 sklearn 分類器，讓 predict_model / SHAP 與一般訓練的模型用法相同
+    return BoosterClassifier(booster)
+
+
+LEARNERS = {'xgboost': train_xgboost, 'lightgbm': train_lightgbm}
+
+
+def build_artifact(model, stats, columns, output_path):
+    """
+    用樣本跑 PyCaret setup 取得前處理 pipeline，補值統計值改為整份資料的平均，
+    接上串流訓練的模型後存成與 train_upgrade.py 相同格式的 .pkl
+    """
+    import joblib
+    from pycaret.classification import setup, save_model, load_model
+
+    sample = stats.sample()[columns + ['label']]
+    setup(data=sample, target='label', session_id=123, numeric_imputation='mean', verbose=False, html=False,
+          system_log=pycaret_logger())
+    save_model(model, output_path, verbose=False)
+
+    pipeline = load_model(output_path, verbose=False)
+    means = stats.means
+    for _, step in pipeline.steps[:-1]:
+        imputer = getattr(step, 'transformer', None)
+        if getattr(imputer, 'strategy', None) == 'mean' and hasattr(imputer, 'statistics_'):
+            names = getattr(imputer, 'feature_names_in_', columns)
+            imputer.statistics_ = means[list(names)].to_numpy()
+    joblib.dump(pipeline, output_path + '.pkl')
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a boosted-tree model by streaming batches from disk")
+    parser.add_argument('--source', default='data/secom_store', help="secom_store directory or processed CSV")
+    parser.add_argument('--learner', choices=sorted(LEARNERS), default='xgboost')
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    parser.add_argument('--rounds', type=int, default=NUM_ROUNDS)
+    parser.add_argument('--max-depth', type=int, default=6)
+    parser.add_argument('--learning-rate', type=float, default=0.05)
+    parser.add_argument('--output', default=OUTPUT_MODEL)
+    parser.add_argument('--activate', action='store_true', help="register the model and make it ACTIVE")
+    args = parser.parse_args()
+    configure_logging('train_out_of_core')
+
+    timings = {}
+    print(f"📦 Pass 1: streaming column statistics from {args.source}...")
+    start = time.perf_counter()
+    stats = StreamingStats()
+    with stage('ooc_stats_pass') as s:
+        for X, y in iter_batches(args.source, args.batch_rows):
+            stats.update(X, y)
+            s.add_rows(len(y))
+    timings['stats_sec'] = time.perf_counter() - start
+    columns = stats.selected_columns()
+    print(f"   -> {stats.n_rows} rows, {len(columns)} / {len(stats.columns)} sensors kept")
+
+    # 串流訓練無法在每個 fold 做 SMOTE，改以 scale_pos_weight 平衡類別
+    params = {'max_depth': args.max_depth, 'learning_rate': args.learning_rate,
+              'scale_pos_weight': (stats.n_rows - stats.n_positive) / max(stats.n_positive, 1)}
+
+    print(f"🌲 Pass 2: training {args.learner} for {args.rounds} rounds...")
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as cache_dir, stage('ooc_train_pass', rows=stats.n_rows):
+        model = LEARNERS[args.learner](args.source, columns, stats.means, params, args.rounds,
+                                       args.batch_rows, cache_dir)
+    timings['train_sec'] = time.perf_counter() - start
+
+    print("💾 Building app-compatible pipeline...")
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    build_artifact(model, stats, columns, args.output)
+
+    report = {
+        'source': args.source,
+        'learner': args.learner,
+        'rows': stats.n_rows,
+        'features': len(columns),
+        'batch_rows': args.batch_rows,
+        'stats_sec': round(timings['stats_sec'], 2),
+        'train_sec': round(timings['train_sec'], 2),
+        'rows_per_sec': round(stats.n_rows / max(timings['stats_sec'] + timings['train_sec'], 1e-9), 1),
+        'peak_rss_mb': round(peak_rss_bytes() / 1e6, 1),
+        'model_path': args.output + '.pkl',
+    }
+    if args.activate:
+        from model_registry import ModelRegistry
+        report['version'] = ModelRegistry().register(
+            args.output + '.pkl', source='train_out_of_core.py',
+            metadata={'model': type(model).__name__, 'out_of_core': report}, activate=True)
+
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Done: {report['rows_per_sec']} rows/s, peak RSS {report['peak_rss_mb']} MB -> {REPORT_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,25 @@
 from pycaret.classification import *
 import pandas as pd
 import pickle
+import json
 import os
 import shutil
+import time
+import joblib
+import numpy as np
 import matplotlib.pyplot as plt
+from sklearn.metrics import roc_auc_score
+from drift_monitor import SensorSketch
+from input_validation import SensorBounds, DEFAULT_BOUNDS_PATH as INPUT_BOUNDS_PATH
+from model_registry import ModelRegistry
+from fast_smote import get_resampler
+from shap_store import ShapStore, build_shap_store, STORE_DIR as SHAP_STORE_DIR
+from wafer_index import build_wafer_index, load_history_metadata, INDEX_DIR as WAFER_INDEX_DIR
+from ensemble import ModelEnsemble, fit_weights, cross_fitted_proba, preprocessing_matches
+from explain import approximation_error, save_error_report, APPROX_REPORT_PATH
+from resource_ledger import ResourceLedger, LEDGER_PATH
+from log_config import configure_logging, pycaret_logger, disable_catboost_files
+from streaming_eval import evaluate_files, eval_inputs_from_env, write_reports, REPORT_IMAGES
 
 # 設定 Matplotlib 後端，避免在無介面伺服器執行時報錯
 plt.switch_backend('Agg')
@@ -14,6 +30,10 @@ print("🚀 開始執行模型升級與報告生成程序 (v4.0 專業多模型
 REPORT_DIR = 'reports'
 if not os.path.exists(REPORT_DIR):
     os.makedirs(REPORT_DIR)
+# PyCaret 的 logs.log 改由背景執行緒寫入 reports/logs/train_upgrade.log (輪替並壓縮)
+configure_logging('train_upgrade')
+# 各階段的牆鐘 / CPU 時間與記憶體峰值 (python resource_ledger.py compare 比較歷次執行)
+ledger = ResourceLedger('train_upgrade.py')
 
 # --- 1. 載入資料 ---
 print("📦 正在載入資料...")
@@ -24,7 +44,10 @@ if not os.path.exists(DATA_FILE):
     else:
         raise FileNotFoundError(f"❌ 找不到 {DATA_FILE}")
 
-dataset = pd.read_csv(DATA_FILE)
+with ledger.stage('load_data') as s_load:
+    dataset = pd.read_csv(DATA_FILE)
+    s_load.set(rows=len(dataset), features=dataset.shape[1] - 1)
+n_rows, n_features = len(dataset), dataset.shape[1] - 1
 
 # --- 2. 生成特徵清單 ---
 print("📝 正在生成特徵清單...")
@@ -32,20 +55,41 @@ required_features = dataset.drop('label', axis=1).columns.tolist()
 with open('required_features.pkl', 'wb') as f:
     pickle.dump(required_features, f)
 
+# --- 2.1 建立感測器參考分佈 (漂移監控用) ---
+print("📐 正在建立感測器參考直方圖 (漂移監控)...")
+with ledger.stage('drift_reference', rows=n_rows, features=n_features):
+    reference_sketch = SensorSketch.from_data(dataset, feature_names=required_features)
+    reference_sketch.save(os.path.join(REPORT_DIR, 'drift_reference.npz'))
+print(f"   -> 已儲存 {len(required_features)} 個感測器的參考分佈")
+
+# --- 2.2 保存輸入驗證界限 (App 在預測前擋下超出範圍或格式錯誤的晶圓) ---
+print("🧪 正在保存感測器輸入界限...")
+with ledger.stage('input_bounds', rows=n_rows, features=n_features):
+    SensorBounds.from_data(dataset, feature_names=required_features).save(INPUT_BOUNDS_PATH)
+print(f"   -> 已儲存至 {INPUT_BOUNDS_PATH}")
+
 # --- 3. 設定 PyCaret 環境 ---
 print("⚙️ 設定訓練環境 (處理不平衡資料)...")
-# fix_imbalance=True 使用 SMOTE 處理良率不平衡問題
-s = setup(data=dataset, target='label', session_id=123, 
-          fix_imbalance=True, verbose=False)
+# fix_imbalance=True 使用 SMOTE 處理良率不平衡問題 (FastSMOTE：向量化 kNN + 鄰居圖快取)
+with ledger.stage('setup', rows=n_rows, features=n_features):
+    s = setup(data=dataset, target='label', session_id=123, 
+              fix_imbalance=True, fix_imbalance_method=get_resampler(), verbose=False,
+              system_log=pycaret_logger())
+disable_catboost_files()
 
 # --- 4. 訓練與比較模型 (RF, XGBoost, LightGBM, CatBoost) ---
 print("🏎️ 正在比較模型 (Random Forest, XGBoost, LightGBM, CatBoost)...")
 # 根據 Grok 建議，我們鎖定 Recall 與 F1 作為主要參考，因為半導體失效檢測更看重漏檢率
-best_model = compare_models(
-    include=['rf', 'xgboost', 'lightgbm', 'catboost'], 
-    sort='Recall',  # 優先保證能抓出失敗樣品
-    verbose=False
-)
+# n_select=4 保留全部候選模型，第一名照舊用於報告，其餘供集成模式使用
+with ledger.stage('compare_models', rows=n_rows, features=n_features):
+    top_models = compare_models(
+        include=['rf', 'xgboost', 'lightgbm', 'catboost'], 
+        sort='Recall',  # 優先保證能抓出失敗樣品
+        n_select=4,
+        verbose=False
+    )
+top_models = top_models if isinstance(top_models, list) else [top_models]
+best_model = top_models[0]
 
 # 抓取比較結果表並儲存
 comparison_results = pull()
@@ -63,11 +107,16 @@ plots = {
     'learning': 'Learning Curve.png', # 新增學習曲線檢查過擬合
     'pr': 'Precision Recall.png'     # 新增 PR 曲線針對不平衡資料
 }
+# YIELD_EVAL_DATA 指定大型已標記 holdout 時，混淆矩陣 / AUC / PR 改由串流評估產生 (見 6.1)
+eval_files = eval_inputs_from_env()
+if eval_files:
+    plots = {k: v for k, v in plots.items() if k not in REPORT_IMAGES}
 
 for plot_type, file_name in plots.items():
     try:
-        plt.clf()
-        plot_model(best_model, plot=plot_type, save=True)
+        with ledger.stage(f'plot_model:{plot_type}', rows=n_rows, features=n_features):
+            plt.clf()
+            plot_model(best_model, plot=plot_type, save=True)
         
         # 處理 PyCaret 存檔名稱中的空格與路徑移動
         generated_file = f"{plot_type.capitalize()}.png" if plot_type != 'confusion_matrix' else 'Confusion Matrix.png'
@@ -80,23 +129,132 @@ for plot_type, file_name in plots.items():
     except Exception as e:
         print(f"   ⚠️ 無法生成 {file_name}: {e}")
 
-# --- 6. 生成 SHAP 解釋圖 ---
-print("🧠 正在計算 SHAP Values...")
-try:
-    plt.close('all')
-    interpret_model(best_model, plot='summary', save=True)
-    
-    # interpret_model 的 save=True 通常存為 'SHAP Summary.png'
-    if os.path.exists('SHAP Summary.png'):
-        shutil.move('SHAP Summary.png', os.path.join(REPORT_DIR, 'SHAP Summary.png'))
-        print(f"   -> ✅ SHAP Summary 儲存完成")
-except Exception as e:
-    print(f"   ❌ SHAP 生成失敗: {e}")
-
-# --- 7. 最終模型存檔 ---
+# --- 6. 最終模型存檔 ---
 print("💾 正在儲存最佳模型...")
-final_model = finalize_model(best_model)
-save_model(final_model, 'final_yield_prediction_model')
+finalize_start = time.perf_counter()
+with ledger.stage('finalize_model', rows=n_rows, features=n_features):
+    final_model = finalize_model(best_model)
+    finalize_sec = time.perf_counter() - finalize_start
+    save_model(final_model, 'final_yield_prediction_model')
 shutil.copy('final_yield_prediction_model.pkl', os.path.join(REPORT_DIR, 'final_yield_prediction_model.pkl'))
 
+# --- 6.1 串流評估：逐塊評分大型已標記 holdout，輸出與 plot_model 相同的圖檔 ---
+if eval_files:
+    print(f"📏 正在串流評估 {len(eval_files)} 個已標記檔案...")
+    with ledger.stage('streaming_eval') as s_eval:
+        eval_hist, eval_errors = evaluate_files(eval_files, final_model,
+                                                workers=int(os.environ.get('YIELD_EVAL_WORKERS', os.cpu_count() or 1)))
+        s_eval.set(rows=eval_hist.n_rows)
+        eval_metrics = write_reports(eval_hist, REPORT_DIR, csv_dir=os.path.join(REPORT_DIR, 'streaming_eval'))
+    for path, error in eval_errors.items():
+        print(f"   ⚠️ 無法評估 {path}: {error}")
+    print(f"   -> {eval_metrics['Rows']:,} 片晶圓: AUC {eval_metrics['AUC']:.4f} / F1 {eval_metrics['F1']:.4f}")
+
+# --- 7. 登錄到模型版本庫 (執行中的 App 會在背景暖機後自動切換) ---
+print("📚 正在登錄模型版本...")
+registry = ModelRegistry()
+model_version = registry.register(
+    'final_yield_prediction_model.pkl',
+    source='train_upgrade.py',
+    metadata={
+        'model': type(best_model).__name__,
+        'cv_metrics': json.loads(comparison_results.iloc[0].to_json()),
+        'finalize_sec': round(finalize_sec, 2),
+    },
+    activate=True
+)
+print(f"   -> ✅ 模型版本 {model_version} 已設為 ACTIVE")
+
+# SHAP store 使用的模型 (集成啟用時改為權重最高的成員，與 App 的解釋一致)
+explained_model = final_model
+
+# --- 7.1 集成模式：保留前幾名模型，以 holdout 擬合權重 (App 以 thread pool 同時預測) ---
+# YIELD_ENSEMBLE=0 時跳過；集成的交叉擬合 holdout AUC 不低於單一最佳模型時才設為 ACTIVE
+# (比較用的集成機率每一折只用其他折擬合權重，避免在擬合權重的同一批資料上評估而高估集成)
+if len(top_models) > 1 and os.environ.get('YIELD_ENSEMBLE', '1') != '0':
+    print(f"🤝 正在建立 {len(top_models)} 個模型的集成...")
+    with ledger.stage('ensemble', rows=n_rows, features=n_features):
+        try:
+            y_holdout = get_config('y_test').to_numpy()
+            holdout_probas = np.column_stack([
+                predict_model(m, raw_score=True, verbose=False)['prediction_score_1'].to_numpy() for m in top_models
+            ])
+            weights = fit_weights(holdout_probas, y_holdout)
+            ensemble_auc = roc_auc_score(y_holdout, cross_fitted_proba(holdout_probas, y_holdout))
+            # compare_models 依 Recall 排序，第一名不一定是 holdout AUC 最高的單一模型
+            single_aucs = [roc_auc_score(y_holdout, holdout_probas[:, k]) for k in range(holdout_probas.shape[1])]
+            best_single = int(np.argmax(single_aucs))
+            single_auc = single_aucs[best_single]
+
+            members = [final_model] + [finalize_model(m) for m in top_models[1:]]
+            ensemble = ModelEnsemble(members, weights, names=[type(m).__name__ for m in top_models])
+            ensemble.shared_preprocessing = preprocessing_matches(members, get_config('X_test').head(200))
+            ensemble_file = 'final_yield_ensemble.pkl'
+            joblib.dump(ensemble, ensemble_file)
+            activate_ensemble = ensemble_auc >= single_auc
+            ensemble_version = registry.register(
+                ensemble_file,
+                source='train_upgrade.py',
+                metadata={
+                    'model': 'ModelEnsemble',
+                    'members': ensemble.names,
+                    'weights': [round(float(w), 4) for w in weights],
+                    'holdout_auc': {'ensemble': round(float(ensemble_auc), 4), 'best_single': round(float(single_auc), 4),
+                                    'best_single_model': ensemble.names[best_single],
+                                    'ensemble_method': 'cross_fitted'},
+                    'shared_preprocessing': ensemble.shared_preprocessing,
+                    # incremental_training.py 無法接續訓練集成，改從這個單一模型版本接續
+                    'single_model_version': model_version,
+                },
+                activate=activate_ensemble
+            )
+            os.remove(ensemble_file)
+            print(ensemble.describe().to_string(index=False))
+            print(f"   -> Holdout AUC: 集成 (交叉擬合) {ensemble_auc:.4f} / "
+                  f"單一最佳 {ensemble.names[best_single]} {single_auc:.4f}")
+            if activate_ensemble:
+                model_version = ensemble_version
+                explained_model = ensemble.explain_pipeline
+                print(f"   -> ✅ 集成版本 {ensemble_version} 已設為 ACTIVE")
+            else:
+                print(f"   -> 集成版本 {ensemble_version} 已登錄 (未啟用，單一模型表現較好)")
+        except Exception as e:
+            print(f"   ❌ 集成建立失敗: {e}")
+
+# --- 8. 建立全域 SHAP store (取代靜態的 SHAP Summary.png，儀表板可互動篩選) ---
+print("🧠 正在計算整份資料的 SHAP Values...")
+with ledger.stage('shap_store', rows=n_rows, features=n_features):
+    try:
+        X_all = dataset.drop('label', axis=1)
+        build_shap_store(explained_model, X_all, labels=dataset['label'], model_version=model_version)
+        print(f"   -> ✅ SHAP store 已儲存至 {SHAP_STORE_DIR} ({len(X_all)} 筆)")
+        # 書面報告用的靜態 summary 圖直接由 store 的點雲繪製
+        ShapStore.load(SHAP_STORE_DIR).save_summary_png(os.path.join(REPORT_DIR, 'SHAP Summary.png'))
+        print("   -> ✅ SHAP Summary 儲存完成")
+    except Exception as e:
+        print(f"   ❌ SHAP store 建立失敗: {e}")
+
+# --- 8.1 近似解釋的誤差報告 (儀表板批次摘要預設使用近似模式，顯示與 exact 的差距) ---
+print("📏 正在比較近似解釋與 exact SHAP...")
+with ledger.stage('shap_approximation'):
+    try:
+        approx_report = approximation_error(explained_model, get_config('X_test'))
+        save_error_report(approx_report, model_version=model_version)
+        print(f"   -> 相對誤差 {approx_report['relative_error']:.1%}，重要性排名相關 {approx_report['importance_spearman']:.3f}，"
+              f"加速 {approx_report['speedup']:.1f} 倍 (已儲存至 {APPROX_REPORT_PATH})")
+    except Exception as e:
+        print(f"   ❌ 近似誤差報告建立失敗: {e}")
+
+# --- 9. 建立相似晶圓索引 (App 以 memory-map 開啟，查詢歷史上最相似的晶圓) ---
+print("🔎 正在建立相似晶圓索引...")
+with ledger.stage('wafer_index', rows=n_rows, features=n_features):
+    try:
+        X_history = dataset.drop('label', axis=1)
+        build_wafer_index(X_history, dataset['label'].to_numpy(), load_history_metadata(len(dataset)),
+                          model_version=model_version)
+        print(f"   -> ✅ 已索引 {len(X_history)} 片晶圓至 {WAFER_INDEX_DIR}")
+    except Exception as e:
+        print(f"   ❌ 相似晶圓索引建立失敗: {e}")
+
+print(f"📒 各階段資源用量已寫入 {LEDGER_PATH} (python resource_ledger.py compare --script train_upgrade.py)")
 print("\n🎉 階段 2 步驟 1 執行完成！已完成多模型比較與學習曲線生成。")
\ No newline at end of file
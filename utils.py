@@ -1,12 +1,16 @@
 import streamlit as st
-from pycaret.classification import load_model, predict_model
+from pycaret.classification import load_model
 import os
 import pickle
+import hashlib
 import pandas as pd
+from instrumentation import stage
+from profiling import profiled
+from ensemble import predict_frame
 
-@st.cache_resource
-def load_model_cached(model_path):
-    """載入 PyCaret 模型並進行快取"""
+@st.cache_resource(max_entries=2)
+def _load_model_from_path(model_path):
+    """載入 PyCaret 模型並進行快取 (最多保留兩個版本，切換時舊版本自然淘汰)"""
     try:
         if not os.path.exists(f"{model_path}.pkl"):
             st.error(f"❌ 找不到模型檔案: {model_path}.pkl")
@@ -16,6 +20,16 @@ def load_model_cached(model_path):
         st.error(f"❌ 無法載入模型: {e}")
         return None
 
+def load_model_cached(model_path=None):
+    """載入模型；未指定路徑時使用版本庫中的 ACTIVE 版本 (切換版本後會自動載入新模型)"""
+    if model_path is None:
+        from model_registry import ModelRegistry
+        _, model_path = ModelRegistry().resolve()
+        if model_path is None:
+            st.error("❌ 模型版本庫中沒有可用的模型")
+            return None
+    return _load_model_from_path(model_path)
+
 def load_feature_config(config_path='required_features.pkl'):
     """載入特徵清單"""
     if os.path.exists(config_path):
@@ -24,11 +38,17 @@ def load_feature_config(config_path='required_features.pkl'):
     else:
         return ['feature_1', 'feature_2', 'feature_3']
 
+def dataframe_fingerprint(df):
+    """計算 DataFrame 內容指紋 (同一批資料在 rerun 時會得到相同的值)"""
+    digest = hashlib.md5('|'.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
 def make_prediction(model, input_data):
     """單筆預測"""
     try:
         input_df = pd.DataFrame([input_data])
-        predictions = predict_model(model, data=input_df)
+        predictions = predict_frame(model, data=input_df)
         
         if 'prediction_label' in predictions.columns:
             pred_label = predictions['prediction_label'].iloc[0]
@@ -41,21 +61,35 @@ def make_prediction(model, input_data):
     except Exception as e:
         raise e
 
-def make_batch_prediction(model, file):
+@profiled('make_batch_prediction')
+def make_batch_prediction(model, file, cache=None, model_version=None):
     """
     執行批量預測
     Args:
         model: PyCaret 模型物件
         file: 上傳的 CSV 檔案物件
+        cache: PredictionCache (選用)；搭配 model_version 時只預測沒看過的列
     Returns:
         pd.DataFrame: 包含原始資料與預測結果 (Label, Score)
     """
     try:
         # 1. 讀取上傳的 CSV
-        data = pd.read_csv(file)
+        with stage('csv_parse') as s:
+            data = pd.read_csv(file)
+            s.add_rows(len(data))
         
         # 2. 執行預測 (PyCaret 會自動處理缺失值與正規化)
-        predictions = predict_model(model, data=data)
+        if cache is not None and model_version is not None:
+            from model_registry import model_feature_names
+
+            def score_rows(rows):
+                with stage('predict_model', rows=len(rows)):
+                    return predict_frame(model, data=rows)
+
+            predictions, _ = cache.predict(data, model_version, model_feature_names(model), score_rows)
+        else:
+            with stage('predict_model', rows=len(data)):
+                predictions = predict_frame(model, data=data)
         
         # 3. 整理欄位名稱 (統一新舊版本 PyCaret 輸出)
         rename_dict = {
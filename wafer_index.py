@@ -0,0 +1,273 @@
+"""
+相似歷史晶圓索引 (Similar Wafer Index)
+
+訓練時把所有歷史晶圓的感測器向量 (或 SHAP 向量) 建成向量索引，App 啟動時以 memory-map 開啟，
+查詢某片晶圓時回傳最相似的 k 片歷史晶圓與其結果 (Pass/Fail)、時間戳記。
+
+    reports/wafer_index/
+        meta.json        <- 特徵名稱、向量空間 (sensor / shap)、筆數、PCA 維度
+        scaler.npz       <- z-score 的平均與標準差、PCA 投影矩陣
+        proj.npy         <- (rows, 32) float32 PCA 投影向量 (粗搜尋)
+        proj_norms.npy   <- 投影向量的平方長度
+        full.npy         <- (rows, features) float32 標準化後的完整向量 (精確重排序)
+        labels.npy / timestamps.npy
+
+查詢流程：在 32 維投影空間分塊計算距離找出 k × RERANK_FACTOR 個候選，
+再讀取候選的完整向量以原始空間距離重新排序。百萬筆資料的粗搜尋只需一次矩陣乘法。
+
+用法:
+    python wafer_index.py build --data data/secom_processed.csv
+    python wafer_index.py query --row 12 --k 10
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+INDEX_DIR = 'reports/wafer_index'
+N_COMPONENTS = 32
+PCA_SAMPLE_ROWS = 20000
+BLOCK_ROWS = 262144
+RERANK_FACTOR = 8
+LABELS_PATH = 'data/secom_labels.txt'
+SECOM_STORE_DIR = 'data/secom_store'
+
+
+def load_history_metadata(n_rows, labels_path=LABELS_PATH, store_dir=SECOM_STORE_DIR):
+    """
+    取得歷史晶圓的時間戳記 (與 secom_processed.csv 同樣的列順序)
+    優先使用 secom_store，其次解析 secom_labels.txt；筆數對不上時回傳 NaT
+    """
+    from secom_store import SecomStore, parse_label_block
+
+    store = SecomStore(store_dir)
+    if store.exists and store.n_rows == n_rows:
+        return np.concatenate([ts for _, _, ts in store.iter_chunks()])
+    if os.path.exists(labels_path):
+        _, timestamps = parse_label_block(labels_path, 0, os.path.getsize(labels_path))
+        if len(timestamps) == n_rows:
+            return timestamps
+    return np.full(n_rows, np.datetime64('NaT'), dtype='datetime64[s]')
+
+
+def _pca_components(sample, n_components):
+    """以 SVD 求主成分 (sample 已標準化)"""
+    centered = sample - sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    return np.ascontiguousarray(vt[:n_components].T, dtype=np.float32)
+
+
+def build_wafer_index(vectors, labels, timestamps=None, out_dir=INDEX_DIR, feature_names=None,
+                      space='sensor', model_version=None, n_components=N_COMPONENTS,
+                      chunk_rows=BLOCK_ROWS, random_state=123):
+    """
+    建立索引 (先寫暫存資料夾，完成後再替換)
+    Args:
+        vectors: (rows, features) 感測器值或 SHAP 值 (DataFrame 或 ndarray，可為 memmap)
+        labels: 0/1 標籤
+    """
+    if isinstance(vectors, pd.DataFrame):
+        feature_names = list(vectors.columns)
+        vectors = vectors.to_numpy(dtype=np.float64)
+    n_rows, n_features = vectors.shape
+    feature_names = feature_names or [f'feature_{i}' for i in range(n_features)]
+    if timestamps is None:
+        timestamps = np.full(n_rows, np.datetime64('NaT'), dtype='datetime64[s]')
+
+    # z-score 統計值 (分塊累計，NaN 忽略)
+    total = np.zeros(n_features)
+    total_sq = np.zeros(n_features)
+    count = np.zeros(n_features)
+    for start in range(0, n_rows, chunk_rows):
+        block = np.asarray(vectors[start:start + chunk_rows], dtype=np.float64)
+        present = ~np.isnan(block)
+        block = np.where(present, block, 0.0)
+        total += block.sum(axis=0)
+        total_sq += (block ** 2).sum(axis=0)
+        count += present.sum(axis=0)
+    mean = total / np.maximum(count, 1)
+    std = np.sqrt(np.maximum(total_sq / np.maximum(count, 1) - mean ** 2, 0.0))
+    std[std == 0] = 1.0
+
+    def normalize(block):
+        z = (np.asarray(block, dtype=np.float64) - mean) / std
+        return np.nan_to_num(z, nan=0.0).astype(np.float32)
+
+    rng = np.random.default_rng(random_state)
+    sample_idx = np.sort(rng.choice(n_rows, size=min(n_rows, PCA_SAMPLE_ROWS), replace=False))
+    n_components = min(n_components, n_features, len(sample_idx))
+    components = _pca_components(normalize(vectors[sample_idx]), n_components)
+
+    staging = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    full = np.lib.format.open_memmap(os.path.join(staging, 'full.npy'), mode='w+',
+                                     dtype=np.float32, shape=(n_rows, n_features))
+    proj = np.lib.format.open_memmap(os.path.join(staging, 'proj.npy'), mode='w+',
+                                     dtype=np.float32, shape=(n_rows, n_components))
+    for start in range(0, n_rows, chunk_rows):
+        z = normalize(vectors[start:start + chunk_rows])
+        full[start:start + len(z)] = z
+        proj[start:start + len(z)] = z @ components
+    full.flush()
+    proj.flush()
+    np.save(os.path.join(staging, 'proj_norms.npy'), np.einsum('ij,ij->i', proj, proj))
+    np.save(os.path.join(staging, 'labels.npy'), np.asarray(labels, dtype=np.int8))
+    np.save(os.path.join(staging, 'timestamps.npy'), np.asarray(timestamps, dtype='datetime64[s]'))
+    np.savez(os.path.join(staging, 'scaler.npz'), mean=mean, std=std, components=components)
+    del full, proj
+
+    meta = {
+        'feature_names': feature_names,
+        'space': space,
+        'n_rows': int(n_rows),
+        'n_components': int(n_components),
+        'model_version': model_version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(out_dir):
+        retired = f"{out_dir}.old-{os.getpid()}"
+        os.replace(out_dir, retired)
+        os.replace(staging, out_dir)
+        shutil.rmtree(retired, ignore_errors=True)
+    else:
+        os.replace(staging, out_dir)
+    return out_dir
+
+
+class WaferIndex:
+    """以 memory-map 開啟的相似晶圓索引"""
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with np.load(os.path.join(index_dir, 'scaler.npz')) as scaler:
+            self.mean = scaler['mean']
+            self.std = scaler['std']
+            self.components = scaler['components']
+        self.proj = np.load(os.path.join(index_dir, 'proj.npy'), mmap_mode='r')
+        self.full = np.load(os.path.join(index_dir, 'full.npy'), mmap_mode='r')
+        self.proj_norms = np.load(os.path.join(index_dir, 'proj_norms.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(index_dir, 'labels.npy'), mmap_mode='r')
+        self.timestamps = np.load(os.path.join(index_dir, 'timestamps.npy'), mmap_mode='r')
+
+    @staticmethod
+    def mtime(index_dir=INDEX_DIR):
+        try:
+            return os.path.getmtime(os.path.join(index_dir, 'meta.json'))
+        except OSError:
+            return None
+
+    @property
+    def feature_names(self):
+        return self.meta['feature_names']
+
+    @property
+    def space(self):
+        return self.meta['space']
+
+    def _normalize(self, vector):
+        z = (np.asarray(vector, dtype=np.float64) - self.mean) / self.std
+        return np.nan_to_num(z, nan=0.0).astype(np.float32)
+
+    def _coarse_candidates(self, q_proj, n_candidates, block_rows=BLOCK_ROWS):
+        """在投影空間分塊找出距離最小的 n_candidates 個候選"""
+        best_idx = np.empty(0, dtype=np.int64)
+        best_dist = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self.proj), block_rows):
+            block = self.proj[start:start + block_rows]
+            dist = self.proj_norms[start:start + block_rows] - 2.0 * (block @ q_proj)
+            take = min(n_candidates, len(dist))
+            local = np.argpartition(dist, take - 1)[:take]
+            best_idx = np.concatenate([best_idx, local + start])
+            best_dist = np.concatenate([best_dist, dist[local]])
+            if len(best_idx) > n_candidates:
+                keep = np.argpartition(best_dist, n_candidates - 1)[:n_candidates]
+                best_idx, best_dist = best_idx[keep], best_dist[keep]
+        return np.sort(best_idx)
+
+    def query(self, vector, k=10, exclude=None, rerank_factor=RERANK_FACTOR):
+        """
+        查詢最相似的 k 片歷史晶圓
+        Args:
+            vector: 與索引相同欄位順序的一維向量 (或單列 DataFrame / Series，會依欄位名稱對齊)
+            exclude: 要排除的歷史列號 (例如查詢的就是歷史晶圓本身)
+        Returns:
+            DataFrame: row, distance, label, outcome, timestamp
+        """
+        if isinstance(vector, pd.DataFrame):
+            vector = vector.iloc[0]
+        if isinstance(vector, pd.Series):
+            vector = vector.reindex(self.feature_names).to_numpy(dtype=np.float64)
+        z = self._normalize(vector)
+        n_extra = 0 if exclude is None else 1
+        n_candidates = min(len(self.proj), (k + n_extra) * rerank_factor)
+        candidates = self._coarse_candidates(z @ self.components, n_candidates)
+
+        diff = np.asarray(self.full[candidates]) - z
+        dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        order = np.argsort(dist, kind='stable')
+        rows, dist = candidates[order], dist[order]
+        if exclude is not None:
+            keep = rows != exclude
+            rows, dist = rows[keep], dist[keep]
+        rows, dist = rows[:k], dist[:k]
+
+        labels = np.asarray(self.labels[rows])
+        return pd.DataFrame({
+            'row': rows,
+            'distance': dist.round(3),
+            'label': labels,
+            'outcome': np.where(labels == 1, 'Fail', 'Pass'),
+            'timestamp': pd.to_datetime(np.asarray(self.timestamps[rows])),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similar historical wafer index")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_build = sub.add_parser('build', help="build the index from the processed training data")
+    p_build.add_argument('--data', default='data/secom_processed.csv')
+    p_build.add_argument('--space', choices=['sensor', 'shap'], default='sensor',
+                         help="index sensor vectors or the SHAP vectors in reports/shap_store")
+    p_build.add_argument('--out', default=INDEX_DIR)
+
+    p_query = sub.add_parser('query', help="look up the wafers most similar to a historical row")
+    p_query.add_argument('--row', type=int, required=True)
+    p_query.add_argument('--k', type=int, default=10)
+    p_query.add_argument('--index', default=INDEX_DIR)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        dataset = pd.read_csv(args.data)
+        labels = dataset.pop('label').to_numpy()
+        if args.space == 'shap':
+            from shap_store import ShapStore
+            store = ShapStore.load()
+            vectors, names = store.values, store.feature_names
+            labels = store.labels
+        else:
+            vectors, names = dataset, None
+        start = time.perf_counter()
+        build_wafer_index(vectors, labels, load_history_metadata(len(labels)), out_dir=args.out,
+                          feature_names=names, space=args.space)
+        print(f"✅ Indexed {len(labels)} wafers in {time.perf_counter() - start:.2f}s -> {args.out}")
+    elif args.command == 'query':
+        index = WaferIndex(args.index)
+        start = time.perf_counter()
+        result = index.query(np.asarray(index.full[args.row]) * index.std + index.mean, k=args.k, exclude=args.row)
+        print(result.to_string(index=False))
+        print(f"⏱️ {1000 * (time.perf_counter() - start):.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+"""
+監看資料夾自動評分 (Watch-Folder Daemon)
+
+機台匯出的 CSV 整天陸續落在共用資料夾，不必再手動上傳到 Tab 1：
+- 定期掃描資料夾，寫入完成 (修改時間超過 settle 秒) 的檔案以 sha256 內容雜湊判斷是否處理過；
+  改名或重複複製的相同內容不會重算，內容改變的同名檔案會重新評分
+- 檔案大小 / 修改時間沒變時沿用上次的雜湊，不會每次掃描都重讀整個資料夾
+- 模型以 ModelHandle 載入一次並保持暖機，ACTIVE 版本切換時在兩個檔案之間熱替換
+- 逐塊 (chunk_rows) 驗證與評分並直接附加寫入分區檔，記憶體只跟 chunk 大小有關
+- 狀態、每個檔案的摘要、每小時彙總與高風險晶圓存在 SQLite (output/watch_scores/state.db)，
+  Tab 2 的 Watch Folder 面板直接讀取
+- 時間一律為 UTC (每小時彙總、分區日期資料夾與顯示的完成時間)，跨時區或夏令時間切換時不會錯位
+
+用法:
+    python watch_folder.py --watch-dir /mnt/fab_exports
+    python watch_folder.py --watch-dir /mnt/fab_exports --once        # 處理目前的檔案後結束
+"""
+import argparse
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from log_config import configure_logging
+from batch_score import iter_chunks, fail_probability, SUPPORTED_SUFFIXES
+from model_registry import file_sha256
+
+WATCH_DIR = 'data/incoming'
+STORE_DIR = 'output/watch_scores'
+DEFAULT_MODEL_PATH = 'output/final_yield_prediction_model'
+POLL_INTERVAL_SEC = 5
+SETTLE_SEC = 2
+CHUNK_ROWS = 20000
+TOP_RISKS = 50
+RECENT_FILES = 50
+# 匯出程式寫到一半的暫存檔
+TEMP_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    model_version TEXT,
+    rows INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    scored INTEGER NOT NULL DEFAULT 0,
+    fails INTEGER NOT NULL DEFAULT 0,
+    sum_proba REAL NOT NULL DEFAULT 0,
+    part TEXT,
+    error TEXT,
+    started_at REAL NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_finished ON files (finished_at);
+CREATE TABLE IF NOT EXISTS seen (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hourly (
+    hour TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    rejected INTEGER NOT NULL,
+    scored INTEGER NOT NULL,
+    fails INTEGER NOT NULL,
+    sum_proba REAL NOT NULL,
+    PRIMARY KEY (hour, model_version)
+);
+CREATE TABLE IF NOT EXISTS risks (
+    sha256 TEXT NOT NULL,
+    source_file TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    wafer_id TEXT,
+    fail_probability REAL NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_risks_proba ON risks (fail_probability DESC);
+"""
+
+
+class WatchStore:
+    """監看評分的結果庫 (daemon 寫入、App 讀取)"""
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.db_path = os.path.join(store_dir, 'state.db')
+        os.makedirs(os.path.join(store_dir, 'scores'), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def mtime(store_dir=STORE_DIR):
+        """結果庫最後更新時間 (含 WAL 檔)；不存在時回傳 None"""
+        paths = [os.path.join(store_dir, name) for name in ('state.db', 'state.db-wal')]
+        times = [os.path.getmtime(p) for p in paths if os.path.exists(p)]
+        return max(times) if times else None
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """autocommit 連線，用完即關閉"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            yield conn
+        finally:
+            conn.close()
+
+    # ---------- daemon ----------
+
+    def known_hash(self, path, size, mtime_ns):
+        """大小與修改時間都沒變時回傳上次計算的雜湊"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT sha256 FROM seen WHERE path = ? AND size = ? AND mtime_ns = ?",
+                               (path, size, mtime_ns)).fetchone()
+        return row['sha256'] if row else None
+
+    def remember(self, path, size, mtime_ns, sha256):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO seen (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                         (path, size, mtime_ns, sha256))
+
+    def status(self, sha256):
+        """該內容的處理狀態 ('done' / 'failed')，沒處理過時回傳 None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM files WHERE sha256 = ?", (sha256,)).fetchone()
+        return row['status'] if row else None
+
+    def record(self, result, risks=None):
+        """寫入一個檔案的結果，並在同一個交易內更新每小時彙總與高風險晶圓"""
+        hour = time.strftime('%Y-%m-%d %H:00', time.gmtime(result['finished_at']))
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO files (sha256, path, size, status, model_version, rows, rejected, scored, "
+                    "fails, sum_proba, part, error, started_at, finished_at) "
+                    "VALUES (:sha256, :path, :size, :status, :model_version, :rows, :rejected, :scored, :fails, "
+                    ":sum_proba, :part, :error, :started_at, :finished_at)", result)
+                if result['status'] == 'done':
+                    conn.execute(
+                        "INSERT INTO hourly (hour, model_version, files, rows, rejected, scored, fails, sum_proba) "
+                        "VALUES (?, ?, 1, ?, ?, ?, ?, ?) ON CONFLICT (hour, model_version) DO UPDATE SET "
+                        "files = files + 1, rows = rows + excluded.rows, rejected = rejected + excluded.rejected, "
+                        "scored = scored + excluded.scored, fails = fails + excluded.fails, "
+                        "sum_proba = sum_proba + excluded.sum_proba",
+                        (hour, result['model_version'], result['rows'], result['rejected'], result['scored'],
+                         result['fails'], result['sum_proba']))
+                if risks is not None and len(risks):
+                    conn.executemany(
+                        "INSERT INTO risks (sha256, source_file, row, wafer_id, fail_probability, finished_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(result['sha256'], result['path'], int(r.row), str(r.wafer_id), float(r.fail_probability),
+                          result['finished_at']) for r in risks.itertuples(index=False)])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def forget_failed(self):
+        """清除失敗紀錄，讓這些檔案在下次掃描時重試"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM files WHERE status = 'failed'").rowcount
+
+    # ---------- dashboard ----------
+
+    def totals(self):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS files, COALESCE(SUM(rows), 0) AS rows, COALESCE(SUM(rejected), 0) AS rejected, "
+                "COALESCE(SUM(scored), 0) AS scored, COALESCE(SUM(fails), 0) AS fails, "
+                "MAX(finished_at) AS last_finished FROM files WHERE status = 'done'").fetchone()
+            failed = conn.execute("SELECT COUNT(*) FROM files WHERE status = 'failed'").fetchone()[0]
+        totals = dict(row)
+        totals['failed_files'] = failed
+        totals['yield'] = 1 - totals['fails'] / totals['scored'] if totals['scored'] else None
+        return totals
+
+    def hourly(self):
+        """每小時 (UTC，跨模型版本合計) 的晶圓數、良率與平均 Fail 機率"""
+        with self._connect() as conn:
+            frame = pd.read_sql_query(
+                "SELECT hour AS hour_utc, SUM(files) AS files, SUM(rows) AS rows, SUM(scored) AS scored, SUM(fails) AS fails, "
+                "SUM(sum_proba) AS sum_proba FROM hourly GROUP BY hour ORDER BY hour", conn)
+        scored = frame['scored'].where(frame['scored'] > 0)
+        frame['yield'] = 1 - frame['fails'] / scored
+        frame['mean_fail_probability'] = frame.pop('sum_proba') / scored
+        return frame
+
+    def recent_files(self, limit=RECENT_FILES):
+        with self._connect() as conn:
+            frame = pd.read_sql_query(
+                "SELECT path, status, model_version, rows, rejected, scored, fails, error, finished_at, "
+                "finished_at - started_at AS elapsed_sec FROM files ORDER BY finished_at DESC LIMIT ?",
+                conn, params=(limit,))
+        frame['finished_at'] = pd.to_datetime(frame['finished_at'], unit='s')
+        return frame.rename(columns={'finished_at': 'finished_at_utc'})
+
+    def top_risks(self, limit=TOP_RISKS):
+        with self._connect() as conn:
+            frame = pd.read_sql_query(
+                "SELECT source_file, row, wafer_id, fail_probability, finished_at FROM risks "
+                "ORDER BY fail_probability DESC LIMIT ?", conn, params=(limit,))
+        frame['finished_at'] = pd.to_datetime(frame['finished_at'], unit='s')
+        return frame.rename(columns={'finished_at': 'finished_at_utc'})
+
+
+def is_candidate(name):
+    """只處理 CSV / Parquet，略過隱藏檔與寫入中的暫存檔"""
+    lower = name.lower()
+    return not name.startswith('.') and lower.endswith(SUPPORTED_SUFFIXES) and not lower.endswith(TEMP_SUFFIXES)
+
+
+def score_to_partition(path, part_path, pipeline, bounds=None, id_column=None, chunk_rows=CHUNK_ROWS,
+                       top_k=TOP_RISKS):
+    """
+    逐塊驗證與評分，結果直接附加到分區 CSV (先寫暫存檔，完成後才改名)
+    Returns:
+        (stats, risks): 統計數字與該檔案 Fail 機率最高的 top_k 片晶圓
+    """
+    from ensemble import predict_frame
+    from input_validation import BatchValidator
+
+    validator = BatchValidator(bounds) if bounds is not None else None
+    stats = {'rows': 0, 'rejected': 0, 'scored': 0, 'fails': 0, 'sum_proba': 0.0}
+    risks = pd.DataFrame(columns=['row', 'wafer_id', 'fail_probability'])
+    tmp_path = f"{part_path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    try:
+        for chunk in iter_chunks(path, chunk_rows):
+            chunk = chunk.reset_index(drop=True)
+            chunk.index += stats['rows']
+            reject = np.zeros(len(chunk), dtype=bool)
+            reasons = pd.Series('', index=chunk.index)
+            if validator is not None:
+                reject, reasons = validator.update(chunk)
+
+            result = chunk.copy()
+            result['prediction_label'] = np.nan
+            result['fail_probability'] = np.nan
+            accepted = chunk[~reject]
+            if len(accepted):
+                with stage('watch_folder_predict', rows=len(accepted)):
+                    predicted = predict_frame(pipeline, data=accepted)
+                result.loc[accepted.index, 'prediction_label'] = predicted['prediction_label'].to_numpy()
+                result.loc[accepted.index, 'fail_probability'] = fail_probability(predicted)
+            result['reject_reason'] = reasons.to_numpy()
+            result.to_csv(tmp_path, mode='a', header=stats['rows'] == 0, index_label='row')
+
+            scored = result[~reject]
+            stats['rows'] += len(chunk)
+            stats['rejected'] += int(reject.sum())
+            stats['scored'] += len(scored)
+            stats['fails'] += int((scored['prediction_label'] == 1).sum())
+            stats['sum_proba'] += float(scored['fail_probability'].sum())
+            # 只保留目前為止的前 top_k 名，記憶體不隨檔案大小增加
+            top = scored.nlargest(top_k, 'fail_probability')
+            top = pd.DataFrame({
+                'row': top.index,
+                'wafer_id': top[id_column].to_numpy() if id_column in top.columns else top.index,
+                'fail_probability': top['fail_probability'].to_numpy(),
+            })
+            risks = pd.concat([risks, top]).nlargest(top_k, 'fail_probability') if len(risks) else top
+        if stats['rows'] == 0:
+            raise ValueError("file contains no rows")
+        os.replace(tmp_path, part_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return stats, risks
+
+
+class FolderWatcher:
+    """掃描資料夾並以同一個暖機中的模型依序評分新檔案"""
+
+    def __init__(self, watch_dir, store, model_handle, bounds=None, settle_sec=SETTLE_SEC, chunk_rows=CHUNK_ROWS,
+                 id_column=None, recursive=False):
+        self.watch_dir = watch_dir
+        self.store = store
+        self.model_handle = model_handle
+        self.bounds = bounds
+        self.settle_sec = settle_sec
+        self.chunk_rows = chunk_rows
+        self.id_column = id_column
+        self.recursive = recursive
+
+    def _list_files(self):
+        if self.recursive:
+            for root, dirs, names in os.walk(self.watch_dir):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for name in sorted(names):
+                    if is_candidate(name):
+                        yield os.path.join(root, name)
+        else:
+            with os.scandir(self.watch_dir) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_file() and is_candidate(entry.name):
+                        yield entry.path
+
+    def scan(self, now=None):
+        """
+        找出待處理的檔案 (已寫入完成、且內容沒有處理過)
+        Returns:
+            list of (path, size, mtime_ns, sha256)，依修改時間排序
+        """
+        now = time.time() if now is None else now
+        ready = []
+        for path in self._list_files():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime < self.settle_sec:
+                continue  # 可能還在寫入，下次掃描再看
+            sha256 = self.store.known_hash(path, st.st_size, st.st_mtime_ns)
+            if sha256 is None:
+                with stage('watch_folder_hash'):
+                    sha256 = file_sha256(path)
+                self.store.remember(path, st.st_size, st.st_mtime_ns, sha256)
+            if self.store.status(sha256) is None:
+                ready.append((path, st.st_size, st.st_mtime_ns, sha256))
+        ready.sort(key=lambda item: item[2])
+        # 同一次掃描中內容相同的檔案只處理第一個
+        unique = {}
+        for item in ready:
+            unique.setdefault(item[3], item)
+        return list(unique.values())
+
+    def process(self, path, size, sha256):
+        """評分一個檔案並寫入結果庫；失敗時記錄錯誤 (內容沒變就不會重試)"""
+        version, pipeline = self.model_handle.current()
+        started = time.time()
+        day = time.strftime('%Y-%m-%d', time.gmtime(started))
+        stem = os.path.splitext(os.path.basename(path))[0]
+        part_path = os.path.join(self.store.store_dir, 'scores', day, f"{stem}-{sha256[:12]}.csv")
+        result = {'sha256': sha256, 'path': path, 'size': size, 'model_version': version, 'part': None,
+                  'error': None, 'started_at': started, 'rows': 0, 'rejected': 0, 'scored': 0, 'fails': 0,
+                  'sum_proba': 0.0}
+        risks = None
+        try:
+            if pipeline is None:
+                raise RuntimeError("no model loaded")
+            with stage('watch_folder_file'):
+                stats, risks = score_to_partition(path, part_path, pipeline, bounds=self.bounds,
+                                                  id_column=self.id_column, chunk_rows=self.chunk_rows)
+            result.update(stats, status='done', part=part_path)
+        except Exception as e:
+            traceback.print_exc()
+            result.update(status='failed', error=f"{type(e).__name__}: {e}")
+        result['finished_at'] = time.time()
+        self.store.record(result, risks)
+        return result
+
+    def run_once(self):
+        """處理目前所有待處理的檔案，回傳各檔案的結果"""
+        results = []
+        for path, size, _, sha256 in self.scan():
+            result = self.process(path, size, sha256)
+            if result['status'] == 'done':
+                print(f"   ✅ {os.path.basename(path)}: {result['scored']} wafers scored, {result['fails']} Fail "
+                      f"({result['finished_at'] - result['started_at']:.1f} s, model {result['model_version']})")
+            else:
+                print(f"   ❌ {os.path.basename(path)}: {result['error']}")
+            results.append(result)
+        return results
+
+    def run_forever(self, poll_interval=POLL_INTERVAL_SEC, stop_event=None):
+        """持續監看直到 stop_event 被設定 (或 Ctrl+C)"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            self.run_once()
+            stop_event.wait(poll_interval)
+
+
+def main():
+    from pycaret.classification import load_model
+    from input_validation import SensorBounds, DEFAULT_BOUNDS_PATH
+    from model_registry import ModelRegistry, ModelHandle, warm_up
+
+    parser = argparse.ArgumentParser(description="Watch a folder and score new CSV/Parquet exports")
+    parser.add_argument('--watch-dir', default=WATCH_DIR)
+    parser.add_argument('--store', default=STORE_DIR, help="result store read by the dashboard")
+    parser.add_argument('--poll', type=float, default=POLL_INTERVAL_SEC, help="seconds between scans")
+    parser.add_argument('--settle', type=float, default=SETTLE_SEC,
+                        help="only pick up files not modified for this many seconds")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--id-column', default=None, help="column identifying each wafer in the risk list")
+    parser.add_argument('--recursive', action='store_true', help="also watch subdirectories")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH,
+                        help="fallback model path without .pkl (used only when the registry is empty)")
+    parser.add_argument('--retry-failed', action='store_true', help="retry files that failed before")
+    parser.add_argument('--once', action='store_true', help="process the current files and exit")
+    args = parser.parse_args()
+
+    configure_logging('watch_folder', profile='scoring')
+    os.makedirs(args.watch_dir, exist_ok=True)
+    store = WatchStore(args.store)
+    if args.retry_failed:
+        print(f"🔁 {store.forget_failed()} failed files will be retried")
+
+    # 模型只載入一次並暖機；ACTIVE 版本切換時由背景執行緒熱替換
+    handle = ModelHandle(ModelRegistry(), loader=load_model, warmup=warm_up, fallback_path=args.model)
+    handle.refresh()
+    if handle.current()[1] is None:
+        raise SystemExit(f"❌ No active model in the registry and no model at {args.model}.pkl")
+    if not args.once:
+        handle.start()
+    bounds = SensorBounds.load(DEFAULT_BOUNDS_PATH) if os.path.exists(DEFAULT_BOUNDS_PATH) else None
+
+    watcher = FolderWatcher(args.watch_dir, store, handle, bounds=bounds, settle_sec=args.settle,
+                            chunk_rows=args.chunk_rows, id_column=args.id_column, recursive=args.recursive)
+    print(f"👀 Watching {args.watch_dir} (model {handle.current()[0]}, results in {args.store})")
+    if args.once:
+        watcher.run_once()
+        return
+    try:
+        watcher.run_forever(args.poll)
+    except KeyboardInterrupt:
+        print("🛑 Stopped")
+
+
+if __name__ == '__main__':
+    main()
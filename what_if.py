@@ -0,0 +1,234 @@
+"""
+What-if 敏感度分析 (Vectorized What-If Sweeps)
+
+針對單一晶圓與選定的感測器，一次建立整個擾動網格 (每個感測器沿自己的範圍取 n_points 個值，
+其他感測器維持原值)，以一次 predict_proba 評分整個網格，得到：
+- 每個感測器的反應曲線 (數值 -> Fail 機率)
+- 讓預測翻轉 (Fail <-> Pass) 所需的最小變化量 (在網格相鄰兩點間線性內插)
+- 兩個感測器同時變動的 2D 網格 (pairwise_grid)
+
+網格直接以 numpy 的 repeat / 指定欄位寫入建立，不逐列複製 DataFrame；
+一般 Pipeline 直接呼叫 predict_proba，略過 predict_model 的整理開銷。
+
+用法:
+    from what_if import default_ranges, sweep
+    ranges = default_ranges(wafer, ['feature_59', 'feature_103'], reference=batch_df)
+    result = sweep(pipeline, wafer, ranges, n_points=41)
+    result['curves'], result['flips']
+"""
+import numpy as np
+import pandas as pd
+
+from instrumentation import stage
+from ensemble import DEFAULT_THRESHOLD
+from model_registry import model_feature_names
+
+N_POINTS = 41
+REFINE_POINTS = 16
+REFERENCE_QUANTILES = (0.01, 0.99)
+
+
+def fail_probability(model, data):
+    """Fail (class 1) 機率；集成模型與 PyCaret Pipeline 都提供 predict_proba"""
+    return np.asarray(model.predict_proba(data))[:, 1]
+
+
+def model_threshold(model):
+    return getattr(model, 'threshold', DEFAULT_THRESHOLD)
+
+
+def _as_row(model, wafer):
+    """把單片晶圓 (Series 或單列 DataFrame) 整理成模型欄位順序的一列"""
+    if isinstance(wafer, pd.DataFrame):
+        if len(wafer) != 1:
+            raise ValueError(f"What-if analysis needs exactly one wafer, got {len(wafer)} rows")
+        wafer = wafer.iloc[0]
+    columns = model_feature_names(model)
+    missing = [c for c in columns if c not in wafer.index]
+    if missing:
+        raise ValueError(f"Wafer is missing {len(missing)} model sensors (e.g. {', '.join(missing[:5])})")
+    return pd.to_numeric(wafer[columns], errors='coerce').astype(np.float64)
+
+
+def default_ranges(wafer, sensors, reference=None, bounds=None, quantiles=REFERENCE_QUANTILES):
+    """
+    每個感測器的掃描範圍 {sensor: (low, high)}，一定包含晶圓目前的數值
+    優先使用參考資料 (目前批次) 的 1% ~ 99% 分位數，其次是訓練界限 (SensorBounds)，
+    都沒有時取目前數值 ± max(|值|, 1)
+    """
+    if isinstance(wafer, pd.DataFrame):
+        wafer = wafer.iloc[0]
+    if reference is not None:
+        present = [s for s in sensors if s in reference.columns]
+        quant = reference[present].apply(pd.to_numeric, errors='coerce').quantile(list(quantiles))
+    ranges = {}
+    for sensor in sensors:
+        value = pd.to_numeric(wafer.get(sensor), errors='coerce')
+        low = high = np.nan
+        if reference is not None and sensor in quant.columns:
+            low, high = quant[sensor].iloc[0], quant[sensor].iloc[1]
+        if not (np.isfinite(low) and np.isfinite(high) and high > low) and bounds is not None \
+                and sensor in bounds.feature_names:
+            i = bounds.feature_names.index(sensor)
+            low, high = bounds.low[i], bounds.high[i]
+        if not (np.isfinite(low) and np.isfinite(high) and high > low):
+            center = value if np.isfinite(value) else 0.0
+            half = max(abs(center), 1.0)
+            low, high = center - half, center + half
+        if np.isfinite(value):
+            low, high = min(low, value), max(high, value)
+        ranges[sensor] = (float(low), float(high))
+    return ranges
+
+
+def build_grid(base_row, ranges, n_points=N_POINTS):
+    """
+    一維掃描網格：第 0 列是原始晶圓，之後每個感測器 n_points 列 (只改變該感測器)
+    Returns:
+        (X, values): X 為 (1 + n_sensors * n_points, n_features) 的 float 陣列，values 為 (n_sensors, n_points)
+    """
+    columns = list(base_row.index)
+    sensors = list(ranges)
+    values = np.stack([np.linspace(low, high, n_points) for low, high in ranges.values()]) \
+        if sensors else np.empty((0, n_points))
+    X = np.repeat(base_row.to_numpy()[None, :], 1 + len(sensors) * n_points, axis=0)
+    positions = np.array([columns.index(s) for s in sensors], dtype=np.intp)
+    rows = 1 + np.arange(len(sensors) * n_points)
+    X[rows, np.repeat(positions, n_points)] = values.ravel()
+    return X, values
+
+
+def _crossings(values, proba, base_value, base_fail, threshold, interpolate=True):
+    """
+    沿曲線找出預測與原本不同的區段，回傳離原值最近的翻轉點
+    interpolate=True 時在相鄰兩點間線性內插；False 時回傳實際已翻轉的網格點 (樹模型的機率是階梯狀，內插點不一定翻轉)
+    Returns:
+        (flip_value, bracket) 或 (nan, None)
+    """
+    flipped = (proba >= threshold) != base_fail
+    if not flipped.any():
+        return np.nan, None
+    # 原值為 NaN 時以範圍中點當作起點
+    origin = base_value if np.isfinite(base_value) else (values[0] + values[-1]) / 2
+    candidates = []
+    for i in np.flatnonzero(flipped):
+        for j in (i - 1, i + 1):
+            if 0 <= j < len(values) and not flipped[j]:
+                # 在 j (未翻轉) 與 i (翻轉) 之間內插出機率剛好等於閾值的位置
+                p_j, p_i = proba[j], proba[i]
+                t = (threshold - p_j) / (p_i - p_j) if interpolate and p_i != p_j else 1.0
+                candidates.append((values[j] + np.clip(t, 0, 1) * (values[i] - values[j]), (j, i)))
+    if not candidates:
+        # 整條曲線都已翻轉 (原值本身落在網格點之間)，取最近的網格點
+        i = int(np.argmin(np.abs(values - origin)))
+        return values[i], (i, i)
+    return min(candidates, key=lambda c: abs(c[0] - origin))
+
+
+def sweep(model, wafer, ranges, n_points=N_POINTS, threshold=None, refine=True):
+    """
+    一維 what-if 掃描
+    Args:
+        model: PyCaret Pipeline 或 ModelEnsemble
+        wafer: 單片晶圓 (Series 或單列 DataFrame，可含額外欄位)
+        ranges: {sensor: (low, high)}，通常來自 default_ranges()
+        refine: 在找到的翻轉區段內再以一次批次評分取更細的點，回報的 flip_value 是實際評分過、確定翻轉的數值
+    Returns:
+        dict: base_proba, threshold, base_label, curves (sensor/value/delta/fail_proba),
+              flips (每個感測器翻轉所需的最小變化，依範圍比例排序), rows_scored
+    """
+    threshold = model_threshold(model) if threshold is None else threshold
+    base_row = _as_row(model, wafer)
+    unknown = [s for s in ranges if s not in base_row.index]
+    if unknown:
+        raise ValueError(f"Unknown sensors for this model: {', '.join(unknown)}")
+    sensors = list(ranges)
+    columns = list(base_row.index)
+
+    X, values = build_grid(base_row, ranges, n_points)
+    with stage('what_if_sweep', rows=len(X)):
+        proba = fail_probability(model, pd.DataFrame(X, columns=columns))
+    base_proba = float(proba[0])
+    base_fail = base_proba >= threshold
+    grid_proba = proba[1:].reshape(len(sensors), n_points)
+    rows_scored = len(X)
+
+    base_values = base_row[sensors].to_numpy()
+    brackets = [_crossings(values[k], grid_proba[k], base_values[k], base_fail, threshold)
+                for k in range(len(sensors))]
+
+    if refine:
+        # 所有感測器的翻轉區段一起細分，只多一次批次評分
+        refine_at = []
+        for k, (_, bracket) in enumerate(brackets):
+            if bracket is not None and bracket[0] != bracket[1]:
+                j, i = bracket
+                refine_at.append((k, np.linspace(values[k][j], values[k][i], REFINE_POINTS)))
+        if refine_at:
+            X_fine = np.repeat(base_row.to_numpy()[None, :], len(refine_at) * REFINE_POINTS, axis=0)
+            for n, (k, points) in enumerate(refine_at):
+                X_fine[n * REFINE_POINTS:(n + 1) * REFINE_POINTS, columns.index(sensors[k])] = points
+            with stage('what_if_refine', rows=len(X_fine)):
+                fine_proba = fail_probability(model, pd.DataFrame(X_fine, columns=columns))
+            rows_scored += len(X_fine)
+            for n, (k, points) in enumerate(refine_at):
+                flip_value, _ = _crossings(points, fine_proba[n * REFINE_POINTS:(n + 1) * REFINE_POINTS],
+                                           base_values[k], base_fail, threshold, interpolate=False)
+                if np.isfinite(flip_value):
+                    brackets[k] = (flip_value, brackets[k][1])
+
+    curves = pd.DataFrame({
+        'sensor': np.repeat(sensors, n_points),
+        'value': values.ravel(),
+        'delta': (values - base_values[:, None]).ravel(),
+        'fail_proba': grid_proba.ravel(),
+    })
+    flip_value = np.array([b[0] for b in brackets], dtype=np.float64)
+    spans = np.array([high - low for low, high in ranges.values()], dtype=np.float64)
+    delta = flip_value - base_values
+    flips = pd.DataFrame({
+        'sensor': sensors,
+        'current': base_values,
+        'flip_value': flip_value,
+        'delta': delta,
+        'delta_pct_of_range': np.abs(delta) / np.where(spans > 0, spans, np.nan) * 100,
+        'min_fail_proba': grid_proba.min(axis=1) if sensors else [],
+        'max_fail_proba': grid_proba.max(axis=1) if sensors else [],
+    }).sort_values('delta_pct_of_range', na_position='last').reset_index(drop=True)
+    return {
+        'base_proba': base_proba,
+        'threshold': threshold,
+        'base_label': int(base_fail),
+        'curves': curves,
+        'flips': flips,
+        'rows_scored': rows_scored,
+    }
+
+
+def pairwise_grid(model, wafer, sensor_x, sensor_y, ranges, n_points=25):
+    """
+    兩個感測器同時變動的 n_points x n_points 網格 (一次評分)
+    Returns:
+        DataFrame: index 為 sensor_y 數值、columns 為 sensor_x 數值，內容為 Fail 機率
+    """
+    base_row = _as_row(model, wafer)
+    columns = list(base_row.index)
+    xs = np.linspace(*ranges[sensor_x], n_points)
+    ys = np.linspace(*ranges[sensor_y], n_points)
+    X = np.repeat(base_row.to_numpy()[None, :], n_points * n_points, axis=0)
+    X[:, columns.index(sensor_x)] = np.tile(xs, n_points)
+    X[:, columns.index(sensor_y)] = np.repeat(ys, n_points)
+    with stage('what_if_pairwise', rows=len(X)):
+        proba = fail_probability(model, pd.DataFrame(X, columns=columns))
+    return pd.DataFrame(proba.reshape(n_points, n_points),
+                        index=pd.Index(np.round(ys, 6), name=sensor_y),
+                        columns=pd.Index(np.round(xs, 6), name=sensor_x))
+
+
+def score_overrides(model, wafer, overrides):
+    """套用一組感測器數值 (滑桿) 後的 Fail 機率"""
+    row = _as_row(model, wafer).copy()
+    for sensor, value in overrides.items():
+        row[sensor] = value
+    with stage('what_if_point', rows=1):
+        return float(fail_probability(model, row.to_frame().T.astype(np.float64))[0])